@@ -76,11 +76,18 @@ const AdminPanel: React.FC = () => {
 
   // Data states
   const [chatHistory, setChatHistory] = useState<ChatHistoryItem[]>([]);
-  const [chatPagination, setChatPagination] = useState({
+  const [chatPagination, setChatPagination] = useState<{
+    total_count: number;
+    limit: number;
+    offset: number;
+    has_more: boolean;
+    next_cursor: string | null;
+  }>({
     total_count: 0,
     limit: 30,
     offset: 0,
-    has_more: false
+    has_more: false,
+    next_cursor: null
   });
   const [analysis, setAnalysis] = useState<AnalysisResult | null>(null);
   const [employeeUsage, setEmployeeUsage] = useState<EmployeeUsageItem[]>([]);
@@ -181,11 +188,11 @@ const AdminPanel: React.FC = () => {
     try {
       const { SharedDataService } = await import('../../services/sharedDataService');
       
-      // ページネーションパラメータ
+      // ページネーションパラメータ（次ページは前ページの next_cursor から取得し、offset 分の読み飛ばしをしない）
       const limit = 30;
-      const offset = loadMore ? chatHistory.length : 0;
+      const cursor = loadMore ? chatPagination.next_cursor : null;
       
-      const cacheKey = `chat-history-${limit}-${offset}`;
+      const cacheKey = `chat-history-${limit}-${cursor || 'first'}`;
       
       if (forceRefresh) {
         SharedDataService.clearCache(cacheKey);
@@ -193,7 +200,7 @@ const AdminPanel: React.FC = () => {
       
       const data = await SharedDataService.getChatHistory({
         limit,
-        offset,
+        cursor,
         user_id: (!isSpecialAdmin && !permissions.can_create) ? JSON.parse(localStorage.getItem("user") || "{}").id : undefined
       });
       
@@ -219,7 +226,8 @@ const AdminPanel: React.FC = () => {
           total_count: pagination.total_count || data.total_count || 0,
           limit: pagination.limit || data.limit || 30,
           offset: newOffset,
-          has_more: pagination.has_more !== undefined ? pagination.has_more : data.has_more || false
+          has_more: pagination.has_more !== undefined ? pagination.has_more : data.has_more || false,
+          next_cursor: pagination.next_cursor || null
         });
         
       } else if (Array.isArray(data)) {
@@ -229,7 +237,8 @@ const AdminPanel: React.FC = () => {
           total_count: data.length,
           limit: data.length,
           offset: data.length,
-          has_more: false
+          has_more: false,
+          next_cursor: null
         });
       } else {
         console.error(
@@ -241,7 +250,8 @@ const AdminPanel: React.FC = () => {
           total_count: 0,
           limit: 30,
           offset: 0,
-          has_more: false
+          has_more: false,
+          next_cursor: null
         });
       }
     } catch (error: any) {
@@ -110,10 +110,12 @@ export class SharedDataService {
 
   /**
    * チャット履歴を取得（共有キャッシュ使用）
+   * 次ページは前ページの pagination.next_cursor を cursor に渡して取得する（offset は後方互換用）
    */
   static async getChatHistory(params: {
     limit?: number;
     offset?: number;
+    cursor?: string | null;
     user_id?: string;
   } = {}): Promise<any> {
     const cacheKey = `chat-history-${JSON.stringify(params)}`;
@@ -125,7 +127,11 @@ export class SharedDataService {
         const searchParams = new URLSearchParams();
         
         if (params.limit) searchParams.append('limit', params.limit.toString());
-        if (params.offset) searchParams.append('offset', params.offset.toString());
+        if (params.cursor) {
+          searchParams.append('cursor', params.cursor);
+        } else if (params.offset) {
+          searchParams.append('offset', params.offset.toString());
+        }
         if (params.user_id) searchParams.append('user_id', params.user_id);
         
         const url = `/admin/chat-history${searchParams.toString() ? '?' + searchParams.toString() : ''}`;
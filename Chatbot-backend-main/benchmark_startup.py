@@ -0,0 +1,213 @@
+"""
+🚀 起動時間（import main）の計測レポート
+新しいプロセスで python -X importtime を使って main.py を読み込み、読み込み時間・RSS・
+時間のかかっているモジュールを表示します。遅延読み込みにしている重い依存（pandas・PyMuPDF・
+openpyxl・Elasticsearch など）が起動時に読み込まれていたら、読み込み元の経路とともに失敗にします
+
+    python benchmark_startup.py                                   # 計測してレポートを表示
+    python benchmark_startup.py --max-import-ms 3000 --max-rss-mb 250
+    python benchmark_startup.py --save-baseline                   # 結果をベースラインとして保存
+    python benchmark_startup.py --compare --fail-on-regression    # ベースラインと比較（1.2倍超で失敗）
+"""
+
+import os
+import sys
+import json
+import platform
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List
+
+DEFAULT_BASELINE_PATH = os.path.join("benchmark_results", "startup_baseline.json")
+
+# 起動時には読み込まず、初めて使うときに読み込む依存（トップレベルのパッケージ名）
+LAZY_MODULES = [
+    "pandas", "fitz", "openpyxl", "xlrd", "docx", "olefile", "PIL", "pdf2image", "pypdf",
+    "elasticsearch", "elasticsearch_dsl", "playwright", "bs4", "googleapiclient", "chardet",
+]
+
+_RESULT_MARKER = "__STARTUP_RESULT__"
+
+# 子プロセスで実行するコード（読み込み時間・RSS・読み込まれた遅延対象を出力）
+_CHILD_CODE = """
+import sys, json, time, resource, importlib
+sys.path.insert(0, {cwd!r})
+started = time.perf_counter()
+importlib.import_module({module!r})
+elapsed = time.perf_counter() - started
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss_kb /= 1024
+print({marker!r} + json.dumps({{
+    "import_ms": elapsed * 1000,
+    "rss_mb": rss_kb / 1024,
+    "module_count": len(sys.modules),
+    "lazy_loaded": [name for name in {lazy!r} if name in sys.modules],
+}}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """-X importtime の出力を解析（読み込み元 parent 付き）"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        raw_name = parts[2].rstrip()
+        name = raw_name.lstrip()
+        entries.append({
+            "name": name,
+            "self_us": int(parts[0]),
+            "cumulative_us": int(parts[1]),
+            "depth": (len(raw_name) - len(name) - 1) // 2,
+            "parent": None,
+        })
+
+    # 子は親より先に出力されるため、後ろから走査して一段浅い直後のエントリを親とする
+    last_at_depth: Dict[int, str] = {}
+    for entry in reversed(entries):
+        entry["parent"] = last_at_depth.get(entry["depth"] - 1)
+        last_at_depth[entry["depth"]] = entry["name"]
+    return entries
+
+
+def import_chain(entries: List[Dict[str, Any]], name: str) -> str:
+    """モジュールが読み込まれた経路（main → ... → name）"""
+    parents = {entry["name"]: entry["parent"] for entry in entries}
+    chain = [name]
+    while parents.get(chain[-1]) and len(chain) < 30:
+        chain.append(parents[chain[-1]])
+    return " → ".join(reversed(chain))
+
+
+def run_import(module: str, env: Dict[str, str]) -> Dict[str, Any]:
+    """新しいプロセスでモジュールを読み込んで計測"""
+    code = _CHILD_CODE.format(cwd=os.getcwd(), module=module, marker=_RESULT_MARKER, lazy=LAZY_MODULES)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env
+    )
+    result_line = next((line for line in proc.stdout.splitlines() if line.startswith(_RESULT_MARKER)), None)
+    if proc.returncode != 0 or result_line is None:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"import {module} に失敗しました:\n" + "\n".join(errors[-20:]))
+    result = json.loads(result_line[len(_RESULT_MARKER):])
+    result["entries"] = parse_importtime(proc.stderr)
+    return result
+
+
+def print_report(result: Dict[str, Any], top: int):
+    entries = result["entries"]
+
+    print(f"\n🐢 読み込みが遅いモジュール（累積、上位{top}件）")
+    for entry in sorted(entries, key=lambda e: e["cumulative_us"], reverse=True)[:top]:
+        print(f"  {entry['cumulative_us'] / 1000:>9.1f}ms  {'  ' * min(entry['depth'], 6)}{entry['name']}")
+
+    packages: Dict[str, int] = {}
+    for entry in entries:
+        package = entry["name"].split(".")[0]
+        packages[package] = packages.get(package, 0) + entry["self_us"]
+    print(f"\n📦 パッケージ別（自身の読み込み時間の合計、上位{top}件）")
+    for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:>9.1f}ms  {package}")
+
+
+def compare_with_baseline(result: Dict[str, float], baseline: Dict[str, Any], threshold: float) -> int:
+    """ベースラインより threshold 倍を超えて悪化した項目数"""
+    regressions = 0
+    for key, label in (("import_ms", "読み込み時間"), ("rss_mb", "RSS")):
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            continue
+        ratio = result[key] / base
+        mark = "❌" if ratio > threshold else "✅"
+        regressions += ratio > threshold
+        print(f"  {mark} {label:<8}{base:>10.1f} → {result[key]:>10.1f}  ({ratio:.2f}倍)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間（import main）の計測レポート")
+    parser.add_argument("--module", default="main", help="計測するモジュール")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（中央値を採用、別途ウォームアップ1回）")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--max-import-ms", type=float, help="読み込み時間の上限（超えたら失敗）")
+    parser.add_argument("--max-rss-mb", type=float, help="読み込み後のRSSの上限（超えたら失敗）")
+    parser.add_argument("--allow-eager", action="store_true", help="遅延対象の依存が読み込まれても失敗にしない")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--threshold", type=float, default=1.2, help="この倍率を超えて悪化したら劣化とみなす")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    # 読み込み時にAPIキーの存在を確認するモジュールがあるため、未設定ならダミーを設定（API呼び出しは行わない）
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "benchmark-dummy-key")
+
+    print("=" * 80)
+    print(f"🚀 起動時間の計測: import {args.module} (repeat={args.repeat})")
+
+    # 1回目は .pyc の生成を含むため計測から除外
+    run_import(args.module, env)
+    runs = [run_import(args.module, env) for _ in range(max(1, args.repeat))]
+    result = {
+        "import_ms": statistics.median(run["import_ms"] for run in runs),
+        "rss_mb": statistics.median(run["rss_mb"] for run in runs),
+        "module_count": runs[-1]["module_count"],
+    }
+    print(f"  読み込み時間: {result['import_ms']:.1f}ms（中央値） / RSS: {result['rss_mb']:.1f}MB / モジュール数: {result['module_count']}")
+    print_report(runs[-1], args.top)
+
+    failures: List[str] = []
+    lazy_loaded = runs[-1]["lazy_loaded"]
+    if lazy_loaded:
+        print(f"\n⚠️ 起動時に読み込まれた遅延対象の依存: {len(lazy_loaded)}件")
+        for name in lazy_loaded:
+            print(f"  {import_chain(runs[-1]['entries'], name)}")
+        if not args.allow_eager:
+            failures.append(f"遅延対象の依存が読み込まれています: {', '.join(lazy_loaded)}")
+    else:
+        print(f"\n✅ 遅延対象の依存は起動時に読み込まれていません（{len(LAZY_MODULES)}件を確認）")
+
+    if args.max_import_ms is not None and result["import_ms"] > args.max_import_ms:
+        failures.append(f"読み込み時間 {result['import_ms']:.1f}ms > 上限 {args.max_import_ms:g}ms")
+    if args.max_rss_mb is not None and result["rss_mb"] > args.max_rss_mb:
+        failures.append(f"RSS {result['rss_mb']:.1f}MB > 上限 {args.max_rss_mb:g}MB")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\n⚠️ ベースラインがありません: {args.baseline}（--save-baseline で作成）")
+        else:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            print("\n📊 ベースラインとの比較")
+            regressions = compare_with_baseline(result, baseline, args.threshold)
+            if regressions and args.fail_on_regression:
+                failures.append(f"ベースラインから劣化: {regressions}件（閾値 {args.threshold:g}倍）")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "module": args.module,
+                "results": result,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 ベースラインを保存しました: {args.baseline}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    print("=" * 80)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+⏱️ テキスト処理・取り込み処理のマイクロベンチマーク
+アップロード時・回答時に大きな入力で実行される CPU 処理を、固定シードの合成日本語コーパス
+（100KB〜50MB）で計測し、保存済みのベースラインと比較します（API・DB へのアクセスなし）
+
+    python benchmark_text_utils.py                                  # 既定サイズで計測
+    python benchmark_text_utils.py --sizes 100k 1m 10m 50m --only chunk_knowledge_base count_tokens
+    python benchmark_text_utils.py --save-baseline                  # 結果をベースラインとして保存
+    python benchmark_text_utils.py --compare --fail-on-regression   # ベースラインと比較（1.2倍超で失敗）
+"""
+
+import os
+import sys
+import gc
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import statistics
+import platform
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.append('.')
+
+# 初期化時にAPIキーの存在を確認するクラスがあるため、未設定ならダミーを設定（API呼び出しは行わない）
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-dummy-key")
+
+import pandas as pd
+
+DEFAULT_BASELINE_PATH = os.path.join("benchmark_results", "text_utils_baseline.json")
+SIZE_UNITS = {"k": 1024, "m": 1024 * 1024}
+
+# 合成コーパス用の部品（社内規程・物件台帳・問い合わせ記録などを想定）
+_WORDS = [
+    "有給休暇", "申請手順", "経費精算", "締め日", "交通費", "出張", "承認フロー", "勤怠管理", "残業申請", "在宅勤務",
+    "セキュリティ", "パスワード", "VPN接続", "社内ネットワーク", "備品購入", "稟議", "契約書", "請求書", "支払期日", "取引先",
+    "物件番号", "賃料", "管理費", "敷金", "更新料", "入居日", "解約通知", "修繕", "点検", "設備",
+]
+_NAMES = ["山田太郎", "佐藤花子", "鈴木一郎", "高橋美咲", "田中健太", "伊藤さくら", "渡辺翔", "中村愛"]
+_CITIES = ["東京都港区", "大阪府大阪市", "神奈川県横浜市", "愛知県名古屋市", "福岡県福岡市"]
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().lower()
+    unit = SIZE_UNITS.get(value[-1])
+    return int(float(value[:-1]) * unit) if unit else int(value)
+
+
+def format_size(size: int) -> str:
+    if size >= SIZE_UNITS["m"]:
+        return f"{size / SIZE_UNITS['m']:g}MB"
+    return f"{size / SIZE_UNITS['k']:g}KB"
+
+
+def synthetic_text(size_bytes: int, seed: int = 42) -> str:
+    """UTF-8で約 size_bytes バイトの日本語テキスト（段落・番号・記号を含む）"""
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size_bytes:
+        words = rng.sample(_WORDS, 3)
+        sentence = (
+            f"第{rng.randint(1, 99)}条 {words[0]}について、{words[1]}と{words[2]}の取り扱いを定める。"
+            f"担当は{rng.choice(_NAMES)}（内線{rng.randint(1000, 9999)}）、金額は{rng.randint(1, 500) * 1000:,}円とする。"
+        )
+        if rng.random() < 0.2:
+            sentence += "\n\n"
+        parts.append(sentence)
+        total += len(sentence.encode("utf-8"))
+    return "".join(parts)
+
+
+def synthetic_dataframe(size_bytes: int, seed: int = 42) -> pd.DataFrame:
+    """CSV換算で約 size_bytes バイトの台帳形式 DataFrame（Unnamed 列・欠損値・メールアドレスを含む）"""
+    rng = random.Random(seed)
+    row_bytes = 220
+    rows = max(10, size_bytes // row_bytes)
+    data = {
+        "物件番号": [f"WPD{rng.randint(1000000, 9999999)}" for _ in range(rows)],
+        "顧客名": [rng.choice(_NAMES) for _ in range(rows)],
+        "Unnamed: 2": [rng.choice(_CITIES) if rng.random() < 0.8 else None for _ in range(rows)],
+        "メールアドレス": [f"user{rng.randint(1, 99999)}@example.co.jp" for _ in range(rows)],
+        "賃料": [rng.randint(50, 300) * 1000 for _ in range(rows)],
+        "入居日": [f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" for _ in range(rows)],
+        "Unnamed: 6": [None] * rows,
+        "備考": ["、".join(rng.sample(_WORDS, 3)) if rng.random() < 0.6 else None for _ in range(rows)],
+    }
+    return pd.DataFrame(data)
+
+
+# ============================================================
+# ベンチマーク対象
+# ============================================================
+
+def _bench_chunk_knowledge_base(size: int) -> Callable[[], Any]:
+    from modules.chat_utils import chunk_knowledge_base
+    text = synthetic_text(size)
+    return lambda: chunk_knowledge_base(text)
+
+
+def _bench_check_text_corruption(size: int) -> Callable[[], Any]:
+    from modules.knowledge.pdf import check_text_corruption
+    text = synthetic_text(size)
+    return lambda: check_text_corruption(text)
+
+
+def _bench_excel_data_cleaner(size: int) -> Callable[[], Any]:
+    from modules.excel_data_cleaner import ExcelDataCleaner
+    cleaner = ExcelDataCleaner()
+    df = synthetic_dataframe(size)
+
+    def run():
+        cleaned = cleaner._clean_dataframe(df.copy())
+        return cleaner._convert_to_structured_text(cleaned, "Sheet1")
+    return run
+
+
+def _bench_unnamed_column_handler(size: int) -> Callable[[], Any]:
+    from modules.knowledge.unnamed_column_handler import UnnamedColumnHandler
+    handler = UnnamedColumnHandler()
+    df = synthetic_dataframe(size)
+    return lambda: handler.fix_dataframe(df.copy(), "benchmark.xlsx")
+
+
+def _bench_extract_records(size: int) -> Callable[[], Any]:
+    from modules.document_processor_record_based import DocumentProcessorRecordBased
+    processor = DocumentProcessorRecordBased()
+    df = synthetic_dataframe(size)
+    return lambda: processor._extract_records_from_dataframe(df.copy(), "Sheet1")
+
+
+def _bench_extract_records_from_excel(size: int) -> Callable[[], Any]:
+    import io
+    from modules.document_processor_record_based import DocumentProcessorRecordBased
+    processor = DocumentProcessorRecordBased()
+    buffer = io.BytesIO()
+    synthetic_dataframe(size).to_excel(buffer, sheet_name="Sheet1", index=False)
+    content = buffer.getvalue()
+    # シートの解析からレコード作成まで（アップロード時にスレッドで実行される処理）
+    return lambda: processor._extract_records_from_excel_sync(content, "benchmark.xlsx")
+
+
+def _bench_count_tokens(size: int) -> Callable[[], Any]:
+    from modules.token_counter import TokenCounter
+    counter = TokenCounter()
+    text = synthetic_text(size)
+    return lambda: counter.count_tokens(text)
+
+
+def _bench_is_chunk_actually_used(size: int) -> Callable[[], Any]:
+    from modules.realtime_rag import RealtimeRAGProcessor
+    # 判定処理はインスタンスの状態を使わないため、DB・APIの初期化を行わずに生成
+    processor = RealtimeRAGProcessor.__new__(RealtimeRAGProcessor)
+    text = synthetic_text(size)
+    chunks = [text[i:i + 700] for i in range(0, len(text), 700)]
+    answer = synthetic_text(2000, seed=7) + chunks[len(chunks) // 2][:200]
+    chunk_dicts = [{"document_name": f"資料{i}.pdf", "content": chunk} for i, chunk in enumerate(chunks)]
+
+    def run():
+        return sum(processor._is_chunk_actually_used(answer, chunk["content"], chunk) for chunk in chunk_dicts)
+    return run
+
+
+BENCHMARKS: Dict[str, Callable[[int], Callable[[], Any]]] = {
+    "chunk_knowledge_base": _bench_chunk_knowledge_base,
+    "check_text_corruption": _bench_check_text_corruption,
+    "excel_data_cleaner": _bench_excel_data_cleaner,
+    "unnamed_column_handler": _bench_unnamed_column_handler,
+    "extract_records_from_dataframe": _bench_extract_records,
+    "extract_records_from_excel": _bench_extract_records_from_excel,
+    "count_tokens": _bench_count_tokens,
+    "is_chunk_actually_used": _bench_is_chunk_actually_used,
+}
+
+
+# ============================================================
+# 計測・比較
+# ============================================================
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[float, float]:
+    """repeat 回実行して (最小, 中央値) 秒を返す"""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), statistics.median(timings)
+
+
+def scaling_exponent(points: List[Tuple[int, float]]) -> float:
+    """最小サイズと最大サイズの計測値から time ∝ size^k の k を推定（1.0 で線形）"""
+    (small_size, small_time), (large_size, large_time) = points[0], points[-1]
+    if small_size == large_size or small_time <= 0 or large_time <= 0:
+        return float("nan")
+    return math.log(large_time / small_time) / math.log(large_size / small_size)
+
+
+def run_benchmarks(names: List[str], sizes: List[int], repeat: int, max_seconds: float) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        results[name] = {}
+        for size in sizes:
+            label = format_size(size)
+            try:
+                func = BENCHMARKS[name](size)
+            except Exception as e:
+                print(f"⚠️ {name} [{label}] 準備失敗: {e}")
+                break
+            best, median = measure(func, 1)
+            # 1回で上限時間を超える場合は繰り返さず、より大きなサイズも省略
+            if best < max_seconds and repeat > 1:
+                best, median = measure(func, repeat)
+            results[name][label] = {"size": size, "best": best, "median": median,
+                                    "mb_per_sec": size / SIZE_UNITS["m"] / best if best > 0 else None}
+            print(f"  {name:<32}{label:>8}{best * 1000:>12.1f}ms{median * 1000:>12.1f}ms"
+                  f"{results[name][label]['mb_per_sec'] or 0:>10.2f}MB/s")
+            if best >= max_seconds:
+                print(f"  ⏭️ {name}: {max_seconds:g}秒を超えたため、これより大きなサイズは省略")
+                break
+    return results
+
+
+def print_scaling(results: Dict[str, Dict[str, Any]]):
+    print("\n📐 スケーリング（time ∝ size^k、k=1.0 で線形）")
+    for name, by_size in results.items():
+        points = sorted((entry["size"], entry["best"]) for entry in by_size.values())
+        if len(points) >= 2:
+            print(f"  {name:<32} k={scaling_exponent(points):.2f}")
+
+
+def compare_with_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> int:
+    """ベースラインとの比（現在/ベースライン）を表示し、閾値を超えた件数を返す"""
+    print(f"\n📊 ベースライン比較（{baseline.get('created_at', '?')} / {baseline.get('python', '?')}）")
+    print(f"  {'対象':<30}{'サイズ':>8}{'ベースライン':>14}{'現在':>12}{'比':>8}")
+    regressions = 0
+    for name, by_size in results.items():
+        for label, entry in by_size.items():
+            base_entry = baseline.get("results", {}).get(name, {}).get(label)
+            if not base_entry:
+                continue
+            ratio = entry["best"] / base_entry["best"] if base_entry["best"] > 0 else float("inf")
+            mark = "❌" if ratio > threshold else ("✅" if ratio < 1 / threshold else "  ")
+            regressions += ratio > threshold
+            print(f"{mark}{name:<30}{label:>8}{base_entry['best'] * 1000:>12.1f}ms{entry['best'] * 1000:>10.1f}ms{ratio:>8.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="テキスト処理・取り込み処理のマイクロベンチマーク")
+    parser.add_argument("--sizes", nargs="+", default=["100k", "1m", "5m"], help="入力サイズ（例: 100k 1m 50m）")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="実行する対象")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-seconds", type=float, default=60.0, help="1回の実行がこれを超えたら大きなサイズを省略")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--threshold", type=float, default=1.2, help="この倍率を超えて遅くなったら劣化とみなす")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    # 行ごと・列ごとのログで計測がぶれないようにする
+    logging.basicConfig(level=logging.WARNING, force=True)
+
+    sizes = sorted(parse_size(size) for size in args.sizes)
+    names = args.only or list(BENCHMARKS)
+
+    print("=" * 80)
+    print(f"⏱️ マイクロベンチマーク: {len(names)}件 × {[format_size(size) for size in sizes]} (repeat={args.repeat})")
+    print(f"  {'対象':<30}{'サイズ':>8}{'最小':>14}{'中央値':>12}{'処理速度':>10}")
+    results = run_benchmarks(names, sizes, args.repeat, args.max_seconds)
+    print_scaling(results)
+
+    exit_code = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\n⚠️ ベースラインがありません: {args.baseline}（--save-baseline で作成）")
+        else:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            regressions = compare_with_baseline(results, baseline, args.threshold)
+            print(f"\n{'❌' if regressions else '✅'} 劣化: {regressions}件（閾値 {args.threshold:g}倍）")
+            if regressions and args.fail_on_regression:
+                exit_code = 1
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 ベースラインを保存しました: {args.baseline}")
+    print("=" * 80)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+📏 ベクトル検索ベンチマーク
+元のベクトルでの全件検索（正解）と量子化インデックスによる2段階検索を比較し、
+再現率（recall@k）とレイテンシを計測します（--local でローカルベクトルインデックスも比較）
+
+会社のチャンクから埋め込みをサンプリングしてクエリとして使用します
+    python benchmark_vector_search.py --company-id <company_id> --queries 20 --top-k 80
+    python benchmark_vector_search.py --company-id <company_id> --mode halfvec --candidates 200 400 800
+    python benchmark_vector_search.py --company-id <company_id> --local
+"""
+
+import sys
+import time
+import argparse
+import statistics
+from typing import List, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+sys.path.append('.')
+
+from modules.config import get_database_url
+from modules.quantized_vector_search import (
+    QUANTIZED_INDEXES, quantized_distance_sql, prepare_quantized_search
+)
+from modules.vector_index import CompanyVectorIndex
+
+
+def sample_query_vectors(cur, company_id: str, count: int) -> List[str]:
+    """会社のチャンクからクエリ用の埋め込みをサンプリング"""
+    cur.execute("""
+        SELECT embedding::text AS embedding
+        FROM chunks
+        WHERE company_id = %s AND embedding IS NOT NULL
+        ORDER BY random()
+        LIMIT %s
+    """, (company_id, count))
+    return [row['embedding'] for row in cur.fetchall()]
+
+
+def exact_search(cur, company_id: str, vector_str: str, top_k: int) -> Tuple[List[str], float]:
+    """元のベクトルで全件比較（正解データ）"""
+    start = time.perf_counter()
+    cur.execute(f"""
+        SELECT c.id
+        FROM chunks c
+        JOIN document_sources ds ON ds.id = c.doc_id
+        WHERE c.company_id = %s AND c.embedding IS NOT NULL
+          AND ds.active = true AND LENGTH(c.content) > 10
+        ORDER BY c.embedding <=> '{vector_str}'::vector
+        LIMIT %s
+    """, (company_id, top_k))
+    ids = [str(row['id']) for row in cur.fetchall()]
+    return ids, (time.perf_counter() - start) * 1000
+
+
+def two_stage_search(cur, company_id: str, vector_str: str, top_k: int,
+                     mode: str, candidates: int) -> Tuple[List[str], float]:
+    """量子化インデックスで候補を絞り込み、元のベクトルで再スコアリング"""
+    start = time.perf_counter()
+    prepare_quantized_search(cur, candidates)
+    cur.execute(f"""
+        SELECT id FROM (
+            SELECT c.id, c.embedding
+            FROM chunks c
+            JOIN document_sources ds ON ds.id = c.doc_id
+            WHERE c.company_id = %s AND c.embedding IS NOT NULL
+              AND ds.active = true AND LENGTH(c.content) > 10
+            ORDER BY {quantized_distance_sql(mode, vector_str)}
+            LIMIT %s
+        ) ann
+        ORDER BY embedding <=> '{vector_str}'::vector
+        LIMIT %s
+    """, (company_id, candidates, top_k))
+    ids = [str(row['id']) for row in cur.fetchall()]
+    return ids, (time.perf_counter() - start) * 1000
+
+
+def local_search(index: CompanyVectorIndex, vector_str: str, top_k: int) -> Tuple[List[str], float]:
+    """ローカルベクトルインデックスで検索（DBアクセスなし）"""
+    query = [float(value) for value in vector_str.strip("[]").split(",")]
+    start = time.perf_counter()
+    ids = [result['chunk_id'] for result in index.search(query, top_k)]
+    return ids, (time.perf_counter() - start) * 1000
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量子化ベクトル2段階検索のベンチマーク")
+    parser.add_argument("--company-id", required=True)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=80)
+    parser.add_argument("--mode", choices=sorted(QUANTIZED_INDEXES), default="binary")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[200, 400, 800])
+    parser.add_argument("--local", action="store_true", help="ローカルベクトルインデックスも計測")
+    args = parser.parse_args()
+
+    with psycopg2.connect(get_database_url(), cursor_factory=RealDictCursor) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_indexes WHERE tablename = 'chunks' AND indexname = %s",
+                        (QUANTIZED_INDEXES[args.mode],))
+            if cur.fetchone() is None:
+                print(f"❌ {QUANTIZED_INDEXES[args.mode]} がありません。sql/add_chunks_quantized_embedding.sql を適用してください")
+                return
+
+            cur.execute("""
+                SELECT pg_size_pretty(pg_relation_size(%s::regclass)) AS index_size,
+                       (SELECT COUNT(*) FROM chunks WHERE company_id = %s AND embedding IS NOT NULL) AS chunk_count
+            """, (QUANTIZED_INDEXES[args.mode], args.company_id))
+            info = cur.fetchone()
+            print(f"📦 会社のチャンク数: {info['chunk_count']} | インデックスサイズ({args.mode}): {info['index_size']}")
+
+            queries = sample_query_vectors(cur, args.company_id, args.queries)
+            if not queries:
+                print("❌ 埋め込み済みのチャンクがありません")
+                return
+
+            exact_results = []
+            exact_latencies = []
+            for vector_str in queries:
+                ids, elapsed = exact_search(cur, args.company_id, vector_str, args.top_k)
+                exact_results.append(set(ids))
+                exact_latencies.append(elapsed)
+                conn.rollback()
+
+            print("=" * 80)
+            print(f"{'方式':<24}{'recall@' + str(args.top_k):>12}{'p50(ms)':>12}{'p95(ms)':>12}")
+            print(f"{'exact':<24}{1.0:>12.3f}{statistics.median(exact_latencies):>12.1f}"
+                  f"{percentile(exact_latencies, 0.95):>12.1f}")
+
+            for candidates in args.candidates:
+                recalls = []
+                latencies = []
+                for vector_str, expected in zip(queries, exact_results):
+                    ids, elapsed = two_stage_search(cur, args.company_id, vector_str, args.top_k,
+                                                    args.mode, candidates)
+                    conn.rollback()
+                    recalls.append(len(expected & set(ids)) / len(expected) if expected else 1.0)
+                    latencies.append(elapsed)
+                label = f"{args.mode} ({candidates}件)"
+                print(f"{label:<24}{statistics.mean(recalls):>12.3f}{statistics.median(latencies):>12.1f}"
+                      f"{percentile(latencies, 0.95):>12.1f}")
+
+            if args.local:
+                index = CompanyVectorIndex(args.company_id)
+                index.ensure_fresh()
+                if not index.ready:
+                    print("🧮 ローカルベクトルインデックス: 対象外（チャンク数が上限超過、または埋め込みなし）")
+                else:
+                    recalls = []
+                    latencies = []
+                    for vector_str, expected in zip(queries, exact_results):
+                        ids, elapsed = local_search(index, vector_str, args.top_k)
+                        recalls.append(len(expected & set(ids)) / len(expected) if expected else 1.0)
+                        latencies.append(elapsed)
+                    print(f"{'local (float16)':<24}{statistics.mean(recalls):>12.3f}{statistics.median(latencies):>12.1f}"
+                          f"{percentile(latencies, 0.95):>12.1f}")
+            print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+📊 Excelのローカル解析と Google Sheets API 経由の出力の比較
+Google Sheets API 経由の出力（レコード・セクション・抽出テキスト）をJSONに記録しておき、
+ローカル解析（EXCEL_PARSER=local）の出力と一致するかを確認します
+
+    python compare_excel_parsers.py --record sample.xlsx            # Sheets API 経由の出力を記録（Google認証が必要）
+    python compare_excel_parsers.py sample.xlsx                     # 記録と比較（不一致があれば終了コード1）
+    python compare_excel_parsers.py --recorded-dir fixtures a.xlsx b.xlsx
+
+レコードの source は経路ごとに異なる（'Excel (Google Sheets)' / 'Excel (ローカル解析)'）ため比較しません。
+fixtures/excel_parity/ に小さなブックと期待する出力を置いてあり、Google認証なしで一致を確認できます
+
+    python compare_excel_parsers.py --recorded-dir fixtures/excel_parity fixtures/excel_parity/parity_sample.xlsx
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Tuple
+
+DEFAULT_RECORDED_DIR = os.path.join("benchmark_results", "excel_sheets_recorded")
+# 経路によって値が異なるため比較しないレコードのキー
+IGNORED_RECORD_KEYS = {"source"}
+
+
+def recorded_path(recorded_dir: str, path: str) -> str:
+    return os.path.join(recorded_dir, os.path.basename(path) + ".json")
+
+
+def to_output(result: Tuple[List[Dict], Dict[str, str], str]) -> Dict[str, Any]:
+    data_list, sections, extracted_text = result
+    return {"records": data_list, "sections": sections, "extracted_text": extracted_text}
+
+
+async def run_sheets_api(contents: bytes, filename: str) -> Dict[str, Any]:
+    from modules.knowledge import excel_sheets_processor
+    excel_sheets_processor.EXCEL_PARSER = "sheets"
+    result = await excel_sheets_processor.process_excel_file_with_sheets_api(
+        contents, filename, None, os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE")
+    )
+    return to_output(result)
+
+
+def run_local(contents: bytes, filename: str) -> Dict[str, Any]:
+    from modules.knowledge.excel_sheets_processor import ExcelSheetsProcessor
+    return to_output(ExcelSheetsProcessor().extract_data_locally(contents, filename))
+
+
+def diff_outputs(expected: Dict[str, Any], actual: Dict[str, Any], limit: int) -> List[str]:
+    """一致しない箇所の説明（最大 limit 件）"""
+    diffs = []
+    if expected["sections"] != actual["sections"]:
+        for name in sorted(set(expected["sections"]) | set(actual["sections"])):
+            if expected["sections"].get(name) != actual["sections"].get(name):
+                diffs.append(f"セクション '{name}':\n      記録: {expected['sections'].get(name)!r}\n      ローカル: {actual['sections'].get(name)!r}")
+    if expected["extracted_text"] != actual["extracted_text"] and not diffs:
+        diffs.append("抽出テキストが一致しません")
+
+    expected_records, actual_records = expected["records"], actual["records"]
+    if len(expected_records) != len(actual_records):
+        diffs.append(f"レコード数: 記録 {len(expected_records)} / ローカル {len(actual_records)}")
+    for index, (expected_record, actual_record) in enumerate(zip(expected_records, actual_records)):
+        keys = sorted((set(expected_record) | set(actual_record)) - IGNORED_RECORD_KEYS)
+        for key in keys:
+            if expected_record.get(key) != actual_record.get(key):
+                diffs.append(f"レコード{index} {key}:\n      記録: {expected_record.get(key)!r}\n      ローカル: {actual_record.get(key)!r}")
+        if len(diffs) >= limit:
+            break
+    return diffs[:limit]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Excelのローカル解析と Google Sheets API 経由の出力の比較")
+    parser.add_argument("files", nargs="+", help="比較するExcelファイル（.xlsx）")
+    parser.add_argument("--record", action="store_true", help="Google Sheets API 経由の出力を記録する")
+    parser.add_argument("--recorded-dir", default=DEFAULT_RECORDED_DIR)
+    parser.add_argument("--max-diffs", type=int, default=20, help="ファイルごとに表示する不一致の最大件数")
+    args = parser.parse_args()
+
+    print("=" * 80)
+    failures = 0
+    for path in args.files:
+        with open(path, "rb") as f:
+            contents = f.read()
+        filename = os.path.basename(path)
+        output_path = recorded_path(args.recorded_dir, path)
+
+        if args.record:
+            started = time.perf_counter()
+            output = await run_sheets_api(contents, filename)
+            os.makedirs(args.recorded_dir, exist_ok=True)
+            with open(output_path, "w", encoding="utf-8") as f:
+                json.dump(output, f, ensure_ascii=False, indent=2)
+            print(f"💾 {filename}: {len(output['records'])} レコード（Sheets API {time.perf_counter() - started:.1f}秒）→ {output_path}")
+            continue
+
+        if not os.path.exists(output_path):
+            print(f"⚠️ {filename}: 記録がありません（--record で作成）: {output_path}")
+            failures += 1
+            continue
+        with open(output_path, encoding="utf-8") as f:
+            expected = json.load(f)
+
+        started = time.perf_counter()
+        # JSONを経由した記録と同じ型で比較する
+        actual = json.loads(json.dumps(run_local(contents, filename), ensure_ascii=False))
+        elapsed = time.perf_counter() - started
+
+        diffs = diff_outputs(expected, actual, args.max_diffs)
+        mark = "❌" if diffs else "✅"
+        print(f"{mark} {filename}: {len(actual['records'])} レコード（ローカル {elapsed:.2f}秒）")
+        for diff in diffs:
+            print(f"    {diff}")
+        failures += bool(diffs)
+
+    print("=" * 80)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
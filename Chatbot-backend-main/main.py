@@ -3,12 +3,13 @@
 FastAPIアプリケーションの設定とルーティングを行うmain.py
 """
 import os
+import asyncio
 import os.path
 import datetime
 import traceback
 from contextlib import asynccontextmanager
 from typing import List, Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request, Form, status
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request, Response, Form, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
@@ -30,14 +31,13 @@ from modules.models import (
     UserWithLimits, DemoUsageStats, AdminUserCreate, UpgradePlanRequest,
     UpgradePlanResponse, SubscriptionInfo
 )
-from modules.knowledge import process_url, process_file, get_knowledge_base_info
-from modules.knowledge.google_drive import GoogleDriveHandler
 from modules.chat import process_chat_message as process_chat, process_chunked_chat as process_chat_chunked, set_model as set_chat_model
 from modules.admin import (
     get_chat_history, get_chat_history_paginated, analyze_chats, get_employee_details,
     get_employee_usage, get_uploaded_resources, toggle_resource_active,
     get_company_employees, set_model as set_admin_model, delete_resource,
-    get_chat_history_by_company_paginated, get_chat_history_by_company
+    get_chat_history_by_company_paginated, get_chat_history_by_company,
+    get_chat_history_page
 )
 from modules.company import get_company_name, set_company_name
 from modules.auth import get_current_user, get_current_user_with_maintenance_check, get_current_admin, register_new_user, get_admin_or_user, get_company_admin, get_user_with_delete_permission, get_user_creation_permission
@@ -57,23 +57,25 @@ from modules.validation import validate_login_input, validate_user_input
 import csv
 import io
 from modules.timezone_utils import create_timestamp_for_db
+from modules.metrics import CHAT_STAGE_SECONDS, GENERATION_PATH_TOTAL, render_metrics
+from modules.log_context import start_request_trace, enable_company_debug_trace, trace
+from modules.shared_state import rate_limit_storage_uri
+from modules.warmup import run_warmup, is_ready, get_warmup_status
 
 # ロギングの設定
 logger = setup_logging()
 
-# Gemini APIの設定
-model = setup_gemini()
-
-# モデルの設定
-set_chat_model(model)
-set_admin_model(model)
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """アプリケーションのライフサイクル管理"""
     # スタートアップ処理
     print("🔄 アプリケーション起動時初期化開始...")
     
+    # Gemini APIの設定（import main だけでは行わない）
+    model = setup_gemini()
+    set_chat_model(model)
+    set_admin_model(model)
+    
     # PostgreSQL Fuzzy Search初期化
     try:
         from modules.postgresql_fuzzy_search import initialize_postgresql_fuzzy
@@ -96,12 +98,54 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"起動時整合性チェックでエラーが発生しましたが、アプリケーションは継続します。{str(e)}")
     
+    # Elasticsearch差分同期（ES_INCREMENTAL_SYNC=true の場合のみ）
+    es_sync_task = None
+    if os.getenv("ES_INCREMENTAL_SYNC", "false").lower() == "true":
+        try:
+            from modules.elasticsearch_search import get_elasticsearch_manager, elasticsearch_available
+            if elasticsearch_available():
+                es_sync_task = asyncio.create_task(get_elasticsearch_manager().run_incremental_sync_loop())
+                print("✅ Elasticsearch差分同期開始")
+        except Exception as e:
+            print(f"⚠️ Elasticsearch差分同期の開始失敗: {e}")
+    else:
+        # 差分同期で消費されない変更ログは保持期間を過ぎたら削除する
+        try:
+            from modules.elasticsearch_search import run_change_log_prune_loop, PSYCOPG2_AVAILABLE
+            if PSYCOPG2_AVAILABLE:
+                es_sync_task = asyncio.create_task(run_change_log_prune_loop())
+        except Exception as e:
+            print(f"⚠️ 変更ログ削除タスクの開始失敗: {e}")
+    
+    # トークナイザー・DB接続・Geminiクライアント・検索構造のウォームアップ（完了まで /health/ready は 503）
+    warmup_task = asyncio.create_task(run_warmup())
+    
     print("✅ アプリケーション起動時初期化完了")
     
     yield  # アプリケーションの実行
     
     # シャットダウン処理（必要に応じて追加）
     print("🔄 アプリケーション終了処理...")
+    
+    if es_sync_task is not None:
+        es_sync_task.cancel()
+    if not warmup_task.done():
+        warmup_task.cancel()
+    
+    # キューに残っているチャット履歴を書き込む
+    try:
+        from modules.chat_history_writer import shutdown_chat_history_writer
+        await shutdown_chat_history_writer()
+    except Exception as e:
+        print(f"⚠️ チャット履歴の書き込み失敗: {e}")
+    
+    # 未反映のテンプレート使用回数を書き込む
+    try:
+        from modules.template_management import flush_template_usage_counts
+        await flush_template_usage_counts()
+    except Exception as e:
+        print(f"⚠️ テンプレート使用回数の書き込み失敗: {e}")
+    
     print("✅ アプリケーション終了処理完了")
 
 # FastAPIアプリケーションの作成
@@ -115,8 +159,8 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# 🛡️ レート制限の設定
-limiter = Limiter(key_func=get_remote_address)
+# 🛡️ レート制限の設定（複数ワーカーではカウンタを共有ストアに置く）
+limiter = Limiter(key_func=get_remote_address, storage_uri=rate_limit_storage_uri())
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -181,17 +225,21 @@ app.add_middleware(
     allow_credentials=True,  # クレデンシャル許可
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["*"],
-    expose_headers=["*"],
+    # クレデンシャル付きリクエストでは "*" がワイルドカードとして扱われないため明示する
+    expose_headers=["*", "X-Request-ID", "X-Next-Cursor"],
     max_age=86400,  # プリフライトリクエストのキャッシュ時間（秒）
 )
 
 # リクエストロギングミドルウェア
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url.path}")
+    # リクエストごとのトレースID（X-Request-ID）と詳細トレース（X-Debug-Trace）を設定
+    trace_id = start_request_trace(request.headers.get("X-Request-ID"), request.headers.get("X-Debug-Trace"))
+    logger.info("Request: %s %s", request.method, request.url.path)
     try:
         response = await call_next(request)
-        logger.info(f"Response: {response.status_code}")
+        logger.info("Response: %s", response.status_code)
+        response.headers["X-Request-ID"] = trace_id
         return response
     except Exception as e:
         logger.error(f"Request error: {str(e)}")
@@ -829,58 +877,20 @@ async def download_chat_history_csv(current_user = Depends(get_admin_or_user), d
         
         print(f"🔍 [CSV_DOWNLOAD] 権限チェック: special_admin={is_special_admin}, admin_user={is_admin_user}, user={is_user}")
         
-        # チャット履歴を複数の方法で取得を試行
+        # チャット履歴をキーセットでページングしながら取得
         chat_history = []
         try:
             if is_special_admin:
-                print(f"🔍 [CSV_DOWNLOAD] 全データアクセス権限で実行: special_admin={is_special_admin}")
                 # 特別管理者のみが全ユーザーのチャットを取得可能
-                try:
-                    chat_history = get_chat_history(None, db)
-                    print(f"🔍 [CSV_DOWNLOAD] get_chat_history結果: {len(chat_history) if chat_history else 0}件")
-                except Exception as e1:
-                    print(f"🔍 [CSV_DOWNLOAD] get_chat_history失敗: {e1}")
-                    # フォールバック：直接Supabaseから取得
-                    from supabase_adapter import select_data
-                    result = select_data("chat_history")
-                    chat_history = result.data if result and result.data else []
-                    print(f"🔍 [CSV_DOWNLOAD] 直接取得結果: {len(chat_history)}件")
-                    
+                chat_history = get_chat_history(None, db)
             elif is_admin_user or is_user:
-                print(f"🔍 [CSV_DOWNLOAD] 会社制限アクセス権限で実行: {current_user['role']}")
                 # 会社管理者の場合は自分の会社のチャットを取得
                 company_id = current_user.get("company_id")
-                print(f"🔍 [CSV_DOWNLOAD] company_id: {company_id}")
                 if company_id:
-                    try:
-                        chat_history = get_chat_history_by_company(company_id, db)
-                        print(f"🔍 [CSV_DOWNLOAD] get_chat_history_by_company結果: {len(chat_history) if chat_history else 0}件")
-                    except Exception as e2:
-                        print(f"🔍 [CSV_DOWNLOAD] get_chat_history_by_company失敗: {e2}")
-                        # フォールバック：ページネーション版を試行
-                        try:
-                            chat_history, total_count = get_chat_history_by_company_paginated(company_id, db, limit=10000, offset=0)
-                            print(f"🔍 [CSV_DOWNLOAD] get_chat_history_by_company_paginated結果: {len(chat_history) if chat_history else 0}件")
-                        except Exception as e3:
-                            print(f"🔍 [CSV_DOWNLOAD] get_chat_history_by_company_paginated失敗: {e3}")
-                            # さらなるフォールバック：直接取得
-                            from supabase_adapter import select_data
-                            company_users_result = select_data("users", filters={"company_id": company_id})
-                            if company_users_result and company_users_result.data:
-                                user_ids = [user["id"] for user in company_users_result.data]
-                                print(f"🔍 [CSV_DOWNLOAD] 会社のユーザーID: {user_ids}")
-                                # 各ユーザーのチャット履歴を個別に取得
-                                all_chats = []
-                                for user_id in user_ids:
-                                    user_chat_result = select_data("chat_history", filters={"employee_id": user_id})
-                                    if user_chat_result and user_chat_result.data:
-                                        all_chats.extend(user_chat_result.data)
-                                chat_history = all_chats
-                                print(f"🔍 [CSV_DOWNLOAD] 個別取得結果: {len(chat_history)}件")
+                    chat_history = get_chat_history_by_company(company_id, db)
                 else:
                     print("🔍 [CSV_DOWNLOAD] company_idがないため権限降格：自分のチャットのみ取得")
                     chat_history = get_chat_history(current_user["id"], db)
-                    print(f"🔍 [CSV_DOWNLOAD] 個人チャット結果: {len(chat_history) if chat_history else 0}件")
             else:
                 # ここに到達することは権限制御により理論上ありえない
                 print(f"⚠️ [CSV_DOWNLOAD] 予期しない権限状態: {current_user['role']}")
@@ -889,6 +899,8 @@ async def download_chat_history_csv(current_user = Depends(get_admin_or_user), d
                     detail="CSVダウンロードの権限がありません"
                 )
                 
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"チャット履歴取得エラー: {e}")
             import traceback
@@ -1012,6 +1024,7 @@ async def admin_get_demo_stats(current_user = Depends(get_admin_or_user), db: Su
 @limiter.limit("10/minute")  # 🛡️ 外部リソース保護：1分間に10回のURL送信制限
 async def submit_url(request: Request, submission: UrlSubmission, current_user = Depends(get_current_user_with_maintenance_check), db: SupabaseConnection = Depends(get_db)):
     """URLを送信して知識ベースを更新"""
+    from modules.knowledge import process_url
     try:
         # URLが空でないことを確認
         if not submission.url or not submission.url.strip():
@@ -1184,6 +1197,7 @@ async def upload_multiple_knowledge(
     db: SupabaseConnection = Depends(get_db)
 ):
     """複数ファイルを順次アップロードして知識ベースを更新（サーバー負荷軽減）"""
+    from modules.knowledge import process_file
     try:
         if not files:
             raise HTTPException(
@@ -1281,10 +1295,38 @@ async def upload_multiple_knowledge(
             detail=f"複数ファイルのアップロード中にエラーが発生しました: {str(e)}"
         )
 
+# メトリクスエンドポイント（Prometheus テキスト形式）
+@app.get("/metrics")
+async def metrics(request: Request):
+    """チャット処理のステージ別レイテンシ・生成経路・429リトライ回数を返す（METRICS_TOKEN の Bearer 認証が必要）
+
+    METRICS_TOKEN が未設定の場合は公開しない（404）。値はこのワーカープロセスのもの（pid ラベル付き）。
+    """
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if not metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    import hmac
+    authorization = request.headers.get("Authorization", "").encode("utf-8")
+    if not hmac.compare_digest(authorization, f"Bearer {metrics_token}".encode("utf-8")):
+        raise HTTPException(status_code=401, detail="認証が必要です")
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ヘルスチェック（live: プロセスが応答できる / ready: ウォームアップ完了後にトラフィックを受けられる）
+@app.get("/health/live")
+async def health_live():
+    """プロセスが応答できるか（ウォームアップ中も 200）"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """ウォームアップが完了したか（完了前は 503、各ステップの結果と所要時間を返す）"""
+    return JSONResponse(status_code=200 if is_ready() else 503, content=get_warmup_status())
+
 # 知識ベース情報を取得するエンドポイント
 @app.get("/chatbot/api/knowledge-base")
 async def get_knowledge_base(current_user = Depends(get_current_user_with_maintenance_check)):
     """現在の知識ベースの情報を取得"""
+    from modules.knowledge import get_knowledge_base_info
     return get_knowledge_base_info()
 
 # チャットエンドポイント
@@ -1293,14 +1335,14 @@ async def get_knowledge_base(current_user = Depends(get_current_user_with_mainte
 async def chat(request: Request, message: ChatMessage, current_user = Depends(get_current_user_with_maintenance_check), db: SupabaseConnection = Depends(get_db)):
     """チャットメッセージを処理してGeminiからの応答を返す（Enhanced RAG統合版）"""
     # デバッグ用：現在のユーザー情報と利用制限を出力
-    print(f"=== 🚀 Enhanced RAG チャット処理開始 ===")
-    print(f"質問内容: {message.text}")
-    print(f"ユーザー情報: {current_user.get('email', 'unknown')} ({current_user.get('name', 'unknown')})")
+    enable_company_debug_trace(current_user.get("company_id"))
+    logger.info("🚀 Enhanced RAG チャット処理開始: user=%s company_id=%s", current_user.get("id"), current_user.get("company_id"))
+    trace(logger, "質問内容: %s", message.text)
     
-    # 現在の利用制限を取得して表示
+    # 現在の利用制限を取得
     from modules.database import get_usage_limits
     current_limits = get_usage_limits(current_user["id"], db)
-    print(f"現在の利用制限: {current_limits}")
+    trace(logger, "現在の利用制限: %s", current_limits)
     
     # ユーザーIDを設定
     message.user_id = current_user["id"]
@@ -1315,15 +1357,58 @@ async def chat(request: Request, message: ChatMessage, current_user = Depends(ge
         if company_result and company_result.data:
             company_name = company_result.data[0].get("name", "")
     
-    print(f"🏢 会社名取得: '{company_name}' (company_id: {current_user.get('company_id')})")
-    
+    trace(logger, "🏢 会社名取得: '%s' (company_id: %s)", company_name, current_user.get("company_id"))
+
+    # 💬 挨拶・お礼などの雑談は検索せずに即答（埋め込み・検索・生成を省略）
+    from modules.chat_conversation import route_message, generate_casual_response, CASUAL_ROUTE_USE_MODEL
+    route = route_message(message.text)
+    if route["route"] == "casual":
+        try:
+            from modules.chat_processing import save_chat_history
+            from modules.database import update_usage_count
+
+            casual_response = await generate_casual_response(message.text, route, use_model=CASUAL_ROUTE_USE_MODEL)
+            GENERATION_PATH_TOTAL.inc(path="casual")
+
+            remaining_questions = None
+            if not current_limits.get("is_unlimited", False):
+                updated_limits = update_usage_count(current_user["id"], "questions_used", db)
+                if updated_limits:
+                    remaining_questions = updated_limits["questions_limit"] - updated_limits["questions_used"]
+            limit_reached = remaining_questions <= 0 if remaining_questions is not None else False
+
+            try:
+                await save_chat_history(
+                    user_id=current_user["id"],
+                    user_message=message.text,
+                    bot_response=casual_response,
+                    company_id=current_user.get("company_id"),
+                    employee_id=current_user["id"],
+                    employee_name=current_user.get("name"),
+                    category=route["intent_type"],
+                    sentiment="neutral",
+                    model_name="casual",
+                    source_document=None
+                )
+            except Exception as save_error:
+                logger.warning(f"チャット履歴保存エラー: {save_error}")
+
+            return ChatResponse(
+                response=casual_response,
+                source="",
+                remaining_questions=remaining_questions,
+                limit_reached=limit_reached
+            )
+        except Exception as casual_error:
+            logger.warning(f"雑談応答エラー、RAGで処理します: {casual_error}")
+
     # 🚀 新しいEnhanced RAGシステムを優先使用
     try:
         # enhanced_chat_integrationは削除済み、リアルタイムRAGを直接使用
         pass
         from modules.chat_processing import save_chat_history
         from modules.question_categorizer import categorize_question
-        print("🚀 リアルタイムRAGシステムを使用開始")
+        logger.debug("🚀 リアルタイムRAGシステムを使用開始")
         
         # リアルタイムRAGシステムを直接使用
         from modules.realtime_rag import process_question_realtime
@@ -1444,16 +1529,13 @@ async def chat(request: Request, message: ChatMessage, current_user = Depends(ge
             safe_source = safe_string(final_source_text) if final_source_text else ""
             
             # フロントエンド連携最終確認
-            print(f"🔗 FINAL CHECK: safe_source = '{safe_source}'")
-            print(f"🔗 FINAL CHECK: response_data存在? {'response_data' in locals()}")
-            if 'response_data' in locals():
-                print(f"🔗 FINAL CHECK: response_data['source'] = '{response_data.get('source', 'N/A')}'")
-            print("=" * 60)
+            trace(logger, "🔗 FINAL CHECK: safe_source = '%s'", safe_source)
             
             # チャット履歴を保存
             try:
                 # 質問内容を分析してカテゴリーを決定
-                category_result = categorize_question(message.text)
+                with CHAT_STAGE_SECONDS.time(stage="categorize_question"):
+                    category_result = categorize_question(message.text)
                 category = category_result.get("category", "general")
                 
                 # ソース文書名を取得
@@ -1466,18 +1548,19 @@ async def chat(request: Request, message: ChatMessage, current_user = Depends(ge
                                 primary_source_document = source_name.strip()
                                 break
                 
-                await save_chat_history(
-                    user_id=current_user["id"],
-                    user_message=message.text,
-                    bot_response=safe_response,
-                    company_id=current_user.get("company_id"),
-                    employee_id=current_user["id"],
-                    employee_name=current_user.get("name"),
-                    category=category,
-                    sentiment="neutral",
-                    model_name="enhanced-rag",
-                    source_document=primary_source_document
-                )
+                with CHAT_STAGE_SECONDS.time(stage="save_chat_history"):
+                    await save_chat_history(
+                        user_id=current_user["id"],
+                        user_message=message.text,
+                        bot_response=safe_response,
+                        company_id=current_user.get("company_id"),
+                        employee_id=current_user["id"],
+                        employee_name=current_user.get("name"),
+                        category=category,
+                        sentiment="neutral",
+                        model_name="enhanced-rag",
+                        source_document=primary_source_document
+                    )
                 logger.debug("チャット履歴保存完了")
             except Exception as save_error:
                 logger.warning(f"チャット履歴保存エラー: {save_error}")
@@ -1499,6 +1582,7 @@ async def chat(request: Request, message: ChatMessage, current_user = Depends(ge
         # フォールバック: 従来のGemini質問分析RAGシステムを使用
         try:
             from modules.chat_realtime_rag import process_chat_with_realtime_rag
+            GENERATION_PATH_TOTAL.inc(path="chat_realtime_rag")
             result = await process_chat_with_realtime_rag(message, db, current_user)
             
             if isinstance(result, dict):
@@ -1812,99 +1896,60 @@ async def chat_with_chunk_visibility(message: ChatMessage, current_user = Depend
         }
 
 
-# チャット履歴を取得するエンドポイント（ページネーション対応）
+# チャット履歴を取得するエンドポイント（キーセットページネーション対応）
 @app.get("/chatbot/api/admin/chat-history")
 async def admin_get_chat_history(
     limit: int = 30,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    employee_id: Optional[str] = None,
+    category: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
     current_user = Depends(get_admin_or_user), 
     db: SupabaseConnection = Depends(get_db)
 ):
-    """チャット履歴を取得する（ページネーション対応）"""
-    print(f"🔍 [CHAT HISTORY DEBUG] admin_get_chat_history 開始")
-    print(f"🔍 [CHAT HISTORY DEBUG] current_user: {current_user}")
-    print(f"🔍 [CHAT HISTORY DEBUG] limit: {limit}, offset: {offset}")
+    """チャット履歴を取得する（キーセットページネーション対応）
     
+    cursor を指定すると (timestamp, id) キーセットで次ページを取得する。
+    cursor 未指定時は offset による従来のページングも受け付ける。
+    """
     # 共通関数を使用して権限チェック（user と admin_user を同等に扱う）
     from modules.utils import get_permission_flags
     permissions = get_permission_flags(current_user)
     is_special_admin = permissions["is_special_admin"]
     is_admin_user = permissions["is_admin_user"]
     is_user = permissions["is_user"]
-    is_employee = current_user["role"] == "employee"
-    
-    # 会社管理者の判定（user=管理者, admin_user=社長）
-    is_company_manager = is_user or is_admin_user
-    
-    print(f"🔍 [CHAT HISTORY DEBUG] 権限チェック:")
-    print(f"  - is_special_admin: {is_special_admin}")
-    print(f"  - is_admin_user: {is_admin_user}")
-    print(f"  - is_company_manager: {is_company_manager}")
-    print(f"  - is_user: {is_user}")
-    print(f"  - is_employee: {is_employee}")
-    
-    try:
-        if is_special_admin:
-            print(f"🔍 [CHAT HISTORY DEBUG] 特別管理者として全ユーザーのチャットを取得")
-            # 特別な管理者の場合は全ユーザーのチャットを取得
-            chat_history, total_count = get_chat_history_paginated(None, db, limit, offset)
-        elif is_admin_user or is_user:
-            print(f"🔍 [CHAT HISTORY DEBUG] 会社管理者として会社のチャットを取得")
-            # admin_user、userは自分の会社のチャットを取得
-            company_id = current_user.get("company_id")
-            print(f"🔍 [CHAT HISTORY DEBUG] company_id: {company_id}")
-            if company_id:
-                chat_history, total_count = get_chat_history_by_company_paginated(company_id, db, limit, offset)
-            else:
-                print(f"🔍 [CHAT HISTORY DEBUG] company_idがないため自分のチャットのみ取得")
-                chat_history, total_count = get_chat_history_paginated(current_user["id"], db, limit, offset)
-        else:
-            print(f"🔍 [CHAT HISTORY DEBUG] 通常ユーザーとして自分のチャットのみ取得")
-            # その他の場合は自分のチャットのみ取得
-            chat_history, total_count = get_chat_history_paginated(current_user["id"], db, limit, offset)
-            
-        print(f"🔍 [CHAT HISTORY DEBUG] 取得結果: {len(chat_history) if chat_history else 0}件 (全体: {total_count}件)")
-        
-    except Exception as e:
-        print(f"🔍 [CHAT HISTORY DEBUG] ページネーション機能でエラーが発生: {e}")
-        import traceback
-        print(traceback.format_exc())
-        
-        # フォールバック: 古い方法でデータを取得
-        if is_special_admin:
-            print(f"🔍 [CHAT HISTORY DEBUG] フォールバック: 特別管理者として全チャット取得")
-            chat_history = get_chat_history(None, db)
-        elif is_admin_user or is_user:
-            print(f"🔍 [CHAT HISTORY DEBUG] フォールバック: 会社チャット取得")
-            company_id = current_user.get("company_id")
-            if company_id:
-                chat_history = get_chat_history_by_company(company_id, db)
-            else:
-                chat_history = get_chat_history(current_user["id"], db)
-        else:
-            print(f"🔍 [CHAT HISTORY DEBUG] フォールバック: 個人チャット取得")
-            chat_history = get_chat_history(current_user["id"], db)
-        
-        # ページネーション風に制限
-        total_count = len(chat_history)
-        start_idx = offset
-        end_idx = min(offset + limit, total_count)
-        chat_history = chat_history[start_idx:end_idx]
-        
-        # has_moreを計算
-        has_more = (offset + limit) < total_count
     
-    # has_moreを計算（try文内で成功した場合の処理）
-    if 'has_more' not in locals():
-        has_more = (offset + limit) < total_count
+    company_id = None
+    if is_special_admin:
+        # 特別な管理者の場合は全ユーザーのチャットを取得
+        pass
+    elif (is_admin_user or is_user) and current_user.get("company_id"):
+        # admin_user、userは自分の会社のチャットを取得
+        company_id = current_user.get("company_id")
+    else:
+        # その他の場合は自分のチャットのみ取得
+        employee_id = current_user["id"]
     
-    print(f"🔍 [CHAT HISTORY DEBUG] 最終レスポンス: {len(chat_history) if chat_history else 0}件, has_more: {has_more}")
+    page = get_chat_history_page(
+        company_id=company_id,
+        employee_id=employee_id,
+        category=category,
+        date_from=date_from,
+        date_to=date_to,
+        cursor=cursor,
+        limit=limit,
+        offset=offset,
+        resolve_names=company_id is not None
+    )
     
     return {
-        "data": chat_history,
+        "data": page["data"],
         "pagination": {
-            "total_count": total_count,
-            "has_more": has_more,
+            "total_count": page["total_count"] or 0,
+            "has_more": page["has_more"],
+            "next_cursor": page["next_cursor"],
             "limit": limit,
             "offset": offset
         }
@@ -2387,15 +2432,23 @@ async def admin_get_ai_insights(current_user = Depends(get_admin_or_user), db: S
 
 # 社員詳細情報を取得するエンドポイント
 @app.get("/chatbot/api/admin/employee-details/{employee_id}", response_model=List[ChatHistoryItem])
-async def admin_get_employee_details(employee_id: str, current_user = Depends(get_admin_or_user), db: SupabaseConnection = Depends(get_db)):
-    """特定の社員の詳細なチャット履歴を取得する"""
-    # 特別な管理者のueue@queuefood.co.jpの場合は全ユーザーのチャットを取得できるようにする
-    from modules.utils import get_permission_flags
-    permissions = get_permission_flags(current_user)
-    is_special_admin = permissions["is_special_admin"]
+async def admin_get_employee_details(
+    employee_id: str,
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    current_user = Depends(get_admin_or_user),
+    db: SupabaseConnection = Depends(get_db)
+):
+    """特定の社員の詳細なチャット履歴を取得する
     
-    # ユーザーIDを渡して権限チェックを行う
-    return await get_employee_details(employee_id, db, current_user["id"])
+    limit・cursor を指定しない場合は全件を返す。
+    指定した場合は1ページ分を返し、次ページがあれば X-Next-Cursor ヘッダーにカーソルを返す。
+    """
+    chat_history, next_cursor = await get_employee_details(employee_id, db, current_user["id"], limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return chat_history
 
 # 会社の全社員情報を取得するエンドポイント
 @app.get("/chatbot/api/admin/company-employees", response_model=List[dict])
@@ -2676,6 +2729,9 @@ async def admin_update_user_status(user_id: str, request: dict, current_user = D
         from modules.database import update_company_users_status
         updated_company_users = update_company_users_status(user_id, new_is_unlimited, db)
         
+        # 社員一覧の統計キャッシュを破棄（新しい利用制限を即時反映）
+        admin.invalidate_employee_stats_cache()
+        
         result_message = f"ユーザー {user['email']} のステータスを{'本番' if new_is_unlimited else 'チェック'}に変更しました"
         if updated_children > 0 or updated_company_users > 0:
             result_message += f"。子アカウント{updated_children} 個、同じ会社のユーザー {updated_company_users} 個も同期しました。"
@@ -3179,8 +3235,8 @@ async def get_company_token_usage_with_prompts(current_user = Depends(get_curren
                         if total_tokens_used > 0:
                             if total_cost_usd > 0:
                                 # 既存のコストデータを使用（新料金体系でプロンプト参照コスト計算）
-                                from modules.token_counter import TokenCounter
-                                counter = TokenCounter()
+                                from modules.token_counter import get_token_counter
+                                counter = get_token_counter()
                                 # JPYからUSDへ変換 (¥0.50 / 150 = $0.00333)
                                 estimated_prompt_cost = estimated_prompt_refs * (counter.prompt_reference_cost / 150)
                                 base_cost_total = max(0, total_cost_usd - estimated_prompt_cost)
@@ -3188,8 +3244,8 @@ async def get_company_token_usage_with_prompts(current_user = Depends(get_curren
                             else:
                                 # コストが0の場合は新料金体系で再計算
                                 print("💰 コストが0のため新料金体系で再計算中...")
-                                from modules.token_counter import TokenCounter
-                                counter = TokenCounter()
+                                from modules.token_counter import get_token_counter
+                                counter = get_token_counter()
                                 pricing = counter.pricing["gemini-2.5-flash"]
                                 
                                 # 30%がinput、70%がoutputと仮定
@@ -3297,8 +3353,8 @@ async def simulate_token_cost_with_prompts(request: dict, current_user = Depends
             raise HTTPException(status_code=400, detail="有効なプロンプト参照数を指定してください")
         
         # 新しい料金体系での計算
-        from modules.token_counter import TokenCounter
-        counter = TokenCounter()
+        from modules.token_counter import get_token_counter
+        counter = get_token_counter()
         
         # 仮のテキストでトークン計算をシミュレート
         # 実際の計算ではinput/outputの比率を仮定
@@ -3373,8 +3429,8 @@ async def get_company_pricing_info(current_user = Depends(get_current_user_with_
             company_name = company_result.data[0].get("name", "Unknown Company")
         
         # TokenCounterを使用して料金体系を判定
-        from modules.token_counter import TokenCounter
-        counter = TokenCounter()
+        from modules.token_counter import get_token_counter
+        counter = get_token_counter()
         pricing_model = counter.get_pricing_model_for_company(company_id)
 
         # Premium Plan判定
@@ -3584,8 +3640,8 @@ async def debug_company_info(current_user = Depends(get_current_user_with_mainte
         company_data = company_result.data[0] if company_result and company_result.data else {}
         
         # Premium Plan判定
-        from modules.token_counter import TokenCounter
-        counter = TokenCounter()
+        from modules.token_counter import get_token_counter
+        counter = get_token_counter()
         is_premium = counter.is_premium_plan_company(company_id)
         
         return {
@@ -3629,8 +3685,8 @@ async def get_company_member_usage(current_user = Depends(get_current_user_with_
             return {"members": [], "total_members": 0}
         
         # TokenCounterを初期化
-        from modules.token_counter import TokenCounter
-        counter = TokenCounter()
+        from modules.token_counter import get_token_counter
+        counter = get_token_counter()
         pricing_model = counter.get_pricing_model_for_company(company_id)
         
         members_usage = []
@@ -4039,6 +4095,8 @@ async def upload_from_google_drive(
     db: SupabaseConnection = Depends(get_db)
 ):
     """Google Driveからファイルをアップロード"""
+    from modules.knowledge import process_file
+    from modules.knowledge.google_drive import GoogleDriveHandler
     try:
         # Google Driveハンドラー初期化
         drive_handler = GoogleDriveHandler()
@@ -4132,6 +4190,7 @@ async def list_drive_files(
     current_user = Depends(get_current_user_with_maintenance_check)
 ):
     """Google Driveファイル一覧取得"""
+    from modules.knowledge.google_drive import GoogleDriveHandler
     try:
         print(f"Google Driveファイル一覧取得 フォルダID={folder_id}")
         
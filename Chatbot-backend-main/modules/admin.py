@@ -3,10 +3,13 @@
 管理画面で使用する機能を提供します
 """
 import os
+import json
+import time
+import base64
 import logging
 import aiofiles
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from io import BytesIO
 from psycopg2.extensions import connection as Connection
 from psycopg2.extras import RealDictCursor
@@ -19,11 +22,6 @@ from .database import get_db
 from .models import ChatHistoryItem, AnalysisResult, EmployeeUsageResult
 from .company import DEFAULT_COMPANY_NAME
 from .knowledge_base import knowledge_base
-from modules.knowledge.url import extract_text_from_url
-from modules.knowledge.excel import process_excel_file
-from modules.knowledge.excel_sheets_processor import process_excel_file_with_sheets_api, is_excel_file
-from modules.knowledge.pdf import process_pdf_file
-from modules.knowledge.text import process_txt_file
 from supabase_adapter import select_data, insert_data, update_data, delete_data
 from .auth import get_current_admin
 
@@ -43,6 +41,13 @@ def set_model(gemini_model):
 # 知識ベースをリフレッシュする関数
 async def refresh_knowledge_base():
     """知識ベースをリフレッシュする"""
+    # 各プロセッサは重い依存を持つため、リフレッシュ時にのみ読み込む
+    from modules.knowledge.url import extract_text_from_url
+    from modules.knowledge.excel import process_excel_file
+    from modules.knowledge.excel_sheets_processor import process_excel_file_with_sheets_api, is_excel_file
+    from modules.knowledge.pdf import process_pdf_file
+    from modules.knowledge.text import process_txt_file
+    
     print("知識ベースをリフレッシュします")
     
     # 現在のソース情報を保存
@@ -50,13 +55,7 @@ async def refresh_knowledge_base():
     source_info = knowledge_base.source_info.copy()
     
     # 知識ベースをリセット
-    knowledge_base.data = None
-    knowledge_base.raw_text = ""
-    knowledge_base.columns = []
-    knowledge_base.url_data = []
-    knowledge_base.url_texts = []
-    knowledge_base.file_data = []
-    knowledge_base.file_texts = []
+    knowledge_base.clear_data()
     
     # ソース情報を復元
     knowledge_base.sources = sources
@@ -153,126 +152,363 @@ async def refresh_knowledge_base():
                 print(f"ソース {source_name} はファイル名と仮定しますが、ファイルパスが不明なため処理できません")
     
     # 知識ベースを更新（update関数は存在しない可能性があるため、直接データを確認）
-    print(f"知識ベース更新完了: {len(knowledge_base.data) if knowledge_base.data is not None else 0} 行のデータ")
+    print(f"知識ベース更新完了: {knowledge_base.row_count} 行のデータ")
     
     return {"status": "success", "message": "知識ベースを更新しました"}
 
+# チャット履歴の取得列（一覧表示に必要な列のみ）
+CHAT_HISTORY_COLUMNS = "id, user_message, bot_response, timestamp, category, sentiment, employee_id, employee_name, source_document, source_page"
+
+# キーセットページネーションの1ページあたり上限
+CHAT_HISTORY_MAX_PAGE_SIZE = 1000
+
+def encode_chat_history_cursor(timestamp: str, chat_id: str) -> str:
+    """(timestamp, id) をURLセーフなカーソル文字列に変換する"""
+    raw = json.dumps([timestamp, chat_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_chat_history_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    """カーソル文字列を (timestamp, id) に戻す。不正な場合は400を返す"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, chat_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        return str(timestamp), str(chat_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="無効なカーソルです")
+
+def _format_chat_history_row(chat: Dict[str, Any], user_name_map: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """chat_history の1行を管理画面用の形式に変換する"""
+    # +00タイムゾーン情報を削除（JSの自動UTC変換を防ぐ）
+    timestamp = chat.get("timestamp") or ""
+    if "+00" in timestamp:
+        timestamp = timestamp.replace("+00", "")
+    
+    employee_id = chat.get("employee_id", "")
+    employee_name = chat.get("employee_name", "")
+    if user_name_map is not None:
+        employee_name = user_name_map.get(employee_id) or employee_name or "不明なユーザー"
+    
+    return {
+        "id": chat.get("id", ""),
+        "user_message": chat.get("user_message", ""),
+        "bot_response": chat.get("bot_response", ""),
+        "timestamp": timestamp,
+        "category": chat.get("category", ""),
+        "sentiment": chat.get("sentiment", ""),
+        "employee_id": employee_id,
+        "employee_name": employee_name,
+        "source_document": chat.get("source_document", ""),
+        "source_page": chat.get("source_page", "")
+    }
+
+def _quote_postgrest_value(value: str) -> str:
+    """PostgRESTのor条件で使える形に値をクォートする"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def get_chat_history_page(
+    company_id: Optional[str] = None,
+    employee_id: Optional[str] = None,
+    category: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 30,
+    offset: int = 0,
+    with_count: bool = True,
+    resolve_names: bool = False
+) -> Dict[str, Any]:
+    """チャット履歴を (timestamp, id) キーセットで1ページ取得する
+    
+    並び替え・フィルタ・件数制限はすべてDB側で行い、
+    idx_chat_history_*_ts_id インデックスに沿った範囲スキャンになるようにする。
+    
+    Args:
+        company_id: 会社IDで絞り込み
+        employee_id: 社員IDで絞り込み
+        category: カテゴリで絞り込み
+        date_from: この日時以降（ISO形式）
+        date_to: この日時以前（ISO形式）
+        cursor: 前ページの next_cursor（指定時は offset を無視）
+        limit: 取得件数
+        offset: カーソル未指定時の後方互換オフセット
+        with_count: 総件数（推定値）を取得するか
+        resolve_names: usersテーブルから社員名を補完するか
+    
+    Returns:
+        {"data": [...], "next_cursor": str | None, "has_more": bool, "total_count": int | None}
+    """
+    from supabase_adapter import get_supabase_client
+    
+    limit = max(1, min(int(limit), CHAT_HISTORY_MAX_PAGE_SIZE))
+    after = decode_chat_history_cursor(cursor)
+    
+    supabase = get_supabase_client()
+    if with_count:
+        # 件数が多い場合は実行計画の推定値を使い、全件カウントを避ける
+        query = supabase.table("chat_history").select(CHAT_HISTORY_COLUMNS, count="estimated")
+    else:
+        query = supabase.table("chat_history").select(CHAT_HISTORY_COLUMNS)
+    
+    if company_id:
+        query = query.eq("company_id", company_id)
+    if employee_id:
+        query = query.eq("employee_id", employee_id)
+    if category:
+        query = query.eq("category", category)
+    if date_from:
+        query = query.gte("timestamp", date_from)
+    if date_to:
+        query = query.lte("timestamp", date_to)
+    
+    if after:
+        after_ts, after_id = after
+        ts = _quote_postgrest_value(after_ts)
+        cid = _quote_postgrest_value(after_id)
+        query = query.or_(f"timestamp.lt.{ts},and(timestamp.eq.{ts},id.lt.{cid})")
+    
+    query = query.order("timestamp", desc=True).order("id", desc=True)
+    
+    # 次ページの有無を判定するため1件多く取得する
+    if after or not offset:
+        query = query.limit(limit + 1)
+    else:
+        query = query.range(offset, offset + limit)
+    
+    result = query.execute()
+    rows = result.data or []
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_chat_history_cursor(last.get("timestamp") or "", last.get("id") or "")
+    
+    user_name_map = None
+    if resolve_names and rows:
+        employee_ids = list({row.get("employee_id") for row in rows if row.get("employee_id")})
+        user_name_map = {}
+        if employee_ids:
+            users_result = supabase.table("users").select("id, name").in_("id", employee_ids).execute()
+            user_name_map = {user["id"]: user.get("name") for user in (users_result.data or [])}
+    
+    return {
+        "data": [_format_chat_history_row(row, user_name_map) for row in rows],
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+        "total_count": getattr(result, "count", None) if with_count else None
+    }
+
+def iter_chat_history(
+    company_id: Optional[str] = None,
+    employee_id: Optional[str] = None,
+    page_size: int = CHAT_HISTORY_MAX_PAGE_SIZE,
+    resolve_names: bool = False,
+    **filters
+):
+    """チャット履歴をキーセットで最後までページングしながら返す（CSV出力用）"""
+    cursor = None
+    while True:
+        page = get_chat_history_page(
+            company_id=company_id,
+            employee_id=employee_id,
+            cursor=cursor,
+            limit=page_size,
+            with_count=False,
+            resolve_names=resolve_names,
+            **filters
+        )
+        yield from page["data"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
 def get_chat_history(user_id: str = None, db = None):
     """チャット履歴を取得する"""
-    print(f"[ADMIN_HISTORY] get_chat_history 呼び出し: user_id={user_id}")
     try:
-        from supabase_adapter import select_data
-        
-        if user_id:
-            result = select_data("chat_history", filters={"employee_id": user_id})
-            print(f"[ADMIN_HISTORY] SupabaseからユーザーID {user_id} のチャット履歴を取得完了。件数: {len(result.data) if result and result.data else 0}")
-        else:
-            result = select_data("chat_history")
-            print(f"[ADMIN_HISTORY] Supabaseから全ユーザーのチャット履歴を取得完了。件数: {len(result.data) if result and result.data else 0}")
-        
-        if not result or not result.data:
-            print("[ADMIN_HISTORY] チャット履歴が見つかりませんでした。")
-            return []
-        
-        chat_history = result.data
-        
-        formatted_history = []
-        for chat in chat_history:
-            # Supabaseの時刻をそのまま表示（フロントでのUTC変換を防ぐ）
-            original_timestamp = chat.get("timestamp", "")
-            display_timestamp = original_timestamp
-            
-            # +00タイムゾーン情報を削除（JSの自動UTC変換を防ぐ）
-            if original_timestamp and "+00" in original_timestamp:
-                display_timestamp = original_timestamp.replace("+00", "")
-                print(f"[時刻修正] {original_timestamp} → {display_timestamp}")
-            
-            item = {
-                "id": chat.get("id", ""),
-                "user_message": chat.get("user_message", ""),
-                "bot_response": chat.get("bot_response", ""),
-                "timestamp": display_timestamp,  # +00を削除した時刻
-                "category": chat.get("category", ""),
-                "sentiment": chat.get("sentiment", ""),
-                "employee_id": chat.get("employee_id", ""),
-                "employee_name": chat.get("employee_name", ""),
-                "source_document": chat.get("source_document", ""),
-                "source_page": chat.get("source_page", "")
-            }
-            formatted_history.append(item)
-        
-        formatted_history.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        
-        print(f"[ADMIN_HISTORY] 最終的にフォーマットされたチャット履歴件数: {len(formatted_history)}")
-        return formatted_history
+        return list(iter_chat_history(employee_id=user_id))
     except Exception as e:
-        print(f"[ADMIN_HISTORY] get_chat_history エラー: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.error(f"[ADMIN_HISTORY] get_chat_history エラー: {e}")
         return []
 
 def get_chat_history_paginated(user_id: str = None, db = None, limit: int = 30, offset: int = 0):
     """ページネーション対応のチャット履歴を取得する"""
-    # print(f"ページネーション対応チャット履歴取得APIが呼び出されました (user_id: {user_id}, limit: {limit}, offset: {offset})")
     try:
-        from supabase_adapter import select_data
-        
-        # 全件数を取得するためのクエリ
-        if user_id:
-            # print(f"ユーザーID {user_id} でフィルタリングします")
-            # 特定のユーザーの履歴を取得
-            count_result = select_data("chat_history", columns="id", filters={"employee_id": user_id})
-            result = select_data("chat_history", columns="*", filters={"employee_id": user_id}, order="timestamp desc", limit=limit, offset=offset)
-        else:
-            # print("全ユーザーのチャット履歴を取得します")
-            # 全履歴を取得
-            count_result = select_data("chat_history", columns="id")
-            result = select_data("chat_history", columns="*", order="timestamp desc", limit=limit, offset=offset)
-        
-        # 全件数を取得
-        total_count = len(count_result.data) if count_result and count_result.data else 0
-        
-        if not result or not result.data:
-            # print("チャット履歴が見つかりませんでした")
-            return [], total_count
-        
-        chat_history = result.data
-        # print(f"チャット履歴取得結果: {len(chat_history)}件 (全体: {total_count}件)")
-        
-        # データ形式を統一
-        formatted_history = []
-        for chat in chat_history:
-            # Supabaseの時刻をそのまま表示（フロントでのUTC変換を防ぐ）
-            original_timestamp = chat.get("timestamp", "")
-            display_timestamp = original_timestamp
+        page = get_chat_history_page(employee_id=user_id, limit=limit, offset=offset)
+        return page["data"], page["total_count"] or 0
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"チャット履歴取得エラー: {e}")
+        raise HTTPException(status_code=500, detail=f"チャット履歴取得中にエラーが発生しました: {str(e)}")
+
+# 社員統計の短期キャッシュ（管理画面の再表示ごとに同じ集計を繰り返さないため）
+EMPLOYEE_STATS_CACHE_TTL = float(os.getenv("EMPLOYEE_STATS_CACHE_TTL", "30"))
+_employee_stats_cache: Dict[Tuple, Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+
+DEFAULT_USAGE_LIMITS = {
+    "is_unlimited": False,
+    "is_demo": True,  # デフォルトはデモ版
+    "questions_used": 0,
+    "questions_limit": 10,
+    "document_uploads_used": 0,
+    "document_uploads_limit": 2
+}
+
+def invalidate_employee_stats_cache():
+    """社員統計キャッシュを破棄する（利用制限の変更時など）"""
+    _employee_stats_cache.clear()
+
+def _cached_employee_stats(kind: str, employee_ids: List[str], loader) -> Dict[str, Dict[str, Any]]:
+    """社員IDの集合ごとに集計結果をTTL付きでキャッシュする"""
+    key = (kind, tuple(sorted(employee_ids)))
+    now = time.monotonic()
+    cached = _employee_stats_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    value = loader(employee_ids)
+    _employee_stats_cache[key] = (now + EMPLOYEE_STATS_CACHE_TTL, value)
+    
+    # 期限切れのエントリを掃除
+    for stale_key in [k for k, (expires, _) in _employee_stats_cache.items() if expires <= now]:
+        _employee_stats_cache.pop(stale_key, None)
+    return value
+
+def _to_iso(value) -> Optional[str]:
+    """datetimeをISO文字列に変換する"""
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+def _load_employee_stats(employee_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """メッセージ数・最終利用日時・利用制限を1回のグループ集計で取得する"""
+    import psycopg2
+    from .config import get_database_url
+    
+    sql = """
+        SELECT
+            u.id AS employee_id,
+            COALESCE(s.message_count, 0) AS message_count,
+            s.last_activity,
+            ul.user_id AS limits_user_id,
+            ul.is_unlimited,
+            ul.questions_used,
+            ul.questions_limit,
+            ul.document_uploads_used,
+            ul.document_uploads_limit
+        FROM unnest(%s::text[]) AS u(id)
+        LEFT JOIN (
+            SELECT employee_id, COUNT(*) AS message_count, MAX(timestamp) AS last_activity
+            FROM chat_history
+            WHERE employee_id = ANY(%s::text[])
+            GROUP BY employee_id
+        ) s ON s.employee_id = u.id
+        LEFT JOIN usage_limits ul ON ul.user_id = u.id
+    """
+    
+    stats = {}
+    with psycopg2.connect(get_database_url(), cursor_factory=RealDictCursor) as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, (employee_ids, employee_ids))
+            for row in cur.fetchall():
+                if row["limits_user_id"]:
+                    is_unlimited = bool(row["is_unlimited"])
+                    usage_limits = {
+                        "is_unlimited": is_unlimited,
+                        "is_demo": not is_unlimited,  # is_unlimitedがfalseならデモ版
+                        "questions_used": int(row["questions_used"] or 0),
+                        "questions_limit": int(row["questions_limit"] if row["questions_limit"] is not None else 10),
+                        "document_uploads_used": int(row["document_uploads_used"] or 0),
+                        "document_uploads_limit": int(row["document_uploads_limit"] if row["document_uploads_limit"] is not None else 2)
+                    }
+                else:
+                    usage_limits = dict(DEFAULT_USAGE_LIMITS)
+                
+                stats[row["employee_id"]] = {
+                    "message_count": int(row["message_count"]),
+                    "last_activity": _to_iso(row["last_activity"]),
+                    "usage_limits": usage_limits,
+                    "is_demo": usage_limits["is_demo"]  # デモ版かどうかを直接返す
+                }
+    return stats
+
+def _load_employee_usage(employee_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """メッセージ数・最終利用日時・カテゴリ分布・直近の質問を社員数に依存しない回数のクエリで取得する"""
+    import psycopg2
+    from .config import get_database_url
+    
+    usage = {
+        employee_id: {"message_count": 0, "last_activity": None, "top_categories": [], "recent_questions": []}
+        for employee_id in employee_ids
+    }
+    
+    with psycopg2.connect(get_database_url(), cursor_factory=RealDictCursor) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT employee_id, COUNT(*) AS message_count, MAX(timestamp) AS last_activity
+                FROM chat_history
+                WHERE employee_id = ANY(%s::text[])
+                GROUP BY employee_id
+            """, (employee_ids,))
+            for row in cur.fetchall():
+                usage[row["employee_id"]]["message_count"] = int(row["message_count"])
+                usage[row["employee_id"]]["last_activity"] = _to_iso(row["last_activity"])
             
-            # +00タイムゾーン情報を削除（JSの自動UTC変換を防ぐ）
-            if original_timestamp and "+00" in original_timestamp:
-                display_timestamp = original_timestamp.replace("+00", "")
-                print(f"[時刻修正ページ分け] {original_timestamp} → {display_timestamp}")
+            # カテゴリ分布
+            cur.execute("""
+                SELECT employee_id, category, COUNT(*) AS count
+                FROM chat_history
+                WHERE employee_id = ANY(%s::text[]) AND category IS NOT NULL AND category <> ''
+                GROUP BY employee_id, category
+                ORDER BY employee_id, count DESC
+            """, (employee_ids,))
+            for row in cur.fetchall():
+                usage[row["employee_id"]]["top_categories"].append(
+                    {"category": row["category"], "count": int(row["count"])}
+                )
             
-            item = {
-                "id": chat.get("id", ""),
-                "user_message": chat.get("user_message", ""),
-                "bot_response": chat.get("bot_response", ""),
-                "timestamp": display_timestamp,  # +00を削除した時刻
-                "category": chat.get("category", ""),
-                "sentiment": chat.get("sentiment", ""),
-                "employee_id": chat.get("employee_id", ""),
-                "employee_name": chat.get("employee_name", ""),
-                "source_document": chat.get("source_document", ""),
-                "source_page": chat.get("source_page", "")
-            }
-            formatted_history.append(item)
-        
-        # print(f"チャット履歴変換結果: {len(formatted_history)}件")
-        return formatted_history, total_count
-        
+            # 最近の質問（最新3件）
+            cur.execute("""
+                SELECT employee_id, user_message
+                FROM (
+                    SELECT employee_id, user_message,
+                           ROW_NUMBER() OVER (PARTITION BY employee_id ORDER BY timestamp DESC, id DESC) AS rn
+                    FROM chat_history
+                    WHERE employee_id = ANY(%s::text[]) AND user_message IS NOT NULL AND user_message <> ''
+                ) recent
+                WHERE rn <= 3
+                ORDER BY employee_id, rn
+            """, (employee_ids,))
+            for row in cur.fetchall():
+                usage[row["employee_id"]]["recent_questions"].append(row["user_message"])
+    
+    return usage
+
+def get_employee_stats_bulk(employee_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """社員ごとの使用状況をまとめて取得する（失敗時はデフォルト値）"""
+    employee_ids = [employee_id for employee_id in employee_ids if employee_id]
+    if not employee_ids:
+        return {}
+    try:
+        return _cached_employee_stats("stats", employee_ids, _load_employee_stats)
     except Exception as e:
-        print(f"チャット履歴取得エラー: {e}")
-        import traceback
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"チャット履歴取得中にエラーが発生しました: {str(e)}")
+        logger.error(f"社員使用状況の一括取得エラー: {e}")
+        return {}
+
+def get_employee_usage_bulk(employee_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """社員ごとの利用状況（カテゴリ・直近の質問を含む）をまとめて取得する"""
+    employee_ids = [employee_id for employee_id in employee_ids if employee_id]
+    if not employee_ids:
+        return {}
+    try:
+        return _cached_employee_stats("usage", employee_ids, _load_employee_usage)
+    except Exception as e:
+        logger.error(f"社員利用状況の一括取得エラー: {e}")
+        return {}
 
 async def get_company_employees(user_id: str = None, db: Connection = Depends(get_db), company_id: str = None):
     """会社の社員情報を取得する
@@ -291,75 +527,14 @@ async def get_company_employees(user_id: str = None, db: Connection = Depends(ge
         # None = 全社員取得（特別管理者・admin用）
         # 有効なID = 指定会社の社員のみ取得（会社管理者用）
         
-        def get_employee_stats(employee_id):
-            """社員の使用状況を取得する"""
-            try:
-                # Supabaseの標準的な方法でメッセージ数を取得
-                chat_history_result = select_data("chat_history", columns="id, timestamp", filters={"employee_id": employee_id})
-                
-                message_count = 0
-                last_activity = None
-                
-                if chat_history_result and chat_history_result.data:
-                    messages = chat_history_result.data
-                    message_count = len(messages)
-                    
-                    # 最新のタイムスタンプを取得
-                    if messages:
-                        timestamps = [msg.get("timestamp") for msg in messages if msg.get("timestamp")]
-                        if timestamps:
-                            last_activity = max(timestamps)
-                
-                # 利用制限情報を取得
-                usage_limits_result = select_data("usage_limits", columns="*", filters={"user_id": employee_id})
-                usage_limits = None
-                is_demo = True  # デフォルトはデモ版
-                
-                if usage_limits_result and usage_limits_result.data and len(usage_limits_result.data) > 0:
-                    limits_data = usage_limits_result.data[0]
-                    is_unlimited = bool(limits_data.get("is_unlimited", False))
-                    is_demo = not is_unlimited  # is_unlimitedがfalseならデモ版
-                    
-                    usage_limits = {
-                        "is_unlimited": is_unlimited,
-                        "is_demo": is_demo,
-                        "questions_used": int(limits_data.get("questions_used", 0)),
-                        "questions_limit": int(limits_data.get("questions_limit", 10)),
-                        "document_uploads_used": int(limits_data.get("document_uploads_used", 0)),
-                        "document_uploads_limit": int(limits_data.get("document_uploads_limit", 2))
-                    }
-                else:
-                    # デフォルトの利用制限情報
-                    usage_limits = {
-                        "is_unlimited": False,
-                        "is_demo": True,  # デフォルトはデモ版
-                        "questions_used": 0,
-                        "questions_limit": 10,
-                        "document_uploads_used": 0,
-                        "document_uploads_limit": 2
-                    }
-                
-                return {
-                    "message_count": message_count,
-                    "last_activity": last_activity,
-                    "usage_limits": usage_limits,
-                    "is_demo": is_demo  # デモ版かどうかを直接返す
-                }
-            except Exception as e:
-                # print(f"社員ID {employee_id} の使用状況取得エラー: {e}")
-                return {
-                    "message_count": 0,
-                    "last_activity": None,
-                    "usage_limits": {
-                        "is_unlimited": False,
-                        "is_demo": True,
-                        "questions_used": 0,
-                        "questions_limit": 10,
-                        "document_uploads_used": 0,
-                        "document_uploads_limit": 2
-                    },
-                    "is_demo": True  # エラー時はデモ版扱い
-                }
+        def default_employee_stats():
+            """統計が取得できない社員のデフォルト値（デモ版扱い）"""
+            return {
+                "message_count": 0,
+                "last_activity": None,
+                "usage_limits": dict(DEFAULT_USAGE_LIMITS),
+                "is_demo": True
+            }
         
         employees = []
         
@@ -378,13 +553,15 @@ async def get_company_employees(user_id: str = None, db: Connection = Depends(ge
                     for company in companies_result.data:
                         companies_dict[company.get("id")] = company.get("name")
                 
+                # 使用状況を全社員分まとめて取得
+                stats_by_id = get_employee_stats_bulk([user.get("id") for user in users_result.data])
+                
                 for user in users_result.data:
                     # 会社名を取得
                     user_company_id = user.get("company_id")
                     company_name = companies_dict.get(user_company_id, f"会社ID: {user_company_id}" if user_company_id else "不明な会社")
                     
-                    # 使用状況を取得
-                    stats = get_employee_stats(user.get("id"))
+                    stats = stats_by_id.get(user.get("id")) or default_employee_stats()
                     employee_with_stats = {
                         **user,
                         "company_name": company_name,
@@ -403,9 +580,11 @@ async def get_company_employees(user_id: str = None, db: Connection = Depends(ge
             
             if result and result.data:
                 print(f"🔍 [ADMIN_EMPLOYEES] 会社の社員情報取得結果: {len(result.data)}件")
+                # 使用状況を全社員分まとめて取得
+                stats_by_id = get_employee_stats_bulk([employee.get("id") for employee in result.data])
+                
                 for employee in result.data:
-                    # 使用状況を取得
-                    stats = get_employee_stats(employee.get("id"))
+                    stats = stats_by_id.get(employee.get("id")) or default_employee_stats()
                     employee_with_stats = {
                         **employee,
                         **stats
@@ -430,65 +609,24 @@ async def get_employee_usage(user_id: str = None, db: Connection = Depends(get_d
         # 社員の利用状況を取得するクエリを実行
         employee_usage = []
         
-        def format_usage_data(user_data, user_id_key="id", name_key="name"):
-            """使用状況データをフォーマットする共通関数"""
-            user_id = user_data.get(user_id_key)
-            if not user_id:
-                return None
-                
-            # Supabaseの標準的な方法でメッセージ数と最終アクティビティを取得
-            try:
-                chat_history_result = select_data("chat_history", columns="id, timestamp, category, user_message", filters={"employee_id": user_id})
-                
-                message_count = 0
-                last_activity = None
-                
-                if chat_history_result and chat_history_result.data:
-                    messages = chat_history_result.data
-                    message_count = len(messages)
-                    
-                    # 最新のタイムスタンプを取得
-                    timestamps = [msg.get("timestamp") for msg in messages if msg.get("timestamp")]
-                    if timestamps:
-                        last_activity = max(timestamps)
-                    
-                    # カテゴリ分布を取得
-                    category_counts = {}
-                    for msg in messages:
-                        category = msg.get("category")
-                        if category:
-                            category_counts[category] = category_counts.get(category, 0) + 1
-                    
-                    top_categories = [
-                        {"category": cat, "count": count}
-                        for cat, count in category_counts.items()
-                    ]
-                    
-                    # 最近の質問を取得（最新3件）
-                    recent_questions = []
-                    sorted_messages = sorted(messages, key=lambda x: x.get("timestamp", ""), reverse=True)
-                    for msg in sorted_messages[:3]:
-                        user_message = msg.get("user_message")
-                        if user_message:
-                            recent_questions.append(user_message)
-                else:
-                    top_categories = []
-                    recent_questions = []
-            except Exception as e:
-                # print(f"ユーザーID {user_id} のチャット履歴取得エラー: {e}")
-                message_count = 0
-                last_activity = None
-                top_categories = []
-                recent_questions = []
-            
-            return {
-                "employee_id": user_id,
-                "employee_name": user_data.get(name_key) or "名前なし",
-                "message_count": message_count,
-                "last_activity": last_activity,
-                "top_categories": top_categories,
-                "recent_questions": recent_questions
-            }
+        def format_usage_data(users):
+            """使用状況データをまとめて取得してフォーマットする"""
+            usage_by_id = get_employee_usage_bulk([user.get("id") for user in users])
+            formatted = []
+            for user in users:
+                user_id = user.get("id")
+                if not user_id:
+                    continue
+                usage = usage_by_id.get(user_id, {})
+                formatted.append({
+                    "employee_id": user_id,
+                    "employee_name": user.get("name") or "名前なし",
+                    "message_count": usage.get("message_count", 0),
+                    "last_activity": usage.get("last_activity"),
+                    "top_categories": usage.get("top_categories", []),
+                    "recent_questions": usage.get("recent_questions", [])
+                })
+            return formatted
         
         if is_special_admin:
             # print("特別な管理者として全ユーザーの利用状況を取得します")
@@ -499,11 +637,7 @@ async def get_employee_usage(user_id: str = None, db: Connection = Depends(get_d
                 # print(f"全ユーザー取得結果: {all_users.data if all_users else 'なし'}")
                 
                 if all_users and all_users.data:
-                    # 各ユーザーのチャット履歴を取得
-                    for user in all_users.data:
-                        formatted_data = format_usage_data(user)
-                        if formatted_data:
-                            employee_usage.append(formatted_data)
+                    employee_usage.extend(format_usage_data(all_users.data))
                 
                 # print(f"全ユーザーの利用状況取得結果: {len(employee_usage)}件")
                 
@@ -538,10 +672,7 @@ async def get_employee_usage(user_id: str = None, db: Connection = Depends(get_d
                     if users_result and users_result.data:
                         # print(f"会社の社員取得結果: {users_result.data}")
                         
-                        for user in users_result.data:
-                            formatted_data = format_usage_data(user)
-                            if formatted_data:
-                                employee_usage.append(formatted_data)
+                        employee_usage.extend(format_usage_data(users_result.data))
                 except Exception as e:
                     # print(f"会社の社員利用状況取得エラー: {e}")
                     # エラーが発生しても処理を続行
@@ -554,10 +685,7 @@ async def get_employee_usage(user_id: str = None, db: Connection = Depends(get_d
                     user_result = select_data("users", columns="id, name", filters={"id": user_id})
                     
                     if user_result and user_result.data and len(user_result.data) > 0:
-                        user = user_result.data[0]
-                        formatted_data = format_usage_data(user)
-                        if formatted_data:
-                            employee_usage.append(formatted_data)
+                        employee_usage.extend(format_usage_data(user_result.data[:1]))
                 except Exception as e:
                     # print(f"ユーザー利用状況取得エラー: {e}")
                     # エラーが発生しても処理を続行
@@ -639,43 +767,25 @@ async def get_analysis(db: Connection = Depends(get_db)):
         print(f"分析結果取得エラー: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def get_employee_details(employee_id: str, db = None, current_user_id: str = None):
-    """特定の社員の詳細なチャット履歴を取得する"""
+async def get_employee_details(employee_id: str, db = None, current_user_id: str = None, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """特定の社員の詳細なチャット履歴を取得する
+    
+    limit・cursor のどちらも指定しない場合は従来どおり全件を返す（キーセットで最後までページング）。
+    
+    Returns:
+        (チャット履歴リスト, 次ページのカーソル)
+    """
     try:
-        from supabase_adapter import select_data
-        
         # ⚠️ 注意: main.pyで既に権限チェックが実行されているため、ここでの詳細な権限チェックは削除
         # main.pyの権限チェックを信頼して、直接データ取得を行う
-        print(f"🔍 [EMPLOYEE_DETAILS] 社員詳細情報取得: employee_id={employee_id}, current_user_id={current_user_id}")
-        print("ℹ️ main.pyで権限チェック済み - 直接データアクセスを実行")
-        
-        # 社員のチャット履歴を取得
-        chat_history_result = select_data("chat_history", columns="*", filters={"employee_id": employee_id})
-        
-        # 結果を変換
-        chat_history = []
-        if chat_history_result and chat_history_result.data:
-            for row in chat_history_result.data:
-                item = {
-                    "id": row.get("id", ""),
-                    "user_message": row.get("user_message", ""),
-                    "bot_response": row.get("bot_response", ""),
-                    "timestamp": row.get("timestamp", ""),
-                    "category": row.get("category", ""),
-                    "sentiment": row.get("sentiment", ""),
-                    "employee_id": row.get("employee_id", ""),
-                    "employee_name": row.get("employee_name", ""),
-                    "source_document": row.get("source_document", ""),
-                    "source_page": row.get("source_page", "")
-                }
-                chat_history.append(item)
-            
-            # タイムスタンプでソート（降順）
-            chat_history.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        
-        return chat_history
+        if limit is None and cursor is None:
+            return list(iter_chat_history(employee_id=employee_id)), None
+        page = get_chat_history_page(employee_id=employee_id, cursor=cursor, limit=limit or 100, with_count=False)
+        return page["data"], page["next_cursor"]
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"社員詳細情報取得エラー: {e}")
+        logger.error(f"社員詳細情報取得エラー: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # リソース関連の関数は modules.resource に移動されているため、
@@ -964,221 +1074,21 @@ async def analyze_chats(user_id: str = None, db = None, company_id: str = None):
 
 def get_chat_history_by_company_paginated(company_id: str, db = None, limit: int = 30, offset: int = 0):
     """会社IDでフィルタリングしたページネーション対応のチャット履歴を取得する"""
-    print(f"[ADMIN_HISTORY] get_chat_history_by_company_paginated 呼び出し: company_id={company_id}, limit={limit}, offset={offset}")
-    
     try:
-        from supabase_adapter import select_data
-        
-        users_result = select_data("users", columns="id", filters={"company_id": company_id})
-        
-        if not users_result or not users_result.data:
-            print(f"[ADMIN_HISTORY] 会社ID {company_id} のユーザーが見つかりません。チャット履歴なし。")
-            return [], 0
-        
-        user_ids = [user["id"] for user in users_result.data]
-        print(f"[ADMIN_HISTORY] 会社のユーザーID一覧: {user_ids}")
-        
-        all_chat_data = []
-        total_count = 0
-        
-        for user_id in user_ids:
-            try:
-                # employee_id または user_id のどちらかでマッチするチャット履歴を検索
-                user_count_result1 = select_data(
-                    "chat_history", 
-                    columns="id", 
-                    filters={"employee_id": user_id}
-                )
-                user_count_result2 = select_data(
-                    "chat_history", 
-                    columns="id", 
-                    filters={"user_id": user_id}
-                )
-                user_count1 = len(user_count_result1.data) if user_count_result1 and user_count_result1.data else 0
-                user_count2 = len(user_count_result2.data) if user_count_result2 and user_count_result2.data else 0
-                user_count = user_count1 + user_count2
-                total_count += user_count
-                
-                # employee_id でのチャット履歴取得
-                user_result1 = select_data(
-                    "chat_history", 
-                    columns="*", 
-                    filters={"employee_id": user_id},
-                    order="timestamp desc"
-                )
-                
-                # user_id でのチャット履歴取得
-                user_result2 = select_data(
-                    "chat_history", 
-                    columns="*", 
-                    filters={"user_id": user_id},
-                    order="timestamp desc"
-                )
-                
-                # 両方の結果をマージ
-                user_chat_count = 0
-                if user_result1 and user_result1.data:
-                    all_chat_data.extend(user_result1.data)
-                    user_chat_count += len(user_result1.data)
-                
-                if user_result2 and user_result2.data:
-                    all_chat_data.extend(user_result2.data)
-                    user_chat_count += len(user_result2.data)
-                
-                if user_chat_count > 0:
-                    print(f"[ADMIN_HISTORY] ユーザー {user_id}: {user_chat_count}件のチャット履歴をSupabaseから取得")
-                
-            except Exception as e:
-                print(f"[ADMIN_HISTORY] ユーザー {user_id} のデータ取得エラー: {e}")
-                continue
-        
-        print(f"[ADMIN_HISTORY] 全ユーザーのチャット合計（Supabaseから取得）: {len(all_chat_data)}件")
-        
-        # 重複除去（同じIDのチャット履歴が複数あった場合）
-        unique_chats = {}
-        for chat in all_chat_data:
-            chat_id = chat.get("id")
-            if chat_id and chat_id not in unique_chats:
-                unique_chats[chat_id] = chat
-        
-        all_chat_data = list(unique_chats.values())
-        print(f"[ADMIN_HISTORY] 重複除去後: {len(all_chat_data)}件")
-        
-        all_chat_data.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        
-        start_idx = offset
-        end_idx = offset + limit
-        result_data = all_chat_data[start_idx:end_idx]
-        
-        print(f"[ADMIN_HISTORY] ページネーション適用後: {len(result_data)}件 (offset: {offset}, limit: {limit})")
-        
-        if not result_data:
-            print("[ADMIN_HISTORY] 会社のチャット履歴が見つかりません。")
-            return [], total_count
-        
-        chat_history = result_data
-        
-        users_detail_result = select_data("users", columns="id, name", filters={"company_id": company_id})
-        user_name_map = {}
-        if users_detail_result and users_detail_result.data:
-            for user in users_detail_result.data:
-                user_name_map[user["id"]] = user.get("name", "不明なユーザー")
-        
-        formatted_history = []
-        for chat in chat_history:
-            employee_id = chat.get("employee_id", "")
-            employee_name = user_name_map.get(employee_id, "不明なユーザー")
-            
-            item = {
-                "id": chat.get("id", ""),
-                "user_message": chat.get("user_message", ""),
-                "bot_response": chat.get("bot_response", ""),
-                "timestamp": chat.get("timestamp", ""),
-                "category": chat.get("category", ""),
-                "sentiment": chat.get("sentiment", ""),
-                "employee_id": employee_id,
-                "employee_name": employee_name,
-                "source_document": chat.get("source_document", ""),
-                "source_page": chat.get("source_page", "")
-            }
-            formatted_history.append(item)
-        
-        print(f"[ADMIN_HISTORY] 最終的にフォーマットされたページネーションチャット履歴件数: {len(formatted_history)}")
-        return formatted_history, total_count
-        
+        page = get_chat_history_page(company_id=company_id, limit=limit, offset=offset, resolve_names=True)
+        return page["data"], page["total_count"] or 0
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ADMIN_HISTORY] get_chat_history_by_company_paginated エラー: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.error(f"[ADMIN_HISTORY] get_chat_history_by_company_paginated エラー: {e}")
         raise HTTPException(status_code=500, detail=f"会社チャット履歴取得中にエラーが発生しました: {str(e)}")
 
 def get_chat_history_by_company(company_id: str, db = None):
-    """会社IDでフィルタリングしたチャット履歴を取得する（フォールバック用）"""
-    print(f"[ADMIN_HISTORY] get_chat_history_by_company 呼び出し: company_id={company_id}")
-    
+    """会社IDでフィルタリングしたチャット履歴を取得する（CSV出力・フォールバック用）"""
     try:
-        from supabase_adapter import select_data
-        
-        users_result = select_data("users", columns="id", filters={"company_id": company_id})
-        
-        if not users_result or not users_result.data:
-            print(f"[ADMIN_HISTORY] 会社ID {company_id} のユーザーが見つかりません。チャット履歴なし。")
-            return []
-        
-        user_ids = [user["id"] for user in users_result.data]
-        print(f"[ADMIN_HISTORY] 会社のユーザーID一覧: {user_ids}")
-
-        all_chat_rows = []
-        # 各ユーザーごとに employee_id / user_id でチャットを収集
-        for uid in user_ids:
-            try:
-                # employee_id
-                emp_res = select_data("chat_history", columns="*", filters={"employee_id": uid})
-                if emp_res and emp_res.data:
-                    all_chat_rows.extend(emp_res.data)
-                # user_id
-                usr_res = select_data("chat_history", columns="*", filters={"user_id": uid})
-                if usr_res and usr_res.data:
-                    all_chat_rows.extend(usr_res.data)
-            except Exception as inner_e:
-                print(f"[ADMIN_HISTORY] ユーザー {uid} の履歴取得エラー: {inner_e}")
-
-        if not all_chat_rows:
-            print("[ADMIN_HISTORY] 会社のチャット履歴が見つかりません。")
-            return []
-
-        print(f"[ADMIN_HISTORY] 取得したチャット行数(重複前): {len(all_chat_rows)}")
-
-        # 重複除去
-        unique_chats = {}
-        for row in all_chat_rows:
-            cid = row.get("id")
-            if cid and cid not in unique_chats:
-                unique_chats[cid] = row
-
-        chat_history = list(unique_chats.values())
-
-        # 従業員名マッピングを取得
-        users_detail_result = select_data("users", columns="id, name", filters={"company_id": company_id})
-        user_name_map = {u["id"]: u.get("name", "不明なユーザー") for u in (users_detail_result.data or [])}
-
-        # 整形
-        formatted_history = []
-        for chat in chat_history:
-            emp_id = chat.get("employee_id", "")
-            
-            # Supabaseの時刻をそのまま表示（フロントでのUTC変換を防ぐ）
-            original_timestamp = chat.get("timestamp", "")
-            display_timestamp = original_timestamp
-            
-            # +00タイムゾーン情報を削除（JSの自動UTC変換を防ぐ）
-            if original_timestamp and "+00" in original_timestamp:
-                display_timestamp = original_timestamp.replace("+00", "")
-                print(f"[時刻修正会社別] {original_timestamp} → {display_timestamp}")
-            
-            formatted_history.append({
-                "id": chat.get("id", ""),
-                "user_message": chat.get("user_message", ""),
-                "bot_response": chat.get("bot_response", ""),
-                "timestamp": display_timestamp,  # +00を削除した時刻
-                "category": chat.get("category", ""),
-                "sentiment": chat.get("sentiment", ""),
-                "employee_id": emp_id,
-                "employee_name": user_name_map.get(emp_id, "不明なユーザー"),
-                "source_document": chat.get("source_document", ""),
-                "source_page": chat.get("source_page", "")
-            })
-
-        print(f"[ADMIN_HISTORY] フォーマット後行数: {len(formatted_history)}")
-        # 時系列降順
-        formatted_history.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-
-        return formatted_history
-        
+        return list(iter_chat_history(company_id=company_id, resolve_names=True))
     except Exception as e:
-        print(f"[ADMIN_HISTORY] get_chat_history_by_company エラー: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.error(f"[ADMIN_HISTORY] get_chat_history_by_company エラー: {e}")
         return []
 
 class DocumentReference(BaseModel):
@@ -2,6 +2,9 @@
 Advanced Fuzzy Search Implementation
 高度なファジー検索システム（normalize_text関数と文字数差を考慮したスコア計算）
 
+正規化済みテキストは chunks.content_normalized に保持し（sql/add_chunks_normalized_content.sql）、
+gin_trgm_ops インデックスと % 演算子で候補を絞り込んでからスコアを計算します。
+
 ご質問のような高度なPostgreSQLクエリを実装：
 SELECT *,
   similarity(normalize_text(content), normalize_text(:query)) AS sim,
@@ -62,6 +65,8 @@ class AdvancedFuzzySearchSystem:
     def __init__(self):
         self.db_url = self._get_db_url()
         self.initialized = False
+        # chunks.content_normalized 列が存在するか（マイグレーション未適用なら従来のクエリを使う）
+        self.has_normalized_column = False
         
     def _get_db_url(self) -> str:
         """データベースURLを構築"""
@@ -110,14 +115,14 @@ class AdvancedFuzzySearchSystem:
                     # 注意: normalize_text関数とcalculate_advanced_fuzzy_score関数は
                     # Supabase側に既に定義されているため、重複定義を削除
                     
-                    # パフォーマンス向上用インデックスを作成
-                    try:
-                        cur.execute("""
-                            CREATE INDEX IF NOT EXISTS idx_chunks_normalized_content_trgm 
-                            ON chunks USING gin (normalize_text(content) gin_trgm_ops);
-                        """)
-                    except Exception as e:
-                        logger.warning(f"インデックス作成警告: {e}")
+                    # 正規化済みテキスト列の有無を確認
+                    cur.execute("""
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'chunks' AND column_name = 'content_normalized'
+                    """)
+                    self.has_normalized_column = cur.fetchone() is not None
+                    if not self.has_normalized_column:
+                        logger.warning("⚠️ chunks.content_normalized 列がありません。sql/add_chunks_normalized_content.sql を適用してください（全件スキャンで検索します）")
                     
                     try:
                         cur.execute("""
@@ -134,12 +139,122 @@ class AdvancedFuzzySearchSystem:
             logger.error(f"❌ 初期化SQL実行エラー: {e}")
             raise
     
+    def _build_indexed_search_sql(self, norm_query: str, company_id: Optional[str],
+                                  length_penalty: float, limit: int,
+                                  use_word_similarity: bool) -> Tuple[str, List[Any]]:
+        """正規化済み列とトライグラムインデックスを使う検索クエリ（クエリは正規化済みの値を渡す）"""
+        if use_word_similarity:
+            sim_expr = "word_similarity(%s, c.content_normalized)"
+            match_expr = "%s <%% c.content_normalized"
+        else:
+            sim_expr = "similarity(c.content_normalized, %s)"
+            match_expr = "c.content_normalized %% %s"
+        
+        sql = f"""
+        WITH candidates AS (
+            SELECT
+                c.id as chunk_id,
+                c.doc_id,
+                c.content,
+                c.chunk_index,
+                c.company_id,
+                ds.name as document_name,
+                ds.type as document_type,
+                c.content_normalized AS norm_content,
+                %s::text AS norm_query,
+                {sim_expr} AS sim
+            FROM chunks c
+            JOIN document_sources ds ON c.doc_id = ds.id
+            WHERE {match_expr}
+              AND length(c.content) > 10
+              AND ds.active = true
+        """
+        params: List[Any] = [norm_query, norm_query, norm_query]
+        
+        if company_id:
+            sql += " AND c.company_id = %s"
+            params.append(company_id)
+        
+        sql += """
+        )
+        SELECT *,
+            abs(length(norm_content) - length(norm_query)) AS len_diff,
+            (
+                sim
+                - %s * abs(length(norm_content) - length(norm_query))  -- 減点弱めに修正
+                + CASE
+                    WHEN norm_content = norm_query THEN 0.4               -- 完全一致ブースト控えめに
+                    WHEN norm_content LIKE norm_query || '%%' THEN 0.2     -- 前方一致も調整
+                    ELSE 0
+                  END
+            ) AS final_score,
+            norm_content as normalized_content,
+            norm_query as normalized_query
+        FROM candidates
+        ORDER BY final_score DESC
+        LIMIT %s
+        """
+        params.extend([length_penalty, limit])
+        return sql, params
+    
+    def _build_scan_search_sql(self, query: str, company_id: Optional[str], threshold: float,
+                               length_penalty: float, limit: int) -> Tuple[str, List[Any]]:
+        """正規化済み列が無い場合の従来クエリ（全行で normalize_text を評価）"""
+        sql = """
+        WITH normalized AS (
+            SELECT
+                c.id as chunk_id,
+                c.doc_id,
+                c.content,
+                c.chunk_index,
+                c.company_id,
+                ds.name as document_name,
+                ds.type as document_type,
+                normalize_text(c.content) AS norm_content,
+                normalize_text(%s) AS norm_query
+            FROM chunks c
+            LEFT JOIN document_sources ds ON c.doc_id = ds.id
+            WHERE c.content IS NOT NULL
+              AND length(c.content) > 10
+              AND ds.active = true
+        """
+        params: List[Any] = [query]
+        
+        if company_id:
+            sql += " AND c.company_id = %s"
+            params.append(company_id)
+        
+        sql += """
+        )
+        SELECT *,
+            similarity(norm_content, norm_query) AS sim,
+            abs(length(norm_content) - length(norm_query)) AS len_diff,
+            (
+                similarity(norm_content, norm_query)
+                - %s * abs(length(norm_content) - length(norm_query))
+                + CASE
+                    WHEN norm_content = norm_query THEN 0.4
+                    WHEN norm_content LIKE norm_query || '%%' THEN 0.2
+                    ELSE 0
+                  END
+            ) AS final_score,
+            norm_content as normalized_content,
+            norm_query as normalized_query
+        FROM normalized
+        WHERE similarity(norm_content, norm_query) > %s
+        ORDER BY final_score DESC
+        LIMIT %s
+        """
+        params.extend([length_penalty, threshold, limit])
+        return sql, params
+    
     async def advanced_fuzzy_search(self, 
                                   query: str, 
                                   company_id: str = None,
                                   threshold: float = 0.4,
                                   length_penalty: float = 0.012,
-                                  limit: int = 40) -> List[AdvancedFuzzyResult]:
+                                  limit: int = 40,
+                                  use_word_similarity: bool = False) -> List[AdvancedFuzzyResult]:
         """
         高度ファジー検索を実行
         
@@ -149,6 +264,7 @@ class AdvancedFuzzySearchSystem:
             threshold: 最終スコアの閾値（デフォルト: 0.45）
             length_penalty: 文字数差のペナルティ係数（デフォルト: 0.012）
             limit: 結果数制限（デフォルト: 50）
+            use_word_similarity: チャンク内の部分一致を word_similarity で評価する
         
         Returns:
             高度ファジー検索結果のリスト
@@ -161,56 +277,18 @@ class AdvancedFuzzySearchSystem:
             
             with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
                 with conn.cursor() as cur:
-                    # ユーザー指定の精度改良版クエリ
-                    sql = """
-                    WITH normalized AS (
-                        SELECT
-                            c.id as chunk_id,
-                            c.doc_id,
-                            c.content,
-                            c.chunk_index,
-                            c.company_id,
-                            ds.name as document_name,
-                            ds.type as document_type,
-                            normalize_text(c.content) AS norm_content,
-                            normalize_text(%s) AS norm_query
-                        FROM chunks c
-                        LEFT JOIN document_sources ds ON c.doc_id = ds.id
-                        WHERE c.content IS NOT NULL
-                          AND length(c.content) > 10
-                          AND ds.active = true
-                    """
-                    
-                    params = [query]
-                    
-                    # 会社IDフィルターを追加
-                    if company_id:
-                        sql += " AND c.company_id = %s"
-                        params.append(company_id)
-                    
-                    sql += """
-                    )
-                    SELECT *,
-                        similarity(norm_content, norm_query) AS sim,
-                        abs(length(norm_content) - length(norm_query)) AS len_diff,
-                        (
-                            similarity(norm_content, norm_query)
-                            - %s * abs(length(norm_content) - length(norm_query))  -- 減点弱めに修正
-                            + CASE
-                                WHEN norm_content = norm_query THEN 0.4               -- 完全一致ブースト控えめに
-                                WHEN norm_content LIKE norm_query || '%%' THEN 0.2     -- 前方一致も調整
-                                ELSE 0
-                              END
-                        ) AS final_score,
-                        norm_content as normalized_content,
-                        norm_query as normalized_query
-                    FROM normalized
-                    WHERE similarity(norm_content, norm_query) > %s
-                    ORDER BY final_score DESC
-                    LIMIT %s
-                    """
-                    
-                    params.extend([length_penalty, threshold, limit])
+                    if self.has_normalized_column:
+                        # クエリ側の正規化は1回だけ行い、定数としてインデックス検索に渡す
+                        cur.execute("SELECT normalize_text(%s) AS norm_query", (query,))
+                        norm_query = cur.fetchone()['norm_query'] or ''
+                        sql, params = self._build_indexed_search_sql(
+                            norm_query, company_id, length_penalty, limit, use_word_similarity
+                        )
+                        # % / <% 演算子の閾値（トランザクション内のみ有効なのでプーラー経由でも安全）
+                        threshold_setting = "pg_trgm.word_similarity_threshold" if use_word_similarity else "pg_trgm.similarity_threshold"
+                        cur.execute("SELECT set_config(%s, %s, true)", (threshold_setting, str(threshold)))
+                    else:
+                        sql, params = self._build_scan_search_sql(query, company_id, threshold, length_penalty, limit)
                     
                     cur.execute(sql, params)
                     rows = cur.fetchall()
@@ -270,26 +348,42 @@ class AdvancedFuzzySearchSystem:
     
     async def get_similarity_distribution(self, query: str, company_id: str = None) -> Dict[str, Any]:
         """類似度分布の分析"""
+        if not self.initialized:
+            await self.initialize()
+        
         try:
             with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
                 with conn.cursor() as cur:
-                    sql = """
-                    SELECT 
-                        COUNT(*) as total_chunks,
-                        AVG(similarity(normalize_text(content), normalize_text(%s))) as avg_similarity,
-                        MIN(similarity(normalize_text(content), normalize_text(%s))) as min_similarity,
-                        MAX(similarity(normalize_text(content), normalize_text(%s))) as max_similarity,
-                        STDDEV(similarity(normalize_text(content), normalize_text(%s))) as std_similarity
-                    FROM chunks
-                    WHERE content IS NOT NULL AND length(content) > 10
+                    # クエリの正規化は1回だけ行い、各行の類似度も1回だけ計算する
+                    content_expr = "c.content_normalized" if self.has_normalized_column else "normalize_text(c.content)"
+                    sql = f"""
+                    WITH q AS (
+                        SELECT normalize_text(%s) AS norm_query
+                    ),
+                    sims AS (
+                        SELECT similarity({content_expr}, q.norm_query) AS sim
+                        FROM chunks c
+                        CROSS JOIN q
+                        WHERE c.content IS NOT NULL AND length(c.content) > 10
                     """
                     
-                    params = [query, query, query, query]
+                    params = [query]
                     
                     if company_id:
-                        sql += " AND company_id = %s"
+                        sql += " AND c.company_id = %s"
                         params.append(company_id)
                     
+                    sql += """
+                    )
+                    SELECT
+                        COUNT(*) as total_chunks,
+                        AVG(sim) as avg_similarity,
+                        MIN(sim) as min_similarity,
+                        MAX(sim) as max_similarity,
+                        STDDEV(sim) as std_similarity
+                    FROM sims
+                    """
+                    
                     cur.execute(sql, params)
                     result = cur.fetchone()
                     
@@ -328,7 +422,8 @@ async def advanced_fuzzy_search(query: str,
                               company_id: str = None,
                               threshold: float = 0.4,
                               length_penalty: float = 0.012,
-                              limit: int = 40) -> List[Dict[str, Any]]:
+                              limit: int = 40,
+                              use_word_similarity: bool = False) -> List[Dict[str, Any]]:
     """
     高度ファジー検索のエントリーポイント
     
@@ -340,7 +435,7 @@ async def advanced_fuzzy_search(query: str,
         logger.error("❌ 高度ファジー検索システムが利用できません")
         return []
     
-    results = await instance.advanced_fuzzy_search(query, company_id, threshold, length_penalty, limit)
+    results = await instance.advanced_fuzzy_search(query, company_id, threshold, length_penalty, limit, use_word_similarity)
     return [result.to_dict() for result in results]
 
 def advanced_fuzzy_search_available() -> bool:
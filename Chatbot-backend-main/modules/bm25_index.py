@@ -0,0 +1,541 @@
+"""
+🔑 BM25キーワード検索インデックス
+会社ごとに chunks から BM25 インデックスを構築し、物件番号や会社名などの完全一致に強いキーワード検索を提供します
+
+- janome の形態素（名詞・動詞・形容詞）+ 日本語文字バイグラム + 英数字の識別子でトークン化
+- インデックスはディスクに保存し、再起動後はメモリマップで読み込む
+  （世代ごとのディレクトリに書き出し、CURRENT ファイルの置き換えで公開するため複数ワーカーの同時再構築でも壊れない）
+- 追加・変更されたドキュメントは差分インデックスに載せ、無効化・削除分は除外して検索
+- 差分が大きくなったらバックグラウンドで全体を再構築
+- 検索時はDBにアクセスしない（更新確認はバックグラウンドで定期実行）
+"""
+
+import os
+import re
+import json
+import mmap
+import time
+import shutil
+import asyncio
+import logging
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Any, Set, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from .shared_state import bump_generation, get_generation
+
+try:
+    import numpy as np
+    import bm25s
+    BM25S_AVAILABLE = True
+except ImportError:
+    BM25S_AVAILABLE = False
+
+try:
+    from janome.tokenizer import Tokenizer as JanomeTokenizer
+    JANOME_AVAILABLE = True
+except ImportError:
+    JANOME_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+BM25_INDEX_DIR = os.getenv(
+    "BM25_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "bm25_index")
+)
+# 更新確認の間隔（秒）
+BM25_REFRESH_SECONDS = int(os.getenv("BM25_REFRESH_SECONDS", "60"))
+# 差分インデックスがこの件数、または本体の BM25_DELTA_RATIO 倍を超えたら全体を再構築
+BM25_DELTA_MAX_CHUNKS = int(os.getenv("BM25_DELTA_MAX_CHUNKS", "2000"))
+BM25_DELTA_RATIO = float(os.getenv("BM25_DELTA_RATIO", "0.2"))
+# 置き換え済みの世代を削除するまでの猶予（秒）。他ワーカーが読み込み中の世代を消さないため
+BM25_OLD_VERSION_GRACE_SECONDS = int(os.getenv("BM25_OLD_VERSION_GRACE_SECONDS", "300"))
+
+# 形態素のうちインデックスに使う品詞
+_CONTENT_POS = ("名詞", "動詞", "形容詞")
+# WPD4100389 のような英数字の識別子（NFKC正規化・小文字化後）
+_IDENTIFIER_PATTERN = re.compile(r'[a-z0-9]+(?:[\-_.][a-z0-9]+)*')
+_CJK_RUN_PATTERN = re.compile(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]+')
+_ASCII_PATTERN = re.compile(r'^[\x00-\x7f]+$')
+
+_janome_tokenizer = None
+_janome_lock = threading.Lock()
+
+
+def _janome_tokens(text: str) -> List[str]:
+    """janomeで内容語を抽出（英数字は識別子として別途扱う）"""
+    global _janome_tokenizer
+    with _janome_lock:
+        if _janome_tokenizer is None:
+            _janome_tokenizer = JanomeTokenizer()
+        tokens = []
+        for token in _janome_tokenizer.tokenize(text):
+            if not token.part_of_speech.startswith(_CONTENT_POS):
+                continue
+            word = token.base_form if token.base_form != "*" else token.surface
+            if len(word) >= 2 and not _ASCII_PATTERN.match(word):
+                tokens.append(word)
+        return tokens
+
+
+def tokenize_japanese(text: str) -> List[str]:
+    """BM25用のトークン列を生成"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", text).lower()
+
+    tokens = _IDENTIFIER_PATTERN.findall(text)
+    if JANOME_AVAILABLE:
+        tokens.extend(_janome_tokens(text))
+
+    # 形態素解析で分割を誤っても拾えるよう、日本語部分は文字バイグラムも加える
+    for run in _CJK_RUN_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _connect():
+    from modules.config import get_database_url
+    return psycopg2.connect(get_database_url(), cursor_factory=RealDictCursor)
+
+
+def _fetch_doc_signatures(company_id: str) -> Dict[str, str]:
+    """アクティブなドキュメントごとのチャンク数と最終更新日時"""
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.doc_id, COUNT(*) AS chunk_count, MAX(c.updated_at) AS last_updated
+                FROM chunks c
+                JOIN document_sources ds ON ds.id = c.doc_id
+                WHERE c.company_id = %s
+                  AND ds.active = true
+                  AND c.content IS NOT NULL
+                GROUP BY c.doc_id
+            """, (company_id,))
+            return {
+                row["doc_id"]: f"{row['chunk_count']}:{row['last_updated']}"
+                for row in cur.fetchall()
+            }
+
+
+def _fetch_chunks(company_id: str, doc_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """インデックス対象のチャンクを取得"""
+    sql = """
+        SELECT c.id, c.doc_id, c.chunk_index, c.content,
+               ds.name AS document_name, ds.type AS document_type
+        FROM chunks c
+        JOIN document_sources ds ON ds.id = c.doc_id
+        WHERE c.company_id = %s
+          AND ds.active = true
+          AND c.content IS NOT NULL
+    """
+    params: List[Any] = [company_id]
+    if doc_ids is not None:
+        sql += " AND c.doc_id = ANY(%s)"
+        params.append(doc_ids)
+    sql += " ORDER BY c.doc_id, c.chunk_index"
+
+    with _connect() as conn:
+        # サーバーサイドカーソルで少しずつ読み込む
+        with conn.cursor(name="bm25_chunks") as cur:
+            cur.itersize = 2000
+            cur.execute(sql, params)
+            return [
+                {
+                    "id": str(row["id"]),
+                    "doc_id": row["doc_id"],
+                    "chunk_index": row["chunk_index"],
+                    "content": row["content"],
+                    "document_name": row["document_name"],
+                    "document_type": row["document_type"]
+                }
+                for row in cur
+            ]
+
+
+def _build_retriever(chunks: List[Dict[str, Any]]):
+    retriever = bm25s.BM25()
+    retriever.index([tokenize_japanese(chunk["content"]) for chunk in chunks], show_progress=False)
+    return retriever
+
+
+def _retrieve(retriever, query_tokens: List[str], k: int) -> List[Tuple[int, float]]:
+    """(コーパス内の位置, スコア) を返す。語彙に無いトークンは除外"""
+    query_tokens = [token for token in query_tokens if token in retriever.vocab_dict]
+    corpus_size = retriever.scores["num_docs"]
+    if not query_tokens or corpus_size == 0:
+        return []
+    indices, scores = retriever.retrieve([query_tokens], k=min(k, corpus_size), show_progress=False)
+    return [
+        (int(index), float(score))
+        for index, score in zip(indices[0], scores[0])
+        if score > 0
+    ]
+
+
+class CompanyBM25Index:
+    """1社分のBM25インデックス（本体 + 差分 + 除外ドキュメント）"""
+
+    def __init__(self, company_id: str):
+        self.company_id = company_id
+        self.path = os.path.join(BM25_INDEX_DIR, re.sub(r'[^A-Za-z0-9_\-]', '_', company_id))
+
+        # 本体（ディスク上・メモリマップ）
+        self.retriever = None
+        self._offsets = None
+        self._chunks_file = None
+        self._chunks_mmap = None
+        self.main_doc_ids: Set[str] = set()
+        self.signatures: Dict[str, str] = {}
+
+        # 差分（メモリ上）
+        self.delta_retriever = None
+        self.delta_chunks: List[Dict[str, Any]] = []
+
+        # 本体に含まれるが検索対象外のドキュメント（無効化・削除・差分で置き換え済み）
+        self.hidden_doc_ids: Set[str] = set()
+
+        self.last_refresh = 0.0
+        self.stale = True
+        # 共有ストアの更新世代（他ワーカーでの更新検知用）
+        self.seen_generation = 0
+        self._lock = threading.Lock()
+
+    # ---- 本体インデックスの保存・読み込み ----
+
+    def _current_file(self) -> str:
+        return os.path.join(self.path, "CURRENT")
+
+    def _save(self, chunks: List[Dict[str, Any]], retriever, signatures: Dict[str, str]):
+        """新しい世代のディレクトリに書き出し、CURRENT をアトミックに置き換えて公開する"""
+        if os.path.exists(os.path.join(self.path, "manifest.json")):
+            # 世代ディレクトリ導入前の配置は作り直す
+            shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+        version = f"v-{time.time_ns()}-{os.getpid()}-{threading.get_ident()}"
+        tmp_path = os.path.join(self.path, version)
+        os.makedirs(tmp_path)
+
+        retriever.save(tmp_path)
+        offsets = []
+        position = 0
+        with open(os.path.join(tmp_path, "chunks.jsonl"), "wb") as f:
+            for chunk in chunks:
+                line = (json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8")
+                offsets.append(position)
+                f.write(line)
+                position += len(line)
+        offsets.append(position)
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"built_at": time.time(), "signatures": signatures}, f)
+
+        current_tmp = f"{self._current_file()}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(current_tmp, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(current_tmp, self._current_file())
+        self._remove_old_versions(version)
+
+    def _remove_old_versions(self, current: str):
+        """猶予を過ぎた古い世代を削除（メモリマップ中のファイルは削除後も読める）"""
+        threshold = time.time() - BM25_OLD_VERSION_GRACE_SECONDS
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name == current or not name.startswith("v-"):
+                continue
+            try:
+                if os.path.getmtime(path) < threshold:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _unpublish(self):
+        try:
+            os.remove(self._current_file())
+        except FileNotFoundError:
+            pass
+
+    def _open(self) -> Optional[Dict[str, Any]]:
+        """公開中の世代をメモリマップで開く（インスタンスの状態は変更しない）"""
+        try:
+            with open(self._current_file(), encoding="utf-8") as f:
+                version_path = os.path.join(self.path, f.read().strip())
+        except FileNotFoundError:
+            return None
+        with open(os.path.join(version_path, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        offsets = np.load(os.path.join(version_path, "offsets.npy"), mmap_mode="r")
+        chunks_file = open(os.path.join(version_path, "chunks.jsonl"), "rb")
+        return {
+            "retriever": bm25s.BM25.load(version_path, mmap=True),
+            "offsets": offsets,
+            "chunks_file": chunks_file,
+            "chunks_mmap": mmap.mmap(chunks_file.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] > 0 else None,
+            "signatures": manifest["signatures"]
+        }
+
+    def _swap(self, opened: Dict[str, Any]):
+        """開いた世代に差し替える（呼び出し側で _lock を保持）"""
+        old_file = self._chunks_file
+        self.retriever = opened["retriever"]
+        self._offsets = opened["offsets"]
+        self._chunks_file = opened["chunks_file"]
+        self._chunks_mmap = opened["chunks_mmap"]
+        self.signatures = opened["signatures"]
+        self.main_doc_ids = set(self.signatures)
+        self.delta_retriever = None
+        self.delta_chunks = []
+        self.hidden_doc_ids = set()
+        if old_file is not None:
+            # 検索中のメモリマップはファイルを閉じても有効
+            old_file.close()
+
+    @staticmethod
+    def _main_chunk(offsets, chunks_mmap, position: int) -> Dict[str, Any]:
+        start, end = int(offsets[position]), int(offsets[position + 1])
+        return json.loads(chunks_mmap[start:end])
+
+    # ---- 構築・更新（バックグラウンドスレッドで実行） ----
+
+    def rebuild(self):
+        """全チャンクから本体を再構築"""
+        started = time.time()
+        signatures = _fetch_doc_signatures(self.company_id)
+        chunks = _fetch_chunks(self.company_id)
+        retriever = _build_retriever(chunks) if chunks else None
+        os.makedirs(BM25_INDEX_DIR, exist_ok=True)
+
+        # 保存・読み込みはロック外で行い、検索を止めないよう参照の差し替えだけをロック内で行う
+        opened = None
+        if retriever is None:
+            self._unpublish()
+        else:
+            self._save(chunks, retriever, signatures)
+            opened = self._open()
+        with self._lock:
+            if opened is None:
+                self.retriever = None
+                self.signatures = signatures
+                self.main_doc_ids = set()
+                self.delta_retriever = None
+                self.delta_chunks = []
+                self.hidden_doc_ids = set()
+            else:
+                self._swap(opened)
+            self.last_refresh = time.time()
+            self.stale = False
+        logger.info(f"🔑 BM25インデックス構築: company={self.company_id}, {len(chunks)}チャンク, {time.time() - started:.1f}秒")
+
+    def refresh(self):
+        """変更されたドキュメントだけを差分インデックスに反映"""
+        signatures = _fetch_doc_signatures(self.company_id)
+        changed = [doc_id for doc_id, sig in signatures.items() if self.signatures.get(doc_id) != sig]
+        removed = [doc_id for doc_id in self.signatures if doc_id not in signatures]
+
+        if changed or removed:
+            keep_delta = [
+                chunk for chunk in self.delta_chunks
+                if chunk["doc_id"] not in changed and chunk["doc_id"] not in removed
+            ]
+            new_chunks = _fetch_chunks(self.company_id, changed) if changed else []
+            delta_chunks = keep_delta + new_chunks
+
+            main_size = self.retriever.scores["num_docs"] if self.retriever is not None else 0
+            if len(delta_chunks) > max(BM25_DELTA_MAX_CHUNKS, main_size * BM25_DELTA_RATIO):
+                self.rebuild()
+                return
+
+            delta_retriever = _build_retriever(delta_chunks) if delta_chunks else None
+            with self._lock:
+                self.delta_chunks = delta_chunks
+                self.delta_retriever = delta_retriever
+                # 検索側が参照中の集合は変更せず差し替える
+                self.hidden_doc_ids = self.hidden_doc_ids | ((set(changed) | set(removed)) & self.main_doc_ids)
+                for doc_id in removed:
+                    self.signatures.pop(doc_id, None)
+                self.signatures.update({doc_id: signatures[doc_id] for doc_id in changed})
+            logger.info(
+                f"🔑 BM25差分更新: company={self.company_id}, 変更{len(changed)}件, 削除{len(removed)}件, "
+                f"差分{len(delta_chunks)}チャンク"
+            )
+
+        with self._lock:
+            self.last_refresh = time.time()
+            self.stale = False
+
+    def ensure_fresh(self):
+        """未構築なら読み込み・構築、古ければ差分更新"""
+        if self.retriever is None and not self.signatures:
+            try:
+                opened = self._open()
+                if opened is not None:
+                    with self._lock:
+                        self._swap(opened)
+                loaded = opened is not None
+            except Exception as e:
+                logger.warning(f"BM25インデックス読み込み失敗（再構築します）: {e}")
+                loaded = False
+            if not loaded:
+                self.rebuild()
+                return
+        if self.stale or time.time() - self.last_refresh >= BM25_REFRESH_SECONDS:
+            self.refresh()
+
+    # ---- 検索 ----
+
+    def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        query_tokens = tokenize_japanese(query)
+        if not query_tokens:
+            return []
+
+        # 参照だけをロック内で取り出し、検索自体はロック外で行う（更新は参照の差し替えのみ）
+        with self._lock:
+            retriever, offsets, chunks_mmap = self.retriever, self._offsets, self._chunks_mmap
+            hidden_doc_ids = self.hidden_doc_ids
+            delta_retriever, delta_chunks = self.delta_retriever, self.delta_chunks
+
+        results = []
+        if retriever is not None:
+            # 除外ドキュメント分を見越して多めに取得
+            for position, score in _retrieve(retriever, query_tokens, limit * 2):
+                chunk = self._main_chunk(offsets, chunks_mmap, position)
+                if chunk["doc_id"] not in hidden_doc_ids:
+                    results.append((score, chunk))
+        if delta_retriever is not None:
+            for position, score in _retrieve(delta_retriever, query_tokens, limit):
+                results.append((score, delta_chunks[position]))
+
+        results.sort(key=lambda item: item[0], reverse=True)
+        return [
+            {
+                "chunk_id": chunk["id"],
+                "doc_id": chunk["doc_id"],
+                "chunk_index": chunk["chunk_index"],
+                "content": chunk["content"],
+                "document_name": chunk["document_name"],
+                "document_type": chunk["document_type"],
+                "bm25_score": score,
+                "search_method": "bm25"
+            }
+            for score, chunk in results[:limit]
+        ]
+
+
+class BM25IndexManager:
+    """会社ごとのBM25インデックスを管理"""
+
+    def __init__(self):
+        self._indexes: Dict[str, CompanyBM25Index] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def _get_index(self, company_id: str) -> CompanyBM25Index:
+        if company_id not in self._indexes:
+            self._indexes[company_id] = CompanyBM25Index(company_id)
+        return self._indexes[company_id]
+
+    def _schedule_refresh(self, index: CompanyBM25Index):
+        task = self._refreshing.get(index.company_id)
+        if task is not None and not task.done():
+            return
+        self._refreshing[index.company_id] = asyncio.create_task(self._refresh(index))
+
+    async def _refresh(self, index: CompanyBM25Index):
+        try:
+            await asyncio.to_thread(index.ensure_fresh)
+        except Exception as e:
+            logger.error(f"❌ BM25インデックス更新エラー (company={index.company_id}): {e}")
+            # 連続で失敗し続けないよう次回確認まで待つ
+            index.last_refresh = time.time()
+            index.stale = False
+
+    async def search(self, query: str, company_id: Optional[str], limit: int = 50) -> List[Dict[str, Any]]:
+        """キーワード検索（インデックス未構築の間は空を返し、バックグラウンドで構築する）"""
+        if not company_id or not BM25S_AVAILABLE:
+            return []
+
+        index = self._get_index(company_id)
+        generation = _shared_generation(company_id)
+        if generation is not None and generation != index.seen_generation:
+            # 他のワーカーでドキュメントが更新された
+            index.seen_generation = generation
+            index.stale = True
+        if index.stale or time.time() - index.last_refresh >= BM25_REFRESH_SECONDS:
+            self._schedule_refresh(index)
+        if index.retriever is None and index.delta_retriever is None:
+            return []
+        # トークン化とスコア計算はイベントループ外で行う
+        return await asyncio.to_thread(index.search, query, limit)
+
+    async def warm_up(self, company_id: str):
+        """起動時のウォームアップ用（インデックスの読み込み・構築の完了を待つ）"""
+        if not company_id or not BM25S_AVAILABLE:
+            return
+        index = self._get_index(company_id)
+        self._schedule_refresh(index)
+        # タイムアウトなどで待ち側がキャンセルされても、共有の更新タスクは止めない
+        # （止めてもスレッドでの構築は続き、次の検索で二重に構築が始まるため）
+        await asyncio.shield(self._refreshing[company_id])
+
+    def mark_stale(self, company_id: Optional[str]):
+        """ドキュメントの追加・有効/無効切り替え時に呼び出す"""
+        if company_id and company_id in self._indexes:
+            self._indexes[company_id].stale = True
+
+
+# グローバルインスタンス
+_bm25_index_manager: Optional[BM25IndexManager] = None
+
+
+def get_bm25_index_manager() -> BM25IndexManager:
+    """BM25インデックスマネージャーのシングルトンを取得"""
+    global _bm25_index_manager
+    if _bm25_index_manager is None:
+        _bm25_index_manager = BM25IndexManager()
+    return _bm25_index_manager
+
+
+def _shared_generation(company_id: str) -> Optional[int]:
+    try:
+        return get_generation(f"bm25:{company_id}")
+    except Exception as e:
+        logger.warning(f"⚠️ BM25更新世代の取得エラー: {e}")
+        return None
+
+
+def mark_bm25_index_stale(company_id: Optional[str]):
+    """会社のBM25インデックスに更新があったことを通知（他のワーカーにも共有ストア経由で伝わる）"""
+    if company_id and BM25S_AVAILABLE:
+        try:
+            bump_generation(f"bm25:{company_id}")
+        except Exception as e:
+            logger.warning(f"⚠️ BM25更新世代の更新エラー: {e}")
+    if _bm25_index_manager is not None:
+        _bm25_index_manager.mark_stale(company_id)
+
+
+def bm25_available() -> bool:
+    """BM25検索が利用可能かチェック"""
+    return BM25S_AVAILABLE
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    """複数の検索結果を順位ベースで統合（RRF）。先に渡したリストの項目内容を優先"""
+    fused: Dict[str, Dict[str, Any]] = {}
+    scores: Dict[str, float] = {}
+    for results in result_lists:
+        for rank, item in enumerate(results):
+            chunk_id = item["chunk_id"]
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+            if chunk_id not in fused:
+                fused[chunk_id] = dict(item)
+    for chunk_id, item in fused.items():
+        item["rrf_score"] = scores[chunk_id]
+    return sorted(fused.values(), key=lambda item: item["rrf_score"], reverse=True)
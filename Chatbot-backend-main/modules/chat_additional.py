@@ -9,6 +9,7 @@ from .chat_config import safe_print, HTTPException, model, get_db_cursor
 from .chat_rag import rag_search, enhanced_rag_search
 from .chat_search_systems import smart_search_system
 from .chat_utils import expand_query
+from .chunk_metadata import get_chunk_search_source
 
 async def rag_search_with_fallback(query: str, limit: int = 10) -> List[Dict[str, Any]]:
     """
@@ -117,26 +118,24 @@ async def pdf_focused_search(query: str, limit: int = 10) -> List[Dict[str, Any]
             return []
         
         # SQL クエリを構築（PDFファイルのみ）
+        source = get_chunk_search_source(cursor)
         sql_query = f"""
         SELECT 
             c.id as chunk_id,
             c.content,
             c.chunk_index,
-            ds.name as document_name,
-            ds.type as document_type,
-            ds.id as doc_id,
+            {source.document_name} as document_name,
+            {source.document_type} as document_type,
+            c.doc_id,
             (CASE 
                 WHEN c.content ILIKE %s THEN 5
                 WHEN {' AND '.join(search_conditions)} THEN 4
                 WHEN {' OR '.join(search_conditions)} THEN 3
                 ELSE 2
             END) as relevance_score
-        FROM chunks c
-        LEFT JOIN document_sources ds ON ds.id = c.doc_id
-        WHERE ds.type = 'pdf'
-          AND ds.active = true
-          AND c.content IS NOT NULL
-          AND LENGTH(c.content) > 10
+        FROM {source.from_sql}
+        WHERE {source.document_type} = 'pdf'
+          AND {source.searchable}
           AND ({' OR '.join(search_conditions)})
         ORDER BY relevance_score DESC, c.id DESC
         LIMIT %s
@@ -213,26 +212,24 @@ async def balanced_partial_match_search(query: str, limit: int = 10) -> List[Dic
                 continue
             
             # SQL クエリを構築（特定ファイルタイプ）
+            source = get_chunk_search_source(cursor)
             sql_query = f"""
             SELECT 
                 c.id as chunk_id,
                 c.content,
                 c.chunk_index,
-                ds.name as document_name,
-                ds.type as document_type,
-                ds.id as doc_id,
+                {source.document_name} as document_name,
+                {source.document_type} as document_type,
+                c.doc_id,
                 (CASE 
                     WHEN c.content ILIKE %s THEN 4
                     WHEN {' AND '.join(search_conditions)} THEN 3
                     WHEN {' OR '.join(search_conditions)} THEN 2
                     ELSE 1
                 END) as relevance_score
-            FROM chunks c
-            LEFT JOIN document_sources ds ON ds.id = c.doc_id
-            WHERE ds.type = %s
-              AND ds.active = true
-              AND c.content IS NOT NULL
-              AND LENGTH(c.content) > 10
+            FROM {source.from_sql}
+            WHERE {source.document_type} = %s
+              AND {source.searchable}
               AND ({' OR '.join(search_conditions)})
             ORDER BY relevance_score DESC, c.id DESC
             LIMIT %s
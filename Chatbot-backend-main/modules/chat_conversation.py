@@ -2,9 +2,118 @@
 会話検出とカジュアル応答生成
 チャットの会話性を判定し、適切な応答を生成します
 """
+import os
 import re
+import asyncio
+import logging
+import unicodedata
 from typing import Optional, Dict, Any
 from .chat_config import safe_print, model
+from .metrics import CHAT_ROUTE_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# 雑談と判定した場合にモデルで応答を生成するか（false ならテンプレートのみ、API呼び出しなし）
+CASUAL_ROUTE_USE_MODEL = os.getenv("CASUAL_ROUTE_USE_MODEL", "false").lower() == "true"
+# この文字数を超えるメッセージは雑談として扱わない
+CASUAL_ROUTE_MAX_LENGTH = int(os.getenv("CASUAL_ROUTE_MAX_LENGTH", "30"))
+
+# メッセージ全体がこれらの定型句だけで構成される場合に雑談と判定する（空白除去後の文字列と照合）
+_CASUAL_PHRASES = {
+    'greeting': [
+        'こんにちは', 'こんばんは', 'おはよう(?:ございます)?', 'はじめまして', 'よろしく(?:お願い(?:します|いたします))?',
+        'hello', 'hi', 'hey', 'good(?:morning|afternoon|evening)'
+    ],
+    'thanks': [
+        '(?:どうも)?ありがと(?:う)?(?:ございます|ございました)?', 'どうも', '助かりました', '助かります', 'サンキュー',
+        'thankyou(?:verymuch)?', 'thanks(?:alot)?', 'thx'
+    ],
+    'farewell': [
+        'さようなら', 'またね', 'また今度', 'バイバイ', 'お疲れ(?:様|さま)(?:です|でした)?',
+        'goodbye', 'bye', 'seeyou'
+    ],
+    'casual_chat': [
+        'はい', 'いいえ', 'うん', 'そうです(?:ね)?', 'なるほど(?:です)?', '了解(?:です|しました)?', 'わかりました', '承知(?:しました)?',
+        'ok', 'okay', 'yes', 'no'
+    ],
+}
+_CASUAL_PHRASE_PATTERNS = {
+    intent_type: re.compile('(?:' + '|'.join(phrases) + ')')
+    for intent_type, phrases in _CASUAL_PHRASES.items()
+}
+_ALL_CASUAL_PATTERN = re.compile(
+    '(?:' + '|'.join(phrase for phrases in _CASUAL_PHRASES.values() for phrase in phrases) + ')+'
+)
+# 判定前に除去する記号・空白・絵文字（長音「ー」は「サンキュー」などの語の一部なので残す）
+_ROUTE_EMOJI_CHARS = r'\U0001F300-\U0001F5FF\U0001F600-\U0001F64F\U0001F680-\U0001F6FF\u2600-\u27BF'
+_ROUTE_STRIP_PATTERN = re.compile(r'[\s、。,.!?！？~〜…・' + _ROUTE_EMOJI_CHARS + r']+')
+_ROUTE_EMOJI_PATTERN = re.compile(r'[' + _ROUTE_EMOJI_CHARS + r']')
+# 日本語の後ろに付く笑いの「www」（NFKC で「ｗ」も「w」になる）。英単語の末尾の w は残す
+_ROUTE_TRAILING_LAUGH_PATTERN = re.compile(r'(?<=[^\x00-\x7f])w+$')
+
+
+def route_message(message: str) -> Dict[str, Any]:
+    """
+    チャットメッセージの振り分け（RAGの前段）
+    挨拶・お礼・相づちだけのメッセージは 'casual'、それ以外はすべて 'rag' とする
+    （質問を雑談と誤判定しないよう、メッセージ全体が定型句で構成される場合のみ casual）
+
+    Returns:
+        detect_conversation_intent と同じ項目 + route / reason
+    """
+    route = {
+        'route': 'rag',
+        'reason': 'default',
+        'is_casual': False,
+        'intent_type': 'unknown',
+        'confidence': 0.0,
+        'suggested_response_type': 'search'
+    }
+
+    normalized = unicodedata.normalize('NFKC', message or '').lower().strip()
+    if not normalized:
+        route['reason'] = 'empty'
+    elif len(normalized) > CASUAL_ROUTE_MAX_LENGTH:
+        route['reason'] = 'too_long'
+    else:
+        compact = _ROUTE_TRAILING_LAUGH_PATTERN.sub('', _ROUTE_STRIP_PATTERN.sub('', normalized))
+        if compact and _ALL_CASUAL_PATTERN.fullmatch(compact):
+            # 先に出現した定型句の種類を意図とする（「はい、ありがとう」→ thanks を優先）
+            intent_type = 'casual_chat'
+            for candidate in ('thanks', 'farewell', 'greeting'):
+                if _CASUAL_PHRASE_PATTERNS[candidate].search(compact):
+                    intent_type = candidate
+                    break
+            route.update({
+                'route': 'casual',
+                'reason': 'phrase_match',
+                'is_casual': True,
+                'intent_type': intent_type,
+                'confidence': 0.95,
+                'suggested_response_type': 'casual'
+            })
+        elif not compact and _ROUTE_EMOJI_PATTERN.search(normalized):
+            # 絵文字のみ（「?」などの記号だけのものは意図が分からないため RAG 側で扱う）
+            route.update({
+                'route': 'casual',
+                'reason': 'emoji_only',
+                'is_casual': True,
+                'intent_type': 'casual_chat',
+                'confidence': 0.8,
+                'suggested_response_type': 'casual'
+            })
+        elif not compact:
+            route['reason'] = 'symbols_only'
+        else:
+            route['reason'] = 'no_phrase_match'
+
+    # 閾値調整用に振り分け結果を記録（メッセージ本文はログに残さない）
+    CHAT_ROUTE_TOTAL.inc(route=route['route'], reason=route['reason'])
+    logger.info(
+        "💬 チャット振り分け: route=%s intent=%s reason=%s length=%s",
+        route['route'], route['intent_type'], route['reason'], len(message or '')
+    )
+    return route
 
 def is_casual_conversation(message: str) -> bool:
     """
@@ -130,13 +239,14 @@ def detect_conversation_intent(message: str) -> Dict[str, Any]:
     
     return intent_result
 
-async def generate_casual_response(message: str, intent_info: Dict[str, Any]) -> str:
+async def generate_casual_response(message: str, intent_info: Dict[str, Any], use_model: bool = True) -> str:
     """
     カジュアルな応答を生成
     
     Args:
         message: 元のメッセージ
         intent_info: 意図分析結果
+        use_model: Falseの場合はモデルを呼ばずテンプレートから選択
         
     Returns:
         生成された応答
@@ -172,7 +282,7 @@ async def generate_casual_response(message: str, intent_info: Dict[str, Any]) ->
     
     try:
         # Geminiモデルを使用してより自然な応答を生成
-        if model:
+        if model and use_model:
             prompt = f"""
 以下のメッセージに対して、親しみやすく自然な日本語で応答してください。
 応答は簡潔で、相手が続けて質問しやすい雰囲気を作ってください。
@@ -182,7 +292,7 @@ async def generate_casual_response(message: str, intent_info: Dict[str, Any]) ->
 
 応答:"""
             
-            response = model.generate_content(prompt)
+            response = await asyncio.to_thread(model.generate_content, prompt)
             generated_response = ""
             try:
                 if hasattr(response, "parts") and response.parts:
@@ -0,0 +1,383 @@
+"""
+📝 チャット履歴ライトビハインド書き込み
+チャット応答の返却をDB書き込みから切り離し、複数行をまとめてSupabaseに挿入します
+
+- プロセス内の上限付きキューに積み、N ミリ秒ごと／M 行ごとに一括INSERT
+- 積んだ時点でローカルのスプールファイルに追記し、クラッシュ時も次回起動で再送
+- トークン数・コスト計算と会社IDの補完はバックグラウンドワーカーで実行
+- 一時的な障害は回数を区切って再試行し、恒久的なエラーの行はデッドレターに退避
+"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Callable
+
+logger = logging.getLogger(__name__)
+
+# 一括INSERTの設定
+CHAT_HISTORY_BATCH_SIZE = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "50"))
+CHAT_HISTORY_FLUSH_MS = int(os.getenv("CHAT_HISTORY_FLUSH_MS", "500"))
+CHAT_HISTORY_QUEUE_MAX = int(os.getenv("CHAT_HISTORY_QUEUE_MAX", "5000"))
+CHAT_HISTORY_SPOOL_DIR = os.getenv(
+    "CHAT_HISTORY_SPOOL_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "chat_history_spool")
+)
+
+CHAT_HISTORY_COMPANY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_COMPANY_CACHE_SIZE", "10000"))
+
+# 一時的な障害での再試行間隔（秒）。使い切ったバッチはバックログに戻して後で再送する
+_RETRY_DELAYS = [1, 2, 5, 10, 30]
+# 再試行を使い切ったバックログを再送するまでの待ち時間（秒）
+_BACKLOG_RETRY_SECONDS = 60
+# 接続断・タイムアウト・サーバー側の一時障害を示すPostgreSQLのエラークラス
+_TRANSIENT_PG_CLASSES = ("08", "40", "53", "57")
+
+
+def _is_transient_error(error: Exception) -> bool:
+    """再試行で回復が見込めるエラーか（接続・タイムアウト・5xx）"""
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    # httpx の ConnectError / ReadTimeout / RemoteProtocolError など
+    name = type(error).__name__
+    if any(keyword in name for keyword in ("Timeout", "Connect", "Network", "Protocol")):
+        return True
+
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+
+    code = str(getattr(error, "code", "") or "")
+    if code.isdigit() and len(code) == 3:
+        return int(code) >= 500 or code == "429"
+    if len(code) == 5:
+        return code[:2] in _TRANSIENT_PG_CLASSES
+    # 分類できないものは恒久的なエラーとして扱い、バッチを分割して原因の行を特定する
+    return False
+
+
+def _pid_alive(pid: int) -> bool:
+    """指定PIDのプロセスが生存しているか"""
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class ChatHistorySpool:
+    """キュー投入済み・未書き込みのチャット履歴を保持する追記型スプールファイル
+
+    1行1レコードのJSON Lines。書き込み完了したIDは ack 行として追記し、
+    未処理が無くなった時点でファイルを切り詰める。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"chat_history-{os.getpid()}.jsonl")
+        # 恒久的なエラーで書き込めなかった行（再送対象の chat_history-*.jsonl とは別名）
+        self.dead_letter_path = os.path.join(directory, "dead_letter.jsonl")
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict[str, Any]):
+        line = json.dumps({"record": record}, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def ack(self, record_ids: List[str], nothing_pending: Callable[[], bool]):
+        with self._lock:
+            # 判定はロック内で行い、同時に追記されたレコードを消さないようにする
+            if nothing_pending():
+                # 未処理が無ければファイルごと空にする
+                open(self.path, "w").close()
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"ack": record_ids}) + "\n")
+                f.flush()
+
+    def dead_letter(self, record: Dict[str, Any], error: str):
+        """書き込めなかった行を調査用に退避する"""
+        line = json.dumps({"record": record, "error": error}, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def claim_orphans(self) -> List[Dict[str, Any]]:
+        """停止済みプロセスが残したスプールから未書き込みのレコードを回収する"""
+        records: List[Dict[str, Any]] = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith("chat_history-") and name.endswith(".jsonl")):
+                continue
+            try:
+                pid = int(name[len("chat_history-"):-len(".jsonl")])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+
+            src = os.path.join(self.directory, name)
+            claimed = f"{src}.replay-{os.getpid()}"
+            try:
+                # rename はアトミックなので複数ワーカーが同時に回収しても1つだけ成功する
+                os.rename(src, claimed)
+            except OSError:
+                continue
+
+            pending: Dict[str, Dict[str, Any]] = {}
+            with open(claimed, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 書き込み途中でクラッシュした最終行
+                        continue
+                    if "record" in entry:
+                        pending[entry["record"]["id"]] = entry["record"]
+                    for record_id in entry.get("ack", []):
+                        pending.pop(record_id, None)
+            records.extend(pending.values())
+            os.remove(claimed)
+        return records
+
+
+class ChatHistoryWriter:
+    """chat_history のライトビハインド書き込みを行うクラス"""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=CHAT_HISTORY_QUEUE_MAX)
+        self.spool = ChatHistorySpool(CHAT_HISTORY_SPOOL_DIR)
+        self._worker_task: Optional[asyncio.Task] = None
+        # スプールに書いたがDBへの書き込みが完了していない件数
+        self._unacked = 0
+        # キューに入りきらなかったレコードと、再試行を使い切ったバッチ（スプールには記録済み）
+        self._backlog: List[Dict[str, Any]] = []
+        self._backlog_retry_at = 0.0
+        # user_id -> company_id（LRUで上限を設ける）
+        self._company_cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "overflowed": 0,
+            "deferred": 0,
+            "dead_lettered": 0,
+            "replayed": 0
+        }
+
+    def start(self):
+        """ワーカーを起動し、停止済みプロセスの未書き込み分を再投入する"""
+        if self._worker_task is not None:
+            return
+        for record in self.spool.claim_orphans():
+            self.spool.append(record)
+            self._unacked += 1
+            self.stats["replayed"] += 1
+            try:
+                self.queue.put_nowait(record)
+            except asyncio.QueueFull:
+                self._backlog.append(record)
+        if self.stats["replayed"]:
+            logger.info(f"📝 スプールから未書き込みのチャット履歴 {self.stats['replayed']} 件を再送します")
+        self._worker_task = asyncio.create_task(self._worker())
+
+    async def enqueue(self, record: Dict[str, Any]):
+        """チャット履歴を書き込みキューに積む（DB書き込みは待たない）"""
+        if self._worker_task is None:
+            self.start()
+
+        self._unacked += 1
+        await asyncio.to_thread(self.spool.append, record)
+        try:
+            self.queue.put_nowait(record)
+            self.stats["enqueued"] += 1
+        except asyncio.QueueFull:
+            # キューが溢れた場合もリクエストは待たせず、スプール済みのレコードをバックログに回す
+            self.stats["overflowed"] += 1
+            self._backlog.append(record)
+
+    def pending_count(self) -> int:
+        return self._unacked
+
+    async def _collect_batch(self, wait: Optional[float] = None) -> List[Dict[str, Any]]:
+        """最大 BATCH_SIZE 行、または FLUSH_MS 経過までレコードを集める
+
+        wait 秒以内に1件も来なければ空リストを返す（None なら来るまで待つ）。
+        """
+        try:
+            batch = [await asyncio.wait_for(self.queue.get(), wait)]
+        except asyncio.TimeoutError:
+            return []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CHAT_HISTORY_FLUSH_MS / 1000
+        while len(batch) < CHAT_HISTORY_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write_with_retry(self, batch: List[Dict[str, Any]]) -> Optional[Exception]:
+        """一時的な障害のみ回数を区切って再試行する。成功なら None、失敗なら最後のエラー"""
+        for attempt in range(len(_RETRY_DELAYS) + 1):
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+                return None
+            except Exception as e:
+                self.stats["failed_batches"] += 1
+                if not _is_transient_error(e) or attempt == len(_RETRY_DELAYS):
+                    return e
+                delay = _RETRY_DELAYS[attempt]
+                logger.error(f"❌ チャット履歴の一括書き込み失敗 ({len(batch)}件, {delay}秒後に再試行): {e}")
+                await asyncio.sleep(delay)
+
+    async def _ack(self, batch: List[Dict[str, Any]]):
+        self._unacked -= len(batch)
+        await asyncio.to_thread(
+            self.spool.ack, [record["id"] for record in batch], lambda: self._unacked == 0
+        )
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        """書き込んでスプールに完了を記録する
+
+        一時的な障害が続く場合はバックログに戻して後で再送し、
+        恒久的なエラーはバッチを二分して原因の行だけをデッドレターに退避する。
+        """
+        error = await self._write_with_retry(batch)
+        if error is None:
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+            await self._ack(batch)
+            return
+
+        if _is_transient_error(error):
+            logger.error(f"❌ チャット履歴 {len(batch)} 件を書き込めません（{_BACKLOG_RETRY_SECONDS}秒後に再送）: {error}")
+            self.stats["deferred"] += len(batch)
+            self._backlog.extend(batch)
+            self._backlog_retry_at = asyncio.get_running_loop().time() + _BACKLOG_RETRY_SECONDS
+            return
+
+        if len(batch) == 1:
+            logger.error(f"❌ チャット履歴 {batch[0].get('id')} をデッドレターに退避しました: {error}")
+            self.stats["dead_lettered"] += 1
+            await asyncio.to_thread(self.spool.dead_letter, batch[0], str(error))
+            await self._ack(batch)
+            return
+
+        middle = len(batch) // 2
+        await self._flush(batch[:middle])
+        await self._flush(batch[middle:])
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._backlog and loop.time() >= self._backlog_retry_at:
+                batch = self._backlog[:CHAT_HISTORY_BATCH_SIZE]
+                del self._backlog[:CHAT_HISTORY_BATCH_SIZE]
+                await self._flush(batch)
+                continue
+
+            # バックログの再送時刻まではキューを処理する
+            wait = max(self._backlog_retry_at - loop.time(), 0) if self._backlog else None
+            batch = await self._collect_batch(wait)
+            try:
+                if batch:
+                    await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _lookup_company_id(self, user_id: str) -> Optional[str]:
+        """ユーザーの会社IDを取得（ワーカー内でLRUキャッシュ）"""
+        if user_id in self._company_cache:
+            self._company_cache.move_to_end(user_id)
+            return self._company_cache[user_id]
+
+        from supabase_adapter import select_data
+        result = select_data("users", filters={"id": user_id}, columns="company_id")
+        company_id = result.data[0].get("company_id") if result and result.data else None
+        self._company_cache[user_id] = company_id
+        while len(self._company_cache) > CHAT_HISTORY_COMPANY_CACHE_SIZE:
+            self._company_cache.popitem(last=False)
+        return company_id
+
+    def _prepare_row(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """会社IDの補完と会社別料金体系でのトークン・コスト計算"""
+        row = dict(record)
+        user_id = row.get("user_id")
+        # 呼び出し側が指定したプロンプト参照回数（未指定の記録はRAG処理としてプロンプト参照1回）
+        prompt_refs = row.pop("_prompt_refs", None)
+
+        if row.get("company_id") is None and user_id and user_id != "anonymous":
+            row["company_id"] = self._lookup_company_id(user_id)
+
+        if (row.get("company_id") or prompt_refs is not None) and row.get("user_message") and row.get("bot_response"):
+            try:
+                from modules.token_counter import get_token_counter
+                cost_result = get_token_counter().calculate_cost_by_company(
+                    row["user_message"], row["bot_response"], row.get("company_id"),
+                    1 if prompt_refs is None else prompt_refs
+                )
+                row["input_tokens"] = cost_result["input_tokens"]
+                row["output_tokens"] = cost_result["output_tokens"]
+                row["cost_usd"] = cost_result["total_cost_usd"]
+            except Exception as calc_error:
+                logger.warning(f"会社別コスト計算エラー: {calc_error}")
+
+        row["total_tokens"] = (row.get("input_tokens") or 0) + (row.get("output_tokens") or 0)
+        return row
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        """複数行を1回のリクエストで書き込む（idで冪等）"""
+        from supabase_adapter import get_supabase_client
+        rows = [self._prepare_row(record) for record in batch]
+        get_supabase_client().table("chat_history").upsert(
+            rows, on_conflict="id", ignore_duplicates=True
+        ).execute()
+
+    async def close(self, timeout: float = 10.0):
+        """キューに残っている分を書き切ってワーカーを停止する"""
+        if self._worker_task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            # 残りはスプールに残り、次回起動時に再送される
+            logger.warning(f"⚠️ チャット履歴 {self.pending_count()} 件を書き込めずに終了します（次回起動時に再送）")
+        self._worker_task.cancel()
+        await asyncio.gather(self._worker_task, return_exceptions=True)
+        self._worker_task = None
+
+
+# グローバルインスタンス
+_chat_history_writer: Optional[ChatHistoryWriter] = None
+
+
+def get_chat_history_writer() -> ChatHistoryWriter:
+    """チャット履歴ライターのシングルトンを取得"""
+    global _chat_history_writer
+    if _chat_history_writer is None:
+        _chat_history_writer = ChatHistoryWriter()
+    return _chat_history_writer
+
+
+async def shutdown_chat_history_writer():
+    """アプリケーション終了時に呼び出す"""
+    if _chat_history_writer is not None:
+        await _chat_history_writer.close()
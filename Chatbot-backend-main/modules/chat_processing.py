@@ -93,57 +93,27 @@ async def save_chat_history(
     cost_usd: float = 0.0,
     employee_id: Optional[str] = None,
     employee_name: Optional[str] = None,
+    prompt_refs: Optional[int] = None,
 ) -> None:
     """
     チャット履歴をSupabaseの chat_history テーブルに保存する
+    
+    書き込みはライトビハインドで行う（chat_history_writer 参照）。
+    会社IDの補完と会社別料金でのトークン・コスト計算もバックグラウンドで実行される。
+    prompt_refs（プロンプト参照回数）を指定すると、会社IDがなくても書き込み時にトークン・コストを計算する。
+    リクエスト処理中にトークン数を数えないよう、呼び出し側ではコストを計算せずにこちらを渡す。
     """
     try:
-        safe_print(f"[DB SAVE] save_chat_history called for user {user_id}. Message: {user_message[:50]}...")
+        from modules.chat_history_writer import get_chat_history_writer
         
-        chat_id = str(uuid.uuid4())
-        timestamp = create_timestamp_for_db()  # 日本時間（JST）で保存
-
-        # company_id が提供されていない場合、user_id から取得を試みる
-        if company_id is None and user_id != "anonymous":
-            safe_print(f"[DB SAVE] Attempting to get company_id for user {user_id}")
-            user_data_result = select_data("users", filters={"id": user_id}, columns="company_id")
-            if user_data_result and user_data_result.data:
-                company_id = user_data_result.data[0].get("company_id")
-                safe_print(f"[DB SAVE] Found company_id: {company_id} for user {user_id}")
-            else:
-                safe_print(f"[DB SAVE] No company_id found for user {user_id}")
-
-        # 会社別料金体系に基づいて正確なコストを計算
-        if company_id and user_message and bot_response:
-            try:
-                from modules.token_counter import TokenCounter
-                counter = TokenCounter()
-                
-                # 会社別料金計算（RAG処理の場合はプロンプト参照1回をカウント）
-                prompt_refs = 1  # RAG処理なのでプロンプト参照1回
-                cost_result = counter.calculate_cost_by_company(
-                    user_message, bot_response, company_id, prompt_refs
-                )
-                
-                # 計算結果でパラメータを上書き
-                input_tokens = cost_result["input_tokens"]
-                output_tokens = cost_result["output_tokens"]
-                cost_usd = cost_result["total_cost_usd"]
-                
-                safe_print(f"[DB SAVE] Company-specific cost calculated: ${cost_usd:.6f} for company {company_id}")
-                
-            except Exception as calc_error:
-                safe_print(f"[DB SAVE] Error calculating company-specific cost: {calc_error}")
-                # エラーの場合は元の値を使用
-
         # employee_id が明示的に渡されていない場合は user_id を利用する
         effective_employee_id = employee_id or user_id
 
-        data = {
-            "id": chat_id,
+        record = {
+            "id": str(uuid.uuid4()),
             "user_message": user_message,
             "bot_response": bot_response,
-            "timestamp": timestamp,
+            "timestamp": create_timestamp_for_db(),  # 日本時間（JST）で保存
             "category": category,
             "sentiment": sentiment,
             "employee_id": effective_employee_id,
@@ -158,12 +128,11 @@ async def save_chat_history(
             "model_name": model_name,
             "cost_usd": cost_usd,
         }
+        if prompt_refs is not None:
+            # chat_history の列ではなく、書き込み時のコスト計算にだけ使う
+            record["_prompt_refs"] = prompt_refs
 
-        result = insert_data("chat_history", data)
-        if result.success:
-            safe_print(f"[DB SAVE] Chat history successfully saved to Supabase for user {user_id} with id {chat_id}")
-        else:
-            safe_print(f"[DB SAVE] Failed to save chat history to Supabase: {result.error}")
+        await get_chat_history_writer().enqueue(record)
     except Exception as e:
         safe_print(f"[DB SAVE] Unexpected error saving chat history: {e}")
         import traceback
@@ -218,17 +187,11 @@ async def process_chat_message(
                 if user_data_result and user_data_result.data:
                     company_id = user_data_result.data[0].get("company_id")
             
-            # トークン・コスト計算（基本応答の場合はプロンプト参照なし）
-            from modules.token_counter import TokenCounter
-            counter = TokenCounter()
-            cost_result = counter.calculate_cost_by_company(message, response, company_id, 0)
-            
+            # トークン・コストは書き込み時に計算（基本応答の場合はプロンプト参照なし）
             await save_chat_history(user_id, message, response, 
                                   category=intent_info.get('category'),
                                   company_id=company_id,
-                                  input_tokens=cost_result.get("input_tokens", 0),
-                                  output_tokens=cost_result.get("output_tokens", 0),
-                                  cost_usd=cost_result.get("total_cost_usd", 0.0))
+                                  prompt_refs=0)
             
             return {
                 'response': response,
@@ -309,21 +272,14 @@ async def process_chat_message(
                 if user_data_result and user_data_result.data:
                     company_id = user_data_result.data[0].get("company_id")
             
-            # トークン・コスト計算（RAG検索を使用した場合はプロンプト参照1回）
-            from modules.token_counter import TokenCounter
-            counter = TokenCounter()
-            prompt_refs = 1  # RAG検索を使用したのでプロンプト参照1回
-            cost_result = counter.calculate_cost_by_company(message, response, company_id, prompt_refs)
-            
+            # トークン・コストは書き込み時に計算（RAG検索を使用した場合はプロンプト参照1回）
             await save_chat_history(
                 user_id, message, response,
                 category=intent_info.get('category'),
                 source_document=source_document,
                 source_page=source_page,
                 company_id=company_id,
-                input_tokens=cost_result.get("input_tokens", 0),
-                output_tokens=cost_result.get("output_tokens", 0),
-                cost_usd=cost_result.get("total_cost_usd", 0.0)
+                prompt_refs=1
             )
             
             return {
@@ -350,18 +306,11 @@ async def process_chat_message(
             if user_data_result and user_data_result.data:
                 company_id = user_data_result.data[0].get("company_id")
         
-        # トークン・コスト計算（RAG処理の場合はプロンプト参照1回をカウント）
-        from modules.token_counter import TokenCounter
-        counter = TokenCounter()
-        prompt_refs = 1  # RAG検索を使用したのでプロンプト参照1回
-        cost_result = counter.calculate_cost_by_company(message, response, company_id, prompt_refs)
-        
+        # トークン・コストは書き込み時に計算（RAG処理の場合はプロンプト参照1回をカウント）
         await save_chat_history(user_id, message, response, 
                               category=intent_info.get('category'),
                               company_id=company_id,
-                              input_tokens=cost_result.get("input_tokens", 0),
-                              output_tokens=cost_result.get("output_tokens", 0),
-                              cost_usd=cost_result.get("total_cost_usd", 0.0))
+                              prompt_refs=1)
         
         return {
             'response': response,
@@ -137,14 +137,10 @@ async def process_chat_with_realtime_rag(message: ChatMessage, db = Depends(get_
             # チャット履歴を保存
             try:
                 from modules.chat_processing import save_chat_history
-                from modules.token_counter import TokenCounter
                 
                 category = intent_info.get('intent_type', 'casual_chat')
                 
-                # トークン・コスト計算
-                counter = TokenCounter()
-                cost_result = counter.calculate_cost_by_company(message_text, casual_response, company_id, 0)
-                
+                # トークン・コストは書き込み時に計算（プロンプト参照なし）
                 await save_chat_history(
                     user_id=user_id or "anonymous",
                     user_message=message_text,
@@ -155,9 +151,7 @@ async def process_chat_with_realtime_rag(message: ChatMessage, db = Depends(get_
                     category=category,
                     sentiment="neutral",
                     model_name="casual",
-                    input_tokens=cost_result.get("input_tokens", 0),
-                    output_tokens=cost_result.get("output_tokens", 0),
-                    cost_usd=cost_result.get("total_cost_usd", 0.0)
+                    prompt_refs=0
                 )
             except Exception as e:
                 safe_print(f"⚠️ Casual chat history save error: {e}")
@@ -308,12 +302,9 @@ async def process_chat_with_realtime_rag(message: ChatMessage, db = Depends(get_
                             elif source_info_list and len(source_info_list) > 0:
                                 primary_source_document = source_info_list[0].get('name')
                             
-                            # トークン・コスト計算
-                            from modules.token_counter import TokenCounter
-                            counter = TokenCounter()
+                            # トークン・コストは書き込み時に計算
                             # RAG処理でベクトル検索を使用した場合はプロンプト参照1回
                             prompt_refs = 1 if source_documents else 0
-                            cost_result = counter.calculate_cost_by_company(message_text, ai_response, company_id, prompt_refs)
                             
                             await save_chat_history(
                                 user_id=user_id or "anonymous",
@@ -326,9 +317,7 @@ async def process_chat_with_realtime_rag(message: ChatMessage, db = Depends(get_
                                 sentiment="neutral",
                                 model_name="realtime-rag",
                                 source_document=primary_source_document,
-                                input_tokens=cost_result.get("input_tokens", 0),
-                                output_tokens=cost_result.get("output_tokens", 0),
-                                cost_usd=cost_result.get("total_cost_usd", 0.0)
+                                prompt_refs=prompt_refs
                             )
                         except Exception as e:
                             safe_print(f"⚠️ Supabase へのチャット履歴保存エラー: {e}")
@@ -539,22 +528,9 @@ async def process_chat_with_realtime_rag(message: ChatMessage, db = Depends(get_
             elif resource_names and len(resource_names) > 0:
                 primary_source_document = resource_names[0]
             
-            # トークン数とコストを計算
-            from modules.token_counter import TokenCounter
-            counter = TokenCounter()
-            
-            safe_print(f"💰 【コスト計算開始】user_id: {user_id}, company_id: {company_id}")
-            safe_print(f"💰 【コスト計算開始】message_text: {message_text[:100]}...")
-            safe_print(f"💰 【コスト計算開始】ai_response: {ai_response[:100]}...")
-            
-            # 会社別料金計算（Premium Planの場合は¥0、従量課金の場合は実際の料金）
+            # 会社別料金計算（Premium Planの場合は¥0、従量課金の場合は実際の料金）は書き込み時に行う
             # RAG処理でベクトル検索を使用した場合はプロンプト参照1回をカウント
             prompt_refs = 1 if search_results else 0
-            cost_result = counter.calculate_cost_by_company(
-                message_text, ai_response, company_id, prompt_refs
-            )
-            
-            safe_print(f"💰 【料金計算結果】: {cost_result}")
             
             await save_chat_history(
                 user_id=user_id or "anonymous",
@@ -567,9 +543,7 @@ async def process_chat_with_realtime_rag(message: ChatMessage, db = Depends(get_
                 sentiment="neutral",
                 model_name="realtime-rag-fallback",
                 source_document=primary_source_document,
-                input_tokens=cost_result.get("input_tokens", 0),
-                output_tokens=cost_result.get("output_tokens", 0),
-                cost_usd=cost_result.get("total_cost_usd", 0.0)
+                prompt_refs=prompt_refs
             )
         except Exception as e:
             safe_print(f"⚠️ Supabase へのチャット履歴保存エラー: {e}")
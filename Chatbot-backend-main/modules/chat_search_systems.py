@@ -10,18 +10,22 @@ from .chat_config import (
     ENHANCED_JAPANESE_SEARCH_AVAILABLE, VECTOR_SEARCH_AVAILABLE,
     DIRECT_VECTOR_SEARCH_AVAILABLE, PARALLEL_VECTOR_SEARCH_AVAILABLE
 )
-try:
-    from .elasticsearch_search import (
-        get_elasticsearch_fuzzy_search, elasticsearch_available
-    )
-    ELASTICSEARCH_IMPORT_AVAILABLE = True
-except ImportError as e:
-    ELASTICSEARCH_IMPORT_AVAILABLE = False
-    def get_elasticsearch_fuzzy_search():
+# Elasticsearchクライアントは重いため、初めて検索で使うときに読み込む
+def get_elasticsearch_fuzzy_search():
+    try:
+        from .elasticsearch_search import get_elasticsearch_fuzzy_search as _get_es_fuzzy_search
+    except ImportError:
         return None
-    def elasticsearch_available():
+    return _get_es_fuzzy_search()
+
+def elasticsearch_available():
+    try:
+        from .elasticsearch_search import elasticsearch_available as _es_available
+    except ImportError:
         return False
+    return _es_available()
 from .postgresql_fuzzy_search import fuzzy_search_chunks
+from .chunk_metadata import get_chunk_search_source
 # enhanced_postgresql_search module does not exist, using postgresql_fuzzy_search instead
 from .postgresql_fuzzy_search import fuzzy_search_chunks as enhanced_search_chunks, initialize_postgresql_fuzzy as initialize_enhanced_postgresql_search
 
@@ -192,7 +196,10 @@ async def postgresql_fuzzy_search_system(query: str, limit: int = 10) -> List[Di
                 'metadata': {
                     'source': 'postgresql_fuzzy_search',
                     'search_types': result.get('search_types', []),
-                    'highlight': result.get('highlight', '')
+                    'highlight': result.get('highlight', ''),
+                    'doc_id': result.get('doc_id'),
+                    'chunk_index': result.get('chunk_index'),
+                    'document_type': result.get('document_type')
                 }
             })
             
@@ -210,8 +217,7 @@ async def enhanced_postgresql_search_system(query: str,
     Enhanced PostgreSQL検索システム（postgresql_fuzzy_searchを使用）
     """
     try:
-        # Use fuzzy_search_chunks instead (company_id is not supported in fuzzy search)
-        results = await enhanced_search_chunks(query, limit)
+        results = await enhanced_search_chunks(query, limit, company_id=str(company_id) if company_id else None)
         formatted_results = []
         
         for result in results:
@@ -364,10 +370,11 @@ async def database_search_fallback(query: str, limit: int = 10) -> List[Dict[str
             parameters.append(f"%{keyword}%")
         
         # SQL文を構築
+        source = get_chunk_search_source(cursor)
         sql_query = f"""
             SELECT 
                 c.id,
-                ds.name as title,
+                {source.document_name} as title,
                 c.content,
                 '' as url,
                 -- スコアリング: 複数キーワードマッチにボーナス
@@ -375,11 +382,8 @@ async def database_search_fallback(query: str, limit: int = 10) -> List[Dict[str
                     {' + '.join([f"WHEN c.content ILIKE %s THEN 1.0" for _ in important_keywords])}
                     ELSE 0.0
                END as rank
-        FROM chunks c
-        LEFT JOIN document_sources ds ON c.doc_id = ds.id
-        WHERE c.content IS NOT NULL 
-          AND LENGTH(c.content) > 10
-          AND ds.active = true
+        FROM {source.from_sql}
+        WHERE {source.searchable}
               AND ({' OR '.join(keyword_conditions)})
         ORDER BY rank DESC, LENGTH(c.content) DESC
         LIMIT %s
@@ -0,0 +1,88 @@
+"""
+📎 chunks の非正規化ドキュメント情報
+sql/add_chunks_document_metadata.sql 適用後は、chunks.active / document_name / document_type / content_length
+を使って document_sources を JOIN せずに検索します。未適用の環境では従来どおり JOIN します
+
+    source = get_chunk_search_source(cur)
+    sql = f'''
+        SELECT c.id, {source.document_name} AS document_name, {source.document_type} AS document_type
+        FROM {source.from_sql}
+        WHERE {source.searchable} AND c.company_id = %s
+    '''
+"""
+
+import time
+import logging
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 列の有無の再確認間隔（秒）
+_CHECK_SECONDS = 600
+
+_lock = threading.Lock()
+# (確認時刻, 列が存在するか)
+_detected: Optional[Tuple[float, bool]] = None
+
+
+class ChunkSearchSource(NamedTuple):
+    """検索SQLに埋め込む FROM 句・列・条件（チャンクの別名は c）"""
+    from_sql: str
+    document_name: str
+    document_type: str
+    # 有効なドキュメントのチャンク
+    active: str
+    # 有効なドキュメントの、本文が10文字を超えるチャンク（短いチャンクを除外してきた検索用）
+    searchable: str
+
+
+DENORMALIZED = ChunkSearchSource(
+    from_sql="chunks c",
+    document_name="c.document_name",
+    document_type="c.document_type",
+    active="c.active = true",
+    searchable="c.active = true AND c.content_length > 10",
+)
+
+JOINED = ChunkSearchSource(
+    from_sql="chunks c LEFT JOIN document_sources ds ON ds.id = c.doc_id",
+    document_name="ds.name",
+    document_type="ds.type",
+    active="ds.active = true",
+    searchable="ds.active = true AND c.content IS NOT NULL AND LENGTH(c.content) > 10",
+)
+
+
+def _check_columns(cur) -> bool:
+    cur.execute("""
+        SELECT COUNT(*) AS column_count FROM information_schema.columns
+        WHERE table_name = 'chunks'
+          AND column_name IN ('active', 'document_name', 'document_type', 'content_length')
+    """)
+    row = cur.fetchone()
+    count = row["column_count"] if isinstance(row, dict) else row[0]
+    return count == 4
+
+
+def chunk_metadata_available(cur) -> bool:
+    """chunks に非正規化列があるか（プロセス内でキャッシュ）"""
+    global _detected
+    with _lock:
+        if _detected and time.time() - _detected[0] < _CHECK_SECONDS:
+            return _detected[1]
+
+    available = _check_columns(cur)
+    with _lock:
+        if _detected is None or _detected[1] != available:
+            if available:
+                logger.info("📎 chunks の非正規化ドキュメント列を使用して検索します")
+            else:
+                logger.info("📎 chunks に非正規化列がありません（sql/add_chunks_document_metadata.sql 未適用）: document_sources を JOIN します")
+        _detected = (time.time(), available)
+    return available
+
+
+def get_chunk_search_source(cur) -> ChunkSearchSource:
+    """検索SQLの FROM 句・列・条件を取得"""
+    return DENORMALIZED if chunk_metadata_available(cur) else JOINED
@@ -19,16 +19,32 @@ except UnicodeDecodeError:
         os.environ.pop(key, None)
     load_dotenv()
 
+def _parse_log_levels(value: str) -> dict:
+    """LOG_LEVELS（例: "modules.realtime_rag=WARNING,modules.token_counter=DEBUG"）を解析"""
+    levels = {}
+    for item in value.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
 # ロギングの設定
 def setup_logging():
-    """ロギングの設定を行います"""
+    """ロギングの設定を行います（LOG_LEVEL で全体、LOG_LEVELS でモジュールごとのレベルを指定）"""
+    from modules.log_context import TraceContextFilter
+
+    handler = logging.StreamHandler(sys.stdout)
+    # すべてのログにリクエストのトレースIDを付与
+    handler.addFilter(TraceContextFilter())
     logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(sys.stdout)
-        ]
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s',
+        handlers=[handler],
+        # インポート時に他モジュールが basicConfig していても上書きする
+        force=True
     )
+    for name, level in _parse_log_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
     # 注意: ここでは会社名を使用しない
     logger = logging.getLogger("chatbot-assistant")
     logger.setLevel(logging.INFO)
@@ -50,6 +66,19 @@ def setup_gemini():
     model = genai.GenerativeModel('gemini-2.5-flash')
     return model
 
+def get_gemini_api_base_url() -> str:
+    """Gemini REST API のベースURL（GEMINI_API_BASE_URL で負荷試験用のフェイクサーバーなどに切り替え可能）"""
+    return os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+def get_gemini_sdk_options() -> dict:
+    """google.generativeai の configure に渡す追加設定（GEMINI_API_BASE_URL 指定時のみ REST で接続先を変更）"""
+    if not os.getenv("GEMINI_API_BASE_URL"):
+        return {}
+    endpoint = get_gemini_api_base_url()
+    if endpoint.endswith("/v1beta"):
+        endpoint = endpoint[:-len("/v1beta")]
+    return {"transport": "rest", "client_options": {"api_endpoint": endpoint}}
+
 def setup_multi_gemini():
     """複数Gemini APIキーの設定を行います（レート制限対応）"""
     from modules.multi_gemini_client import get_multi_gemini_client, multi_gemini_available
@@ -96,6 +125,25 @@ def get_db_params():
         "database": db_path
     }
 
+def get_database_url() -> str:
+    """psycopg2で直接接続するためのPostgreSQL接続URLを構築します"""
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+    
+    if not supabase_url or not supabase_key:
+        raise ValueError("SUPABASE_URL と SUPABASE_KEY 環境変数が設定されていません")
+    
+    # Supabase URLから接続情報を抽出
+    if "supabase.co" in supabase_url:
+        project_id = supabase_url.split("://")[1].split(".")[0]
+        return f"postgresql://postgres.{project_id}:{os.getenv('DB_PASSWORD', '')}@aws-0-ap-northeast-1.pooler.supabase.com:6543/postgres"
+    
+    # カスタムデータベースURLの場合
+    db_url = os.getenv("DATABASE_URL")
+    if not db_url:
+        raise ValueError("DATABASE_URL 環境変数が設定されていません")
+    return db_url
+
 # ポート設定
 def get_environment():
     """現在の実行環境を判定します"""
@@ -16,7 +16,6 @@ from typing import List, Dict, Any, Optional, Tuple, Union
 from datetime import datetime
 from modules.timezone_utils import create_timestamp_for_db
 import re
-import tiktoken
 from fastapi import HTTPException, UploadFile
 try:
     from google import genai
@@ -29,6 +28,7 @@ except ImportError:
 import psycopg2
 from psycopg2.extras import execute_values
 from .multi_api_embedding import get_multi_api_embedding_client, multi_api_embedding_available
+from .tokenizer import get_tokenizer
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -52,12 +52,8 @@ class DocumentProcessor:
         self.chunk_size_tokens = 250  # 参考トークン数（動的調整されます）
         self.chunk_overlap_chars = 50  # 🎯 固定50文字オーバーラップ（サイズ制御）
         
-        # トークンカウンター初期化
-        try:
-            self.tokenizer = tiktoken.get_encoding("cl100k_base")
-        except Exception as e:
-            logger.warning(f"tiktoken初期化失敗: {e}")
-            self.tokenizer = None
+        # トークンカウンター（プロセス共有のエンコーディングを使用）
+        self.tokenizer = get_tokenizer()
         
         # 複数API対応を最優先、次にGemini API
         if multi_api_embedding_available():
@@ -83,18 +79,17 @@ class DocumentProcessor:
     
     def _count_tokens(self, text: str) -> int:
         """テキストのトークン数をカウント"""
-        if self.tokenizer:
-            try:
-                return len(self.tokenizer.encode(text))
-            except Exception as e:
-                logger.warning(f"トークンカウントエラー: {e}")
+        if self.tokenizer.encoding is not None:
+            return self.tokenizer.count(text)
         
         # フォールバック: 文字数ベースの推定（日本語対応）
-        # 日本語: 1文字 ≈ 1.5トークン, 英語: 4文字 ≈ 1トークン
-        japanese_chars = len(re.findall(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', text))
-        other_chars = len(text) - japanese_chars
-        estimated_tokens = int(japanese_chars * 1.5 + other_chars * 0.25)
-        return estimated_tokens
+        return self.tokenizer.estimate(text)
+    
+    def _count_tokens_many(self, texts: List[str]) -> List[int]:
+        """複数テキストのトークン数をまとめてカウント"""
+        if self.tokenizer.encoding is not None:
+            return self.tokenizer.count_many(texts)
+        return [self.tokenizer.estimate(text) for text in texts]
     
     def _split_text_into_chunks(self, text: str, doc_name: str = "") -> List[Dict[str, Any]]:
         """
@@ -117,11 +112,14 @@ class DocumentProcessor:
         oversized_chunks = 0
         undersized_chunks = 0
         
-        for i, chunk_text in enumerate(chunk_texts):
-            if chunk_text.strip():
-                chunk_content = chunk_text.strip()
+        # トークン数はまとめて計算
+        stripped_texts = [chunk_text.strip() for chunk_text in chunk_texts]
+        token_counts = self._count_tokens_many(stripped_texts)
+        
+        for i, chunk_content in enumerate(stripped_texts):
+            if chunk_content:
                 char_count = len(chunk_content)
-                token_count = self._count_tokens(chunk_content)
+                token_count = token_counts[i]
                 
                 # 🎯 サイズ範囲チェック
                 if char_count > self.max_chunk_size_chars:
@@ -608,6 +606,19 @@ class DocumentProcessor:
             else:
                 logger.info(f"🎉 全embedding生成成功: {stats['successful_embeddings']}/{stats['total_chunks']}")
 
+            # キーワード検索・ローカルベクトル検索のインデックスに新しいチャンクを反映させる
+            from .bm25_index import mark_bm25_index_stale
+            from .vector_index import mark_vector_index_stale
+            from .single_flight import bump_document_set_version
+            mark_bm25_index_stale(company_id)
+            mark_vector_index_stale(company_id)
+            bump_document_set_version(company_id)
+            try:
+                from .postgresql_fuzzy_search import index_document_search_tokens
+                await index_document_search_tokens(doc_id)
+            except Exception as e:
+                logger.warning(f"⚠️ 全文検索インデックス作成失敗（後でバックフィル可能）: {e}")
+
             return stats
 
         except Exception as e:
@@ -8,6 +8,7 @@ Excelファイルなどの構造化データを行（レコード）単位で処
 テキストチャンクではなく、データベースのレコードとして扱う
 """
 
+import io
 import os
 # import uuid  # 🚀 超短縮列名により不要
 import logging
@@ -197,7 +198,32 @@ class DocumentProcessorRecordBased:
             )
     
     async def _extract_records_from_excel(self, content: bytes, filename: str) -> List[Dict[str, Any]]:
-        """Excelファイルからレコードを抽出"""
+        """Excelファイルからレコードを抽出（解析・レコード作成はCPU処理のためスレッドで実行）"""
+        return await asyncio.to_thread(self._extract_records_from_excel_sync, content, filename)
+    
+    def _read_sheet_rows(self, excel_file: pd.ExcelFile, sheet_name: str) -> List[List[Any]]:
+        """
+        シートを1回だけ解析してセルの値（行のリスト）を取得
+        dtype=object・na_filter=False で読み込むため、型変換・欠損値変換前の pd.read_excel 内部の値と同じ
+        """
+        raw = pd.read_excel(excel_file, sheet_name=sheet_name, header=None, dtype=object, na_filter=False)
+        return raw.values.tolist()
+    
+    def _rows_to_dataframe(self, rows: List[List[Any]], header: Optional[int]) -> pd.DataFrame:
+        """
+        セルの値から DataFrame を作成（pd.read_excel(header=header) と同じ結果）
+        pd.read_excel もシートの値を TextParser で DataFrame に変換しているため、同じ引数で変換する
+        """
+        from pandas.errors import EmptyDataError
+        from pandas.io.parsers import TextParser
+        if not rows:
+            return pd.DataFrame()
+        try:
+            return TextParser([list(row) for row in rows], header=header, skip_blank_lines=False).read()
+        except EmptyDataError:
+            return pd.DataFrame()
+    
+    def _extract_records_from_excel_sync(self, content: bytes, filename: str) -> List[Dict[str, Any]]:
         try:
             logger.info(f"📊 Excel レコード抽出開始: {filename}")
             
@@ -205,7 +231,7 @@ class DocumentProcessorRecordBased:
             # cleaned_text = self.excel_cleaner.clean_excel_data(content)
             
             # pandas でExcelファイルを直接読み込み
-            excel_file = pd.ExcelFile(content)
+            excel_file = pd.ExcelFile(io.BytesIO(content))
             all_records = []
             
             for sheet_name in excel_file.sheet_names:
@@ -215,8 +241,11 @@ class DocumentProcessorRecordBased:
                     # シートをDataFrameとして読み込み
                     logger.info(f"📋 シート読み込み開始: {sheet_name}")
                     
-                    # 最初にヘッダーなしで読み込んで構造を確認
-                    df_raw = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
+                    # シートの解析は1回だけ行い、ヘッダーなし・検出したヘッダー行ありの両方をその値から作成
+                    rows = self._read_sheet_rows(excel_file, sheet_name)
+                    
+                    # 最初にヘッダーなしで構造を確認
+                    df_raw = self._rows_to_dataframe(rows, None)
                     logger.info(f"📊 生のシート情報（ヘッダーなし）:")
                     logger.info(f"  - 形状: {df_raw.shape}")
                     if not df_raw.empty:
@@ -244,8 +273,8 @@ class DocumentProcessorRecordBased:
                     else:
                         logger.warning("⚠️ 適切なヘッダー行が見つかりません。行0を使用します。")
                     
-                    # 検出されたヘッダー行で再読み込み
-                    df = pd.read_excel(excel_file, sheet_name=sheet_name, header=header_row)
+                    # 検出されたヘッダー行で DataFrame を作成
+                    df = self._rows_to_dataframe(rows, header_row)
                     
                     # 複数行ヘッダーの場合、上の行の情報も結合
                     if header_row > 0:
@@ -315,77 +344,75 @@ class DocumentProcessorRecordBased:
             raise
     
     def _extract_records_from_dataframe(self, df: pd.DataFrame, sheet_name: str) -> List[Dict[str, Any]]:
-        """DataFrameからレコードを抽出"""
-        records = []
-        
+        """
+        DataFrameからレコードを抽出
+        行ごとに Series を作らず、列単位で文字列化・欠損判定を行ってから行のレコードを組み立てる
+        """
         try:
             # 列名を正規化
             logger.info(f"DataFrame列名（正規化前）: {list(df.columns)}")
             df.columns = [self._normalize_column_name(str(col)) for col in df.columns]
-            logger.info(f"DataFrame列名（正規化後）: {list(df.columns)}")
+            columns = list(df.columns)
+            logger.info(f"DataFrame列名（正規化後）: {columns}")
+            
+            # 行単位で取り出した場合と同じ型の値（全列共通の型）で列ごとに文字列化
+            values = df.values
+            column_values = []  # 列ごとの record_data 用の値
+            column_parts = []   # 列ごとの「列名: 値」
+            filled_columns = []
+            for col_index, col in enumerate(columns):
+                column = pd.Series(values[:, col_index], copy=False)
+                missing = column.isna().tolist()
+                texts = ["" if is_missing else str(value).strip() for value, is_missing in zip(column, missing)]
+                column_values.append(texts)
+                # 空セルも構造情報として保持
+                column_parts.append([
+                    f"{col}: [空]" if is_missing else f"{col}: {text}" for text, is_missing in zip(texts, missing)
+                ])
+                filled_columns.append([not is_missing for is_missing in missing])
+            
+            indexes = df.index.tolist()
+            row_values = list(zip(*column_values)) if columns else [()] * len(indexes)
+            row_parts = list(zip(*column_parts)) if columns else [()] * len(indexes)
+            meaningful_counts = [sum(flags) for flags in zip(*filled_columns)] if columns else [0] * len(indexes)
+            
+            contents = []
+            for index, parts in zip(indexes, row_parts):
+                # レコードの内容を作成（空行でも構造情報を保持）
+                if not parts:
+                    record_content = f"[空行] 行{index}: 全セル空"
+                else:
+                    record_content = " | ".join(parts)
+                
+                # 🎯 レコードの長さ制限を有効化 - 600-800文字範囲に制限
+                if len(record_content) > self.max_record_length:
+                    # 800文字を超える場合は切り詰める
+                    record_content = record_content[:self.max_record_length]
+                    # 最後の完全な列情報で終わるように調整
+                    last_separator = record_content.rfind(" | ")
+                    if last_separator > self.min_record_length:  # 600文字以上の位置にセパレータがある場合
+                        record_content = record_content[:last_separator]
+                    record_content += " [...]"  # 切り詰めたことを示す
+                    logger.debug(f"📏 レコード {index} を{len(record_content)}文字に切り詰めました")
+                contents.append(record_content)
+            
+            token_counts = self.base_processor._count_tokens_many(contents)
             
-            # 各行をレコードとして処理
-            for index, row in df.iterrows():
-                try:
-                    # 空の行スキップを無効化 - 全行保持
-                    # if row.isna().all():
-                    #     continue
-                    
-                    # レコードの内容を構築
-                    record_data = {}
-                    record_parts = []
-                    meaningful_columns = 0
-                    
-                    for col in df.columns:
-                        value = row[col]
-                        if pd.notna(value):
-                            clean_value = str(value).strip()
-                            record_data[col] = clean_value
-                            record_parts.append(f"{col}: {clean_value}")
-                            meaningful_columns += 1
-                        else:
-                            # 空セルも構造情報として保持
-                            record_data[col] = ""
-                            record_parts.append(f"{col}: [空]")
-                    
-                    # 意味のある列数チェックを無効化 - 全レコード保持
-                    # if meaningful_columns < self.min_meaningful_columns:
-                    #     continue
-                    
-                    # レコードの内容を作成（空行でも構造情報を保持）
-                    if not record_parts:
-                        record_content = f"[空行] 行{index}: 全セル空"
-                    else:
-                        record_content = " | ".join(record_parts)
-                    
-                    # 🎯 レコードの長さ制限を有効化 - 600-800文字範囲に制限
-                    if len(record_content) > self.max_record_length:
-                        # 800文字を超える場合は切り詰める
-                        record_content = record_content[:self.max_record_length]
-                        # 最後の完全な列情報で終わるように調整
-                        last_separator = record_content.rfind(" | ")
-                        if last_separator > self.min_record_length:  # 600文字以上の位置にセパレータがある場合
-                            record_content = record_content[:last_separator]
-                        record_content += " [...]"  # 切り詰めたことを示す
-                        logger.debug(f"📏 レコード {index} を{len(record_content)}文字に切り詰めました")
-                    
-                    # メタデータを追加
-                    record = {
-                        "chunk_index": len(records),  # chunks テーブルとの互換性のため
-                        "content": record_content,
-                        "token_count": self.base_processor._count_tokens(record_content),
-                        "sheet_name": sheet_name,
-                        "row_index": index,
-                        "record_data": record_data,
-                        "column_count": meaningful_columns,
-                        "columns": list(record_data.keys())  # 列名リストを追加
-                    }
-                    
-                    records.append(record)
-                    
-                except Exception as e:
-                    logger.warning(f"⚠️ 行 {index} 処理エラー: {e}")
-                    continue
+            records = []
+            for index, record_content, token_count, cells, meaningful_columns in zip(
+                indexes, contents, token_counts, row_values, meaningful_counts
+            ):
+                record_data = dict(zip(columns, cells))
+                records.append({
+                    "chunk_index": len(records),  # chunks テーブルとの互換性のため
+                    "content": record_content,
+                    "token_count": token_count,
+                    "sheet_name": sheet_name,
+                    "row_index": index,
+                    "record_data": record_data,
+                    "column_count": meaningful_columns,
+                    "columns": list(record_data.keys())  # 列名リストを追加
+                })
             
             return records
             
@@ -569,6 +596,19 @@ class DocumentProcessorRecordBased:
             else:
                 logger.info(f"🎉 全レコード保存 & 全embedding生成成功: {stats['successful_embeddings']}/{stats['total_chunks']}")
 
+            # キーワード検索・ローカルベクトル検索のインデックスに新しいチャンクを反映させる
+            from .bm25_index import mark_bm25_index_stale
+            from .vector_index import mark_vector_index_stale
+            from .single_flight import bump_document_set_version
+            mark_bm25_index_stale(company_id)
+            mark_vector_index_stale(company_id)
+            bump_document_set_version(company_id)
+            try:
+                from .postgresql_fuzzy_search import index_document_search_tokens
+                await index_document_search_tokens(doc_id)
+            except Exception as e:
+                logger.warning(f"⚠️ 全文検索インデックス作成失敗（後でバックフィル可能）: {e}")
+
             return stats
 
         except Exception as e:
@@ -614,7 +654,7 @@ class DocumentProcessorRecordBased:
             csv_buffer = io.StringIO(text_content)
             
             # CSVを読み込み（自動的にヘッダーを検出）
-            df = pd.read_csv(csv_buffer, encoding=None)
+            df = await asyncio.to_thread(pd.read_csv, csv_buffer, encoding=None)
             logger.info(f"📊 CSV読み込み完了: {df.shape[0]} 行 × {df.shape[1]} 列")
             
             if df.empty:
@@ -625,7 +665,7 @@ class DocumentProcessorRecordBased:
             logger.info(f"📋 CSV列名: {list(df.columns)}")
             
             # DataFrameからレコードを抽出
-            records = self._extract_records_from_dataframe(df, "CSV")
+            records = await asyncio.to_thread(self._extract_records_from_dataframe, df, "CSV")
             
             logger.info(f"🎉 CSV レコード抽出完了: {len(records)} レコード")
             return records
@@ -5,15 +5,17 @@ Fuzzy searchとadvanced query機能を提供
 
 import os
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import json
 from datetime import datetime
 import asyncio
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
 
 # Elasticsearchの条件付きインポート
 try:
     from elasticsearch import Elasticsearch
+    from elasticsearch.helpers import parallel_bulk
     from elasticsearch_dsl import Search, Q, Document, Text, Keyword, Integer, Float, Date, Index
     from elasticsearch_dsl.connections import connections
     ELASTICSEARCH_AVAILABLE = True
@@ -46,6 +48,18 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# バルク投入の設定
+ES_BULK_THREADS = int(os.getenv("ES_BULK_THREADS", "4"))
+ES_BULK_CHUNK_SIZE = int(os.getenv("ES_BULK_CHUNK_SIZE", "500"))
+# 通常時のリフレッシュ間隔（大量投入中は無効化する）
+ES_REFRESH_INTERVAL = os.getenv("ES_REFRESH_INTERVAL", "1s")
+# 差分同期の間隔（秒）と1回に処理する変更ログの上限
+ES_SYNC_INTERVAL = float(os.getenv("ES_SYNC_INTERVAL", "5"))
+ES_SYNC_MAX_CHANGES = int(os.getenv("ES_SYNC_MAX_CHANGES", "5000"))
+# 差分同期を使わない場合に変更ログを残しておく時間（時間）と削除の間隔（秒）
+ES_CHANGE_LOG_RETENTION_HOURS = float(os.getenv("ES_CHANGE_LOG_RETENTION_HOURS", "24"))
+ES_CHANGE_LOG_PRUNE_INTERVAL = float(os.getenv("ES_CHANGE_LOG_PRUNE_INTERVAL", "3600"))
+
 class ElasticsearchManager:
     """Elasticsearch管理クラス"""
     
@@ -209,10 +223,35 @@ class ElasticsearchManager:
         """Elasticsearchが利用可能かチェック"""
         return self.es is not None and self.es.ping()
     
+    async def is_available_async(self) -> bool:
+        """is_available をイベントループ外で実行（ping は同期HTTPリクエストのため）"""
+        if self.es is None:
+            return False
+        return await asyncio.to_thread(self.is_available)
+    
+    # 同期対象チャンクの取得SQL（embedding は全文検索に使わないため転送しない）
+    _CHUNK_SELECT_SQL = """
+    SELECT 
+        c.id as chunk_id,
+        c.doc_id as document_id,
+        c.chunk_index,
+        c.content,
+        c.company_id,
+        c.created_at,
+        c.updated_at,
+        ds.name as document_name,
+        ds.type as document_type,
+        ds.special
+    FROM chunks c
+    JOIN document_sources ds ON c.doc_id = ds.id
+    WHERE c.content IS NOT NULL
+    AND ds.active = true
+    """
+    
     async def sync_database_to_elasticsearch(self, company_id: str = None):
-        """データベースからElasticsearchに同期"""
+        """データベースからElasticsearchに全件同期（初回・復旧用。通常は sync_incremental を使用）"""
         try:
-            if not self.is_available():
+            if not await self.is_available_async():
                 logger.error("❌ Elasticsearch利用不可")
                 return False
             
@@ -220,92 +259,248 @@ class ElasticsearchManager:
                 logger.error("❌ psycopg2利用不可")
                 return False
             
-            logger.info("🔄 データベースからElasticsearchへの同期開始")
-            
-            # データベースからチャンクデータを取得
-            with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
-                with conn.cursor() as cur:
-                    sql = """
-                    SELECT 
-                        c.id as chunk_id,
-                        c.doc_id as document_id,
-                        c.chunk_index,
-                        c.content,
-                        c.company_id,
-                        c.embedding,
-                        c.created_at,
-                        c.updated_at,
-                        ds.name as document_name,
-                        ds.type as document_type,
-                        ds.special
-                    FROM chunks c
-                    LEFT JOIN document_sources ds ON c.doc_id = ds.id
-                    WHERE c.content IS NOT NULL
-                    AND ds.active = true
-                    """
-                    
-                    params = []
-                    if company_id:
-                        sql += " AND c.company_id = %s"
-                        params.append(company_id)
-                    
-                    cur.execute(sql, params)
-                    rows = cur.fetchall()
-                    
-                    logger.info(f"📊 同期対象: {len(rows)}件")
-                    
-                    # バッチでElasticsearchにインデックス
-                    batch_size = 100
-                    for i in range(0, len(rows), batch_size):
-                        batch = rows[i:i + batch_size]
-                        await self._index_batch(batch)
-                        logger.info(f"📝 進捗: {i + len(batch)}/{len(rows)}")
-                    
-                    logger.info("✅ 同期完了")
-                    return True
+            logger.info("🔄 データベースからElasticsearchへの全件同期開始")
+            loop = asyncio.get_running_loop()
+            indexed, failed = await loop.run_in_executor(self.thread_pool, self._full_sync, company_id)
+            logger.info(f"✅ 全件同期完了: {indexed}件 (失敗 {failed}件)")
+            return failed == 0
         
         except Exception as e:
             logger.error(f"❌ 同期エラー: {e}")
             return False
     
-    async def _index_batch(self, batch: List[Dict]):
-        """バッチでのインデックス処理"""
-        try:
-            if not ELASTICSEARCH_AVAILABLE:
-                logger.warning("⚠️ Elasticsearchが利用できないため、バッチインデックスをスキップします")
-                return
-                
-            actions = []
+    def _full_sync(self, company_id: Optional[str]) -> Tuple[int, int]:
+        """サーバーサイドカーソルで読みながら並列バルクで投入"""
+        with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
+            # 読み込み開始前までの変更ログは全件同期に含まれるので、完了後に削除する
+            # （開始後の変更は残り、差分同期で再反映されるが冪等）
+            covered_change_id = None
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('chunk_change_log') IS NOT NULL AS has_change_log")
+                if cur.fetchone()['has_change_log']:
+                    cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM chunk_change_log")
+                    covered_change_id = cur.fetchone()['max_id']
             
-            for row in batch:
-                doc = {
-                    "_index": self.index_name,
-                    "_id": row['chunk_id'],
-                    "_source": {
-                        "chunk_id": row['chunk_id'],
-                        "document_id": row['document_id'],
-                        "document_name": row['document_name'] or 'Unknown',
-                        "document_type": row['document_type'] or 'unknown',
-                        "chunk_index": row['chunk_index'],
-                        "content": row['content'],
-                        "company_id": row['company_id'],
-                        "created_at": row['created_at'].isoformat() if row['created_at'] else None,
-                        "updated_at": row['updated_at'].isoformat() if row['updated_at'] else None,
-                        "embedding": row['embedding'] if row['embedding'] else None,
-                        "special": row['special'] or False
-                    }
-                }
-                actions.append(doc)
+            sql = self._CHUNK_SELECT_SQL
+            params = []
+            if company_id:
+                sql += " AND c.company_id = %s"
+                params.append(company_id)
+            
+            with conn.cursor(name="es_full_sync") as cur:
+                cur.itersize = ES_BULK_CHUNK_SIZE * ES_BULK_THREADS
+                cur.execute(sql, params)
+                with self._bulk_load_settings():
+                    indexed, failed = self._parallel_bulk(self._index_action(row) for row in cur)
             
-            # バルクインデックス
+            if covered_change_id is None:
+                return indexed, failed
+            if failed == 0:
+                with conn.cursor() as cur:
+                    if company_id:
+                        cur.execute(
+                            "DELETE FROM chunk_change_log WHERE id <= %s AND company_id = %s",
+                            (covered_change_id, company_id)
+                        )
+                    else:
+                        cur.execute("DELETE FROM chunk_change_log WHERE id <= %s", (covered_change_id,))
+                if company_id:
+                    self._save_checkpoint(conn, company_id, covered_change_id)
+                conn.commit()
+            return indexed, failed
+    
+    @contextmanager
+    def _bulk_load_settings(self):
+        """大量投入中はリフレッシュを止め、終了後に元の設定へ戻して1回だけリフレッシュする"""
+        settings = self.es.indices.get_settings(index=self.index_name, name="index.refresh_interval")
+        previous = settings.get(self.index_name, {}).get("settings", {}).get("index", {}).get("refresh_interval")
+        if previous == "-1":
+            # 前回の投入が中断して無効のまま残っている
+            previous = ES_REFRESH_INTERVAL
+        
+        self.es.indices.put_settings(index=self.index_name, body={"index": {"refresh_interval": "-1"}})
+        try:
+            yield
+        finally:
+            # 復元に失敗しても投入側の例外を隠さない（未設定だった場合は None で既定値に戻る）
+            try:
+                self.es.indices.put_settings(index=self.index_name, body={"index": {"refresh_interval": previous}})
+            except Exception as e:
+                logger.error(f"❌ refresh_interval の復元に失敗 ({previous}): {e}")
             try:
-                from elasticsearch.helpers import bulk
-                bulk(self.es, actions)
-            except ImportError:
-                logger.warning("⚠️ elasticsearch.helpersが利用できません")
+                self.es.indices.refresh(index=self.index_name)
+            except Exception as e:
+                logger.error(f"❌ インデックスのリフレッシュに失敗: {e}")
+    
+    def _parallel_bulk(self, actions) -> Tuple[int, int]:
+        """parallel_bulk で投入し (成功件数, 失敗件数) を返す"""
+        succeeded = 0
+        failed = 0
+        for ok, info in parallel_bulk(
+            self.es,
+            actions,
+            thread_count=ES_BULK_THREADS,
+            chunk_size=ES_BULK_CHUNK_SIZE,
+            raise_on_error=False,
+            raise_on_exception=False
+        ):
+            if ok:
+                succeeded += 1
+            else:
+                # 既に存在しないドキュメントの削除は成功扱い
+                if info.get("delete", {}).get("status") == 404:
+                    succeeded += 1
+                    continue
+                failed += 1
+                if failed <= 5:
+                    logger.warning(f"⚠️ バルク処理失敗: {info}")
+        return succeeded, failed
+    
+    def _index_action(self, row: Dict) -> Dict:
+        chunk_id = str(row['chunk_id'])
+        return {
+            "_op_type": "index",
+            "_index": self.index_name,
+            "_id": chunk_id,
+            "_source": {
+                "chunk_id": chunk_id,
+                "document_id": row['document_id'],
+                "document_name": row['document_name'] or 'Unknown',
+                "document_type": row['document_type'] or 'unknown',
+                "chunk_index": row['chunk_index'],
+                "content": row['content'],
+                "company_id": row['company_id'],
+                "created_at": row['created_at'].isoformat() if row['created_at'] else None,
+                "updated_at": row['updated_at'].isoformat() if row['updated_at'] else None,
+                "special": row['special'] or False
+            }
+        }
+    
+    def _delete_action(self, chunk_id: str) -> Dict:
+        return {"_op_type": "delete", "_index": self.index_name, "_id": chunk_id}
+    
+    def _save_checkpoint(self, conn, company_id: str, last_change_id: int):
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO es_sync_checkpoints (company_id, last_change_id, synced_at)
+                VALUES (%s, %s, now())
+                ON CONFLICT (company_id) DO UPDATE
+                SET last_change_id = GREATEST(es_sync_checkpoints.last_change_id, EXCLUDED.last_change_id),
+                    synced_at = now()
+            """, (company_id, last_change_id))
+    
+    async def sync_incremental(self) -> Dict[str, int]:
+        """変更ログに溜まった分だけを会社ごとに同期（戻り値は会社別の反映件数）"""
+        if not PSYCOPG2_AVAILABLE or not await self.is_available_async():
+            return {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_pool, self._sync_incremental)
+    
+    def _sync_incremental(self) -> Dict[str, int]:
+        synced = {}
+        with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
+            with conn.cursor() as cur:
+                # 消費済みのログは削除しているので、残っている会社だけが同期対象
+                cur.execute("SELECT DISTINCT COALESCE(company_id, '') AS company_id FROM chunk_change_log")
+                company_ids = [row['company_id'] for row in cur.fetchall()]
             
-        except Exception as e:
-            logger.error(f"❌ バッチインデックスエラー: {e}")
+            for company_id in company_ids:
+                try:
+                    # 上限件数まで読んだ場合は残りがあるので続けて処理する
+                    total = 0
+                    while True:
+                        count = self._sync_company_changes(conn, company_id)
+                        total += count
+                        if count < ES_SYNC_MAX_CHANGES:
+                            break
+                    synced[company_id] = total
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f"❌ 差分同期エラー (company={company_id}): {e}")
+        return synced
+    
+    def _sync_company_changes(self, conn, company_id: str) -> int:
+        """1社分の変更ログを反映し、チェックポイントを進める"""
+        with conn.cursor() as cur:
+            # 反映したログは削除するため、残っているものが未反映分
+            # （ID順に読み飛ばさないので、後からコミットされた小さいIDの変更も取りこぼさない）
+            cur.execute("""
+                SELECT id, doc_id, chunk_id, op
+                FROM chunk_change_log
+                WHERE COALESCE(company_id, '') = %s
+                ORDER BY id
+                LIMIT %s
+            """, (company_id, ES_SYNC_MAX_CHANGES))
+            changes = cur.fetchall()
+        
+        if not changes:
+            return 0
+        
+        # 同じチャンク・ドキュメントへの変更は最後のものだけ反映する
+        chunk_ops: Dict[str, str] = {}
+        doc_ops: Dict[str, str] = {}
+        for change in changes:
+            if change['chunk_id']:
+                chunk_ops[str(change['chunk_id'])] = change['op']
+            else:
+                doc_ops[change['doc_id']] = change['op']
+        
+        upsert_chunk_ids = [chunk_id for chunk_id, op in chunk_ops.items() if op == 'upsert']
+        delete_chunk_ids = [chunk_id for chunk_id, op in chunk_ops.items() if op == 'delete']
+        activated_doc_ids = [doc_id for doc_id, op in doc_ops.items() if op == 'doc_active']
+        deactivated_doc_ids = [doc_id for doc_id, op in doc_ops.items() if op == 'doc_inactive']
+        
+        rows = []
+        if upsert_chunk_ids or activated_doc_ids:
+            with conn.cursor() as cur:
+                cur.execute(
+                    self._CHUNK_SELECT_SQL + " AND (c.id = ANY(%s::uuid[]) OR c.doc_id = ANY(%s))",
+                    (upsert_chunk_ids, activated_doc_ids)
+                )
+                rows = cur.fetchall()
+        
+        # 無効なドキュメントに属するなど取得できなかった更新チャンクは検索対象から外す
+        found_ids = {str(row['chunk_id']) for row in rows}
+        delete_chunk_ids += [chunk_id for chunk_id in upsert_chunk_ids if chunk_id not in found_ids]
+        
+        actions = [self._index_action(row) for row in rows]
+        actions += [self._delete_action(chunk_id) for chunk_id in delete_chunk_ids]
+        if actions:
+            _, failed = self._parallel_bulk(iter(actions))
+            if failed:
+                raise RuntimeError(f"{failed}件のバルク処理に失敗しました")
+        
+        if deactivated_doc_ids:
+            self.es.delete_by_query(
+                index=self.index_name,
+                body={"query": {"terms": {"document_id": deactivated_doc_ids}}},
+                conflicts="proceed"
+            )
+        
+        last_change_id = changes[-1]['id']
+        self._save_checkpoint(conn, company_id, last_change_id)
+        with conn.cursor() as cur:
+            # 反映済みのログを削除（チェックポイントと同じトランザクション）
+            cur.execute(
+                "DELETE FROM chunk_change_log WHERE id = ANY(%s)",
+                ([change['id'] for change in changes],)
+            )
+        conn.commit()
+        
+        logger.info(f"🔄 差分同期 company={company_id or '(なし)'}: 変更{len(changes)}件を反映 (checkpoint={last_change_id})")
+        return len(changes)
+    
+    async def run_incremental_sync_loop(self, interval: float = None):
+        """差分同期を定期実行（アプリ起動時にタスクとして開始）"""
+        interval = interval or ES_SYNC_INTERVAL
+        while True:
+            try:
+                await self.sync_incremental()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 差分同期ループエラー: {e}")
+            await asyncio.sleep(interval)
 
 class ElasticsearchFuzzySearch:
     """Elasticsearch Fuzzy Search機能"""
@@ -333,7 +528,7 @@ class ElasticsearchFuzzySearch:
             検索結果リスト
         """
         try:
-            if not self.es_manager.is_available():
+            if not await self.es_manager.is_available_async():
                 logger.error("❌ Elasticsearch利用不可")
                 return []
             
@@ -434,7 +629,7 @@ class ElasticsearchFuzzySearch:
             limit: 結果件数
         """
         try:
-            if not self.es_manager.is_available():
+            if not await self.es_manager.is_available_async():
                 return []
             
             logger.info(f"🔍 Advanced Search: '{query}' (type: {search_type})")
@@ -582,6 +777,34 @@ def get_elasticsearch_fuzzy_search() -> Optional[ElasticsearchFuzzySearch]:
     
     return _elasticsearch_fuzzy_search
 
+def _prune_chunk_change_log(retention_hours: float) -> int:
+    """保持期間を過ぎた変更ログを削除（差分同期を使わない環境でテーブルが増え続けないように）"""
+    from modules.config import get_database_url
+    with psycopg2.connect(get_database_url()) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('chunk_change_log') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                return 0
+            cur.execute(
+                "DELETE FROM chunk_change_log WHERE changed_at < now() - %s * interval '1 hour'",
+                (retention_hours,)
+            )
+            return cur.rowcount
+
+async def run_change_log_prune_loop(interval: float = None):
+    """ES_INCREMENTAL_SYNC が無効な場合に変更ログを定期的に削除（アプリ起動時にタスクとして開始）"""
+    interval = interval or ES_CHANGE_LOG_PRUNE_INTERVAL
+    while True:
+        try:
+            deleted = await asyncio.to_thread(_prune_chunk_change_log, ES_CHANGE_LOG_RETENTION_HOURS)
+            if deleted:
+                logger.info(f"🧹 変更ログを削除: {deleted}件 ({ES_CHANGE_LOG_RETENTION_HOURS}時間より前)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ 変更ログの削除エラー: {e}")
+        await asyncio.sleep(interval)
+
 def elasticsearch_available() -> bool:
     """Elasticsearchが利用可能かチェック"""
     try:
@@ -10,6 +10,7 @@ import logging
 from typing import List, Dict, Any, Optional, Tuple
 from io import BytesIO
 import unicodedata
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
@@ -112,7 +113,7 @@ class ExcelDataCleaner:
             df[col] = df[col].apply(self._clean_cell_content)
         
         # 3. 意味のない行を削除
-        df = df[df.apply(self._is_meaningful_row, axis=1)]
+        df = df[self._meaningful_row_mask(df)]
         
         # 4. 重複行を削除
         df = df.drop_duplicates()
@@ -210,6 +211,34 @@ class ExcelDataCleaner:
         # 意味のあるセルが1個以上、または総文字数が5文字以上（基準を緩和）
         return meaningful_cells >= 1 or total_content_length >= 5
     
+    def _column_texts(self, df: pd.DataFrame) -> List[List[Optional[str]]]:
+        """
+        列ごとのセルの文字列（strip済み、欠損は None）
+        iterrows で取り出した場合と同じ型（全列共通の型）の値を文字列化するため、結果は行単位の処理と同じ
+        """
+        values = df.values
+        column_texts = []
+        for col_index in range(values.shape[1]):
+            column = pd.Series(values[:, col_index], copy=False)
+            missing = column.isna().tolist()
+            column_texts.append([None if is_missing else str(cell).strip() for cell, is_missing in zip(column, missing)])
+        return column_texts
+    
+    def _meaningful_row_mask(self, df: pd.DataFrame) -> np.ndarray:
+        """各行が意味のあるデータを含んでいるか（_is_meaningful_row を列単位でまとめて判定）"""
+        is_metadata = lru_cache(maxsize=None)(self._is_metadata_text)
+        meaningful_cells = np.zeros(len(df), dtype=int)
+        total_content_length = np.zeros(len(df), dtype=int)
+        for texts in self._column_texts(df):
+            lengths = np.array([
+                len(text) if text and len(text) >= self.min_meaningful_length and not is_metadata(text) else 0
+                for text in texts
+            ], dtype=int)
+            meaningful_cells += lengths > 0
+            total_content_length += lengths
+        # 意味のあるセルが1個以上、または総文字数が5文字以上（基準を緩和）
+        return (meaningful_cells >= 1) | (total_content_length >= 5)
+    
     def _is_metadata_text(self, text: str) -> bool:
         """
         テキストがメタデータ（シート名など）かどうかをチェック
@@ -359,18 +388,19 @@ class ExcelDataCleaner:
         
         formatted_parts.append("\n【データ内容】")
         
-        # データ行を処理
-        for idx, row in data_rows.iterrows():
-            row_data = []
-            for col_idx, header_name in valid_headers:
-                if col_idx < len(row):
-                    cell_value = row.iloc[col_idx]
-                    if pd.notna(cell_value) and str(cell_value).strip():
-                        clean_value = str(cell_value).strip()
-                        # メタデータやシート名の繰り返しを除外
-                        if not self._is_metadata_text(clean_value):
-                            row_data.append(f"{header_name}: {clean_value}")
-            
+        # データ行を処理（列ごとに「項目: 値」を作成してから行単位で結合）
+        is_metadata = lru_cache(maxsize=None)(self._is_metadata_text)
+        column_texts = self._column_texts(data_rows)
+        column_parts = []
+        for col_idx, header_name in valid_headers:
+            # メタデータやシート名の繰り返しを除外
+            column_parts.append([
+                f"{header_name}: {text}" if text and not is_metadata(text) else None
+                for text in column_texts[col_idx]
+            ])
+        
+        for parts in zip(*column_parts):
+            row_data = [part for part in parts if part is not None]
             if row_data:
                 formatted_parts.append(f"• {' | '.join(row_data)}")
         
@@ -383,14 +413,11 @@ class ExcelDataCleaner:
         formatted_parts = []
         formatted_parts.append("【データ内容】")
         
-        for idx, row in df.iterrows():
-            row_data = []
-            for col_idx, cell_value in enumerate(row):
-                if pd.notna(cell_value) and str(cell_value).strip():
-                    clean_value = str(cell_value).strip()
-                    # メタデータやシート名の繰り返しを除外
-                    if not self._is_metadata_text(clean_value):
-                        row_data.append(clean_value)
+        is_metadata = lru_cache(maxsize=None)(self._is_metadata_text)
+        column_texts = self._column_texts(df)
+        for idx, texts in zip(df.index.tolist(), zip(*column_texts)):
+            # メタデータやシート名の繰り返しを除外
+            row_data = [text for text in texts if text and not is_metadata(text)]
             
             if row_data:
                 formatted_parts.append(f"行{idx + 1}: {' | '.join(row_data)}")
@@ -19,6 +19,7 @@ from enum import Enum
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from .chunk_metadata import get_chunk_search_source
 
 # 環境変数の読み込み
 load_dotenv()
@@ -489,21 +490,19 @@ JSON形式のみで回答してください：
                         logger.info("🎯 故障受付シート専用検索を実行")
                         
                         # 故障受付シートを直接検索
-                        direct_sql = """
+                        source = get_chunk_search_source(cur)
+                        direct_sql = f"""
                         SELECT DISTINCT
                             c.id as chunk_id,
                             c.doc_id as document_id,
                             c.chunk_index,
                             c.content as snippet,
-                            ds.name as document_name,
-                            ds.type as document_type,
+                            {source.document_name} as document_name,
+                            {source.document_type} as document_type,
                             3.0 as score  -- 高優先度スコア
-                        FROM chunks c
-                        LEFT JOIN document_sources ds ON ds.id = c.doc_id
-                        WHERE c.content IS NOT NULL
-                          AND LENGTH(c.content) > 10
+                        FROM {source.from_sql}
+                        WHERE {source.searchable}
                           AND c.content LIKE '%故障受付シート%'
-                          AND ds.active = true
                         ORDER BY score DESC
                         LIMIT 5
                         """
@@ -750,20 +749,18 @@ JSON形式のみで回答してください：
         # 最終的なWHERE句
         final_where = ' AND '.join(where_conditions)
         
+        source = get_chunk_search_source(cursor)
         sql = f"""
         SELECT DISTINCT
             c.id as chunk_id,
             c.doc_id as document_id,
             c.chunk_index,
             c.content as snippet,
-            ds.name as document_name,
-            ds.type as document_type,
+            {source.document_name} as document_name,
+            {source.document_type} as document_type,
             1.0 as score
-        FROM chunks c
-        LEFT JOIN document_sources ds ON ds.id = c.doc_id
-        WHERE c.content IS NOT NULL
-          AND LENGTH(c.content) > 10
-          AND ds.active = true
+        FROM {source.from_sql}
+        WHERE {source.searchable}
           AND {final_where}
         ORDER BY score DESC LIMIT %s
         """
@@ -803,20 +800,18 @@ JSON形式のみで回答してください：
         
         final_where = ' OR '.join(or_conditions)
         
+        source = get_chunk_search_source(cursor)
         sql = f"""
         SELECT DISTINCT
             c.id as chunk_id,
             c.doc_id as document_id,
             c.chunk_index,
             c.content as snippet,
-            ds.name as document_name,
-            ds.type as document_type,
+            {source.document_name} as document_name,
+            {source.document_type} as document_type,
             0.8 as score
-        FROM chunks c
-        LEFT JOIN document_sources ds ON ds.id = c.doc_id
-        WHERE c.content IS NOT NULL
-          AND LENGTH(c.content) > 10
-          AND ds.active = true
+        FROM {source.from_sql}
+        WHERE {source.searchable}
           AND ({final_where})
         ORDER BY score DESC LIMIT %s
         """
@@ -874,21 +869,19 @@ JSON形式のみで回答してください：
                     # Convert Python list to PostgreSQL vector format
                     vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
                     
+                    source = get_chunk_search_source(cur)
                     sql = f"""
                     SELECT DISTINCT
                         c.id as chunk_id,
                         c.doc_id as document_id,
                         c.chunk_index,
                         c.content as snippet,
-                        ds.name as document_name,
-                        ds.type as document_type,
+                        {source.document_name} as document_name,
+                        {source.document_type} as document_type,
                         (1 - (c.embedding <=> '{vector_str}'::vector)) as score
-                    FROM chunks c
-                    LEFT JOIN document_sources ds ON ds.id = c.doc_id
-                    WHERE c.content IS NOT NULL
-                      AND c.embedding IS NOT NULL
-                      AND LENGTH(c.content) > 10
-                      AND ds.active = true
+                    FROM {source.from_sql}
+                    WHERE c.embedding IS NOT NULL
+                      AND {source.searchable}
                     """
                     
                     params = []
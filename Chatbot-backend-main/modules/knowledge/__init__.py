@@ -1,31 +1,40 @@
 """
 知識ベースモジュール
 知識ベースの管理と処理を行います
+
+各プロセッサ（pandas・PyMuPDF・openpyxl・python-docx などに依存）は
+初めて参照されたときに読み込みます（起動時間とワーカーごとのメモリ削減のため）
 """
 
-from .base import KnowledgeBase, knowledge_base, get_active_resources, get_knowledge_base_info
-from .api import process_file, process_url, toggle_resource_active, get_uploaded_resources
-from .image import process_image_file, is_image_file
-from .csv_processor import process_csv_file, is_csv_file, check_csv_dependencies
-from .word_processor import process_word_file, is_word_file, check_word_dependencies
-from .file_detector import detect_file_type
+import importlib
+
+# 公開名 -> 定義しているサブモジュール
+_EXPORTS = {
+    'KnowledgeBase': '.base',
+    'knowledge_base': '.base',
+    'get_active_resources': '.base',
+    'get_knowledge_base_info': '.base',
+    'process_file': '.api',
+    'process_url': '.api',
+    'toggle_resource_active': '.api',
+    'get_uploaded_resources': '.api',
+    'process_image_file': '.image',
+    'is_image_file': '.image',
+    'process_csv_file': '.csv_processor',
+    'is_csv_file': '.csv_processor',
+    'check_csv_dependencies': '.csv_processor',
+    'process_word_file': '.word_processor',
+    'is_word_file': '.word_processor',
+    'check_word_dependencies': '.word_processor',
+    'detect_file_type': '.file_detector',
+}
+
+__all__ = list(_EXPORTS)
+
 
-__all__ = [
-    'KnowledgeBase',
-    'knowledge_base',
-    'get_active_resources',
-    'get_knowledge_base_info',
-    'process_file',
-    'process_url',
-    'toggle_resource_active',
-    'get_uploaded_resources',
-    'process_image_file',
-    'is_image_file',
-    'process_csv_file',
-    'is_csv_file',
-    'check_csv_dependencies',
-    'process_word_file',
-    'is_word_file',
-    'check_word_dependencies',
-    'detect_file_type',
-] 
\ No newline at end of file
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
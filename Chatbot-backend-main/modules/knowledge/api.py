@@ -388,7 +388,7 @@ def _prepare_response(
     
     return {
         "message": f"{DEFAULT_COMPANY_NAME}の情報が正常に更新されました（{source_name}）",
-        "columns": knowledge_base.columns if knowledge_base.data is not None else [],
+        "columns": knowledge_base.columns,
         "preview": preview_data,
         "total_rows": total_rows,
         "sections": list(sections.keys()),
@@ -2,29 +2,60 @@
 知識ベース基本モジュール
 知識ベースの基本クラスと共通関数を提供します
 """
-import pandas as pd
 import logging
 from datetime import datetime
 from ..database import ensure_string
+from .frame_store import KnowledgeFrameStore
 
 logger = logging.getLogger(__name__)
 
 # 知識ベースの保存用クラス
 class KnowledgeBase:
     def __init__(self):
-        self.data = None
-        self.raw_text = ""
-        self.columns = []
         self.sources = {}  # ソース（ファイル名やURL）を保存する辞書 {source_name: sections_dict}
-        self.url_data = []  # URLから取得したデータを保存するリスト
-        self.url_texts = []  # URLから取得したテキストを保存するリスト
-        self.file_data = []  # ファイルから取得したデータを保存するリスト
-        self.file_texts = []  # ファイルから取得したテキストを保存するリスト
         self.images = []    # PDFから抽出した画像データを保存するリスト
         self.source_info = {}  # ソースの詳細情報（タイムスタンプ、アクティブ状態など）
-        self.original_data = {}  # 各ソースの元のデータを保存する辞書 {source_name: {'df': dataframe, 'text': text}}
         self.company_sources = {}  # 会社ごとのソースを保存する辞書 {company_id: [source_name1, source_name2, ...]}
-        
+        # ソースごとのデータ（メモリ上限付き、溢れた分はディスクに退避）
+        self.store = KnowledgeFrameStore()
+        self._anonymous_count = 0
+
+    @property
+    def columns(self):
+        """全ソースの列名"""
+        return self.store.columns
+
+    @property
+    def row_count(self) -> int:
+        """全ソースの行数の合計（データを結合せずに集計）"""
+        return self.store.row_count
+
+    def iter_frames(self):
+        """ソースごとの DataFrame を1件ずつ返す（結合せず、退避済みのものもメモリに載せない）"""
+        for _, (df, _) in self.store.items():
+            if df is not None:
+                yield df
+
+    @property
+    def data(self):
+        """全ソースを結合した DataFrame（後方互換用、呼び出しごとに結合するため大きなデータでは iter_frames を使う）"""
+        frames = list(self.iter_frames())
+        if not frames:
+            return None
+        import pandas as pd
+        return pd.concat(frames, ignore_index=True)
+
+    @property
+    def raw_text(self) -> str:
+        """全ソースのテキスト（ファイル → URL の順、呼び出しごとに結合。DataFrame は読み込まない）"""
+        texts = list(self.store.texts(is_file=True))
+        texts += self.store.texts(is_file=False)
+        return "\n\n".join(texts)
+
+    def clear_data(self):
+        """データのみを破棄（ソース情報は残す）"""
+        self.store.clear()
+
     def get_company_data(self, company_id):
         """会社IDに関連するデータを取得する"""
         if not company_id or company_id not in self.company_sources:
@@ -40,16 +71,18 @@ class KnowledgeBase:
         company_columns = []
         
         for source in company_sources:
-            if source in self.original_data:
-                source_data = self.original_data[source]
-                if 'df' in source_data and not source_data['df'].empty:
-                    company_data.append(source_data['df'])
-                if 'text' in source_data:
-                    company_text += source_data['text'] + "\n\n"
+            source_data = self.store.get(company_id, source)
+            if source_data is None:
+                continue
+            df, text = source_data
+            if df is not None and not df.empty:
+                company_data.append(df)
+            company_text += text + "\n\n"
         
         # データフレームを結合
         combined_df = None
         if company_data:
+            import pandas as pd
             combined_df = pd.concat(company_data, ignore_index=True)
             company_columns = combined_df.columns.tolist()
             
@@ -60,54 +93,25 @@ knowledge_base = KnowledgeBase()
 
 # 知識ベースを更新する内部関数
 def _update_knowledge_base(df, text, is_file=True, source_name=None, company_id=None):
-    """知識ベースを更新する内部関数"""
-    # 元のデータを保存
+    """知識ベースを更新する内部関数（同じソースのデータは置き換え、全体の結合は行わない）"""
     if source_name:
-        knowledge_base.original_data[source_name] = {
-            'df': df.copy(),
-            'text': ensure_string(text, for_db=True),
-            'company_id': company_id
-        }
-        
         # 会社のソースリストに追加
         if company_id:
             if company_id not in knowledge_base.company_sources:
                 knowledge_base.company_sources[company_id] = []
             if source_name not in knowledge_base.company_sources[company_id]:
                 knowledge_base.company_sources[company_id].append(source_name)
-    
-    # ファイルかURLかに応じてデータを保存
-    if is_file:
-        knowledge_base.file_data.append(df)
-        knowledge_base.file_texts.append(text)
     else:
-        knowledge_base.url_data.append(df)
-        knowledge_base.url_texts.append(text)
+        knowledge_base._anonymous_count += 1
+        source_name = f"__source_{knowledge_base._anonymous_count}"
     
-    # 全データを結合
-    all_data = []
-    if knowledge_base.file_data:
-        all_data.extend(knowledge_base.file_data)
-    if knowledge_base.url_data:
-        all_data.extend(knowledge_base.url_data)
-    
-    if all_data:
-        # データフレームを結合
-        knowledge_base.data = pd.concat(all_data, ignore_index=True)
-        
-        # 列名を保存
-        knowledge_base.columns = knowledge_base.data.columns.tolist()
-        
-        # 生テキストを結合
-        all_texts = []
-        if knowledge_base.file_texts:
-            all_texts.extend([ensure_string(text, for_db=True) for text in knowledge_base.file_texts])
-        if knowledge_base.url_texts:
-            all_texts.extend([ensure_string(text, for_db=True) for text in knowledge_base.url_texts])
-        
-        knowledge_base.raw_text = "\n\n".join(all_texts)
+    knowledge_base.store.put(company_id, source_name, df, ensure_string(text, for_db=True), is_file=is_file)
     
-    print(f"知識ベース更新完了: {len(knowledge_base.data) if knowledge_base.data is not None else 0} 行のデータ")
+    stats = knowledge_base.store.stats()
+    print(
+        f"知識ベース更新完了: {knowledge_base.row_count} 行のデータ "
+        f"(メモリ {stats['memory_mb']}MB / {stats['memory_limit_mb']}MB, 退避 {stats['spilled']}件)"
+    )
 
 # アクティブなリソースのみを取得する関数
 def get_active_resources(company_id=None):
@@ -155,8 +159,9 @@ def get_knowledge_base_info():
         "total_sources": len(knowledge_base.sources),
         "active_sources": len(active_sources),
         "sources": sources_info,
-        "data_size": len(knowledge_base.data) if knowledge_base.data is not None else 0,
-        "columns": knowledge_base.columns if knowledge_base.data is not None else []
+        "data_size": knowledge_base.row_count,
+        "columns": knowledge_base.columns,
+        "storage": knowledge_base.store.stats()
     }
 
 def _update_knowledge_base_from_list(data_list, text, is_file=True, source_name=None, company_id=None):
@@ -175,6 +180,7 @@ def _update_knowledge_base_from_list(data_list, text, is_file=True, source_name=
                         item[key] = ensure_string(value)
             
             # DataFrameに変換
+            import pandas as pd
             df = pd.DataFrame(data_list)
             
             # 従来の関数を呼び出し
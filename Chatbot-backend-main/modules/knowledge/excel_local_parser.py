@@ -0,0 +1,386 @@
+"""
+Excelのローカル解析（openpyxl の読み取り専用モード）
+Google Drive へのアップロード・Google Sheets への変換を行わずに、Sheets API（FORMATTED_VALUE）と
+同じ形の「行ごとの表示文字列のリスト」を作成します。レコード・セクションの作成は
+ExcelSheetsProcessor._build_sheet_records を共用するため、出力の形は Sheets API 経由と同じです
+
+- 行は1行ずつ読み込み、シートごとの上限行数に達したら以降は読み込まない（大きなブックでもメモリは一定）
+- マージセルはシートXMLの <mergeCell> を先に走査して取得し、読み込みながら左上の値で埋める
+- 表示形式（number_format）から Sheets の表示文字列に近い形へ整形（日付・桁区切り・小数点・%）
+"""
+
+import re
+import io
+import zipfile
+import posixpath
+import logging
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+# Sheets API 経由で取得していた範囲（A:ZZ）と同じ列数
+MAX_COLUMNS = 702
+
+# 読み取り専用モードで解析できる拡張子（.xls は openpyxl で読めないため Sheets API を使用）
+LOCAL_EXTENSIONS = ('xlsx', 'xlsm', 'xltx', 'xltm')
+
+_NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+_MERGE_CELL_PATTERN = re.compile(rb'<(?:\w+:)?mergeCell\b[^>]*?\bref="([A-Za-z]+)(\d+)(?::([A-Za-z]+)(\d+))?"')
+_CHUNK_SIZE = 1024 * 1024
+
+
+def is_local_parsable(filename: str) -> bool:
+    """ローカル解析の対象かどうか（拡張子で判定）"""
+    if not filename:
+        return False
+    return filename.lower().rsplit('.', 1)[-1] in LOCAL_EXTENSIONS
+
+
+# ---- マージセル ----
+
+def _column_index(letters: bytes) -> int:
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + (char - 64)
+    return index
+
+
+def _sheet_paths(archive: zipfile.ZipFile) -> Dict[str, str]:
+    """シート名 -> ブック内のシートXMLのパス"""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.iter(f'{{{_NS_PKG_REL}}}Relationship')}
+
+    paths = {}
+    for sheet in workbook.iter(f'{{{_NS_MAIN}}}sheet'):
+        target = targets.get(sheet.get(f'{{{_NS_REL}}}id'))
+        if not target:
+            continue
+        # Target は xl/ からの相対パス、または / から始まる絶対パス
+        path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        paths[sheet.get('name')] = path
+    return paths
+
+
+def _scan_merges(source) -> List[Dict[str, int]]:
+    """シートXMLから <mergeCell ref="A1:B2"> を抽出（XMLとして解析せず、チャンク単位で検索）"""
+    merges = []
+    tail = b''
+    while True:
+        chunk = source.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer = tail + chunk
+        last_end = 0
+        for match in _MERGE_CELL_PATTERN.finditer(buffer):
+            start_col, start_row, end_col, end_row = match.groups()
+            merges.append({
+                'startRowIndex': int(start_row) - 1,
+                'endRowIndex': int(end_row or start_row),
+                'startColumnIndex': _column_index(start_col) - 1,
+                'endColumnIndex': min(_column_index(end_col or start_col), MAX_COLUMNS),
+            })
+            last_end = match.end()
+        # チャンクの境界をまたぐタグのために末尾を次回に持ち越す
+        tail = buffer[max(last_end, len(buffer) - 256):]
+    return [merge for merge in merges if merge['startColumnIndex'] < MAX_COLUMNS]
+
+
+def read_merged_ranges(contents: bytes) -> Dict[str, List[Dict[str, int]]]:
+    """
+    シート名 -> マージ範囲のリスト（Sheets API の GridRange と同じ 0始まり・終端を含まない形式）
+    読み取り専用モードの openpyxl はマージ情報を返さないため、シートXMLを直接走査します
+    """
+    merged_ranges = {}
+    with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+        for sheet_name, path in _sheet_paths(archive).items():
+            try:
+                with archive.open(path) as source:
+                    merges = _scan_merges(source)
+            except KeyError:
+                continue
+            if merges:
+                merged_ranges[sheet_name] = merges
+    return merged_ranges
+
+
+def expand_merged_rows(rows: Iterable[List[str]], merges: List[Dict[str, int]]) -> Iterator[List[str]]:
+    """
+    行を読み込みながらマージ範囲を左上の値で埋める
+    （ExcelSheetsProcessor._expand_merged_cells と同じ結果を、シート全体を保持せずに作成）
+    """
+    pending: Dict[int, List[Dict[str, int]]] = {}
+    for merge in merges:
+        pending.setdefault(merge['startRowIndex'], []).append(merge)
+    active = []  # (終了行, 開始列, 終了列, 値)
+
+    def fill(row_index: int, row: List[str]) -> List[str]:
+        nonlocal active
+        for merge in pending.pop(row_index, ()):
+            start_col = merge['startColumnIndex']
+            value = row[start_col] if start_col < len(row) else ''
+            active.append((merge['endRowIndex'], start_col, merge['endColumnIndex'], value))
+        if not active:
+            return row
+        for end_row, start_col, end_col, value in active:
+            if len(row) < end_col:
+                row.extend([''] * (end_col - len(row)))
+            row[start_col:end_col] = [value] * (end_col - start_col)
+        active = [item for item in active if item[0] > row_index + 1]
+        return row
+
+    row_index = -1
+    for row_index, row in enumerate(rows):
+        yield fill(row_index, row)
+
+    # データ行より下まで続くマージ範囲
+    while active or pending:
+        row_index += 1
+        if not active and min(pending) > row_index:
+            # 左上が空のマージ範囲しか残っていない（埋める値がない）
+            break
+        yield fill(row_index, [])
+
+
+def collect_sheet_values(rows: Iterable[List[str]], max_rows: int) -> List[List[str]]:
+    """
+    Sheets API の values と同じ形にそろえる（末尾の空セル・末尾の空行を除く）
+    max_rows 行に達したら以降は読み込まない
+    """
+    values: List[List[str]] = []
+    empty_rows = 0
+    for row in rows:
+        while row and not row[-1]:
+            row.pop()
+        if not row:
+            # 後ろにデータ行がある場合だけ空行として残す
+            empty_rows += 1
+            continue
+        while empty_rows and len(values) < max_rows:
+            values.append([])
+            empty_rows -= 1
+        if len(values) >= max_rows:
+            break
+        values.append(row)
+        if len(values) >= max_rows:
+            break
+    return values
+
+
+# ---- 表示形式 ----
+
+# ロケール依存の組み込み形式は日本語環境の表示にそろえる（14: 短い日付、22: 日付と時刻）
+_LOCALE_DATE_FORMATS = {
+    'mm-dd-yy': 'yyyy/m/d',
+    'm/d/yy h:mm': 'yyyy/m/d h:mm',
+}
+
+_MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+                'August', 'September', 'October', 'November', 'December']
+_WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+_WEEKDAY_NAMES_JA = ['月', '火', '水', '木', '金', '土', '日']
+
+_DATE_TOKEN_PATTERN = re.compile(
+    r'"[^"]*"|\\.|\[[^\]]*\]|[_*].|yyyy|yy|m{1,5}|d{1,4}|a{3,4}|h{1,2}|s{1,2}(?:\.0+)?|am/pm|a/p|.',
+    re.IGNORECASE
+)
+
+
+def _first_section(number_format: str) -> str:
+    """「正;負;ゼロ;文字列」のうち最初の形式"""
+    return re.split(r';(?=(?:[^"]*"[^"]*")*[^"]*$)', number_format, maxsplit=1)[0]
+
+
+def _tokenize_date_format(number_format: str) -> List[str]:
+    return _DATE_TOKEN_PATTERN.findall(_first_section(number_format))
+
+
+def format_datetime(value, number_format: str) -> str:
+    """日付・時刻を表示形式に沿って文字列にする"""
+    if isinstance(value, timedelta):
+        total_seconds = int(value.total_seconds())
+        hours, remainder = divmod(total_seconds, 3600)
+        return f"{hours}:{remainder // 60:02d}:{remainder % 60:02d}"
+
+    number_format = _LOCALE_DATE_FORMATS.get(number_format, number_format)
+    if not number_format or number_format == 'General' or number_format == '@':
+        if isinstance(value, datetime) and (value.hour or value.minute or value.second):
+            number_format = 'yyyy/m/d h:mm:ss'
+        elif isinstance(value, dt_time):
+            number_format = 'h:mm:ss'
+        else:
+            number_format = 'yyyy/m/d'
+
+    if isinstance(value, dt_time):
+        value = datetime.combine(date(1899, 12, 30), value)
+    elif not isinstance(value, datetime):
+        value = datetime.combine(value, dt_time())
+
+    tokens = _tokenize_date_format(number_format)
+    lowered = [token.lower() for token in tokens]
+    twelve_hour = any(token in ('am/pm', 'a/p') for token in lowered)
+
+    parts = []
+    previous = None
+    for index, token in enumerate(tokens):
+        lower = lowered[index]
+        if token.startswith('"'):
+            parts.append(token[1:-1])
+        elif token.startswith('\\'):
+            parts.append(token[1:])
+        elif token.startswith('[') or token[0] in '_*':
+            continue
+        elif lower == 'yyyy':
+            parts.append(f"{value.year:04d}")
+        elif lower == 'yy':
+            parts.append(f"{value.year % 100:02d}")
+        elif lower.startswith('m'):
+            following = next((t for t in lowered[index + 1:] if t[0] in 'ydhs'), None)
+            if len(lower) <= 2 and (previous in ('h', 'hh') or (following or '').startswith('s')):
+                parts.append(f"{value.minute:02d}" if lower == 'mm' else str(value.minute))
+            elif lower == 'm':
+                parts.append(str(value.month))
+            elif lower == 'mm':
+                parts.append(f"{value.month:02d}")
+            elif lower == 'mmm':
+                parts.append(_MONTH_NAMES[value.month - 1][:3])
+            elif lower == 'mmmmm':
+                parts.append(_MONTH_NAMES[value.month - 1][0])
+            else:
+                parts.append(_MONTH_NAMES[value.month - 1])
+        elif lower.startswith('d'):
+            if lower == 'd':
+                parts.append(str(value.day))
+            elif lower == 'dd':
+                parts.append(f"{value.day:02d}")
+            elif lower == 'ddd':
+                parts.append(_WEEKDAY_NAMES[value.weekday()][:3])
+            else:
+                parts.append(_WEEKDAY_NAMES[value.weekday()])
+        elif lower in ('aaa', 'aaaa'):
+            name = _WEEKDAY_NAMES_JA[value.weekday()]
+            parts.append(name if lower == 'aaa' else f"{name}曜日")
+        elif lower.startswith('h'):
+            hour = (value.hour % 12 or 12) if twelve_hour else value.hour
+            parts.append(f"{hour:02d}" if lower == 'hh' else str(hour))
+        elif lower.startswith('s'):
+            seconds = f"{value.second:02d}" if lower.startswith('ss') else str(value.second)
+            if '.' in lower:
+                digits = len(lower.split('.', 1)[1])
+                seconds += '.' + f"{value.microsecond:06d}"[:digits]
+            parts.append(seconds)
+        elif lower == 'am/pm':
+            parts.append('AM' if value.hour < 12 else 'PM')
+        elif lower == 'a/p':
+            parts.append('A' if value.hour < 12 else 'P')
+        else:
+            parts.append(token)
+            continue
+        if token[0] not in '"\\':
+            previous = lower
+    return ''.join(parts)
+
+
+def _format_general_number(value) -> str:
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return format(value, '.15g')
+    return str(value)
+
+
+def _format_literal(text: str) -> str:
+    """数値の前後の文字列部分（引用符・エスケープ・[$¥-411] などを表示文字に変換）"""
+    result = []
+    for token in re.findall(r'"[^"]*"|\\.|\[[^\]]*\]|[_*].|.', text):
+        if token.startswith('"'):
+            result.append(token[1:-1])
+        elif token.startswith('\\'):
+            result.append(token[1:])
+        elif token.startswith('[$'):
+            result.append(token[2:-1].split('-', 1)[0])
+        elif token.startswith('[') or token[0] in '_*':
+            continue
+        else:
+            result.append(token)
+    return ''.join(result)
+
+
+def format_number(value, number_format: str) -> str:
+    """数値を表示形式（桁区切り・小数点以下の桁数・%・通貨記号）に沿って文字列にする"""
+    if not number_format or number_format in ('General', '@'):
+        return _format_general_number(value)
+
+    sections = re.split(r';(?=(?:[^"]*"[^"]*")*[^"]*$)', number_format)
+    section = sections[0]
+    negative = value < 0
+    if negative and len(sections) > 1 and sections[1]:
+        # 負の数の形式（括弧・記号は形式側に含まれる）
+        section = sections[1]
+        value = -value
+        negative = False
+
+    # 引用符・角括弧の外にある数値部分（0 # ? , .）の範囲
+    unquoted = re.sub(r'"[^"]*"|\\.|\[[^\]]*\]|[_*].', lambda m: '\0' * len(m.group()), section)
+    match = re.search(r'[0#?][0#?,]*(?:\.[0#?]*)?|\.[0#?]+', unquoted)
+    if not match or re.search(r'[eE][+-]', unquoted):
+        return _format_general_number(value)
+
+    numeric = match.group()
+    prefix = _format_literal(section[:match.start()])
+    suffix = _format_literal(section[match.end():])
+    percent = '%' in unquoted
+    if percent:
+        value = value * 100
+
+    integer_part, _, decimal_part = numeric.partition('.')
+    min_decimals = decimal_part.count('0')
+    max_decimals = len(decimal_part)
+    thousands = ',' in integer_part.rstrip(',')
+
+    text = format(abs(value), f"{',' if thousands else ''}.{max_decimals}f")
+    if max_decimals > min_decimals:
+        # # の桁は末尾の0を表示しない
+        whole, _, fraction = text.partition('.')
+        fraction = fraction.rstrip('0').ljust(min_decimals, '0')
+        text = f"{whole}.{fraction}" if fraction else whole
+    if not integer_part.count('0') and text.startswith('0.'):
+        text = text[1:]
+    if negative and text.strip('0.,'):
+        text = '-' + text
+    return f"{prefix}{text}{suffix}"
+
+
+def format_cell_value(cell) -> str:
+    """セルの値を Sheets API（FORMATTED_VALUE）の表示文字列に近い形にする"""
+    value = cell.value
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (datetime, date, dt_time, timedelta)):
+        return format_datetime(value, cell.number_format)
+    if isinstance(value, (int, float)):
+        return format_number(value, cell.number_format)
+    return str(value)
+
+
+def iter_sheet_rows(worksheet) -> Iterator[List[str]]:
+    """読み取り専用ワークシートの行を1行ずつ表示文字列のリストにする（列の位置は保持）"""
+    # 作成したアプリによってはシートの範囲情報（dimension）が正しくないため、実際のセルから読む
+    worksheet.reset_dimensions()
+    for row in worksheet.iter_rows(min_row=1, min_col=1):
+        yield [format_cell_value(cell) for cell in row[:MAX_COLUMNS]]
+
+
+def read_sheet_values(worksheet, merges: Optional[List[Dict[str, int]]], max_rows: int) -> List[List[str]]:
+    """ワークシートを Sheets API の values と同じ形で読み込む（マージセル展開済み、最大 max_rows 行）"""
+    rows = iter_sheet_rows(worksheet)
+    if merges:
+        rows = expand_merged_rows(rows, merges)
+    return collect_sheet_values(rows, max_rows)
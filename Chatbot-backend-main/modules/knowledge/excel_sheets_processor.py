@@ -1,6 +1,10 @@
 """
 Excel処理モジュール（Google Sheets API使用）
 ExcelファイルをGoogle Drive APIでCSVに変換し、Google Sheets APIで綺麗な形で抽出してSupabaseに保存
+
+- EXCEL_PARSER=local（デフォルト）: .xlsx はGoogle Driveを使わずローカルで解析（excel_local_parser）
+  失敗した場合・.xls の場合は Google Sheets API で処理
+- EXCEL_PARSER=sheets: 常に Google Sheets API で処理
 """
 import os
 import io
@@ -12,10 +16,13 @@ import aiohttp
 import aiofiles
 from ..database import ensure_string
 from .unnamed_column_handler import UnnamedColumnHandler
+from .excel_local_parser import is_local_parsable, read_merged_ranges, read_sheet_values
 
 # ロガーの設定
 logger = logging.getLogger(__name__)
 
+EXCEL_PARSER = os.getenv("EXCEL_PARSER", "local").lower()
+
 # Google APIs
 try:
     from google.oauth2.credentials import Credentials
@@ -34,6 +41,13 @@ except ImportError:
 class ExcelSheetsProcessor:
     """Excel処理クラス（Google Sheets API使用）"""
     
+    # シートごとに処理するデータ行数の上限
+    MAX_SHEET_ROWS = 5000
+    # シート処理全体の時間制限（秒）
+    SHEET_TIME_LIMIT = 240
+    # ローカル解析（EXCEL_PARSER=local）で作成したレコードの source
+    LOCAL_SOURCE_LABEL = 'Excel (ローカル解析)'
+    
     def __init__(self):
         self.drive_service = None
         self.sheets_service = None
@@ -295,7 +309,7 @@ class ExcelSheetsProcessor:
                     
                     # 処理時間チェック
                     elapsed_time = time.time() - start_time
-                    if elapsed_time > 240:  # 4分制限
+                    if elapsed_time > self.SHEET_TIME_LIMIT:  # 4分制限
                         logger.warning(f"シート処理時間制限に達しました ({elapsed_time:.1f}秒) - 残りのシートをスキップ")
                         break
                     
@@ -322,105 +336,10 @@ class ExcelSheetsProcessor:
                         
                         logger.info(f"シート '{sheet_title}' データ取得完了: {len(values)} 行")
                         
-                        # ヘッダー行とデータ行を分離
-                        headers = values[0] if values else []
-                        data_rows = values[1:] if len(values) > 1 else []
-                        
-                        # 大きなシートの場合は行数制限
-                        max_rows = 5000  # 最大5000行
-                        if len(data_rows) > max_rows:
-                            logger.warning(f"シート '{sheet_title}' の行数が多すぎます ({len(data_rows)} 行) - 最初の{max_rows}行のみ処理")
-                            data_rows = data_rows[:max_rows]
-                    
-                        # 生のデータをDataFrameに変換してUnnamedカラム修正を適用
-                        if headers and data_rows:
-                            try:
-                                # DataFrameを作成
-                                import pandas as pd
-                                df_data = []
-                                for row in data_rows:
-                                    # 行の長さをヘッダーに合わせる
-                                    extended_row = row + [''] * (len(headers) - len(row))
-                                    df_data.append(extended_row[:len(headers)])
-                                
-                                df = pd.DataFrame(df_data, columns=headers)
-                                
-                                # Unnamedカラム修正を適用
-                                handler = UnnamedColumnHandler()
-                                df, modifications = handler.fix_dataframe(df, f"{filename}_{sheet_title}")
-                                
-                                if modifications:
-                                    logger.info(f"シート '{sheet_title}' のUnnamedカラム修正: {', '.join(modifications)}")
-                                
-                                # 修正されたヘッダーとデータ行を更新
-                                headers = df.columns.tolist()
-                                data_rows = df.values.tolist()
-                                
-                            except Exception as fix_error:
-                                logger.warning(f"シート '{sheet_title}' のUnnamedカラム修正エラー: {str(fix_error)}")
-                                # エラーの場合は元のデータを使用
-                        
-                        # セクション情報を作成
-                        section_name = f"シート: {sheet_title}"
-                        section_content = f"行数: {len(data_rows)}, 列数: {len(headers)}\n"
-                        
-                        if headers:
-                            section_content += f"列名: {', '.join(headers)}\n"
-                        
-                        # サンプルデータを追加
-                        if data_rows:
-                            sample_rows = data_rows[:3]  # 最初の3行をサンプルとして
-                            section_content += "サンプルデータ:\n"
-                            for i, row in enumerate(sample_rows):
-                                row_data = []
-                                for j, header in enumerate(headers):
-                                    if j < len(row) and row[j]:
-                                        row_data.append(f"{header}: {row[j]}")
-                                if row_data:
-                                    section_content += f"  行{i+1}: {' | '.join(row_data)}\n"
-                        
+                        sheet_records, section_name, section_content = self._build_sheet_records(values, sheet_title, filename)
                         sections[section_name] = section_content
                         extracted_text += f"=== {section_name} ===\n{section_content}\n\n"
-                        
-                        # 各データ行を処理
-                        for row_index, row in enumerate(data_rows):
-                            if not any(cell for cell in row if cell):  # 空行をスキップ
-                                continue
-                            
-                            # 行データを辞書形式で作成
-                            row_dict = {}
-                            content_parts = []
-                            
-                            for col_index, header in enumerate(headers):
-                                cell_value = row[col_index] if col_index < len(row) else ""
-                                
-                                if cell_value:
-                                    header_str = ensure_string(header) if header else f"列{col_index+1}"
-                                    cell_str = ensure_string(cell_value)
-                                    row_dict[header_str] = cell_str
-                                    content_parts.append(f"{header_str}: {cell_str}")
-                            
-                            if content_parts:
-                                # データベース保存用の構造を作成
-                                data_record = {
-                                    'section': ensure_string(section_name),
-                                    'content': ' | '.join(content_parts),
-                                    'source': 'Excel (Google Sheets)',
-                                    'file': ensure_string(filename),
-                                    'url': None,
-                                    'metadata': {
-                                        'sheet_name': ensure_string(sheet_title),
-                                        'row_index': row_index + 1,
-                                        'columns': list(row_dict.keys()),
-                                        'date_types': self._detect_date_types(headers, data_rows)
-                                    }
-                                }
-                                
-                                # 元の列データも保持
-                                for key, value in row_dict.items():
-                                    data_record[f"column_{key}"] = value
-                                
-                                all_data.append(data_record)
+                        all_data.extend(sheet_records)
                     
                     except Exception as sheet_error:
                         logger.error(f"シート '{sheet_title}' の処理エラー: {str(sheet_error)}")
@@ -437,6 +356,224 @@ class ExcelSheetsProcessor:
             logger.error(f"Google Sheetsデータ抽出エラー: {str(e)}")
             raise
     
+    def extract_data_locally(self, contents: bytes, filename: str) -> Tuple[List[Dict], Dict[str, str], str]:
+        """
+        Google Drive・Sheets APIを使わずにExcelファイル（.xlsx）からデータを抽出（同期処理、スレッドで実行）
+        openpyxl の読み取り専用モードで1行ずつ読み込み、extract_data_from_sheets と同じ形で返します
+        """
+        import time
+        from openpyxl import load_workbook
+        
+        start_time = time.time()
+        merged_ranges = read_merged_ranges(contents)
+        workbook = load_workbook(io.BytesIO(contents), read_only=True, data_only=True)
+        
+        try:
+            worksheets = workbook.worksheets
+            logger.info(f"検出されたシート数: {len(worksheets)}（ローカル解析）")
+            
+            all_data = []
+            sections = {}
+            extracted_text = f"=== ファイル: {filename} ===\n\n"
+            
+            for sheet_index, worksheet in enumerate(worksheets):
+                sheet_title = worksheet.title
+                logger.info(f"シート処理開始 ({sheet_index + 1}/{len(worksheets)}): {sheet_title}")
+                
+                elapsed_time = time.time() - start_time
+                if elapsed_time > self.SHEET_TIME_LIMIT:
+                    logger.warning(f"シート処理時間制限に達しました ({elapsed_time:.1f}秒) - 残りのシートをスキップ")
+                    break
+                
+                try:
+                    # ヘッダー行 + 上限行数まで読み込み、それ以降の行は読まない
+                    merges = merged_ranges.get(sheet_title)
+                    values = read_sheet_values(worksheet, merges, self.MAX_SHEET_ROWS + 1)
+                    
+                    if not values:
+                        logger.warning(f"シート '{sheet_title}' にデータがありません")
+                        continue
+                    
+                    if merges:
+                        logger.info(f"シート '{sheet_title}' の {len(merges)} 個のマージセルを展開しました")
+                    if len(values) > self.MAX_SHEET_ROWS:
+                        logger.warning(f"シート '{sheet_title}' は最初の{self.MAX_SHEET_ROWS}行のみ処理します")
+                    
+                    logger.info(f"シート '{sheet_title}' データ取得完了: {len(values)} 行")
+                    
+                    sheet_records, section_name, section_content = self._build_sheet_records(
+                        values, sheet_title, filename, self.LOCAL_SOURCE_LABEL
+                    )
+                    sections[section_name] = section_content
+                    extracted_text += f"=== {section_name} ===\n{section_content}\n\n"
+                    all_data.extend(sheet_records)
+                
+                except Exception as sheet_error:
+                    logger.error(f"シート '{sheet_title}' の処理エラー: {str(sheet_error)}")
+                    continue
+            
+            logger.info(f"データ抽出完了: {len(all_data)} レコード（ローカル解析）")
+            return all_data, sections, extracted_text
+        
+        finally:
+            workbook.close()
+    
+    def _expand_merged_cells(self, values: List[List[str]], merges: List[Dict]) -> List[List[str]]:
+        """マージセルを展開して値を埋める（merges は Sheets API の GridRange 形式）"""
+        if not values or not merges:
+            return values
+        
+        # 最大行と列を計算
+        max_row = max(len(values), max(m['endRowIndex'] for m in merges))
+        max_col = max(max(len(row) for row in values), max(m['endColumnIndex'] for m in merges))
+        
+        # 値を埋めた新しいグリッドを作成
+        grid = [['' for _ in range(max_col)] for _ in range(max_row)]
+        
+        # 元の値をコピー
+        for r, row in enumerate(values):
+            for c, val in enumerate(row):
+                grid[r][c] = val
+        
+        # 各マージ範囲を処理
+        for merge in merges:
+            start_row = merge['startRowIndex']
+            end_row = merge['endRowIndex']
+            start_col = merge['startColumnIndex']
+            end_col = merge['endColumnIndex']
+            
+            # トップ左の値を範囲全体に設定
+            value = grid[start_row][start_col]
+            for r in range(start_row, end_row):
+                for c in range(start_col, end_col):
+                    grid[r][c] = value
+        
+        # 列の位置を保ったまま、Sheets API と同じく末尾の空セル・空行だけを除く
+        expanded_values = []
+        for row in grid:
+            while row and not row[-1]:
+                row.pop()
+            expanded_values.append(row)
+        while expanded_values and not expanded_values[-1]:
+            expanded_values.pop()
+        
+        return expanded_values
+    
+    def _build_sheet_records(self, values: List[List[str]], sheet_title: str, filename: str,
+                             source_label: str = 'Excel (Google Sheets)') -> Tuple[List[Dict], str, str]:
+        """
+        シートの値（マージセル展開済みの行のリスト）からレコード・セクション内容を作成
+        Google Sheets API・ローカル解析（excel_local_parser）の両方で使用
+        source_label はレコードの source（どちらの経路で解析したか）
+        
+        Returns:
+            (レコードリスト, セクション名, セクション内容)
+        """
+        # ヘッダー行とデータ行を分離
+        headers = values[0] if values else []
+        data_rows = values[1:] if len(values) > 1 else []
+        
+        # 大きなシートの場合は行数制限
+        max_rows = self.MAX_SHEET_ROWS
+        if len(data_rows) > max_rows:
+            logger.warning(f"シート '{sheet_title}' の行数が多すぎます ({len(data_rows)} 行) - 最初の{max_rows}行のみ処理")
+            data_rows = data_rows[:max_rows]
+        
+        # 生のデータをDataFrameに変換してUnnamedカラム修正を適用
+        if headers and data_rows:
+            try:
+                # DataFrameを作成
+                import pandas as pd
+                df_data = []
+                for row in data_rows:
+                    # 行の長さをヘッダーに合わせる
+                    extended_row = row + [''] * (len(headers) - len(row))
+                    df_data.append(extended_row[:len(headers)])
+                
+                df = pd.DataFrame(df_data, columns=headers)
+                
+                # Unnamedカラム修正を適用
+                handler = UnnamedColumnHandler()
+                df, modifications = handler.fix_dataframe(df, f"{filename}_{sheet_title}")
+                
+                if modifications:
+                    logger.info(f"シート '{sheet_title}' のUnnamedカラム修正: {', '.join(modifications)}")
+                
+                # 修正されたヘッダーとデータ行を更新
+                headers = df.columns.tolist()
+                data_rows = df.values.tolist()
+                
+            except Exception as fix_error:
+                logger.warning(f"シート '{sheet_title}' のUnnamedカラム修正エラー: {str(fix_error)}")
+                # エラーの場合は元のデータを使用
+        
+        # セクション情報を作成
+        section_name = f"シート: {sheet_title}"
+        section_content = f"行数: {len(data_rows)}, 列数: {len(headers)}\n"
+        
+        if headers:
+            section_content += f"列名: {', '.join(headers)}\n"
+        
+        # サンプルデータを追加
+        if data_rows:
+            sample_rows = data_rows[:3]  # 最初の3行をサンプルとして
+            section_content += "サンプルデータ:\n"
+            for i, row in enumerate(sample_rows):
+                row_data = []
+                for j, header in enumerate(headers):
+                    if j < len(row) and row[j]:
+                        row_data.append(f"{header}: {row[j]}")
+                if row_data:
+                    section_content += f"  行{i+1}: {' | '.join(row_data)}\n"
+        
+        # 日付列の判定はシート単位（行ごとに同じ結果になるため一度だけ計算）
+        date_types = self._detect_date_types(headers, data_rows)
+        
+        # 各データ行を処理
+        records = []
+        for row_index, row in enumerate(data_rows):
+            if not any(cell for cell in row if cell):  # 空行をスキップ
+                continue
+            
+            # 行データを辞書形式で作成
+            row_dict = {}
+            content_parts = []
+            
+            for col_index, header in enumerate(headers):
+                cell_value = row[col_index] if col_index < len(row) else ""
+                
+                if cell_value:
+                    header_str = ensure_string(header) if header else f"列{col_index+1}"
+                    cell_str = ensure_string(cell_value)
+                    row_dict[header_str] = cell_str
+                    content_parts.append(f"{header_str}: {cell_str}")
+            
+            if content_parts:
+                # データベース保存用の構造を作成
+                data_record = {
+                    'section': ensure_string(section_name),
+                    'content': ' | '.join(content_parts),
+                    'source': source_label,
+                    'file': ensure_string(filename),
+                    'url': None,
+                    'metadata': {
+                        'sheet_name': ensure_string(sheet_title),
+                        'row_index': row_index + 1,
+                        'columns': list(row_dict.keys()),
+                        'date_types': dict(date_types)
+                    }
+                }
+                
+                # 元の列データも保持
+                for key, value in row_dict.items():
+                    data_record[f"column_{key}"] = value
+                
+                records.append(data_record)
+        
+        return records, section_name, section_content
+
+    
+    
     async def cleanup_drive_file(self, file_id: str):
         """Google Driveファイルを削除"""
         try:
@@ -449,48 +586,6 @@ class ExcelSheetsProcessor:
         except Exception as e:
             logger.warning(f"Google Driveファイル削除エラー: {file_id} - {str(e)}")
 
-def _expand_merged_cells(self, values: List[List[str]], merges: List[Dict]) -> List[List[str]]:
-    """マージセルを展開して値を埋める"""
-    if not values or not merges:
-        return values
-    
-    # 最大行と列を計算
-    max_row = max(len(values), max(m['endRowIndex'] for m in merges))
-    max_col = max(max(len(row) for row in values), max(m['endColumnIndex'] for m in merges))
-    
-    # 値を埋めた新しいグリッドを作成
-    grid = [['' for _ in range(max_col)] for _ in range(max_row)]
-    
-    # 元の値をコピー
-    for r, row in enumerate(values):
-        for c, val in enumerate(row):
-            grid[r][c] = val
-    
-    # 各マージ範囲を処理
-    for merge in merges:
-        start_row = merge['startRowIndex']
-        end_row = merge['endRowIndex']
-        start_col = merge['startColumnIndex']
-        end_col = merge['endColumnIndex']
-        
-        # トップ左の値を取得
-        if start_row < len(grid) and start_col < len(grid[start_row]):
-            value = grid[start_row][start_col]
-            
-            # 範囲全体に値を設定
-            for r in range(start_row, end_row):
-                for c in range(start_col, end_col):
-                    if r < len(grid) and c < len(grid[r]):
-                        grid[r][c] = value
-    
-    # リストに戻す（空の行や列を保持）
-    expanded_values = []
-    for row in grid:
-        expanded_row = [cell for cell in row if cell]  # 末尾の空セルをトリムしない
-        expanded_values.append(expanded_row)
-    
-    return expanded_values
-
 async def process_excel_file_with_sheets_api(
     contents: bytes, 
     filename: str, 
@@ -513,6 +608,18 @@ async def process_excel_file_with_sheets_api(
     spreadsheet_id = None
     
     try:
+        # .xlsx はローカルで解析（Google Driveへのアップロード・変換を行わない）
+        if EXCEL_PARSER == "local" and is_local_parsable(filename):
+            try:
+                logger.info(f"Excel処理開始（ローカル解析）: {filename}")
+                data_list, sections, extracted_text = await asyncio.to_thread(
+                    processor.extract_data_locally, contents, filename
+                )
+                logger.info(f"Excel処理完了: {len(data_list)} レコード抽出")
+                return data_list, sections, extracted_text
+            except Exception as local_error:
+                logger.warning(f"ローカル解析に失敗したため Google Sheets API で処理します: {str(local_error)}")
+        
         logger.info(f"Excel処理開始（Google Sheets API使用）: {filename}")
         
         # Google APIサービスを取得
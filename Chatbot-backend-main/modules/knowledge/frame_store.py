@@ -0,0 +1,281 @@
+"""
+知識ベースのデータ保存領域（メモリ上限付き）
+ソース（会社ID・ソース名）ごとに DataFrame とテキストを保持し、メモリ使用量が上限を超えたら
+最近使われていないものからローカルディスク（Parquet、pyarrow がなければ pickle）に退避します
+
+- ソースごとに別々に保持するため、追加時に全データを結合（コピー）しない
+- KNOWLEDGE_BASE_MEMORY_MB: メモリ上に保持する上限（MB）
+- KNOWLEDGE_BASE_SPILL_DIR: 退避先ディレクトリ（プロセスごとのサブディレクトリを使用。
+  停止済みプロセスのサブディレクトリは起動時に削除）
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import pyarrow  # noqa: F401 (to_parquet のエンジン)
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_BASE_MEMORY_MB = float(os.getenv("KNOWLEDGE_BASE_MEMORY_MB", "256"))
+KNOWLEDGE_BASE_SPILL_DIR = os.getenv(
+    "KNOWLEDGE_BASE_SPILL_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "knowledge_spill")
+)
+
+StoreKey = Tuple[str, str]
+
+
+def _pid_alive(pid: int) -> bool:
+    """指定PIDのプロセスが生存しているか"""
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _sweep_stale_spill_dirs(spill_root: str):
+    """強制終了などで atexit が動かず残った、停止済みプロセスの退避ディレクトリを削除"""
+    try:
+        names = os.listdir(spill_root)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.isdigit() or int(name) == os.getpid() or _pid_alive(int(name)):
+            continue
+        shutil.rmtree(os.path.join(spill_root, name), ignore_errors=True)
+        logger.info(f"🧹 停止済みプロセスの知識ベース退避ディレクトリを削除: {name}")
+
+
+def _estimate_size(df, text: str) -> int:
+    size = sys.getsizeof(text) if text else 0
+    if df is not None:
+        try:
+            size += int(df.memory_usage(deep=True).sum())
+        except Exception:
+            size += sys.getsizeof(df)
+    return size
+
+
+class KnowledgeFrameStore:
+    """(会社ID, ソース名) ごとの DataFrame・テキストを LRU でメモリに保持し、溢れた分をディスクに退避"""
+
+    def __init__(self, memory_limit_mb: float = KNOWLEDGE_BASE_MEMORY_MB, spill_dir: str = KNOWLEDGE_BASE_SPILL_DIR):
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+        # 追加順のメタデータ（行数・列・種別・退避先）
+        self._entries: Dict[StoreKey, Dict[str, Any]] = {}
+        # メモリ上のデータ（LRU順）: key -> (df, text)
+        self._memory: "OrderedDict[StoreKey, Tuple[Any, str]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "spills": 0, "loads": 0}
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+        _sweep_stale_spill_dirs(spill_dir)
+        atexit.register(shutil.rmtree, self.spill_dir, True)
+
+    # ---- 追加・取得 ----
+
+    def put(self, company_id: Optional[str], source_name: str, df, text: str, is_file: bool = True):
+        """ソースのデータを保存（同じソースは置き換え）"""
+        key = (company_id or "", source_name)
+        size = _estimate_size(df, text)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = {
+                "rows": len(df) if df is not None else 0,
+                "columns": [str(column) for column in df.columns] if df is not None else [],
+                "is_file": is_file,
+                "size": size,
+                "path": None,
+            }
+            self._memory[key] = (df, text)
+            self._memory_bytes += size
+            self._evict()
+
+    def get(self, company_id: Optional[str], source_name: str) -> Optional[Tuple[Any, str]]:
+        """ソースの (DataFrame, テキスト) を取得（退避済みならディスクから読み込む）"""
+        key = (company_id or "", source_name)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._memory[key]
+            entry = self._entries.get(key)
+            if entry is None or entry["path"] is None:
+                return None
+            self._stats["misses"] += 1
+            value = self._load(entry["path"])
+            self._stats["loads"] += 1
+            # 上限に収まる大きさなら再びメモリに載せる
+            if entry["size"] <= self.memory_limit:
+                self._remove_spill(entry)
+                self._memory[key] = value
+                self._memory_bytes += entry["size"]
+                self._evict(keep=key)
+            return value
+
+    def _keys(self, is_file: Optional[bool]) -> List[StoreKey]:
+        with self._lock:
+            return [key for key, entry in self._entries.items() if is_file is None or entry["is_file"] == is_file]
+
+    def items(self, is_file: Optional[bool] = None) -> Iterator[Tuple[StoreKey, Tuple[Any, str]]]:
+        """追加順にすべてのソースを1件ずつ返す（is_file でファイル/URLを絞り込み）
+
+        全件走査でメモリ上のデータを追い出さないよう、LRU の順序は変えず、
+        退避済みのものはディスクから読むだけでメモリには載せない。
+        """
+        for key in self._keys(is_file):
+            with self._lock:
+                if key in self._memory:
+                    value = self._memory[key]
+                else:
+                    entry = self._entries.get(key)
+                    if entry is None or entry["path"] is None:
+                        continue
+                    value = self._load(entry["path"])
+                    self._stats["loads"] += 1
+            yield key, value
+
+    def texts(self, is_file: Optional[bool] = None) -> Iterator[str]:
+        """追加順にすべてのソースのテキストを返す（退避済みのものも DataFrame は読み込まない）"""
+        for key in self._keys(is_file):
+            with self._lock:
+                if key in self._memory:
+                    text = self._memory[key][1]
+                else:
+                    entry = self._entries.get(key)
+                    if entry is None or entry["path"] is None:
+                        continue
+                    text = self._load_text(entry["path"])
+            yield text
+
+    def remove(self, company_id: Optional[str], source_name: str):
+        with self._lock:
+            self._discard((company_id or "", source_name))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory.clear()
+            self._memory_bytes = 0
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    # ---- 集計 ----
+
+    @property
+    def row_count(self) -> int:
+        with self._lock:
+            return sum(entry["rows"] for entry in self._entries.values())
+
+    @property
+    def columns(self) -> List[str]:
+        """全ソースの列名（初出順）"""
+        with self._lock:
+            columns: Dict[str, None] = {}
+            for entry in self._entries.values():
+                columns.update(dict.fromkeys(entry["columns"]))
+            return list(columns)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "sources": len(self._entries),
+                "in_memory": len(self._memory),
+                "spilled": len(self._entries) - len(self._memory),
+                "memory_mb": round(self._memory_bytes / 1024 / 1024, 2),
+                "memory_limit_mb": round(self.memory_limit / 1024 / 1024, 2),
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+                **self._stats,
+            }
+
+    # ---- 退避 ----
+
+    def _discard(self, key: StoreKey):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if key in self._memory:
+            del self._memory[key]
+            self._memory_bytes -= entry["size"]
+        self._remove_spill(entry)
+
+    def _evict(self, keep: Optional[StoreKey] = None):
+        """上限を超えている間、最近使われていないものから退避"""
+        while self._memory_bytes > self.memory_limit and self._memory:
+            key = next(iter(self._memory))
+            if key == keep:
+                if len(self._memory) == 1:
+                    break
+                self._memory.move_to_end(key)
+                continue
+            df, text = self._memory.pop(key)
+            entry = self._entries[key]
+            self._memory_bytes -= entry["size"]
+            try:
+                entry["path"] = self._spill(key, df, text)
+                self._stats["spills"] += 1
+            except Exception as e:
+                # 退避できなければメモリに残す（データは失わない）
+                logger.error(f"❌ 知識ベースの退避に失敗 ({key[1]}): {e}")
+                self._memory[key] = (df, text)
+                self._memory_bytes += entry["size"]
+                break
+
+    def _spill(self, key: StoreKey, df, text: str) -> str:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        base = os.path.join(self.spill_dir, hashlib.sha1("\0".join(key).encode("utf-8")).hexdigest())
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(text or "")
+        if df is None:
+            return base
+        if PYARROW_AVAILABLE:
+            try:
+                df.to_parquet(base + ".parquet", index=False)
+                return base
+            except Exception as e:
+                # 列名が文字列でない・型が混在している列などは pickle で保存
+                logger.debug(f"Parquetで保存できないため pickle を使用 ({key[1]}): {e}")
+        df.to_pickle(base + ".pkl")
+        return base
+
+    def _load_text(self, base: str) -> str:
+        with open(base + ".txt", encoding="utf-8") as f:
+            return f.read()
+
+    def _load(self, base: str) -> Tuple[Any, str]:
+        import pandas as pd
+        text = self._load_text(base)
+        if os.path.exists(base + ".parquet"):
+            return pd.read_parquet(base + ".parquet"), text
+        if os.path.exists(base + ".pkl"):
+            return pd.read_pickle(base + ".pkl"), text
+        return None, text
+
+    def _remove_spill(self, entry: Dict[str, Any]):
+        base = entry.get("path")
+        if base is None:
+            return
+        for suffix in (".txt", ".parquet", ".pkl"):
+            try:
+                os.remove(base + suffix)
+            except FileNotFoundError:
+                pass
+        entry["path"] = None
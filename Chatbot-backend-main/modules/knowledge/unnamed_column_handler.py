@@ -599,24 +599,24 @@ class UnnamedColumnHandler:
                 'url': None
             })
             
-            # 各行をセクションとして追加
-            for index, row in df.iterrows():
-                content_parts = []
-                for col, raw_value in row.items():
+            # 列ごとに「列名: 値」を作成（行ごとに取り出した場合と同じ型＝全列共通の型で文字列化）
+            values = df.values
+            column_parts = []
+            for col_index, col in enumerate(df.columns):
+                parts = []
+                for index, raw_value in zip(df.index, pd.Series(values[:, col_index], copy=False)):
                     try:
-                        # pandas Series エラー対策: 安全に値を取得
-                        if hasattr(raw_value, 'item'):
-                            value = raw_value.item() if not pd.isna(raw_value.item()) else None
-                        else:
-                            value = raw_value if not pd.isna(raw_value) else None
-                        
-                        if value is not None:
-                            value_str = str(value).strip()
-                            if value_str:
-                                content_parts.append(f"{col}: {ensure_string(value_str)}")
+                        value = raw_value if not pd.isna(raw_value) else None
+                        value_str = str(value).strip() if value is not None else ""
+                        parts.append(f"{col}: {ensure_string(value_str)}" if value_str else None)
                     except Exception as col_error:
                         logger.debug(f"Unnamed列処理エラー ({col}, 行 {index}): {col_error}")
-                        continue
+                        parts.append(None)
+                column_parts.append(parts)
+            
+            # 各行をセクションとして追加
+            for index, parts in zip(df.index, zip(*column_parts)):
+                content_parts = [part for part in parts if part is not None]
                 
                 if content_parts:
                     content = " | ".join(content_parts)
@@ -6,17 +6,8 @@
 # データ型変換ユーティリティ関数をインポート
 from .database import ensure_string
 
-# 新しいモジュール構造からインポート
-from .knowledge import (
-    KnowledgeBase,
-    knowledge_base,
-    get_active_resources,
-    get_knowledge_base_info,
-    process_file,
-    process_url,
-    toggle_resource_active,
-    get_uploaded_resources
-)
+# 新しいモジュール構造からインポート（参照時に modules.knowledge から読み込む）
+from . import knowledge as _knowledge
 
 # 後方互換性のために元の関数をエクスポート
 __all__ = [
@@ -28,4 +19,12 @@ __all__ = [
     'process_url',
     'toggle_resource_active',
     'get_uploaded_resources'
-] 
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(_knowledge, name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,89 @@
+"""
+🧵 リクエスト単位のログコンテキスト
+リクエストごとのトレースIDをすべてのログに付与し、詳細トレース（チャンク一覧などの大量ログ）を
+指定したリクエスト・会社・サンプリング対象のリクエストに限って出力します
+
+- X-Request-ID ヘッダー（なければ生成）をトレースIDとして使用し、レスポンスにも返す
+- X-Debug-Trace ヘッダー（DEBUG_TRACE_HEADER_ENABLED=true の場合のみ）、DEBUG_TRACE_COMPANY_IDS の会社、
+  DEBUG_TRACE_SAMPLE_RATE の割合で詳細トレースを有効化
+  DEBUG_TRACE_TOKEN を設定した場合、ヘッダーの値がトークンと一致するときだけ有効にする
+- 詳細ログは trace_enabled() で確認してから組み立てる（無効時は文字列を作らない）
+
+    if trace_enabled(logger):
+        trace(logger, "チャンク一覧:\\n%s", "\\n".join(lines))
+"""
+
+import os
+import hmac
+import uuid
+import random
+import logging
+from contextvars import ContextVar
+from typing import Optional
+
+# 詳細トレースを出力する割合（0.0〜1.0）
+DEBUG_TRACE_SAMPLE_RATE = float(os.getenv("DEBUG_TRACE_SAMPLE_RATE", "0"))
+# 詳細トレースを常に出力する会社ID（カンマ区切り）
+DEBUG_TRACE_COMPANY_IDS = {
+    company_id.strip() for company_id in os.getenv("DEBUG_TRACE_COMPANY_IDS", "").split(",") if company_id.strip()
+}
+# X-Debug-Trace ヘッダーでの有効化を許可するか（誰でも大量ログを出させられるため既定は無効）
+DEBUG_TRACE_HEADER_ENABLED = os.getenv("DEBUG_TRACE_HEADER_ENABLED", "false").lower() == "true"
+# 設定した場合は X-Debug-Trace の値がこのトークンと一致するときだけ有効化する
+DEBUG_TRACE_TOKEN = os.getenv("DEBUG_TRACE_TOKEN", "")
+
+_trace_id: ContextVar[str] = ContextVar("trace_id", default="-")
+_debug_trace: ContextVar[bool] = ContextVar("debug_trace", default=False)
+
+
+class TraceContextFilter(logging.Filter):
+    """ログレコードに trace_id を付与（ハンドラーに設定）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get()
+        return True
+
+
+def _debug_header_accepted(value: str) -> bool:
+    if DEBUG_TRACE_TOKEN:
+        return hmac.compare_digest(value.encode("utf-8"), DEBUG_TRACE_TOKEN.encode("utf-8"))
+    return value.lower() in ("1", "true", "yes")
+
+
+def start_request_trace(request_id: Optional[str] = None, debug_header: Optional[str] = None) -> str:
+    """リクエスト開始時に呼び出し、トレースIDと詳細トレースの有無を設定する"""
+    trace_id = (request_id or "").strip()[:64] or uuid.uuid4().hex[:12]
+    _trace_id.set(trace_id)
+
+    debug = DEBUG_TRACE_HEADER_ENABLED and _debug_header_accepted((debug_header or "").strip())
+    if not debug and DEBUG_TRACE_SAMPLE_RATE > 0:
+        debug = random.random() < DEBUG_TRACE_SAMPLE_RATE
+    _debug_trace.set(debug)
+    return trace_id
+
+
+def enable_company_debug_trace(company_id: Optional[str]):
+    """会社が判明した時点で呼び出し、対象の会社なら詳細トレースを有効化する"""
+    if company_id and company_id in DEBUG_TRACE_COMPANY_IDS:
+        _debug_trace.set(True)
+
+
+def current_trace_id() -> str:
+    return _trace_id.get()
+
+
+def debug_trace_active() -> bool:
+    """現在のリクエストで詳細トレースが有効か"""
+    return _debug_trace.get()
+
+
+def trace_enabled(logger: logging.Logger) -> bool:
+    """詳細ログを組み立てる必要があるか（詳細トレース中、またはロガーが DEBUG レベル）"""
+    return _debug_trace.get() or logger.isEnabledFor(logging.DEBUG)
+
+
+def trace(logger: logging.Logger, msg: str, *args):
+    """詳細ログを出力（詳細トレース中は INFO、それ以外は DEBUG）"""
+    level = logging.INFO if _debug_trace.get() else logging.DEBUG
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args)
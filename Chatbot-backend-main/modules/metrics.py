@@ -0,0 +1,183 @@
+"""
+📈 チャット処理のレイテンシ計測（Prometheus テキスト形式）
+ステージごとの処理時間ヒストグラムと、生成経路・429リトライのカウンタを記録し、/metrics で公開します
+
+    with CHAT_STAGE_SECONDS.time(stage="step2_generate_embedding"):
+        ...
+    GENERATION_PATH_TOTAL.inc(path="enhanced")
+
+値はプロセス内でのみ保持し、すべてのサンプルに pid ラベルを付けて出力します
+uvicorn を複数ワーカーで起動すると /metrics はリクエストを受けたワーカーの値だけを返すため、
+単一ワーカーで運用するか、ワーカーごとにスクレイプして sum without (pid) で集計してください
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# 秒単位のバケット（DB検索の数ms〜Gemini生成の数十秒までをカバー）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+_registry_lock = threading.Lock()
+_registry: List["_Metric"] = []
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    # 値はワーカープロセスごとなので、どのプロセスの値かを示す（fork 後も正しいよう出力時に取得）
+    pairs.append(f'pid="{os.getpid()}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ラベルが一致しません {sorted(labels)} != {sorted(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """単調増加するカウンタ"""
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """処理時間などの分布（累積バケット・合計・件数）"""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # ラベル値 -> (バケットごとの件数, 合計, 件数)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with ブロックの処理時間を記録（例外発生時も記録）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (bucket_counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render_metrics() -> str:
+    """登録済みの全メトリクスを Prometheus テキスト形式で出力"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# チャット処理の各ステージ（step2〜step4・カテゴリ分類・履歴保存など）
+CHAT_STAGE_SECONDS = Histogram(
+    "chat_stage_duration_seconds",
+    "Duration of each chat pipeline stage in seconds",
+    ["stage"],
+)
+
+# Gemini API 呼び出し（APIキーのスロット・モデル・結果別）
+GEMINI_REQUEST_SECONDS = Histogram(
+    "gemini_request_duration_seconds",
+    "Duration of Gemini generateContent calls in seconds",
+    ["key_slot", "model", "status"],
+)
+
+# 429 を受けて別のAPIキーで再試行した回数
+GEMINI_RATE_LIMIT_RETRIES_TOTAL = Counter(
+    "gemini_rate_limit_retries_total",
+    "Gemini calls that hit HTTP 429 and were retried with another key",
+    ["key_slot", "model"],
+)
+
+# 回答生成に使われた経路（enhanced / multi_gemini / chat_realtime_rag）
+GENERATION_PATH_TOTAL = Counter(
+    "chat_generation_path_total",
+    "Answers generated per client path, including fallbacks",
+    ["path"],
+)
+
+# チャットメッセージの振り分け結果（chat_conversation.route_message、閾値調整用）
+CHAT_ROUTE_TOTAL = Counter(
+    "chat_route_total",
+    "Chat messages per routing decision and reason",
+    ["route", "reason"],
+)
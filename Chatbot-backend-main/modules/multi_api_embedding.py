@@ -11,6 +11,8 @@ from typing import List, Optional, Dict, Any
 from enum import Enum
 from dotenv import load_dotenv
 import google.generativeai as genai
+from .config import get_gemini_sdk_options
+from .shared_state import get_shared_state, api_key_id
 
 # 環境変数読み込み
 load_dotenv()
@@ -80,6 +82,9 @@ class MultiAPIEmbeddingClient:
                 self.api_status[client_name] = APIKeyStatus.ERROR
                 self.api_last_error[client_name] = str(e)
         
+        # ワーカー間で共有するレート制限のクールダウン（キーはAPIキーのハッシュ）
+        self.cooldown_namespace = "gemini_embedding_cooldown"
+        
         # 現在使用中のクライアントインデックス
         self.current_client_index = 0
         
@@ -90,6 +95,7 @@ class MultiAPIEmbeddingClient:
     def _get_active_client(self) -> Optional[tuple]:
         """アクティブなクライアントを取得"""
         current_time = time.time()
+        shared_cooldowns = self._get_shared_cooldowns()
         
         # 現在のクライアントから開始して、利用可能なクライアントを探す
         for attempt in range(len(self.api_clients)):
@@ -100,6 +106,14 @@ class MultiAPIEmbeddingClient:
             
             status = self.api_status.get(client_name, APIKeyStatus.ERROR)
             
+            # 他のワーカーがレート制限を検知したキーはクールダウンを引き継ぐ
+            shared_reset_time = shared_cooldowns.get(api_key_id(self.api_clients[client_name]))
+            if status == APIKeyStatus.ACTIVE and shared_reset_time and shared_reset_time > current_time:
+                self.api_status[client_name] = APIKeyStatus.RATE_LIMITED
+                self.api_rate_limit_reset[client_name] = shared_reset_time
+                status = APIKeyStatus.RATE_LIMITED
+                logger.info(f"🔗 {client_name} 他ワーカーのレート制限を共有 (残り{shared_reset_time - current_time:.0f}秒)")
+            
             # レート制限のリセット時間をチェック
             if status == APIKeyStatus.RATE_LIMITED:
                 reset_time = self.api_rate_limit_reset.get(client_name, 0)
@@ -114,6 +128,14 @@ class MultiAPIEmbeddingClient:
         
         return None
     
+    def _get_shared_cooldowns(self) -> Dict[str, float]:
+        """共有ストアのクールダウン（APIキーID -> 解除時刻）、取得できなければ空"""
+        try:
+            return get_shared_state().get_namespace(self.cooldown_namespace)
+        except Exception as e:
+            logger.warning(f"⚠️ 共有クールダウン取得エラー: {e}")
+            return {}
+    
     def _is_rate_limit_error(self, error_message: str) -> bool:
         """レート制限エラーかどうかを判定"""
         rate_limit_indicators = [
@@ -151,6 +173,13 @@ class MultiAPIEmbeddingClient:
             self.api_status[client_name] = APIKeyStatus.RATE_LIMITED
             # レート制限の場合、60秒後にリセット
             self.api_rate_limit_reset[client_name] = time.time() + 60
+            try:
+                get_shared_state().set(
+                    self.cooldown_namespace, api_key_id(self.api_clients[client_name]),
+                    self.api_rate_limit_reset[client_name], ttl=60
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ 共有クールダウン保存エラー: {e}")
             logger.warning(f"⚠️ {client_name} レート制限エラー: {error_message}")
             
         elif self._is_quota_exceeded_error(error_message):
@@ -192,7 +221,7 @@ class MultiAPIEmbeddingClient:
                     logger.debug(f"🧠 {client_name} でembedding生成中 (試行 {retry + 1}/{max_retries})")
                     
                     # APIキーを設定してリクエスト
-                    genai.configure(api_key=api_key)
+                    genai.configure(api_key=api_key, **get_gemini_sdk_options())
                     response = await asyncio.to_thread(
                         genai.embed_content,
                         model=self.embedding_model,
@@ -11,6 +11,9 @@ import random
 from typing import List, Optional, Dict, Any, Tuple, Set
 from enum import Enum
 from dotenv import load_dotenv
+from .metrics import GEMINI_REQUEST_SECONDS, GEMINI_RATE_LIMIT_RETRIES_TOTAL
+from .config import get_gemini_api_base_url
+from .shared_state import get_shared_state, api_key_id
 
 # 環境変数読み込み
 load_dotenv()
@@ -72,11 +75,15 @@ class MultiGeminiClient:
             self.api_retry_count[client_name] = 0
             logger.info(f"✅ Gemini APIクライアント {client_name} 初期化完了")
         
+        # ワーカー間で共有するレート制限のクールダウン（キーはAPIキーのハッシュ）
+        self.api_key_ids = [api_key_id(api_key) for api_key in self.api_keys]
+        self.cooldown_namespace = "gemini_chat_cooldown"
+        
         # 現在使用中のクライアントインデックス
         self.current_client_index = 0
         
         # API設定
-        self.api_base_url = "https://generativelanguage.googleapis.com/v1beta"
+        self.api_base_url = get_gemini_api_base_url()
         self.chat_model = "gemini-2.5-flash"
         self.max_retries = len(self.api_keys)  # 🎯 APIキー数に応じたリトライ（31個なら31回）
         self.retry_delay_base = 2  # 基本待機時間（秒）
@@ -92,6 +99,7 @@ class MultiGeminiClient:
             
         current_time = time.time()
         available_clients = []
+        shared_cooldowns = self._get_shared_cooldowns()
         
         # 全てのクライアントをチェックして利用可能なものをリストアップ
         for i, api_key in enumerate(self.api_keys):
@@ -103,6 +111,14 @@ class MultiGeminiClient:
                 
             status = self.api_status.get(client_name, APIKeyStatus.ERROR)
             
+            # 他のワーカーがレート制限を検知したキーはクールダウンを引き継ぐ
+            shared_reset_time = shared_cooldowns.get(self.api_key_ids[i])
+            if status == APIKeyStatus.ACTIVE and shared_reset_time and shared_reset_time > current_time:
+                self.api_status[client_name] = APIKeyStatus.RATE_LIMITED
+                self.api_rate_limit_reset[client_name] = shared_reset_time
+                status = APIKeyStatus.RATE_LIMITED
+                logger.info(f"🔗 {client_name} 他ワーカーのレート制限を共有 (残り{shared_reset_time - current_time:.0f}秒)")
+            
             # レート制限のリセット時間をチェック
             if status == APIKeyStatus.RATE_LIMITED:
                 reset_time = self.api_rate_limit_reset.get(client_name, 0)
@@ -136,6 +152,14 @@ class MultiGeminiClient:
         logger.info(f"🎲 ランダム選択: {selected_name} (利用可能: {len(available_clients)}個)")
         return selected_name, selected_key
     
+    def _get_shared_cooldowns(self) -> Dict[str, float]:
+        """共有ストアのクールダウン（APIキーID -> 解除時刻）、取得できなければ空"""
+        try:
+            return get_shared_state().get_namespace(self.cooldown_namespace)
+        except Exception as e:
+            logger.warning(f"⚠️ 共有クールダウン取得エラー: {e}")
+            return {}
+    
     def _is_rate_limit_error(self, error_message: str, status_code: int = None) -> bool:
         """レート制限エラーかどうかを判定"""
         if status_code == 429:
@@ -164,6 +188,13 @@ class MultiGeminiClient:
             self.api_status[client_name] = APIKeyStatus.RATE_LIMITED
             # レート制限の場合、60秒後にリセット
             self.api_rate_limit_reset[client_name] = current_time + 60
+            try:
+                client_index = int(client_name.rsplit("_", 1)[1]) - 1
+                get_shared_state().set(
+                    self.cooldown_namespace, self.api_key_ids[client_index], current_time + 60, ttl=60
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ 共有クールダウン保存エラー: {e}")
             logger.warning(f"⚠️ {client_name} レート制限エラー: {error_message}")
         else:
             self.api_status[client_name] = APIKeyStatus.ERROR
@@ -231,12 +262,17 @@ class MultiGeminiClient:
                 
                 logger.info(f"⏱️ API呼び出し (試行 {attempt + 1}/{self.max_retries}): {client_name}")
                 
+                request_start = time.perf_counter()
                 response = requests.post(
                     api_url, 
                     headers=headers, 
                     json=request_data, 
                     timeout=120  # 120秒タイムアウト（長いプロンプトに対応）
                 )
+                GEMINI_REQUEST_SECONDS.observe(
+                    time.perf_counter() - request_start,
+                    key_slot=client_name, model=self.chat_model, status=str(response.status_code)
+                )
                 
                 # 成功した場合
                 if response.status_code == 200:
@@ -253,6 +289,7 @@ class MultiGeminiClient:
                     # このクライアントを除外リストに追加
                     excluded_clients.add(client_name)
                     self._handle_api_error(client_name, error_msg, 429)
+                    GEMINI_RATE_LIMIT_RETRIES_TOTAL.inc(key_slot=client_name, model=self.chat_model)
                     logger.info(f"🚫 {client_name} を除外リストに追加")
                     continue
                 
@@ -269,6 +306,10 @@ class MultiGeminiClient:
                     continue
                     
             except requests.exceptions.Timeout as e:
+                GEMINI_REQUEST_SECONDS.observe(
+                    time.perf_counter() - request_start,
+                    key_slot=client_name, model=self.chat_model, status="timeout"
+                )
                 error_msg = f"API タイムアウトエラー (50秒): {e}"
                 logger.warning(f"⏰ {client_name} {error_msg} - 次のAPIキーに切り替え")
                 
@@ -312,6 +353,10 @@ class MultiGeminiClient:
             self.api_last_error[client_name] = None
             self.api_rate_limit_reset[client_name] = 0
             self.api_retry_count[client_name] = 0
+            try:
+                get_shared_state().delete(self.cooldown_namespace, self.api_key_ids[i])
+            except Exception as e:
+                logger.warning(f"⚠️ 共有クールダウン削除エラー: {e}")
             
         self.current_client_index = 0
         logger.info(f"✅ 全 {len(self.api_keys)} 個のAPIキーをリセット完了")
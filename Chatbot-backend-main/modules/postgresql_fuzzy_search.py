@@ -2,135 +2,261 @@
 PostgreSQL Fuzzy Search Implementation
 既存のPostgreSQLでFuzzy Search機能を実装
 Elasticsearchは不要！
+
+日本語全文検索:
+- chunks.search_tokens に Python 側でトークン化（英数字の識別子 + 形態素 + 文字バイグラム）した tsvector を保存
+- GIN インデックスで候補を絞り込み、ts_rank_cd で順位付け（1クエリ）
+- 検索クエリも同じトークナイザーで tsquery に変換
+sql/add_chunks_search_tokens.sql を適用後、backfill_search_tokens() で既存チャンクを索引化してください
+
+ローカルのPostgreSQLで確認する場合:
+    python -m modules.postgresql_fuzzy_search --backfill
+    python -m modules.postgresql_fuzzy_search "検索したい文字列"
 """
 
+import sys
+import asyncio
 import logging
+from collections import defaultdict
 from typing import List, Dict, Any, Optional
-from .database import get_db
-from supabase_adapter import get_supabase_client, execute_query
+
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+from .bm25_index import tokenize_japanese
 
 logger = logging.getLogger(__name__)
 
+# tsvector の位置情報の上限（PostgreSQLの仕様）
+_MAX_POSITION = 16383
+_MAX_POSITIONS_PER_LEXEME = 255
+# tsquery に含めるトークン数の上限
+_MAX_QUERY_TOKENS = 64
+
+
+def _quote_lexeme(token: str) -> str:
+    """tsvector / tsquery のリテラル用にクォート"""
+    return "'" + token.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def build_search_tokens(text: str) -> Optional[str]:
+    """チャンク本文から tsvector のリテラル表現を生成（位置情報付き）"""
+    positions: Dict[str, List[int]] = defaultdict(list)
+    for position, token in enumerate(tokenize_japanese(text), start=1):
+        if position > _MAX_POSITION:
+            break
+        if len(positions[token]) < _MAX_POSITIONS_PER_LEXEME:
+            positions[token].append(position)
+    if not positions:
+        return None
+    return " ".join(
+        f"{_quote_lexeme(token)}:{','.join(map(str, token_positions))}"
+        for token, token_positions in positions.items()
+    )
+
+
+def build_search_query(query: str) -> Optional[str]:
+    """検索クエリから tsquery のリテラル表現を生成（いずれかのトークンに一致）"""
+    tokens = list(dict.fromkeys(tokenize_japanese(query)))[:_MAX_QUERY_TOKENS]
+    if not tokens:
+        return None
+    return " | ".join(_quote_lexeme(token) for token in tokens)
+
+
 class PostgreSQLFuzzySearch:
     def __init__(self):
-        self.supabase = get_supabase_client()
-        
+        self.db_url = None
+        # chunks.search_tokens 列が存在するか（マイグレーション未適用なら部分一致検索にフォールバック）
+        self.fulltext_available = False
+        self.initialized = False
+
+    def _connect(self):
+        if self.db_url is None:
+            from .config import get_database_url
+            self.db_url = get_database_url()
+        return psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
+
     async def initialize(self):
-        """PostgreSQL Fuzzy Search拡張を初期化"""
+        """全文検索用の列が使えるか確認"""
         try:
-            # pg_trgm拡張を有効化（trigram検索用）
-            await self._execute_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
-            
-            # 日本語対応のためのインデックス作成
-            await self._execute_sql("""
-                CREATE INDEX IF NOT EXISTS idx_chunks_content_trgm 
-                ON chunks USING gin (content gin_trgm_ops);
-            """)
-            
-            await self._execute_sql("""
-                CREATE INDEX IF NOT EXISTS idx_chunks_content_fulltext 
-                ON chunks USING gin (to_tsvector('japanese', content));
-            """)
-            
-            logger.info("PostgreSQL Fuzzy Search初期化完了")
+            self.fulltext_available = await asyncio.to_thread(self._check_fulltext_column)
+            self.initialized = True
+            if self.fulltext_available:
+                logger.info("PostgreSQL Fuzzy Search初期化完了（日本語全文検索インデックス使用）")
+            else:
+                logger.warning("chunks.search_tokens 列がありません。sql/add_chunks_search_tokens.sql を適用してください（部分一致検索で動作します）")
             return True
-            
+
         except Exception as e:
             logger.error(f"PostgreSQL Fuzzy Search初期化エラー: {e}")
             return False
-            
-    async def _execute_sql(self, sql: str):
-        """SQLを実行"""
-        try:
-            result = execute_query(sql)
-            return result
-        except Exception as e:
-            logger.warning(f"SQL実行エラー（継続）: {e}")
-            # エラーでも継続（既に拡張が有効な場合など）
-            return None
-            
-    async def fuzzy_search(self, query: str, limit: int = 25, threshold: float = 0.2) -> List[Dict[str, Any]]:
+
+    def _check_fulltext_column(self) -> bool:
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'chunks' AND column_name = 'search_tokens'
+                """)
+                return cur.fetchone() is not None
+
+    # ---- 索引化 ----
+
+    def _index_chunks(self, where_sql: str, params: List[Any], batch_size: int) -> int:
+        """search_tokens が未設定のチャンクを索引化"""
+        indexed = 0
+        with self._connect() as conn:
+            while True:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT id, content FROM chunks
+                        WHERE search_tokens IS NULL AND content IS NOT NULL {where_sql}
+                        LIMIT %s
+                    """, params + [batch_size])
+                    rows = cur.fetchall()
+                    if not rows:
+                        break
+
+                    # トークンが作れないチャンクも空の tsvector にして再処理しない
+                    values = [(row["id"], build_search_tokens(row["content"]) or "") for row in rows]
+                    execute_values(cur, """
+                        UPDATE chunks AS c
+                        SET search_tokens = v.search_tokens::tsvector
+                        FROM (VALUES %s) AS v(id, search_tokens)
+                        WHERE c.id = v.id::uuid
+                    """, values)
+                conn.commit()
+                indexed += len(rows)
+                if len(rows) < batch_size:
+                    break
+        return indexed
+
+    async def index_document(self, doc_id: str, batch_size: int = 500) -> int:
+        """ドキュメントのチャンクを全文検索用に索引化（アップロード直後に呼び出す）"""
+        if not self.initialized:
+            await self.initialize()
+        if not self.fulltext_available:
+            return 0
+        return await asyncio.to_thread(self._index_chunks, "AND doc_id = %s", [doc_id], batch_size)
+
+    async def backfill_search_tokens(self, company_id: Optional[str] = None, batch_size: int = 500) -> int:
+        """既存チャンクを全文検索用に索引化"""
+        if not self.initialized:
+            await self.initialize()
+        if not self.fulltext_available:
+            return 0
+        if company_id:
+            count = await asyncio.to_thread(self._index_chunks, "AND company_id = %s", [company_id], batch_size)
+        else:
+            count = await asyncio.to_thread(self._index_chunks, "", [], batch_size)
+        logger.info(f"全文検索インデックス作成: {count}チャンク")
+        return count
+
+    # ---- 検索 ----
+
+    def _search_fulltext(self, ts_query: str, limit: int, threshold: float,
+                         company_id: Optional[str]) -> List[Dict[str, Any]]:
+        sql = """
+            SELECT
+                c.id AS chunk_id,
+                c.doc_id,
+                c.chunk_index,
+                c.content,
+                ds.name AS file_name,
+                ds.type AS document_type,
+                ts_rank_cd(c.search_tokens, q.query, 32) AS score
+            FROM chunks c
+            JOIN document_sources ds ON ds.id = c.doc_id
+            CROSS JOIN (SELECT %s::tsquery AS query) q
+            WHERE c.search_tokens @@ q.query
+              AND ds.active = true
+        """
+        params: List[Any] = [ts_query]
+        if company_id:
+            sql += " AND c.company_id = %s"
+            params.append(company_id)
+        sql += " ORDER BY score DESC LIMIT %s"
+        params.append(limit)
+
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return [dict(row) for row in cur.fetchall() if float(row["score"]) >= threshold]
+
+    def _search_substring(self, query: str, limit: int, company_id: Optional[str]) -> List[Dict[str, Any]]:
+        """全文検索列が無い場合の部分一致検索"""
+        sql = """
+            SELECT
+                c.id AS chunk_id,
+                c.doc_id,
+                c.chunk_index,
+                c.content,
+                ds.name AS file_name,
+                ds.type AS document_type,
+                0.5 AS score
+            FROM chunks c
+            JOIN document_sources ds ON ds.id = c.doc_id
+            WHERE c.content ILIKE %s
+              AND ds.active = true
+        """
+        params: List[Any] = [f"%{query}%"]
+        if company_id:
+            sql += " AND c.company_id = %s"
+            params.append(company_id)
+        sql += " LIMIT %s"
+        params.append(limit)
+
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return [dict(row) for row in cur.fetchall()]
+
+    async def fuzzy_search(self, query: str, limit: int = 25, threshold: float = 0.0,
+                           company_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Fuzzy Search実行
-        
+
         Args:
             query: 検索クエリ
             limit: 結果数制限
-            threshold: 類似度閾値（0.0-1.0）
+            threshold: スコアの下限（ts_rank_cd を 0.0-1.0 に正規化した値）
+            company_id: 会社ID（オプション）
         """
+        if not self.initialized:
+            await self.initialize()
+
         try:
-            # 複数の検索手法を組み合わせ
-            sql = """
-            WITH fuzzy_results AS (
-                -- 1. Trigram類似度検索
-                SELECT 
-                    chunk_id,
-                    content,
-                    file_name,
-                    similarity(content, $1) as similarity_score,
-                    'trigram' as search_type
-                FROM chunks 
-                WHERE similarity(content, $1) > $3
-                
-                UNION ALL
-                
-                -- 2. 全文検索
-                SELECT 
-                    chunk_id,
-                    content,
-                    file_name,
-                    ts_rank(to_tsvector('japanese', content), plainto_tsquery('japanese', $1)) as similarity_score,
-                    'fulltext' as search_type
-                FROM chunks 
-                WHERE to_tsvector('japanese', content) @@ plainto_tsquery('japanese', $1)
-                
-                UNION ALL
-                
-                -- 3. LIKE検索（部分一致）
-                SELECT 
-                    chunk_id,
-                    content,
-                    file_name,
-                    0.5 as similarity_score,
-                    'like' as search_type
-                FROM chunks 
-                WHERE content ILIKE '%' || $1 || '%'
-            )
-            SELECT DISTINCT
-                chunk_id,
-                content,
-                file_name,
-                MAX(similarity_score) as max_score,
-                array_agg(DISTINCT search_type) as search_types
-            FROM fuzzy_results
-            GROUP BY chunk_id, content, file_name
-            ORDER BY max_score DESC
-            LIMIT $2;
-            """
-            
-            # パラメータをSQLに埋め込み（Supabase用）
-            formatted_sql = sql.replace('$1', f"'{query}'").replace('$2', str(limit)).replace('$3', str(threshold))
-            
-            rows = execute_query(formatted_sql)
-            
+            if self.fulltext_available:
+                ts_query = build_search_query(query)
+                if not ts_query:
+                    return []
+                rows = await asyncio.to_thread(self._search_fulltext, ts_query, limit, threshold, company_id)
+                search_type = 'fulltext'
+            else:
+                rows = await asyncio.to_thread(self._search_substring, query, limit, company_id)
+                search_type = 'like'
+
             results = []
             for row in rows:
                 results.append({
-                    'chunk_id': row.get('chunk_id'),
-                    'content': row.get('content'),
-                    'file_name': row.get('file_name'),
-                    'score': float(row.get('max_score', 0)),
-                    'search_types': row.get('search_types', []),
+                    'chunk_id': str(row['chunk_id']),
+                    'doc_id': row['doc_id'],
+                    'chunk_index': row['chunk_index'],
+                    'content': row['content'],
+                    'file_name': row['file_name'],
+                    'document_type': row['document_type'],
+                    'score': float(row['score']),
+                    'search_types': [search_type],
                     'highlight': self._highlight_matches(row.get('content', ''), query)
                 })
-                
+
             logger.info(f"Fuzzy Search実行: クエリ='{query}', 結果数={len(results)}")
             return results
-            
+
         except Exception as e:
             logger.error(f"Fuzzy Search実行エラー: {e}")
             return []
-            
+
     def _highlight_matches(self, content: str, query: str) -> str:
         """検索結果をハイライト"""
         try:
@@ -139,9 +265,9 @@ class PostgreSQLFuzzySearch:
             return highlighted
         except:
             return content
-            
+
     async def close(self):
-        """接続を閉じる（Supabaseでは不要）"""
+        """接続を閉じる（検索ごとに接続するため不要）"""
         pass
 
 # グローバルインスタンス
@@ -151,6 +277,22 @@ async def initialize_postgresql_fuzzy():
     """PostgreSQL Fuzzy Search初期化"""
     return await postgresql_fuzzy.initialize()
 
-async def fuzzy_search_chunks(query: str, limit: int = 25, threshold: float = 0.2) -> List[Dict[str, Any]]:
+async def fuzzy_search_chunks(query: str, limit: int = 25, threshold: float = 0.0,
+                              company_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """Fuzzy Search実行"""
-    return await postgresql_fuzzy.fuzzy_search(query, limit, threshold) 
\ No newline at end of file
+    return await postgresql_fuzzy.fuzzy_search(query, limit, threshold, company_id)
+
+async def index_document_search_tokens(doc_id: str) -> int:
+    """アップロードしたドキュメントのチャンクを全文検索用に索引化"""
+    return await postgresql_fuzzy.index_document(doc_id)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == "--backfill":
+        asyncio.run(postgresql_fuzzy.backfill_search_tokens())
+    elif len(sys.argv) > 1:
+        for result in asyncio.run(fuzzy_search_chunks(sys.argv[1], limit=10)):
+            print(f"{result['score']:.4f}  {result['file_name']}  {result['content'][:80]!r}")
+    else:
+        print("usage: python -m modules.postgresql_fuzzy_search [--backfill | QUERY]")
@@ -0,0 +1,156 @@
+"""
+🗜️ 量子化ベクトルによる2段階検索
+3072次元の float32 ベクトル（1件 12KB）を全件比較する代わりに、
+量子化した小さな表現のインデックスで候補を絞り込み、候補だけを元のベクトルで再スコアリングします
+
+- binary : binary_quantize(embedding)::bit(3072)（1件 384B、ハミング距離）
+- halfvec: embedding::halfvec(3072)（1件 6KB、コサイン距離）
+どちらも chunks.embedding からの式インデックスのため、別列やトリガーなしで常に同期されます
+インデックスは sql/add_chunks_quantized_embedding.sql で作成（pgvector 0.7.0 以上が必要）
+
+インデックスが無い環境では従来どおり元のベクトルだけで検索します
+インデックスは全社共通のため会社IDの絞り込みは走査後に掛かる。pgvector 0.8.0 以上では
+反復スキャンで候補数を満たすまで探索を続け、それでも条件に合う行数より候補が少ない場合だけ
+呼び出し側で元のベクトルによる全件比較に切り替える（チャンク数の少ない会社では切り替えない）
+
+既定は off。再現率と速度を benchmark_vector_search.py で計測してから auto / binary / halfvec を設定する
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# off: 使用しない（既定） / auto: 作成済みインデックスから選択 / binary / halfvec
+QUANTIZED_SEARCH_MODE = os.getenv("VECTOR_QUANTIZED_SEARCH", "off").lower()
+# 量子化インデックスから取得して再スコアリングする候補数
+QUANTIZED_RESCORE_CANDIDATES = int(os.getenv("VECTOR_RESCORE_CANDIDATES", "400"))
+# インデックス有無の再確認間隔（秒）
+QUANTIZED_INDEX_CHECK_SECONDS = int(os.getenv("VECTOR_QUANTIZED_INDEX_CHECK_SECONDS", "600"))
+
+EMBEDDING_DIMENSIONS = 3072
+
+# モード -> インデックス名
+QUANTIZED_INDEXES = {
+    "binary": "idx_chunks_embedding_binary_hnsw",
+    "halfvec": "idx_chunks_embedding_halfvec_hnsw",
+}
+
+# hnsw.ef_search の上限（pgvector の仕様）
+_MAX_EF_SEARCH = 1000
+
+_lock = threading.Lock()
+# (確認時刻, 利用するモード)
+_detected_mode: Optional[Tuple[float, Optional[str]]] = None
+
+
+def _detect_mode(conn) -> Optional[str]:
+    """作成済みの量子化インデックスから利用するモードを決定"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'chunks' AND indexname = ANY(%s)",
+            (list(QUANTIZED_INDEXES.values()),)
+        )
+        rows = cur.fetchall()
+    existing = {row["indexname"] if isinstance(row, dict) else row[0] for row in rows}
+
+    if QUANTIZED_SEARCH_MODE in QUANTIZED_INDEXES:
+        candidates = [QUANTIZED_SEARCH_MODE]
+    else:
+        candidates = ["binary", "halfvec"]
+    for mode in candidates:
+        if QUANTIZED_INDEXES[mode] in existing:
+            return mode
+    return None
+
+
+def get_quantized_mode(conn) -> Optional[str]:
+    """
+    利用する量子化モードを返す（binary / halfvec / None）
+    結果はプロセス内でキャッシュし、QUANTIZED_INDEX_CHECK_SECONDS ごとに再確認する
+    """
+    global _detected_mode
+    if QUANTIZED_SEARCH_MODE == "off":
+        return None
+
+    with _lock:
+        if _detected_mode and time.time() - _detected_mode[0] < QUANTIZED_INDEX_CHECK_SECONDS:
+            return _detected_mode[1]
+
+    try:
+        mode = _detect_mode(conn)
+    except Exception as e:
+        logger.warning(f"⚠️ 量子化インデックスの確認に失敗: {e}")
+        conn.rollback()
+        mode = None
+
+    with _lock:
+        if _detected_mode is None or _detected_mode[1] != mode:
+            if mode:
+                logger.info(f"🗜️ 量子化ベクトル2段階検索を使用: {mode} (候補{QUANTIZED_RESCORE_CANDIDATES}件)")
+            else:
+                logger.info("🗜️ 量子化インデックスなし: 元のベクトルで検索します")
+        _detected_mode = (time.time(), mode)
+    return mode
+
+
+def quantized_distance_sql(mode: str, vector_str: str, column: str = "c.embedding") -> str:
+    """候補絞り込み用の距離式（式インデックスと同じ形にする必要がある）"""
+    if mode == "binary":
+        return (
+            f"binary_quantize({column})::bit({EMBEDDING_DIMENSIONS}) "
+            f"<~> binary_quantize('{vector_str}'::vector)"
+        )
+    if mode == "halfvec":
+        return (
+            f"{column}::halfvec({EMBEDDING_DIMENSIONS}) "
+            f"<=> '{vector_str}'::halfvec({EMBEDDING_DIMENSIONS})"
+        )
+    raise ValueError(f"未対応の量子化モード: {mode}")
+
+
+def rescore_candidate_count(limit: int) -> int:
+    """再スコアリングする候補数（最終件数より少なくはしない）"""
+    return max(QUANTIZED_RESCORE_CANDIDATES, limit)
+
+
+def prepare_quantized_search(cur, candidate_count: int):
+    """HNSW の探索幅を候補数に合わせる（トランザクション内のみ有効）
+
+    会社IDの絞り込みで候補が減らないよう、対応していれば反復スキャンも有効にする
+    （順序は再スコアリングで付け直すため relaxed_order で十分）
+    """
+    ef_search = min(max(candidate_count, 40), _MAX_EF_SEARCH)
+    cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),))
+    cur.execute("SAVEPOINT quantized_iterative_scan")
+    try:
+        cur.execute("SELECT set_config('hnsw.iterative_scan', 'relaxed_order', true)")
+        cur.execute("RELEASE SAVEPOINT quantized_iterative_scan")
+    except Exception:
+        # pgvector 0.8.0 未満（候補不足時は呼び出し側が全件比較に切り替える）
+        cur.execute("ROLLBACK TO SAVEPOINT quantized_iterative_scan")
+
+
+def count_eligible_rows(cur, from_sql: str, where_sql: str, params, cap: int) -> int:
+    """絞り込み条件に合う行数（cap 件で打ち切るため、会社のチャンク数によらず読む行数は一定）"""
+    cur.execute(
+        f"SELECT COUNT(*) AS row_count FROM (SELECT 1 FROM {from_sql} WHERE {where_sql} LIMIT %s) eligible",
+        list(params) + [cap]
+    )
+    row = cur.fetchone()
+    return row["row_count"] if isinstance(row, dict) else row[0]
+
+
+def needs_exact_fallback(row_count: int, eligible_count: int) -> bool:
+    """量子化インデックスの候補が足りず、全件比較で取り直すべきか
+
+    eligible_count は count_eligible_rows で数えた条件に合う行数（取得件数で打ち切り済み）。
+    会社のチャンク数が取得件数より少なく、その全件が返っている場合は取り直さない
+    """
+    if row_count < eligible_count:
+        logger.info(f"🗜️ 量子化インデックスの候補不足 ({row_count}/{eligible_count}件): 元のベクトルで全件比較します")
+        return True
+    return False
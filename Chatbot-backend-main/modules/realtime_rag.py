@@ -23,11 +23,21 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from supabase import create_client, Client
 from modules.database import SupabaseConnection
-from modules.token_counter import TokenCounter
+from modules.tokenizer import get_tokenizer
+from modules.bm25_index import get_bm25_index_manager, bm25_available, reciprocal_rank_fusion
+from modules.quantized_vector_search import (
+    get_quantized_mode, quantized_distance_sql, rescore_candidate_count, prepare_quantized_search,
+    needs_exact_fallback, count_eligible_rows
+)
+from modules.vector_index import get_vector_index_manager
+from modules.chunk_metadata import get_chunk_search_source
+from modules.single_flight import SingleFlight, normalize_question, document_set_version
+from modules.metrics import CHAT_STAGE_SECONDS, GENERATION_PATH_TOTAL
+from modules.log_context import trace_enabled, trace
 from modules.models import ChatResponse, ChatMessage
 import urllib.parse  # 追加
 import re # 追加
-from modules.config import setup_gemini
+from modules.config import setup_gemini, get_gemini_api_base_url
 from modules.multi_gemini_client import get_multi_gemini_client, multi_gemini_available
 import json
 
@@ -64,6 +74,41 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# ベクトル検索とキーワード検索のRRF定数
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
+# コンテキストのトークン上限（Gemini 2.5 Flash の入力上限 1,048,576 に対して質問・指示分の余裕を残す）
+MAX_CONTEXT_TOKENS = int(os.getenv("RAG_MAX_CONTEXT_TOKENS", "900000"))
+
+
+def _parse_type_quotas(value) -> Dict[str, int]:
+    """タイプ別枠の設定（JSON文字列または辞書）を {document_type: 件数} に変換"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            logger.warning(f"タイプ別枠の設定を解釈できません: {value!r}")
+            return {}
+    if not isinstance(value, dict):
+        return {}
+    quotas = {}
+    for doc_type, count in value.items():
+        try:
+            quotas[str(doc_type)] = int(count)
+        except (TypeError, ValueError):
+            # 不正な件数の項目だけ読み飛ばし、他のタイプの枠は有効にする
+            logger.warning(f"タイプ別枠の件数を解釈できません: {doc_type}={count!r}")
+    return quotas
+
+
+# Step 3 で類似度上位の候補からファイルタイプ別に確保する最低件数（会社ごとに company_settings で上書き可能）
+DEFAULT_TYPE_QUOTAS = _parse_type_quotas(os.getenv("RAG_TYPE_QUOTAS", '{"pdf": 20}'))
+# タイプ別枠を埋めるために Top-K の何倍の候補を取得するか
+TYPE_CANDIDATE_MULTIPLIER = int(os.getenv("RAG_TYPE_CANDIDATE_MULTIPLIER", "3"))
+TYPE_QUOTA_CACHE_SECONDS = int(os.getenv("RAG_TYPE_QUOTA_CACHE_SECONDS", "300"))
+# company_id -> (取得時刻, タイプ別枠)
+_type_quota_cache: Dict[str, Tuple[float, Dict[str, int]]] = {}
+
 # safe_print関数の定義（Windows環境でのUnicode対応）
 def safe_print(text):
     """Windows環境でのUnicode文字エンコーディング問題を回避する安全なprint関数"""
@@ -93,7 +138,7 @@ class RealtimeRAGProcessor:
             raise ValueError("GOOGLE_API_KEY または GEMINI_API_KEY 環境変数が設定されていません")
         
         # Gemini API の直接呼び出し用URL
-        self.api_base_url = "https://generativelanguage.googleapis.com/v1beta"
+        self.api_base_url = get_gemini_api_base_url()
         
         # Gemini Embeddingクライアントの初期化（埋め込み用）
         try:
@@ -116,152 +161,28 @@ class RealtimeRAGProcessor:
 
     async def _keyword_search(self, query: str, company_id: Optional[str], limit: int = 80) -> List[Dict]:  # 🚀🚀🚀 50→80に統一（最大限の検索網羅）
         """
-        複数キーワード対応検索（ILIKEを使用）
-        すべての物件番号とキーワードで個別検索してマージ
+        BM25キーワード検索（会社別のインプロセスインデックスを使用）
+        物件番号や会社名など、エンベディングでは拾いにくい完全一致を補う
         """
-        # 🔧 キーワード検索の無効化チェック（一時的に強制無効化）
-        disable_keyword_search = True  # 強制的にキーワード検索をオフ
-        # disable_keyword_search = os.getenv("DISABLE_KEYWORD_SEARCH", "false").lower() == "true"
+        disable_keyword_search = os.getenv("DISABLE_KEYWORD_SEARCH", "false").lower() == "true"
         if disable_keyword_search:
             logger.info("🔇 キーワード検索が無効化されています (DISABLE_KEYWORD_SEARCH=true)")
             return []
         
-        logger.info(f"🔑 Step 3-Keyword: 複数キーワード検索開始 (Top-{limit})")
-        
-        # クエリからキーワードを抽出（改善版 - 会社名優先抽出）
-        property_keywords = re.findall(r'[A-Z]+\d+', query)  # WPD4100389など
-        company_keywords = re.findall(r'[a-zA-Z]{3,}(?:株式会社|会社)', query)  # queue株式会社など
-        
-        # 🎯 会社名パターン（株式会社、有限会社等）
-        company_name_patterns = [
-            r'([ァ-ヶー]{2,}?)(?:株式会社|有限会社|合同会社)',  # カタカナ会社名
-            r'([一-龠]{2,}?)(?:株式会社|有限会社|合同会社)',      # 漢字会社名
-            r'株式会社\s*([ァ-ヶー]{2,})',                     # 株式会社 カタカナ
-            r'株式会社\s*([一-龠]{2,})',                       # 株式会社 漢字
-            r'([ァ-ヶー]{2,})',                              # カタカナ語（2文字以上）
-        ]
-        
-        extracted_company_names = []
-        for pattern in company_name_patterns:
-            matches = re.findall(pattern, query)
-            extracted_company_names.extend(matches)
-        
-        # 🎯 重要な単語のみを抽出（不要なフレーズを除外）
-        important_keywords = []
-        
-        # カタカナ語（2文字以上、8文字以下）
-        katakana_words = re.findall(r'[ァ-ヶー]{2,8}', query)
-        important_keywords.extend(katakana_words)
-        
-        # 漢字語（2-6文字）
-        kanji_words = re.findall(r'[一-龠]{2,6}', query)
-        important_keywords.extend(kanji_words)
-        
-        # 英語（2-10文字）
-        english_words = re.findall(r'[a-zA-Z]{2,10}', query)
-        important_keywords.extend(english_words)
-        
-        # 🚫 除外パターン（意味のないフレーズ）
-        exclude_patterns = [
-            r'.*形式.*', r'.*整理.*', r'.*してください.*', r'.*情報.*テ.*', 
-            r'.*ブル.*', r'.*カラム.*', r'.*対象.*', r'.*場合.*', r'.*以下.*'
-        ]
-        
-        filtered_keywords = []
-        for keyword in important_keywords:
-            should_exclude = False
-            for exclude_pattern in exclude_patterns:
-                if re.match(exclude_pattern, keyword):
-                    should_exclude = True
-                    break
-            if not should_exclude and len(keyword.strip()) >= 2:
-                filtered_keywords.append(keyword.strip())
-        
-        # 全キーワードを結合（会社名を優先）
-        all_keywords = list(set(property_keywords + company_keywords + extracted_company_names + filtered_keywords))
-        
-        if not all_keywords:
-            logger.info("キーワードが見つからないため、キーワード検索をスキップします。")
+        if not bm25_available():
+            logger.info("🔇 bm25s が利用できないため、キーワード検索をスキップします")
             return []
         
-        logger.info(f"🔍 抽出キーワード: 物件={len(property_keywords)}個, 会社={len(company_keywords + extracted_company_names)}個, テキスト={len(filtered_keywords)}個")
-        logger.info(f"🎯 会社名抽出: {extracted_company_names}")
-        logger.info(f"💡 重要キーワード: {filtered_keywords[:10]}")  # 最初の10個のみ表示
-        
-        # 🎯 キーワードを種類別に分類
-        property_numbers = [k for k in all_keywords if re.match(r'WP[DN]\d{7}', k)]
-        other_keywords = [k for k in all_keywords if k not in property_numbers]
+        start_time = time.perf_counter()
+        results = await get_bm25_index_manager().search(query, company_id, limit)
         
-        logger.info(f"🔍 検出キーワード: 物件番号={len(property_numbers)}個, その他={len(other_keywords)}個")
+        # 表示用の類似度（従来のキーワード検索と同じく最上位を0.95とする）
+        top_score = results[0]["bm25_score"] if results else 0.0
+        for result in results:
+            result["similarity_score"] = round(0.95 * result["bm25_score"] / top_score, 4) if top_score > 0 else 0.0
         
-        # 大量キーワードは制限（全部見つかるように大幅拡張）
-        if len(all_keywords) > 25:
-            logger.info(f"⚡ 大量キーワード検索: {len(all_keywords)}個 → 上位25個に制限")
-            all_keywords = all_keywords[:25]
-        
-        try:
-            all_results = []
-            seen_chunk_ids = set()  # 重複除去用
-            
-            with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
-                with conn.cursor() as cur:
-                    
-                    # 🚀 各キーワードで個別検索
-                    for i, keyword in enumerate(all_keywords):
-                        logger.info(f"🔍 キーワード{i+1}/{len(all_keywords)}: '{keyword}' で検索中...")
-                        
-                        sql_keyword = """
-                        SELECT
-                            c.id, c.doc_id, c.chunk_index, c.content,
-                            ds.name as document_name, ds.type as document_type,
-                            0.95 as similarity_score, -- 複数キーワード検索は最高スコア
-                            'multi_keyword' as search_method
-                        FROM chunks c
-                        LEFT JOIN document_sources ds ON ds.id = c.doc_id
-                        WHERE c.content ILIKE %s
-                        AND ds.active = true
-                        """
-                        params_keyword = [f"%{keyword}%"]
-
-                        # 会社IDフィルタ（デバッグモードで無効化可能）
-                        debug_mode_no_company_filter = os.getenv("DEBUG_NO_COMPANY_FILTER", "false").lower() == "true"
-                        
-                        if company_id and not debug_mode_no_company_filter:
-                            sql_keyword += " AND c.company_id = %s"
-                            params_keyword.append(company_id)
-                        elif debug_mode_no_company_filter:
-                            logger.warning(f"🚫 デバッグモード: キーワード検索で会社IDフィルタ無効化")
-                        
-                        # 各キーワードで最大20件取得（全部見つかるように大幅拡張）
-                        sql_keyword += " LIMIT 20"
-                        
-                        cur.execute(sql_keyword, params_keyword)
-                        keyword_results = cur.fetchall()
-                        
-                        # 重複除去して追加
-                        new_results = []
-                        for row in keyword_results:
-                            if row['id'] not in seen_chunk_ids:
-                                seen_chunk_ids.add(row['id'])
-                                new_results.append(dict(row))
-                        
-                        all_results.extend(new_results)
-                        logger.info(f"   ✅ '{keyword}': {len(keyword_results)}件ヒット, 新規{len(new_results)}件追加")
-                    
-                    # 類似度でソート
-                    all_results.sort(key=lambda x: x['similarity_score'], reverse=True)
-                    
-                    # 制限数に調整
-                    final_results = all_results[:limit]
-                    
-                    logger.info(f"🎯 複数キーワード検索完了: 総計{len(final_results)}件取得")
-                    logger.info(f"   📊 物件番号: {len(property_numbers)}個, その他: {len(other_keywords)}個")
-                    
-                    return final_results
-                    
-        except Exception as e:
-            logger.error(f"❌ 複数キーワード検索エラー: {e}")
-            return []
+        logger.info(f"🔑 Step 3-Keyword: BM25検索完了 {len(results)}件 ({(time.perf_counter() - start_time) * 1000:.1f}ms)")
+        return results
 
     def _get_db_url(self) -> str:
         """データベースURLを構築"""
@@ -336,251 +257,226 @@ class RealtimeRAGProcessor:
             logger.error(f"❌ Step 2エラー: エンベディング生成失敗 - {e}")
             raise
     
+    def _get_type_quotas(self, company_id: Optional[str], conn=None) -> Dict[str, int]:
+        """
+        ファイルタイプ別の最低枠を取得
+        既定値（RAG_TYPE_QUOTAS）に company_settings.retrieval_type_quotas を上書きして返す
+        """
+        if not company_id:
+            return dict(DEFAULT_TYPE_QUOTAS)
+
+        cached = _type_quota_cache.get(company_id)
+        if cached and time.time() - cached[0] < TYPE_QUOTA_CACHE_SECONDS:
+            return cached[1]
+
+        if conn is None:
+            with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as own_conn:
+                return self._get_type_quotas(company_id, own_conn)
+
+        quotas = dict(DEFAULT_TYPE_QUOTAS)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT retrieval_type_quotas FROM company_settings WHERE company_id = %s",
+                    (company_id,)
+                )
+                row = cur.fetchone()
+            if row and row['retrieval_type_quotas']:
+                quotas.update(_parse_type_quotas(row['retrieval_type_quotas']))
+        except psycopg2.Error as e:
+            # マイグレーション未適用（sql/add_retrieval_type_quotas.sql）の場合は既定値を使用
+            conn.rollback()
+            logger.debug(f"会社別タイプ枠の取得をスキップ: {e}")
+
+        _type_quota_cache[company_id] = (time.time(), quotas)
+        return quotas
+
     async def step3_similarity_search(self, query_embedding: List[float], company_id: str = None, top_k: int = 80) -> List[Dict]:  # 🎯🎯 50→80に大幅拡張（最大限の情報網羅）
         """
         🔍 Step 3. 類似チャンク検索（Top-K）
         Supabaseの chunks テーブルから、ベクトル距離が近いチャンクを pgvector を用いて取得
-        PDFファイルを含むすべてのファイルタイプを平等に検索対象とする
+        1回のクエリで Top-K より広い候補を取得し、ファイルタイプ別の枠（PDF等）を候補の中から確保する
         """
         logger.info(f"🔍 Step 3: 類似チャンク検索開始 (Top-{top_k})")
+        step3_start = time.perf_counter()
         
         try:
-            with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
-                with conn.cursor() as cur:
-                    # 🔍 まず、埋め込みベクトルが利用可能なチャンクでベクトル類似検索
-                    
-                    # Convert query vector to proper string format and cast to vector type
-                    vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
-                    
-                    sql_vector = f"""
-                    SELECT
-                        c.id,
-                        c.doc_id,
-                        c.chunk_index,
-                        c.content,
-                        ds.name as document_name,
-                        ds.type as document_type,
-                        1 - (c.embedding <=> '{vector_str}'::vector) as similarity_score,
-                        'vector' as search_method
-                    FROM chunks c
-                    LEFT JOIN document_sources ds ON ds.id = c.doc_id
-                    WHERE c.embedding IS NOT NULL
-                      AND c.content IS NOT NULL
-                      AND LENGTH(c.content) > 10
-                      AND ds.active = true
-                    """
-                    
-                    params_vector = []
-                    
-                    # 会社IDフィルタ（オプション）- デバッグモードで一時的に無効化可能
-                    debug_mode_no_company_filter = os.getenv("DEBUG_NO_COMPANY_FILTER", "false").lower() == "true"
-                    
-                    if company_id and not debug_mode_no_company_filter:
-                        sql_vector += " AND c.company_id = %s"
-                        params_vector.append(company_id)
-                        logger.info(f"🏢 会社IDフィルタ適用: {company_id}")
-                    elif debug_mode_no_company_filter:
-                        logger.warning(f"🚫 デバッグモード: 会社IDフィルタを無効化して全データを検索")
-                    
-                    # ベクトル距離順でソート
-                    sql_vector += f" ORDER BY c.embedding <=> '{vector_str}'::vector LIMIT %s"
-                    params_vector.append(top_k)
-                    
-                    logger.info(f"実行SQL: ベクトル類似検索 (Top-{top_k})")
-                    cur.execute(sql_vector, params_vector)
-                    vector_results = cur.fetchall()
-                    
-                    # 🔍 PDFファイルのベクトル検索結果を確認
-                    pdf_vector_count = len([r for r in vector_results if r['document_type'] == 'pdf'])
-                    excel_vector_count = len([r for r in vector_results if r['document_type'] == 'excel'])
-                    
-                    logger.info(f"ベクトル検索結果: PDF={pdf_vector_count}件, Excel={excel_vector_count}件, 総計={len(vector_results)}件")
-                    
-                    # 結果を辞書のリストに変換
-                    similar_chunks = []
-                    for row in vector_results:
-                        similar_chunks.append({
-                            'chunk_id': row['id'],
-                            'doc_id': row['doc_id'],
-                            'chunk_index': row['chunk_index'],
-                            'content': row['content'],
-                            'document_name': row['document_name'],
-                            'document_type': row['document_type'],
-                            'similarity_score': float(row['similarity_score']),
-                            'search_method': row['search_method']
-                        })
+            # 会社IDフィルタ（オプション）- デバッグモードで一時的に無効化可能
+            debug_mode_no_company_filter = os.getenv("DEBUG_NO_COMPANY_FILTER", "false").lower() == "true"
+            filter_company_id = company_id if company_id and not debug_mode_no_company_filter else None
+            candidate_limit = top_k * TYPE_CANDIDATE_MULTIPLIER
+            
+            # 🧮 チャンク数の少ない会社はローカルのベクトルインデックスで検索（対象外・構築中は None）
+            candidates = None
+            if filter_company_id:
+                local_start = time.perf_counter()
+                local_results = await get_vector_index_manager().search(query_embedding, filter_company_id, candidate_limit)
+                if local_results is not None:
+                    CHAT_STAGE_SECONDS.observe(time.perf_counter() - local_start, stage="step3_local_index")
+                    type_quotas = self._get_type_quotas(filter_company_id)
+                    type_counts = {}
+                    candidates = []
+                    for result in local_results:
+                        doc_type = result['document_type'] or 'unknown'
+                        type_counts[doc_type] = type_counts.get(doc_type, 0) + 1
+                        candidates.append({**result, 'id': result['chunk_id'], 'type_rank': type_counts[doc_type]})
+                    logger.info(f"🧮 ローカルベクトルインデックスで検索: 候補{len(candidates)}件 (タイプ枠={type_quotas})")
+            
+            if candidates is None:
+                connect_start = time.perf_counter()
+                with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
+                    CHAT_STAGE_SECONDS.observe(time.perf_counter() - connect_start, stage="step3_connect")
+                    type_quotas = self._get_type_quotas(filter_company_id, conn)
+                    quantized_mode = get_quantized_mode(conn)
+                
+                    with conn.cursor() as cur:
+                        # Convert query vector to proper string format and cast to vector type
+                        vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
+                        # 📎 非正規化列があれば document_sources を JOIN せずにチャンクだけで絞り込む
+                        source = get_chunk_search_source(cur)
                     
-                    # 🔍 PDFファイルの結果が少ない場合、フォールバック検索を実行
-                    if pdf_vector_count < 20:  # PDFファイルの結果が20件未満の場合（80個中25%基準）
-                        logger.info("📄 PDFファイルの結果が少ないため、フォールバック検索を実行")
-                        
-                        # 埋め込みベクトルがないチャンクに対してテキスト検索を実行
-                        sql_text = """
-                        SELECT
-                            c.id,
-                            c.doc_id,
-                            c.chunk_index,
-                            c.content,
-                            ds.name as document_name,
-                            ds.type as document_type,
-                            0.5 as similarity_score,
-                            'text_fallback' as search_method
-                        FROM chunks c
-                        LEFT JOIN document_sources ds ON ds.id = c.doc_id
-                        WHERE c.embedding IS NULL
-                          AND c.content IS NOT NULL
-                          AND LENGTH(c.content) > 10
-                          AND ds.type = 'pdf'
-                        """
-                        
-                        params_text = []
-                        
-                        # 会社IDフィルタ（デバッグモードで無効化可能）
-                        debug_mode_no_company_filter = os.getenv("DEBUG_NO_COMPANY_FILTER", "false").lower() == "true"
-                        
-                        if company_id and not debug_mode_no_company_filter:
-                            sql_text += " AND c.company_id = %s"
-                            params_text.append(company_id)
-                        
-                        # ランダムサンプリング（埋め込みベクトルがない場合）
-                        sql_text += " ORDER BY RANDOM() LIMIT %s"
-                        params_text.append(min(10, top_k))
-                        
-                        logger.info("実行SQL: PDFファイル向けテキストフォールバック検索")
-                        cur.execute(sql_text, params_text)
-                        text_fallback_results = cur.fetchall()
-                        
-                        # フォールバック結果を追加
-                        for row in text_fallback_results:
-                            similar_chunks.append({
-                                'chunk_id': row['id'],
-                                'doc_id': row['doc_id'],
-                                'chunk_index': row['chunk_index'],
-                                'content': row['content'],
-                                'document_name': row['document_name'],
-                                'document_type': row['document_type'],
-                                'similarity_score': float(row['similarity_score']),
-                                'search_method': row['search_method']
-                            })
-                        
-                        logger.info(f"フォールバック検索で{len(text_fallback_results)}件のPDFチャンクを追加")
+                        # 🗜️ 量子化インデックスがあれば小さな表現で候補を絞り、元のベクトルで再スコアリング
+                        exact_order_sql = f"c.embedding <=> '{vector_str}'::vector"
+                        if quantized_mode:
+                            ann_limit = rescore_candidate_count(candidate_limit)
+                            ann_order_sql = quantized_distance_sql(quantized_mode, vector_str)
+                            prepare_quantized_search(cur, ann_limit)
+                        else:
+                            ann_limit = candidate_limit
+                            ann_order_sql = exact_order_sql
                     
-                    # 🔍 さらに、特定のファイルタイプが不足している場合の追加検索
-                    file_type_distribution = {}
-                    for chunk in similar_chunks:
-                        doc_type = chunk['document_type'] or 'unknown'
-                        file_type_distribution[doc_type] = file_type_distribution.get(doc_type, 0) + 1
+                        where_sql = f"c.embedding IS NOT NULL AND {source.searchable}"
+                        if filter_company_id:
+                            where_sql += " AND c.company_id = %s"
                     
-                    # PDFファイルの結果が依然として少ない場合
-                    if file_type_distribution.get('pdf', 0) < 15:  # 5→15に調整（80個中約20%基準）
-                        logger.info("📄 PDFファイル結果が不足しているため、追加検索を実行")
-                        
-                        # 会社全体のPDFファイルから代表的なチャンクを取得
-                        sql_pdf_supplement = """
+                        # ANN候補を1回で取得し、ファイルタイプ内の順位を付与
+                        sql_vector = f"""
+                        WITH ann AS (
+                            SELECT
+                                c.id,
+                                c.doc_id,
+                                c.chunk_index,
+                                c.content,
+                                {source.document_name} as document_name,
+                                {source.document_type} as document_type,
+                                c.embedding
+                            FROM {source.from_sql}
+                            WHERE {where_sql}
+                            ORDER BY {ann_order_sql}
+                            LIMIT %s
+                        ),
+                        candidates AS (
+                            SELECT
+                                id,
+                                doc_id,
+                                chunk_index,
+                                content,
+                                document_name,
+                                document_type,
+                                1 - (embedding <=> '{vector_str}'::vector) as similarity_score
+                            FROM ann
+                            ORDER BY embedding <=> '{vector_str}'::vector
+                            LIMIT %s
+                        )
                         SELECT
-                            c.id,
-                            c.doc_id,
-                            c.chunk_index,
-                            c.content,
-                            ds.name as document_name,
-                            ds.type as document_type,
-                            0.4 as similarity_score,
-                            'pdf_supplement' as search_method
-                        FROM chunks c
-                        LEFT JOIN document_sources ds ON ds.id = c.doc_id
-                        WHERE c.content IS NOT NULL
-                          AND LENGTH(c.content) > 10
-                          AND ds.type = 'pdf'
-                          AND ds.active = true
+                            *,
+                            'vector' as search_method,
+                            ROW_NUMBER() OVER (
+                                PARTITION BY COALESCE(document_type, 'unknown')
+                                ORDER BY similarity_score DESC
+                            ) as type_rank
+                        FROM candidates
+                        ORDER BY similarity_score DESC
                         """
-                        
-                        params_pdf_supplement = []
-                        
-                        # 会社IDフィルタ（デバッグモードで無効化可能）
-                        debug_mode_no_company_filter = os.getenv("DEBUG_NO_COMPANY_FILTER", "false").lower() == "true"
-                        
-                        if company_id and not debug_mode_no_company_filter:
-                            sql_pdf_supplement += " AND c.company_id = %s"
-                            params_pdf_supplement.append(company_id)
-                        
-                        # 最新のチャンクから優先的に取得
-                        sql_pdf_supplement += " ORDER BY c.id DESC LIMIT %s"
-                        params_pdf_supplement.append(15)  # 5→15に拡張（PDFサプリメント強化）
-                        
-                        logger.info("実行SQL: PDF補完検索")
-                        cur.execute(sql_pdf_supplement, params_pdf_supplement)
-                        pdf_supplement_results = cur.fetchall()
-                        
-                        # PDF補完結果を追加
-                        for row in pdf_supplement_results:
-                            # 重複チェック
-                            if not any(chunk['chunk_id'] == row['id'] for chunk in similar_chunks):
-                                similar_chunks.append({
-                                    'chunk_id': row['id'],
-                                    'doc_id': row['doc_id'],
-                                    'chunk_index': row['chunk_index'],
-                                    'content': row['content'],
-                                    'document_name': row['document_name'],
-                                    'document_type': row['document_type'],
-                                    'similarity_score': float(row['similarity_score']),
-                                    'search_method': row['search_method']
-                                })
-                        
-                        logger.info(f"PDF補完検索で{len(pdf_supplement_results)}件のチャンクを追加")
-                    
-                    # 結果を類似度順でソート
-                    similar_chunks.sort(key=lambda x: x['similarity_score'], reverse=True)
-                    
-                    # 最大チャンク数に制限
-                    final_chunks = similar_chunks[:top_k]
-                    
-                    logger.info(f"✅ Step 3完了: {len(final_chunks)}個の類似チャンクを取得")
-                    
-                    # 🔍 詳細チャンク選択ログ（リアルタイムRAG）
-                    print("\n" + "="*80)
-                    print(f"🔍 【Step 3: 類似チャンク検索結果】")
-                    print(f"📊 取得チャンク数: {len(final_chunks)}件 (Top-{top_k})")
-                    print(f"🏢 会社IDフィルタ: {'適用 (' + company_id + ')' if company_id else '未適用（全データ検索）'}")
-                    print(f"🧠 エンベディングモデル: {self.embedding_model} ({self.expected_dimensions}次元)")
                     
-                    # ファイルタイプ別統計を表示
-                    final_file_type_distribution = {}
-                    for chunk in final_chunks:
-                        doc_type = chunk['document_type'] or 'unknown'
-                        final_file_type_distribution[doc_type] = final_file_type_distribution.get(doc_type, 0) + 1
-                    
-                    print(f"📁 ファイルタイプ別結果: {final_file_type_distribution}")
-                    print("="*80)
-                    
-                    for i, chunk in enumerate(final_chunks):
-                        similarity = chunk['similarity_score']
-                        doc_name = chunk['document_name'] or 'Unknown'
-                        chunk_idx = chunk['chunk_index']
-                        content_preview = (chunk['content'] or '')[:150].replace('\n', ' ')
-                        search_method = chunk['search_method']
-                        
-                        # 類似度に基づく評価
-                        if similarity > 0.8:
-                            evaluation = "🟢 非常に高い関連性"
-                        elif similarity > 0.6:
-                            evaluation = "🟡 高い関連性"
-                        elif similarity > 0.4:
-                            evaluation = "🟠 中程度の関連性"
-                        elif similarity > 0.2:
-                            evaluation = "🔴 低い関連性"
-                        else:
-                            evaluation = "⚫ 極めて低い関連性"
-                        
-                        print(f"  {i+1:2d}. 📄 {doc_name} ({chunk['document_type']})")
-                        print(f"      🧩 チャンク#{chunk_idx} | 🎯 類似度: {similarity:.4f} | {evaluation}")
-                        print(f"      🔍 検索方法: {search_method}")
-                        print(f"      📝 内容: {content_preview}...")
-                        print(f"      🔗 チャンクID: {chunk['chunk_id']} | 📄 ドキュメントID: {chunk['doc_id']}")
-                        print()
-                    
-                    print("="*80 + "\n")
+                        params_vector = []
+                        if filter_company_id:
+                            params_vector.append(filter_company_id)
+                            logger.info(f"🏢 会社IDフィルタ適用: {filter_company_id}")
+                        elif debug_mode_no_company_filter:
+                            logger.warning(f"🚫 デバッグモード: 会社IDフィルタを無効化して全データを検索")
+                        params_vector.extend([ann_limit, candidate_limit])
                     
-                    return final_chunks
+                        logger.info(
+                            f"実行SQL: ベクトル類似検索 (候補{candidate_limit}件 → Top-{top_k}, タイプ枠={type_quotas}, "
+                            f"量子化={quantized_mode or 'なし'})"
+                        )
+                        query_start = time.perf_counter()
+                        cur.execute(sql_vector, params_vector)
+                        fetch_start = time.perf_counter()
+                        candidates = cur.fetchall()
+                        fetch_end = time.perf_counter()
+                        CHAT_STAGE_SECONDS.observe(fetch_start - query_start, stage="step3_query")
+                        CHAT_STAGE_SECONDS.observe(fetch_end - fetch_start, stage="step3_fetch")
+                        if quantized_mode and len(candidates) < candidate_limit:
+                            # 会社のチャンク数が候補数未満で全件返っている場合は取り直さない
+                            eligible_count = count_eligible_rows(
+                                cur, source.from_sql, where_sql, params_vector[:-2], candidate_limit
+                            )
+                            if needs_exact_fallback(len(candidates), eligible_count):
+                                # 会社IDの絞り込みで候補が減った場合は元のベクトルで全件比較
+                                params_vector[-2] = candidate_limit
+                                cur.execute(sql_vector.replace(ann_order_sql, exact_order_sql), params_vector)
+                                candidates = cur.fetchall()
+                            CHAT_STAGE_SECONDS.observe(time.perf_counter() - fetch_end, stage="step3_exact_fallback")
+            
+            # 🔍 タイプ別の枠を先に確保し、残りを類似度順で埋める
+            selected_ids = set()
+            selected = []
+            for row in candidates:
+                quota = type_quotas.get(row['document_type'] or 'unknown', 0)
+                if row['type_rank'] <= quota and len(selected) < top_k:
+                    selected_ids.add(row['id'])
+                    selected.append(row)
+            for row in candidates:
+                if len(selected) >= top_k:
+                    break
+                if row['id'] not in selected_ids:
+                    selected_ids.add(row['id'])
+                    selected.append(row)
+            
+            # 結果を辞書のリストに変換（類似度順）
+            final_chunks = [
+                {
+                    'chunk_id': row['id'],
+                    'doc_id': row['doc_id'],
+                    'chunk_index': row['chunk_index'],
+                    'content': row['content'],
+                    'document_name': row['document_name'],
+                    'document_type': row['document_type'],
+                    'similarity_score': float(row['similarity_score']),
+                    'search_method': row['search_method']
+                }
+                for row in selected
+            ]
+            final_chunks.sort(key=lambda x: x['similarity_score'], reverse=True)
+            CHAT_STAGE_SECONDS.observe(time.perf_counter() - step3_start, stage="step3_similarity_search")
+            
+            logger.info(f"✅ Step 3完了: {len(final_chunks)}個の類似チャンクを取得（候補{len(candidates)}件）")
+            
+            # 🔍 詳細チャンク選択ログ（詳細トレース時のみ組み立てる）
+            if trace_enabled(logger):
+                final_file_type_distribution = {}
+                for chunk in final_chunks:
+                    doc_type = chunk['document_type'] or 'unknown'
+                    final_file_type_distribution[doc_type] = final_file_type_distribution.get(doc_type, 0) + 1
+                
+                lines = [
+                    f"🔍 【Step 3: 類似チャンク検索結果】 {len(final_chunks)}件 (Top-{top_k})",
+                    f"🏢 会社IDフィルタ: {'適用 (' + company_id + ')' if company_id else '未適用（全データ検索）'}",
+                    f"🧠 エンベディングモデル: {self.embedding_model} ({self.expected_dimensions}次元)",
+                    f"📁 ファイルタイプ別結果: {final_file_type_distribution}",
+                ]
+                for i, chunk in enumerate(final_chunks):
+                    content_preview = (chunk['content'] or '')[:150].replace('\n', ' ')
+                    lines.append(
+                        f"  {i+1:2d}. 📄 {chunk['document_name'] or 'Unknown'} ({chunk['document_type']}) "
+                        f"#{chunk['chunk_index']} 🎯 {chunk['similarity_score']:.4f} [{chunk['search_method']}] "
+                        f"chunk={chunk['chunk_id']} doc={chunk['doc_id']} 📝 {content_preview}..."
+                    )
+                trace(logger, "%s", "\n".join(lines))
+            
+            return final_chunks
         
         except Exception as e:
             logger.error(f"❌ Step 3エラー: 類似検索失敗 - {e}")
@@ -601,10 +497,9 @@ class RealtimeRAGProcessor:
             }
         
         try:
-            # 🔍 Step 4: コンテキスト構築ログ
-            print("\n" + "="*80)
-            print(f"💡 【Step 4: LLM回答生成 - コンテキスト構築】")
-            print(f"📊 利用可能チャンク数: {len(similar_chunks)}個")
+            # 🔍 Step 4: コンテキスト構築ログ（詳細トレース時のみ組み立てる）
+            detailed = trace_enabled(logger)
+            trace_lines = [f"💡 【Step 4: LLM回答生成 - コンテキスト構築】 利用可能チャンク数: {len(similar_chunks)}個"] if detailed else None
             
             # 🚀🚀🚀 無限コンテキスト：情報完全性絶対優先
             question_length = len(question)
@@ -614,54 +509,58 @@ class RealtimeRAGProcessor:
             if question_length > 10000:
                 # 超長質問には無限に近いコンテキストを提供
                 max_context_length = base_limit + (question_length * 2.0)  # 🎆 上限なし！
-                print(f"🎆 無限コンテキスト長: {max_context_length:,}文字 (情報完全性絶対優先)")
             elif question_length > 5000:
                 # 長い質問には大量コンテキストを提供
                 max_context_length = base_limit + (question_length * 1.5)  # 🎆 制限緩和！
-                print(f"🎆 大量コンテキスト長: {max_context_length:,}文字 (情報完全性絶対優先)")
             elif question_length > 2000:
                 max_context_length = base_limit + (question_length * 1.0)  # 🎆 制限緩和！
-                print(f"🎆 大量コンテキスト長: {max_context_length:,}文字 (情報完全性絶対優先)")
             else:
                 max_context_length = base_limit  # 🎆 50万文字（無限モード基準）
-                print(f"🎆 無限標準コンテキスト長: {max_context_length:,}文字 (情報完全性絶対優先)")
-            
-            print("="*80)
+            if detailed:
+                trace_lines.append(f"🎆 コンテキスト長上限: {max_context_length:,}文字 (情報完全性絶対優先)")
             
             # コンテキスト構築（原文ベース）
             context_parts = []
             total_length = 0
+            total_tokens = 0
             used_chunks = []
+            # トークン予算は概算で判定（エンコードせずに文字種比率で見積もる）
+            tokenizer = get_tokenizer()
             
             for i, chunk in enumerate(similar_chunks):
                 chunk_content = f"【{chunk['document_name']}】\n{chunk['content']}\n"
                 chunk_length = len(chunk_content)
-                
-                print(f"  {i+1:2d}. 📄 {chunk['document_name']} [チャンク#{chunk['chunk_index']}]")
-                print(f"      🎯 類似度: {chunk['similarity_score']:.4f}")
-                print(f"      📏 文字数: {chunk_length:,}文字")
+                chunk_tokens = tokenizer.estimate(chunk_content)
                 
                 if total_length + chunk_length > max_context_length:
-                    print(f"      ❌ 除外: コンテキスト長制限超過 (現在: {total_length:,}文字)")
-                    print(f"         💡 {i}個のチャンクを最終的に使用")
+                    if detailed:
+                        trace_lines.append(f"  ❌ 除外: コンテキスト長制限超過 (現在: {total_length:,}文字) → {i}個のチャンクを使用")
+                    break
+                
+                if total_tokens + chunk_tokens > MAX_CONTEXT_TOKENS:
+                    if detailed:
+                        trace_lines.append(f"  ❌ 除外: トークン上限超過 (現在: 推定 {total_tokens:,}トークン) → {i}個のチャンクを使用")
                     break
                 
                 context_parts.append(chunk_content)
                 total_length += chunk_length
+                total_tokens += chunk_tokens
                 used_chunks.append(chunk)
-                print(f"      ✅ 採用: 累計 {total_length:,}文字")
-                print(f"      📝 内容プレビュー: {(chunk['content'] or '')[:100].replace(chr(10), ' ')}...")
-                print()
+                if detailed:
+                    trace_lines.append(
+                        f"  {i+1:2d}. 📄 {chunk['document_name']} [チャンク#{chunk['chunk_index']}] "
+                        f"🎯 {chunk['similarity_score']:.4f} 📏 {chunk_length:,}文字 (推定 {chunk_tokens:,}トークン) "
+                        f"累計 {total_length:,}文字 📝 {(chunk['content'] or '')[:100].replace(chr(10), ' ')}..."
+                    )
             
             context = "\n".join(context_parts)
             
             # 🎆 無限コンテキスト：情報抜け絶対防止
             # 制限を大幅緩和して、すべての情報を漏らさず収集
             
-            print(f"📋 最終コンテキスト情報:")
-            print(f"   ✅ 使用チャンク数: {len(used_chunks)}個")
-            print(f"   📏 総文字数: {len(context):,}文字")
-            print("="*80 + "\n")
+            logger.info(f"📋 最終コンテキスト: {len(used_chunks)}個のチャンク, {len(context):,}文字 (推定 {total_tokens:,}トークン)")
+            if detailed:
+                trace(logger, "%s", "\n".join(trace_lines))
             
             # 🎯 特別指示を取得してプロンプトの一番前に配置
             special_instructions_text = ""
@@ -684,20 +583,18 @@ class RealtimeRAGProcessor:
                             
                             if special_results:
                                 special_instructions = []
-                                print(f"🎯 特別指示を取得しました: {len(special_results)}件")
+                                logger.info(f"🎯 特別指示を取得しました: {len(special_results)}件")
                                 for i, row in enumerate(special_results, 1):
                                     resource_name = row['name']
                                     special_instruction = row['special']
                                     special_instructions.append(f"{i}. 【{resource_name}】: {special_instruction}")
-                                    print(f"   {i}. {resource_name}: {special_instruction}")
+                                    trace(logger, "   %s. %s: %s", i, resource_name, special_instruction)
                                 
                                 special_instructions_text = "特別な回答指示（以下のリソースを参照する際は、各リソースの指示に従ってください）：\n" + "\n".join(special_instructions) + "\n\n"
-                                print(f"✅ 特別指示をプロンプトに追加完了")
                             else:
-                                print(f"ℹ️ 特別指示が設定されたリソースが見つかりませんでした")
+                                logger.debug("ℹ️ 特別指示が設定されたリソースが見つかりませんでした")
                                 
                 except Exception as e:
-                    print(f"⚠️ 特別指示取得エラー: {e}")
                     logger.warning(f"特別指示取得エラー: {e}")
             
             # 🎯 複雑な質問の検出（表形式、複数条件など）
@@ -811,6 +708,7 @@ class RealtimeRAGProcessor:
                             company_id=company_id
                         )
                         logger.info("📥 Enhanced Multi Gemini Clientからのレスポンス受信完了")
+                        GENERATION_PATH_TOTAL.inc(path="enhanced")
                     else:
                         raise ImportError("Enhanced Multi Gemini Client利用不可")
                 except (ImportError, Exception) as enhanced_error:
@@ -837,13 +735,14 @@ class RealtimeRAGProcessor:
                                 ]
                             }
                         logger.info("📥 Multi Gemini Clientからのレスポンス受信完了（10回リトライ後）")
+                        GENERATION_PATH_TOTAL.inc(path="multi_gemini")
                     else:
                         logger.error("❌ Multi Gemini Client利用不可、全APIキー失敗")
                         raise Exception("全APIキーでリトライ失敗")
                 
                 if not response_data:
                     raise Exception("レスポンスデータが取得できませんでした")
-                logger.info(f"🔍 Geminiレスポンス構造: {list(response_data.keys())}")
+                logger.debug("🔍 Geminiレスポンス構造: %s", list(response_data.keys()))
                 
                 answer = None
                 
@@ -852,11 +751,11 @@ class RealtimeRAGProcessor:
                     
                     try:
                         candidate = response_data["candidates"][0]
-                        logger.info(f"🔍 candidate構造: {list(candidate.keys()) if isinstance(candidate, dict) else type(candidate)}")
+                        logger.debug("🔍 candidate構造: %s", list(candidate.keys()) if isinstance(candidate, dict) else type(candidate))
                         
                         if "finishReason" in candidate:
                             finish_reason = candidate['finishReason']
-                            logger.info(f"🔍 finishReason: {finish_reason}")
+                            logger.debug("🔍 finishReason: %s", finish_reason)
                             
                             # MAX_TOKENSエラーは32768トークンで解決済み
                             if finish_reason == "MAX_TOKENS":
@@ -907,9 +806,9 @@ class RealtimeRAGProcessor:
                                         actually_used_chunks.append(chunk)
                                         if chunk_doc_name not in actually_used_sources:
                                             actually_used_sources.append(chunk_doc_name)
-                                            logger.info(f"✅ 実使用ソース確定: {chunk_doc_name}")
+                                            trace(logger, "✅ 実使用ソース確定: %s", chunk_doc_name)
                                     else:
-                                        logger.info(f"❌ 未使用ソース除外: {chunk_doc_name}")
+                                        trace(logger, "❌ 未使用ソース除外: %s", chunk_doc_name)
                                 
                                 # 実際に使用されたチャンクがない場合の安全装置（より制限的に）
                                 if not actually_used_sources and used_chunks:
@@ -1269,11 +1168,11 @@ class RealtimeRAGProcessor:
         is_used = final_score >= threshold
         
         # デバッグログ
-        chunk_doc_name = chunk.get('document_name', 'Unknown')
-        if is_used:
-            logger.info(f"   ✅ チャンク使用確認: {chunk_doc_name} (スコア: {final_score:.2f}, 閾値: {threshold})")
-        else:
-            logger.info(f"   ❌ チャンク未使用: {chunk_doc_name} (スコア: {final_score:.2f}, 閾値: {threshold})")
+        trace(
+            logger, "   %s: %s (スコア: %.2f, 閾値: %s)",
+            "✅ チャンク使用確認" if is_used else "❌ チャンク未使用",
+            chunk.get('document_name', 'Unknown'), final_score, threshold
+        )
         
         return is_used
     
@@ -1331,7 +1230,7 @@ class RealtimeRAGProcessor:
             question_text = str(question)
         
         logger.info(f"🚀 リアルタイムRAG処理開始: '{question_text[:50]}...'")
-        logger.info(f"🔧 デバッグ: 分割システム実行チェック開始")
+        logger.debug("🔧 デバッグ: 分割システム実行チェック開始")
         
         # Geminiによる自動質問分割処理
         import re
@@ -1350,9 +1249,9 @@ class RealtimeRAGProcessor:
         has_multi_tasks = any(re.search(pattern, question_text) for pattern in multi_task_indicators)
         is_long = len(question_text) > 30
         
-        logger.info(f"🔧 デバッグ: パターンチェック完了")
+        logger.debug("🔧 デバッグ: パターンチェック完了")
         logger.info(f"🔍 質問分析: 文字数={len(question_text)}, 複数タスク検出={has_multi_tasks}")
-        logger.info(f"🔧 デバッグ: is_long={is_long}, 分割判定={has_multi_tasks or is_long}")
+        logger.debug("🔧 デバッグ: is_long=%s, 分割判定=%s", is_long, has_multi_tasks or is_long)
         logger.info("🚫 質問分割機能は無効化されています - 単一処理で実行")
         
         if False:  # 質問分割を無効化（処理時間短縮・シンプル化のため）
@@ -1406,60 +1305,41 @@ class RealtimeRAGProcessor:
             processed_question = step1_result["processed_question"]
             
             # Step 2: エンベディング生成
-            query_embedding = await self.step2_generate_embedding(processed_question)
+            with CHAT_STAGE_SECONDS.time(stage="step2_generate_embedding"):
+                query_embedding = await self.step2_generate_embedding(processed_question)
 
-            # Step 3: ベクトル検索とキーワード検索を並列実行（キーワード検索は条件付き）
-            search_tasks = [self.step3_similarity_search(query_embedding, company_id, top_k)]
-            
-            # 🔧 キーワード検索の無効化チェック（一時的に強制無効化）
-            disable_keyword_search = True  # 強制的にキーワード検索をオフ
-            # disable_keyword_search = os.getenv("DISABLE_KEYWORD_SEARCH", "false").lower() == "true"
-            if not disable_keyword_search:
-                search_tasks.append(self._keyword_search(processed_question, company_id, 50))
-            else:
-                logger.info("🔇 キーワード検索をスキップしています (DISABLE_KEYWORD_SEARCH=true)")
-            results_list = await asyncio.gather(*search_tasks, return_exceptions=True)
+            # Step 3: ベクトル検索とBM25キーワード検索を並列実行
+            results_list = await asyncio.gather(
+                self.step3_similarity_search(query_embedding, company_id, top_k),
+                self._keyword_search(processed_question, company_id, 50),
+                return_exceptions=True
+            )
 
             vector_results = results_list[0] if not isinstance(results_list[0], Exception) else []
-            # キーワード検索の結果取得（無効化されている場合は空のリスト）
-            if disable_keyword_search:
-                keyword_results = []
-            else:
-                keyword_results = results_list[1] if len(results_list) > 1 and not isinstance(results_list[1], Exception) else []
+            keyword_results = results_list[1] if not isinstance(results_list[1], Exception) else []
+            if isinstance(results_list[1], Exception):
+                logger.warning(f"⚠️ キーワード検索エラー（ベクトル検索のみ使用）: {results_list[1]}")
 
-            # 結果の統合と重複除去
-            all_chunks = {r['chunk_id']: r for r in vector_results}
-            for r in keyword_results:
-                # キーワード検索結果を優先的に上書き
-                all_chunks[r['id']] = {
-                    'chunk_id': r['id'],
-                    'doc_id': r['doc_id'],
-                    'chunk_index': r['chunk_index'],
-                    'content': r['content'],
-                    'document_name': r['document_name'],
-                    'document_type': r['document_type'],
-                    'similarity_score': float(r['similarity_score']),
-                    'search_method': r['search_method']
-                }
-
-            # スコアでソート
-            sorted_chunks = sorted(all_chunks.values(), key=lambda x: x['similarity_score'], reverse=True)
+            # 順位ベースで統合（RRF）し、重複はベクトル検索側の情報を優先
+            fused_chunks = reciprocal_rank_fusion([vector_results, keyword_results], k=RRF_K)
             
             # 最終的なチャンクリスト
-            similar_chunks = sorted_chunks[:top_k]
+            similar_chunks = fused_chunks[:top_k]
             
             metadata = {
                 "original_question": question_text, # セグメントの質問をメタデータに含める
                 "processed_question": processed_question,
                 "chunks_used": len(similar_chunks),
-                "top_similarity": similar_chunks[0]["similarity_score"] if similar_chunks else 0.0,
+                "top_similarity": max((chunk["similarity_score"] for chunk in similar_chunks), default=0.0),
+                "keyword_hits": len(keyword_results),
                 "company_id": company_id,
                 "company_name": company_name,
-                "search_method": "hybrid_search" # ハイブリッド検索に変更
+                "search_method": "hybrid_search" # ベクトル + BM25 (RRF)
             }
             
             # Step 4: LLM回答生成
-            generation_result = await self.step4_generate_answer(processed_question, similar_chunks, company_name, company_id, user_id)
+            with CHAT_STAGE_SECONDS.time(stage="step4_generate_answer"):
+                generation_result = await self.step4_generate_answer(processed_question, similar_chunks, company_name, company_id, user_id)
             answer = generation_result["answer"]
             actually_used_chunks = generation_result["used_chunks"]
             
@@ -1499,6 +1379,9 @@ class RealtimeRAGProcessor:
 
 # グローバルインスタンス
 _realtime_rag_processor = None
+# 同一質問の同時実行を集約（RAG_SINGLE_FLIGHT=false で無効化）
+SINGLE_FLIGHT_ENABLED = os.getenv("RAG_SINGLE_FLIGHT", "true").lower() == "true"
+_question_flights = SingleFlight("リアルタイムRAG")
 
 def get_realtime_rag_processor() -> Optional[RealtimeRAGProcessor]:
     """リアルタイムRAGプロセッサのインスタンスを取得（シングルトンパターン）"""
@@ -1536,7 +1419,22 @@ async def process_question_realtime(question: str, company_id: str = None, compa
             "status": "error"
         }
     
-    return await processor.process_realtime_rag(question, company_id, company_name, top_k, user_id)
+    if not SINGLE_FLIGHT_ENABLED:
+        return await processor.process_realtime_rag(question, company_id, company_name, top_k, user_id)
+    
+    # 🛫 同じ会社・同じ質問・同じドキュメント構成のリクエストが処理中なら、その結果を共有する
+    question_text = question.text if hasattr(question, 'text') else str(question)
+    flight_key = (
+        company_id,
+        normalize_question(question_text),
+        document_set_version(company_id),
+        company_name,
+        top_k
+    )
+    return await _question_flights.run(
+        flight_key,
+        lambda: processor.process_realtime_rag(question_text, company_id, company_name, top_k, user_id)
+    )
 
 def realtime_rag_available() -> bool:
     """リアルタイムRAGが利用可能かチェック"""
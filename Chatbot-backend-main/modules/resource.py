@@ -192,7 +192,7 @@ async def toggle_resource_active_by_id(resource_id: str, db: Connection):
         supabase = get_supabase_client()
         
         # リソース情報を取得
-        query = supabase.table("document_sources").select("name, active").eq("id", resource_id)
+        query = supabase.table("document_sources").select("name, active, company_id").eq("id", resource_id)
         result = query.execute()
         
         if not result.data or len(result.data) == 0:
@@ -215,6 +215,14 @@ async def toggle_resource_active_by_id(resource_id: str, db: Connection):
         
         print(f"更新結果: {update_result.data if update_result.data else '更新失敗'}")
         
+        # 検索インデックスに有効/無効の切り替えを反映させる
+        from modules.bm25_index import mark_bm25_index_stale
+        from modules.vector_index import mark_vector_index_stale
+        from modules.single_flight import bump_document_set_version
+        mark_bm25_index_stale(result.data[0].get("company_id"))
+        mark_vector_index_stale(result.data[0].get("company_id"))
+        bump_document_set_version(result.data[0].get("company_id"))
+        
         return {
             "name": resource_name,
             "active": new_active_state,
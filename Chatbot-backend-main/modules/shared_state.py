@@ -0,0 +1,361 @@
+"""
+🔗 ワーカー間で共有する状態（APIキーのクールダウン・レート制限・インデックスの更新通知）
+uvicorn を複数ワーカーで起動しても、枯渇したAPIキーを全ワーカーが叩き続けたり、
+レート制限がワーカーごとにリセットされたりしないよう、状態を共有ストアに置きます
+
+- SHARED_STATE_BACKEND=memory（既定）: プロセス内のみ（従来どおり、単一ワーカー向け）
+- SHARED_STATE_BACKEND=sqlite: SHARED_STATE_PATH の SQLite（WALモード）を同一ホストの全ワーカーで共有
+- その他のバックエンドは register_shared_state_backend() で追加できます
+
+    state = get_shared_state()
+    state.set("gemini_chat_cooldown", api_key_id(api_key), time.time() + 60, ttl=60)
+    count = state.incr("rate_limit", key, ttl=60)
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "memory").lower()
+SHARED_STATE_PATH = os.getenv(
+    "SHARED_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "shared_state.db")
+)
+# SQLite のロック待ちの上限（秒）。呼び出しはイベントループ上で同期的に行われるため短くする
+SHARED_STATE_BUSY_TIMEOUT = float(os.getenv("SHARED_STATE_BUSY_TIMEOUT", "1.0"))
+# 更新世代の読み取りをプロセス内でキャッシュする時間（秒）。検索のたびにSQLiteを読まないため
+SHARED_STATE_GENERATION_CACHE_SECONDS = float(os.getenv("SHARED_STATE_GENERATION_CACHE_SECONDS", "1.0"))
+# 期限切れの行を掃除する確率（書き込みごと）
+_PURGE_PROBABILITY = 0.01
+# UPSERT ... RETURNING で incr を1文で行えるか（SQLite 3.35 以上）
+_SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+class SharedStateBackend(ABC):
+    """共有状態ストアのインターフェース（値は JSON で表現できるもの、ttl は秒。未実装のメソッドがあるとインスタンス化できない）"""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def incr(self, namespace: str, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """加算後の値を返す（キーがない・期限切れなら amount から開始し、ttl を設定）"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def expires_at(self, namespace: str, key: str) -> Optional[float]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_namespace(self, namespace: str) -> Dict[str, Any]:
+        """名前空間内の期限切れでない全キー"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_namespace(self, namespace: str) -> int:
+        raise NotImplementedError
+
+
+class MemorySharedState(SharedStateBackend):
+    """プロセス内のみの実装（単一ワーカー向け）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (namespace, key) -> (値, 期限)
+        self._data: Dict[tuple, tuple] = {}
+
+    def _live(self, item_key: tuple, now: float) -> Optional[tuple]:
+        item = self._data.get(item_key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[item_key]
+            return None
+        return item
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            item = self._live((namespace, key), time.time())
+        return default if item is None else item[0]
+
+    def set(self, namespace, key, value, ttl=None):
+        with self._lock:
+            self._data[(namespace, key)] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def incr(self, namespace, key, amount=1, ttl=None):
+        now = time.time()
+        with self._lock:
+            item = self._live((namespace, key), now)
+            if item is None:
+                item = (amount, now + ttl if ttl else None)
+            else:
+                item = (item[0] + amount, item[1])
+            self._data[(namespace, key)] = item
+            return item[0]
+
+    def expires_at(self, namespace, key):
+        with self._lock:
+            item = self._live((namespace, key), time.time())
+        return None if item is None else item[1]
+
+    def get_namespace(self, namespace):
+        now = time.time()
+        with self._lock:
+            return {
+                key: value for (ns, key), (value, expires) in list(self._data.items())
+                if ns == namespace and (expires is None or expires > now)
+            }
+
+    def clear_namespace(self, namespace):
+        with self._lock:
+            keys = [item_key for item_key in self._data if item_key[0] == namespace]
+            for item_key in keys:
+                del self._data[item_key]
+        return len(keys)
+
+
+class SQLiteSharedState(SharedStateBackend):
+    """SQLite（WALモード）による同一ホスト内の共有実装"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS shared_state (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+        """)
+        logger.info(f"🔗 共有状態ストア: SQLite ({path})")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 自動コミット（incr は1文の UPSERT、古い SQLite のみ BEGIN IMMEDIATE で排他）
+            conn = sqlite3.connect(
+                self.path, timeout=SHARED_STATE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _maybe_purge(self, conn: sqlite3.Connection, now: float):
+        if random.random() < _PURGE_PROBABILITY:
+            conn.execute("DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def get(self, namespace, key, default=None):
+        row = self._conn().execute(
+            "SELECT value FROM shared_state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO shared_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), now + ttl if ttl else None)
+        )
+        self._maybe_purge(conn, now)
+
+    def delete(self, namespace, key):
+        self._conn().execute("DELETE FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def incr(self, namespace, key, amount=1, ttl=None):
+        now = time.time()
+        conn = self._conn()
+        if _SQLITE_RETURNING:
+            # 1文で読み書きし、書き込みロックを保持する時間を最小にする（期限切れなら amount から開始）
+            row = conn.execute("""
+                INSERT INTO shared_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (namespace, key) DO UPDATE SET
+                    value = CASE WHEN expires_at IS NOT NULL AND expires_at <= ?
+                                 THEN excluded.value
+                                 ELSE CAST(CAST(value AS INTEGER) + ? AS TEXT) END,
+                    expires_at = CASE WHEN expires_at IS NOT NULL AND expires_at <= ?
+                                      THEN excluded.expires_at
+                                      ELSE expires_at END
+                RETURNING value
+            """, (namespace, key, json.dumps(amount), now + ttl if ttl else None, now, amount, now)).fetchone()
+            self._maybe_purge(conn, now)
+            return json.loads(row[0])
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                value, expires_at = amount, now + ttl if ttl else None
+            else:
+                value, expires_at = json.loads(row[0]) + amount, row[1]
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._maybe_purge(conn, now)
+        return value
+
+    def expires_at(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT expires_at FROM shared_state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def get_namespace(self, namespace):
+        rows = self._conn().execute(
+            "SELECT key, value FROM shared_state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time())
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def clear_namespace(self, namespace):
+        return self._conn().execute("DELETE FROM shared_state WHERE namespace = ?", (namespace,)).rowcount
+
+
+_backend_factories: Dict[str, Callable[[], SharedStateBackend]] = {
+    "memory": MemorySharedState,
+    "sqlite": lambda: SQLiteSharedState(SHARED_STATE_PATH),
+}
+_shared_state: Optional[SharedStateBackend] = None
+_shared_state_lock = threading.Lock()
+
+
+def register_shared_state_backend(name: str, factory: Callable[[], SharedStateBackend]):
+    """SHARED_STATE_BACKEND で選択できるバックエンドを追加（get_shared_state の初回呼び出し前に登録）"""
+    _backend_factories[name.lower()] = factory
+
+
+def get_shared_state() -> SharedStateBackend:
+    """共有状態ストアのシングルトンを取得"""
+    global _shared_state
+    if _shared_state is None:
+        with _shared_state_lock:
+            if _shared_state is None:
+                factory = _backend_factories.get(SHARED_STATE_BACKEND)
+                if factory is None:
+                    logger.warning(f"⚠️ 不明な SHARED_STATE_BACKEND={SHARED_STATE_BACKEND}: プロセス内の状態を使用します")
+                    factory = MemorySharedState
+                _shared_state = factory()
+    return _shared_state
+
+
+def shared_state_is_local() -> bool:
+    """プロセス内のみの状態か（単一ワーカー向けの構成か）"""
+    return isinstance(get_shared_state(), MemorySharedState)
+
+
+def api_key_id(api_key: str) -> str:
+    """APIキーを共有ストアに書かずに識別するためのID（ワーカー間でキーの並び順が違っても一致）"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+# 世代名 -> (読み取り時刻, 世代)
+_generation_cache: Dict[str, tuple] = {}
+
+
+def bump_generation(name: str) -> int:
+    """更新通知の世代を進める（他のワーカーは get_generation の変化で更新を検知）"""
+    generation = get_shared_state().incr("generation", name)
+    _generation_cache[name] = (time.monotonic(), generation)
+    return generation
+
+
+def get_generation(name: str) -> int:
+    """更新通知の世代（共有ストアの場合は SHARED_STATE_GENERATION_CACHE_SECONDS だけ遅れて反映）"""
+    state = get_shared_state()
+    if isinstance(state, MemorySharedState):
+        return state.get("generation", name, 0)
+    now = time.monotonic()
+    cached = _generation_cache.get(name)
+    if cached is not None and now - cached[0] < SHARED_STATE_GENERATION_CACHE_SECONDS:
+        return cached[1]
+    generation = state.get("generation", name, 0)
+    _generation_cache[name] = (now, generation)
+    return generation
+
+
+# slowapi（limits）のレート制限カウンタを共有ストアに置くためのストレージ
+try:
+    from limits.storage import Storage
+
+    class SharedStateLimitStorage(Storage):
+        """limits のストレージ実装（storage_uri="shared-state://"、固定ウィンドウ方式）"""
+
+        STORAGE_SCHEME = ["shared-state"]
+        _NAMESPACE = "rate_limit"
+
+        def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options):
+            super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+        @property
+        def base_exceptions(self):
+            return sqlite3.Error
+
+        def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+            state = get_shared_state()
+            value = state.incr(self._NAMESPACE, key, amount, ttl=expiry)
+            if elastic_expiry:
+                state.set(self._NAMESPACE, key, value, ttl=expiry)
+            return value
+
+        def get(self, key: str) -> int:
+            return get_shared_state().get(self._NAMESPACE, key, 0)
+
+        def get_expiry(self, key: str) -> float:
+            return get_shared_state().expires_at(self._NAMESPACE, key) or time.time()
+
+        def check(self) -> bool:
+            return True
+
+        def reset(self) -> Optional[int]:
+            return get_shared_state().clear_namespace(self._NAMESPACE)
+
+        def clear(self, key: str):
+            get_shared_state().delete(self._NAMESPACE, key)
+
+    LIMITS_STORAGE_AVAILABLE = True
+except ImportError:
+    LIMITS_STORAGE_AVAILABLE = False
+
+
+def rate_limit_storage_uri() -> str:
+    """slowapi の storage_uri（RATE_LIMIT_STORAGE_URI で redis:// なども指定可能）"""
+    uri = os.getenv("RATE_LIMIT_STORAGE_URI")
+    if uri:
+        return uri
+    if SHARED_STATE_BACKEND != "memory" and LIMITS_STORAGE_AVAILABLE:
+        return "shared-state://"
+    return "memory://"
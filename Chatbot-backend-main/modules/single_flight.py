@@ -0,0 +1,76 @@
+"""
+🛫 同一質問の同時実行の集約（シングルフライト）
+同じ会社で同じ質問が同時に届いた場合（始業時のお知らせ直後など）、
+最初のリクエストの処理（embedding・検索・Gemini生成）を共有し、後続は同じ結果を受け取ります
+
+- キーは (会社ID, 正規化した質問, ドキュメント構成のバージョン, ...)
+- 集約するのは処理中のリクエストだけ（結果のキャッシュはしない）
+- 利用回数・チャット履歴などユーザーごとの処理は呼び出し側でそれぞれ実行する
+"""
+
+import re
+import copy
+import asyncio
+import logging
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+# 末尾の句読点・記号は質問の意味を変えないため除去
+_TRAILING_PUNCTUATION_PATTERN = re.compile(r'[\s?!.。、,？！…]+$')
+
+# company_id -> ドキュメント構成のバージョン（アップロード・有効/無効切り替えで更新）
+_document_set_versions: Dict[str, int] = {}
+
+
+def normalize_question(question: str) -> str:
+    """集約キー用に質問を正規化（全角/半角・大文字/小文字・空白・末尾の記号の違いを吸収）"""
+    text = unicodedata.normalize("NFKC", question).lower().strip()
+    text = _WHITESPACE_PATTERN.sub(" ", text)
+    return _TRAILING_PUNCTUATION_PATTERN.sub("", text)
+
+
+def document_set_version(company_id: Optional[str]) -> int:
+    """会社のドキュメント構成のバージョン"""
+    return _document_set_versions.get(company_id or "", 0)
+
+
+def bump_document_set_version(company_id: Optional[str]):
+    """ドキュメントの追加・有効/無効切り替え時に呼び出す（以降の質問は処理中の結果を共有しない）"""
+    key = company_id or ""
+    _document_set_versions[key] = _document_set_versions.get(key, 0) + 1
+
+
+class SingleFlight:
+    """キーごとに処理中のタスクを1つに集約"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        同じキーの処理が実行中ならその結果を待ち、なければ func を実行する
+        結果は呼び出し側ごとにコピーして返す（呼び出し側での変更が他に影響しないように）
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        else:
+            logger.info(f"🛫 {self.name}: 処理中の同一リクエストに合流 (待機中={len(self._inflight)}件)")
+
+        # 待機側がキャンセルされても、共有中の処理は止めない
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    @property
+    def inflight_count(self) -> int:
+        return len(self._inflight)
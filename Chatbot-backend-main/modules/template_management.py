@@ -2,13 +2,131 @@
 テンプレート管理モジュール
 プロンプトテンプレートのCRUD操作とビジネスロジックを提供
 """
+import os
+import copy
+import time
 import uuid
+import asyncio
+import logging
 import datetime
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from pydantic import BaseModel
 from modules.timezone_utils import create_timestamp_for_db
 from supabase_adapter import select_data, insert_data, update_data, delete_data, execute_query
 from modules.database import SupabaseConnection
+from modules.shared_state import bump_generation, get_generation
+
+logger = logging.getLogger(__name__)
+
+# テンプレート一覧キャッシュ（会社ID・テンプレート種別ごと）
+# 他のワーカーでの更新は共有ストアの世代（templates / templates:{company_id}）の変化で検知して取り直す
+TEMPLATE_CACHE_TTL = float(os.getenv("TEMPLATE_CACHE_TTL", "300"))
+_template_cache: Dict[Tuple[Optional[str], Optional[str]], Tuple[float, Tuple[int, int], List[Dict]]] = {}
+
+# IN条件1回あたりのID数（PostgRESTのURL長制限対策）
+_IN_QUERY_BATCH_SIZE = 100
+
+# 使用回数のライトビハインドカウンタ
+TEMPLATE_USAGE_FLUSH_INTERVAL = float(os.getenv("TEMPLATE_USAGE_FLUSH_INTERVAL", "10"))
+_pending_usage_counts: Dict[str, int] = {}
+_usage_flush_task: Optional[asyncio.Task] = None
+
+def _template_cache_generation(company_id: Optional[str]) -> Tuple[int, int]:
+    """キャッシュの有効性を判定する世代（全体の世代, 会社ごとの世代）"""
+    company_generation = get_generation(f"templates:{company_id}") if company_id else 0
+    return get_generation("templates"), company_generation
+
+def invalidate_template_cache(company_id: Optional[str] = None):
+    """テンプレートキャッシュを破棄する（company_id未指定時は全件、他のワーカーにも世代で通知）"""
+    try:
+        bump_generation("templates" if company_id is None else f"templates:{company_id}")
+    except Exception as e:
+        logger.warning(f"テンプレートキャッシュの世代更新エラー: {e}")
+    if company_id is None:
+        _template_cache.clear()
+        return
+    for key in [key for key in _template_cache if key[0] == company_id]:
+        _template_cache.pop(key, None)
+
+def _apply_pending_usage(templates: List[Dict]) -> List[Dict]:
+    """未反映の使用回数を加算し、一覧の並び順（使用回数降順）を保つ"""
+    if _pending_usage_counts:
+        for template in templates:
+            pending = _pending_usage_counts.get(template.get("id"))
+            if pending:
+                template["usage_count"] = (template.get("usage_count") or 0) + pending
+        templates.sort(key=lambda t: t.get("created_at") or "", reverse=True)
+        templates.sort(key=lambda t: t.get("usage_count") or 0, reverse=True)
+    return templates
+
+def _select_in_batches(table: str, column: str, values: List[str], order: Optional[str] = None,
+                       filters: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """IN条件の検索をID数に応じて分割して実行する"""
+    rows = []
+    unique_values = list(dict.fromkeys(value for value in values if value))
+    for start in range(0, len(unique_values), _IN_QUERY_BATCH_SIZE):
+        batch_filters = dict(filters or {})
+        batch_filters[column] = unique_values[start:start + _IN_QUERY_BATCH_SIZE]
+        result = select_data(table, filters=batch_filters, order=order)
+        if result.success and result.data:
+            rows.extend(result.data)
+    return rows
+
+async def flush_template_usage_counts():
+    """溜まった使用回数を1回の UPDATE でまとめて加算する"""
+    if not _pending_usage_counts:
+        return
+    
+    pending = dict(_pending_usage_counts)
+    _pending_usage_counts.clear()
+    
+    def _flush() -> List[Tuple[Optional[str], Optional[str]]]:
+        import psycopg2
+        from psycopg2.extras import execute_values
+        from modules.config import get_database_url
+        
+        with psycopg2.connect(get_database_url()) as conn:
+            with conn.cursor() as cur:
+                updated = execute_values(
+                    cur,
+                    """
+                    UPDATE prompt_templates AS t
+                    SET usage_count = COALESCE(t.usage_count, 0) + d.delta
+                    FROM (VALUES %s) AS d(id, delta)
+                    WHERE t.id::text = d.id
+                    RETURNING t.company_id::text, t.template_type
+                    """,
+                    list(pending.items()),
+                    fetch=True
+                )
+            conn.commit()
+        return updated
+    
+    try:
+        updated = await asyncio.to_thread(_flush)
+    except Exception as e:
+        logger.error(f"使用回数の一括更新エラー: {e}")
+        # 失敗分は次回のフラッシュで再送する
+        for template_id, delta in pending.items():
+            _pending_usage_counts[template_id] = _pending_usage_counts.get(template_id, 0) + delta
+        return
+    
+    # 使用回数が変わった会社の一覧だけを他のワーカーも含めて取り直す
+    # （全体の世代を進めると全社のキャッシュが消えるため。システムテンプレートは自ワーカー分のみ破棄し、他は TTL で反映）
+    for company_id in {company_id for company_id, template_type in updated if template_type != "system" and company_id}:
+        invalidate_template_cache(company_id)
+    if any(template_type == "system" for _, template_type in updated):
+        _template_cache.pop((None, "system"), None)
+
+async def _usage_flush_loop():
+    """使用回数を一定間隔でフラッシュするバックグラウンドタスク"""
+    global _usage_flush_task
+    try:
+        while _pending_usage_counts:
+            await asyncio.sleep(TEMPLATE_USAGE_FLUSH_INTERVAL)
+            await flush_template_usage_counts()
+    finally:
+        _usage_flush_task = None
 
 # Pydanticモデル定義
 class TemplateVariable(BaseModel):
@@ -132,6 +250,7 @@ class TemplateManager:
             result = insert_data("template_categories", category_dict)
             
             if result.success:
+                invalidate_template_cache()
                 return category_dict
             else:
                 raise Exception(f"カテゴリ作成失敗: {result.error}")
@@ -176,6 +295,8 @@ class TemplateManager:
             result = update_data("template_categories", "id", category_id, update_dict)
             
             if result.success:
+                # カテゴリ名はテンプレート一覧にも含まれるため破棄
+                invalidate_template_cache()
                 # 更新されたカテゴリを取得して返す
                 updated_result = select_data(
                     "template_categories",
@@ -223,6 +344,8 @@ class TemplateManager:
                 }
             )
             
+            if result.success:
+                invalidate_template_cache()
             return result.success
         except Exception as e:
             print(f"カテゴリ削除エラー: {e}")
@@ -233,60 +356,80 @@ class TemplateManager:
                           template_type: Optional[str] = None, user_id: Optional[str] = None) -> List[Dict]:
         """テンプレート一覧を取得（会社別フィルタリング）"""
         try:
-            filters = {"is_active": True}
-            
-            # 会社レベルのフィルタリング
-            if template_type == "system":
-                # システムテンプレートは全社共通
-                filters["template_type"] = "system"
-            elif company_id:
-                # 会社テンプレートまたはユーザーテンプレート
-                filters["company_id"] = company_id
-                if template_type:
-                    filters["template_type"] = template_type
-            else:
-                # company_idがない場合はシステムテンプレートのみ返す
-                filters["template_type"] = "system"
+            templates = await self._get_cached_templates(company_id, template_type)
             
             if category_id:
-                filters["category_id"] = category_id
+                templates = [t for t in templates if t.get("category_id") == category_id]
             
-            # テンプレートを取得
-            result = select_data(
-                "prompt_templates",
-                filters=filters,
-                order="usage_count desc, created_at desc"
-            )
-            
-            if result.success and result.data:
-                # 各テンプレートの変数情報も取得
-                templates = []
-                for template in result.data:
-                    template_with_vars = await self._get_template_with_variables(template)
-                    templates.append(template_with_vars)
-                return templates
-            return []
+            return _apply_pending_usage(copy.deepcopy(templates))
         except Exception as e:
             print(f"テンプレート取得エラー: {e}")
             return []
     
+    async def _get_cached_templates(self, company_id: Optional[str], template_type: Optional[str]) -> List[Dict]:
+        """会社・種別ごとのテンプレート一覧をキャッシュ経由で取得"""
+        # システムテンプレートは会社に依存しない
+        if template_type == "system" or not company_id:
+            cache_key = (None, "system")
+        else:
+            cache_key = (company_id, template_type)
+        
+        generation = _template_cache_generation(cache_key[0])
+        cached = _template_cache.get(cache_key)
+        if cached and cached[0] > time.monotonic() and cached[1] == generation:
+            return cached[2]
+        
+        filters = {"is_active": True}
+        if cache_key[0] is None:
+            filters["template_type"] = "system"
+        else:
+            # 会社テンプレートまたはユーザーテンプレート
+            filters["company_id"] = company_id
+            if template_type:
+                filters["template_type"] = template_type
+        
+        result = select_data(
+            "prompt_templates",
+            filters=filters,
+            order="usage_count desc, created_at desc"
+        )
+        
+        templates = []
+        if result.success and result.data:
+            templates = await self._attach_variables_and_categories(result.data)
+        
+        _template_cache[cache_key] = (time.monotonic() + TEMPLATE_CACHE_TTL, generation, templates)
+        return templates
+    
+    async def _find_cached_template(self, template_id: str) -> Optional[Dict]:
+        """キャッシュ済みの一覧からテンプレートを探す"""
+        now = time.monotonic()
+        for (company_id, _), (expires, generation, templates) in list(_template_cache.items()):
+            if expires <= now or generation != _template_cache_generation(company_id):
+                continue
+            for template in templates:
+                if template.get("id") == template_id:
+                    return template
+        return None
+    
     async def get_template_by_id(self, template_id: str, company_id: Optional[str] = None) -> Optional[Dict]:
         """特定のテンプレートを取得"""
         try:
-            result = select_data(
-                "prompt_templates",
-                filters={"id": template_id, "is_active": True}
-            )
-            
-            if result.success and result.data:
-                template = result.data[0]
-                
-                # 会社レベルのアクセス制御
-                if template["template_type"] != "system" and company_id and template["company_id"] != company_id:
+            template = await self._find_cached_template(template_id)
+            if template is None:
+                result = select_data(
+                    "prompt_templates",
+                    filters={"id": template_id, "is_active": True}
+                )
+                if not result.success or not result.data:
                     return None
-                
-                return await self._get_template_with_variables(template)
-            return None
+                template = (await self._attach_variables_and_categories(result.data))[0]
+            
+            # 会社レベルのアクセス制御
+            if template["template_type"] != "system" and company_id and template["company_id"] != company_id:
+                return None
+            
+            return _apply_pending_usage([copy.deepcopy(template)])[0]
         except Exception as e:
             print(f"テンプレート取得エラー: {e}")
             return None
@@ -323,6 +466,7 @@ class TemplateManager:
             if template_data.variables:
                 await self._create_template_variables(template_id, template_data.variables)
             
+            invalidate_template_cache(None if template_data.template_type == "system" else company_id)
             return await self._get_template_with_variables(template_dict)
         except Exception as e:
             print(f"テンプレート作成エラー: {e}")
@@ -365,6 +509,7 @@ class TemplateManager:
             if template_data.variables is not None:
                 await self._update_template_variables(template_id, template_data.variables)
             
+            invalidate_template_cache(None if existing.get("template_type") == "system" else existing.get("company_id"))
             return await self.get_template_by_id(template_id, company_id)
         except Exception as e:
             print(f"テンプレート更新エラー: {e}")
@@ -389,6 +534,8 @@ class TemplateManager:
                 }
             )
             
+            if result.success:
+                invalidate_template_cache(None if existing.get("template_type") == "system" else existing.get("company_id"))
             return result.success
         except Exception as e:
             print(f"テンプレート削除エラー: {e}")
@@ -547,13 +694,31 @@ class TemplateManager:
             )
             
             if result.success and result.data:
-                # 各お気に入りのテンプレート詳細も取得
-                favorites = []
+                # お気に入りのテンプレート詳細をまとめて取得
+                templates_by_id = {}
+                missing_ids = []
                 for favorite in result.data:
-                    template = await self.get_template_by_id(favorite["template_id"], company_id)
+                    template = await self._find_cached_template(favorite["template_id"])
                     if template:
-                        favorite["template"] = template
-                        favorites.append(favorite)
+                        templates_by_id[template["id"]] = template
+                    else:
+                        missing_ids.append(favorite["template_id"])
+                
+                if missing_ids:
+                    rows = _select_in_batches("prompt_templates", "id", missing_ids, filters={"is_active": True})
+                    for template in await self._attach_variables_and_categories(rows):
+                        templates_by_id[template["id"]] = template
+                
+                favorites = []
+                for favorite in result.data:
+                    template = templates_by_id.get(favorite["template_id"])
+                    if not template:
+                        continue
+                    # 会社レベルのアクセス制御
+                    if template["template_type"] != "system" and company_id and template["company_id"] != company_id:
+                        continue
+                    favorite["template"] = _apply_pending_usage([copy.deepcopy(template)])[0]
+                    favorites.append(favorite)
                 return favorites
             return []
         except Exception as e:
@@ -578,41 +743,46 @@ class TemplateManager:
             return []
     
     # プライベートメソッド
-    async def _get_template_with_variables(self, template: Dict) -> Dict:
-        """テンプレートに変数情報とカテゴリ名を追加"""
+    async def _attach_variables_and_categories(self, templates: List[Dict]) -> List[Dict]:
+        """複数テンプレートに変数情報とカテゴリ名をまとめて付与（テンプレート数に依存しないクエリ数）"""
+        if not templates:
+            return []
+        
+        variables_by_template: Dict[str, List[Dict]] = {}
         try:
-            # 変数情報を取得
-            variables_result = select_data(
-                "template_variables",
-                filters={"template_id": template["id"]},
+            variables = _select_in_batches(
+                "template_variables", "template_id",
+                [template["id"] for template in templates],
                 order="display_order asc"
             )
-            
-            template["variables"] = []
-            if variables_result.success and variables_result.data:
-                template["variables"] = variables_result.data
-            
-            # カテゴリ名を取得
-            template["category_name"] = "カテゴリなし"  # デフォルト値
-            if template.get("category_id"):
-                try:
-                    category_result = select_data(
-                        "template_categories",
-                        filters={"id": template["category_id"]}
-                    )
-                    if category_result.success and category_result.data and len(category_result.data) > 0:
-                        template["category_name"] = category_result.data[0].get("name", "カテゴリなし")
-                except Exception as e:
-                    print(f"カテゴリ名取得エラー: {e}")
-                    # デフォルト値を維持
-            
-            # フロントエンド互換性のためにcontentフィールドを追加
-            template["content"] = template.get("template_content", "")
-            
-            return template
+            for variable in variables:
+                variables_by_template.setdefault(variable["template_id"], []).append(variable)
+            for template_variables in variables_by_template.values():
+                template_variables.sort(key=lambda v: v.get("display_order") or 0)
         except Exception as e:
             print(f"テンプレート変数取得エラー: {e}")
-            return template
+        
+        category_names: Dict[str, str] = {}
+        try:
+            categories = _select_in_batches(
+                "template_categories", "id",
+                [template.get("category_id") for template in templates]
+            )
+            category_names = {c["id"]: c.get("name", "カテゴリなし") for c in categories}
+        except Exception as e:
+            print(f"カテゴリ名取得エラー: {e}")
+        
+        for template in templates:
+            template["variables"] = variables_by_template.get(template["id"], [])
+            template["category_name"] = category_names.get(template.get("category_id"), "カテゴリなし")
+            # フロントエンド互換性のためにcontentフィールドを追加
+            template["content"] = template.get("template_content", "")
+        
+        return templates
+    
+    async def _get_template_with_variables(self, template: Dict) -> Dict:
+        """テンプレートに変数情報とカテゴリ名を追加"""
+        return (await self._attach_variables_and_categories([template]))[0]
     
     async def _create_template_variables(self, template_id: str, variables: List[TemplateVariable]):
         """テンプレート変数を作成"""
@@ -665,20 +835,12 @@ class TemplateManager:
             return template_content
     
     async def _increment_usage_count(self, template_id: str):
-        """テンプレートの使用回数を増加"""
-        try:
-            # 現在の使用回数を取得
-            result = select_data("prompt_templates", filters={"id": template_id})
-            if result.success and result.data:
-                current_count = result.data[0].get("usage_count", 0)
-                update_data(
-                    "prompt_templates", 
-                    "id", 
-                    template_id, 
-                    {"usage_count": current_count + 1}
-                )
-        except Exception as e:
-            print(f"使用回数更新エラー: {e}")
+        """テンプレートの使用回数を増加（ライトビハインドで一定間隔ごとにまとめて反映）"""
+        global _usage_flush_task
+        _pending_usage_counts[template_id] = _pending_usage_counts.get(template_id, 0) + 1
+        
+        if _usage_flush_task is None:
+            _usage_flush_task = asyncio.create_task(_usage_flush_loop())
 
 # 会社設定管理
 class CompanyTemplateSettingsManager:
@@ -3,17 +3,11 @@
 OpenAI APIのトークン使用量を正確に計算・追跡します
 """
 
-try:
-    import tiktoken
-    TIKTOKEN_AVAILABLE = True
-except ImportError:
-    TIKTOKEN_AVAILABLE = False
-    print("Warning: tiktoken not available, using fallback token counting")
-
 import uuid
 from datetime import datetime
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from modules.timezone_utils import create_timestamp_for_db
+from modules.tokenizer import get_tokenizer, TIKTOKEN_AVAILABLE
 from decimal import Decimal
 
 class TokenCounter:
@@ -67,26 +61,12 @@ class TokenCounter:
     
     def count_tokens(self, text: str, model: str = "gemini-2.5-flash") -> int:
         """指定されたモデルでテキストのトークン数を計算"""
-        try:
-            if TIKTOKEN_AVAILABLE:
-                # モデル名に基づいてエンコーディングを取得
-                if "gpt-4" in model:
-                    encoding_name = "cl100k_base"
-                elif "gpt-3.5" in model:
-                    encoding_name = "cl100k_base"
-                else:
-                    encoding_name = "cl100k_base"  # デフォルト
-                
-                encoding = tiktoken.get_encoding(encoding_name)
-                tokens = encoding.encode(text)
-                return len(tokens)
-            else:
-                # フォールバック：文字数 × 1.3の推定
-                return int(len(text) * 1.3)
-        except Exception as e:
-            print(f"トークン計算エラー: {e}")
-            # フォールバック：文字数 × 1.3の推定
-            return int(len(text) * 1.3)
+        # 全モデル共通で cl100k_base を使用（共有トークナイザーでキャッシュ済み）
+        return get_tokenizer().count(text)
+    
+    def count_tokens_many(self, texts: List[str], model: str = "gemini-2.5-flash") -> List[int]:
+        """複数テキストのトークン数をまとめて計算"""
+        return get_tokenizer().count_many(texts)
     
     def calculate_tokens_and_cost(
         self, 
@@ -362,21 +342,24 @@ class TokenCounter:
         # no1株式会社の実際のcompany_ID（実際のデータに基づく）
         NO1_COMPANY_ID = "77acc2e2-ce67-458d-bd38-7af0476b297a"
         
-        print(f"🔍 Premium Plan判定:")
-        print(f"   入力company_id: '{company_id}'")
-        print(f"   NO1_COMPANY_ID: '{NO1_COMPANY_ID}'")
-        print(f"   判定結果: {company_id == NO1_COMPANY_ID}")
-        print(f"   company_id type: {type(company_id)}")
-        print(f"   NO1_COMPANY_ID type: {type(NO1_COMPANY_ID)}")
-        
         return company_id == NO1_COMPANY_ID
 
+# グローバルインスタンス（料金表は不変なので使い回す）
+_token_counter: Optional[TokenCounter] = None
+
+def get_token_counter() -> TokenCounter:
+    """共有TokenCounterを取得"""
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = TokenCounter()
+    return _token_counter
+
 class TokenUsageTracker:
     """トークン使用量をデータベースに保存・追跡するクラス"""
     
     def __init__(self, db_connection):
         self.db = db_connection
-        self.counter = TokenCounter()
+        self.counter = get_token_counter()
     
     def save_chat_with_tokens(
         self,
@@ -0,0 +1,172 @@
+"""
+🔢 共有トークナイザーサービス
+プロセス全体で1つのエンコーディングを使い回し、トークン数計算を高速化します
+
+- tiktoken のエンコーディングは初回のみ生成してキャッシュ
+- count_many で複数テキストをまとめてエンコード（チャンク分割・一括取り込み用）
+- estimate で文字種ごとの比率による高速な概算（予算チェック用）
+- 環境変数 TOKENIZER_GEMINI_CALIBRATION=true で Gemini countTokens により比率を補正
+"""
+
+import os
+import re
+import logging
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# tiktoken が使えない場合の従来の推定（文字数 × 1.3）
+FALLBACK_TOKENS_PER_CHAR = 1.3
+
+# estimate で使う文字種ごとの既定比率（1文字あたりのトークン数）
+# 日本語: 1文字 ≈ 1.5トークン, その他（英数字・記号）: 4文字 ≈ 1トークン
+DEFAULT_TOKEN_RATIOS = {
+    "ja": 1.5,
+    "other": 0.25
+}
+
+# count_many でスレッド並列エンコードを行う件数の下限
+_BATCH_THREAD_THRESHOLD = 32
+
+_JAPANESE_CHAR_PATTERN = re.compile(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]')
+
+# 補正用のサンプル（Gemini countTokens に送る）
+_CALIBRATION_SAMPLES = {
+    "ja": "社内規定により、有給休暇の申請は取得予定日の三日前までに上長へ提出してください。",
+    "other": "Please submit the expense report with receipts attached by the end of the month."
+}
+
+
+class TokenizerService:
+    """プロセス共有のトークン数計算サービス"""
+
+    def __init__(self, encoding_name: str = DEFAULT_ENCODING):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._encoding_failed = False
+        self._lock = threading.Lock()
+        self.ratios: Dict[str, float] = dict(DEFAULT_TOKEN_RATIOS)
+        self.calibrated = False
+
+    @property
+    def encoding(self):
+        """エンコーディングを取得（初回のみ生成）"""
+        if self._encoding is None and not self._encoding_failed and TIKTOKEN_AVAILABLE:
+            with self._lock:
+                if self._encoding is None and not self._encoding_failed:
+                    try:
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        logger.warning(f"tiktoken初期化失敗: {e}")
+                        self._encoding_failed = True
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        """テキストのトークン数を計算"""
+        if not text:
+            return 0
+        encoding = self.encoding
+        if encoding is not None:
+            try:
+                return len(encoding.encode(text, disallowed_special=()))
+            except Exception as e:
+                logger.warning(f"トークン計算エラー: {e}")
+        return int(len(text) * FALLBACK_TOKENS_PER_CHAR)
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        """複数テキストのトークン数をまとめて計算"""
+        if not texts:
+            return []
+        encoding = self.encoding
+        if encoding is not None:
+            try:
+                if len(texts) >= _BATCH_THREAD_THRESHOLD:
+                    # encode_batch はスレッドプールで並列にエンコードする
+                    encoded = encoding.encode_batch(
+                        [text or "" for text in texts], disallowed_special=()
+                    )
+                    return [len(tokens) for tokens in encoded]
+                return [
+                    len(encoding.encode(text, disallowed_special=())) if text else 0
+                    for text in texts
+                ]
+            except Exception as e:
+                logger.warning(f"一括トークン計算エラー: {e}")
+        return [int(len(text or "") * FALLBACK_TOKENS_PER_CHAR) for text in texts]
+
+    def estimate(self, text: str) -> int:
+        """文字種ごとの比率によるトークン数の概算（エンコードしない）"""
+        if not text:
+            return 0
+        japanese_chars = len(_JAPANESE_CHAR_PATTERN.findall(text))
+        other_chars = len(text) - japanese_chars
+        return int(japanese_chars * self.ratios["ja"] + other_chars * self.ratios["other"])
+
+    def calibrate_with_gemini(self, model_name: Optional[str] = None) -> bool:
+        """Gemini countTokens の結果から文字種ごとの比率を補正する"""
+        try:
+            from google import genai
+        except ImportError:
+            logger.warning("google-genai が利用できないため比率補正をスキップします")
+            return False
+
+        api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            return False
+
+        model_name = model_name or os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+        try:
+            client = genai.Client(api_key=api_key)
+            ratios = {}
+            for language, sample in _CALIBRATION_SAMPLES.items():
+                result = client.models.count_tokens(model=model_name, contents=sample)
+                ratios[language] = result.total_tokens / len(sample)
+            self.ratios.update(ratios)
+            self.calibrated = True
+            logger.info(f"🔢 トークン比率をGeminiで補正: {self.ratios}")
+            return True
+        except Exception as e:
+            logger.warning(f"Geminiによるトークン比率補正失敗: {e}")
+            return False
+
+
+# グローバルインスタンス
+_tokenizer: Optional[TokenizerService] = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer() -> TokenizerService:
+    """共有トークナイザーを取得"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                tokenizer = TokenizerService()
+                if os.getenv("TOKENIZER_GEMINI_CALIBRATION", "false").lower() == "true":
+                    tokenizer.calibrate_with_gemini()
+                _tokenizer = tokenizer
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """共有トークナイザーでトークン数を計算"""
+    return get_tokenizer().count(text)
+
+
+def count_tokens_many(texts: List[str]) -> List[int]:
+    """共有トークナイザーで複数テキストのトークン数を計算"""
+    return get_tokenizer().count_many(texts)
+
+
+def estimate_tokens(text: str) -> int:
+    """共有トークナイザーでトークン数を概算"""
+    return get_tokenizer().estimate(text)
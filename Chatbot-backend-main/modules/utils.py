@@ -1,13 +1,9 @@
 import requests
 import re
-from bs4 import BeautifulSoup
 from io import BytesIO
-import pandas as pd
 import time
 from dotenv import load_dotenv
 import os
-from playwright.async_api import async_playwright
-import fitz
 import tempfile
 import asyncio
 from .database import ensure_string
@@ -79,6 +75,7 @@ async def extract_text_from_pdf(url: str) -> str:
             return f"❌ このURLは有効なPDFファイルを指していません\n• Content-Type: {content_type}\n• PDFファイルの直接リンクを使用してください\n• URL: {url}"
         
         # PyMuPDFを使用してPDFからテキストを抽出
+        import fitz
         pdf_document = fitz.open(stream=response.content, filetype="pdf")
         
         # PDFが空でないか確認
@@ -115,6 +112,7 @@ def extract_text_from_pdf_bytes(content: bytes) -> str:
     """
     try:
         # PyMuPDFを使用してPDFからテキストを抽出
+        import fitz
         pdf_document = fitz.open(stream=content, filetype="pdf")
         text = ""
         for page_num in range(len(pdf_document)):
@@ -186,6 +184,7 @@ async def extract_text_from_html(url: str) -> str:
             return f"❌ このURLには内容がありません\n• ページが空白です\n• 別のURLで試してみてください\n• URL: {url}"
         
         # BeautifulSoupでHTMLを解析
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response.content, 'html.parser')
         
         # スクリプトとスタイルタグを削除
@@ -324,6 +323,7 @@ def _process_video_file(contents, filename):
         sections = {"トランスクリプション": transcription_text}
         extracted_text = f"=== ファイル: {filename} ===\n\n=== トランスクリプション ===\n{transcription_text}\n\n"
 
+        import pandas as pd
         result_df = pd.DataFrame({
             'section': ["トランスクリプション"],
             'content': [transcription_text],
@@ -0,0 +1,607 @@
+"""
+🧮 ローカルベクトルインデックス（会社ごと・メモリマップ）
+チャンク数の少ない会社は、Supabase へのベクトル検索の往復よりも
+プロセス内での厳密な行列ベクトル積の方が速いため、埋め込みをローカルに保持して検索します
+
+- 会社ごとに正規化済み float16 の埋め込み行列（.npy）とチャンク情報を保存し、メモリマップで読み込む
+  （世代ごとのディレクトリに書き出し、CURRENT ファイルの置き換えで公開するため複数ワーカーの同時再構築でも壊れない）
+- 検索は行列ベクトル積 + argpartition による厳密な Top-K（DBアクセスなし）
+- 追加・変更されたドキュメントは差分（メモリ上）に載せ、無効化・削除分は除外して検索
+- チャンク数が LOCAL_VECTOR_INDEX_MAX_CHUNKS を超える会社は対象外（pgvector で検索）
+
+LOCAL_VECTOR_INDEX=true で有効化します
+"""
+
+import os
+import re
+import json
+import mmap
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Any, Set, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from .shared_state import bump_generation, get_generation
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    from pgvector.psycopg2 import register_vector
+    PGVECTOR_ADAPTER_AVAILABLE = True
+except ImportError:
+    PGVECTOR_ADAPTER_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+LOCAL_VECTOR_INDEX_ENABLED = os.getenv("LOCAL_VECTOR_INDEX", "false").lower() == "true"
+VECTOR_INDEX_DIR = os.getenv(
+    "VECTOR_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "vector_index")
+)
+# ローカル検索の対象とする会社のチャンク数上限
+LOCAL_VECTOR_INDEX_MAX_CHUNKS = int(os.getenv("LOCAL_VECTOR_INDEX_MAX_CHUNKS", "50000"))
+# 更新確認の間隔（秒）
+VECTOR_INDEX_REFRESH_SECONDS = int(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "60"))
+# 差分がこの件数、または本体の VECTOR_INDEX_DELTA_RATIO 倍を超えたら全体を再構築
+VECTOR_INDEX_DELTA_MAX_CHUNKS = int(os.getenv("VECTOR_INDEX_DELTA_MAX_CHUNKS", "2000"))
+VECTOR_INDEX_DELTA_RATIO = float(os.getenv("VECTOR_INDEX_DELTA_RATIO", "0.2"))
+# 置き換え済みの世代を削除するまでの猶予（秒）。他ワーカーが読み込み中の世代を消さないため
+VECTOR_INDEX_OLD_VERSION_GRACE_SECONDS = int(os.getenv("VECTOR_INDEX_OLD_VERSION_GRACE_SECONDS", "300"))
+
+# float16 → float32 に変換しながら積を取るブロックの行数
+_MATMUL_BLOCK_ROWS = 4096
+# チャンク取得のバッチサイズ
+_FETCH_BATCH_SIZE = 500
+
+
+def _connect():
+    from modules.config import get_database_url
+    conn = psycopg2.connect(get_database_url(), cursor_factory=RealDictCursor)
+    if PGVECTOR_ADAPTER_AVAILABLE:
+        register_vector(conn)
+    return conn
+
+
+def _fetch_doc_signatures(company_id: str) -> Dict[str, str]:
+    """アクティブなドキュメントごとの埋め込み済みチャンク数と最終更新日時"""
+    with _connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.doc_id, COUNT(*) AS chunk_count, MAX(c.updated_at) AS last_updated
+                FROM chunks c
+                JOIN document_sources ds ON ds.id = c.doc_id
+                WHERE c.company_id = %s
+                  AND ds.active = true
+                  AND c.embedding IS NOT NULL
+                  AND c.content IS NOT NULL
+                  AND LENGTH(c.content) > 10
+                GROUP BY c.doc_id
+            """, (company_id,))
+            return {
+                row["doc_id"]: f"{row['chunk_count']}:{row['last_updated']}"
+                for row in cur.fetchall()
+            }
+
+
+def _count_chunks(signatures: Dict[str, str]) -> int:
+    return sum(int(signature.split(":", 1)[0]) for signature in signatures.values())
+
+
+def _to_vector(value) -> "np.ndarray":
+    """pgvector の値（アダプタ未登録時は文字列）を float32 配列に変換"""
+    if isinstance(value, str):
+        return np.array(value.strip("[]").split(","), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def _normalize_rows(matrix: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _iter_chunk_batches(company_id: str, doc_ids: Optional[List[str]] = None):
+    """(チャンク情報のリスト, 正規化済み埋め込み行列) をバッチごとに返す"""
+    sql = """
+        SELECT c.id, c.doc_id, c.chunk_index, c.content, c.embedding,
+               ds.name AS document_name, ds.type AS document_type
+        FROM chunks c
+        JOIN document_sources ds ON ds.id = c.doc_id
+        WHERE c.company_id = %s
+          AND ds.active = true
+          AND c.embedding IS NOT NULL
+          AND c.content IS NOT NULL
+          AND LENGTH(c.content) > 10
+    """
+    params: List[Any] = [company_id]
+    if doc_ids is not None:
+        sql += " AND c.doc_id = ANY(%s)"
+        params.append(doc_ids)
+    sql += " ORDER BY c.doc_id, c.chunk_index"
+
+    with _connect() as conn:
+        # サーバーサイドカーソルで少しずつ読み込む
+        with conn.cursor(name="vector_index_chunks") as cur:
+            cur.itersize = _FETCH_BATCH_SIZE
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(_FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                chunks = [
+                    {
+                        "id": str(row["id"]),
+                        "doc_id": row["doc_id"],
+                        "chunk_index": row["chunk_index"],
+                        "content": row["content"],
+                        "document_name": row["document_name"],
+                        "document_type": row["document_type"]
+                    }
+                    for row in rows
+                ]
+                vectors = _normalize_rows(np.stack([_to_vector(row["embedding"]) for row in rows]))
+                yield chunks, vectors
+
+
+def _top_k(matrix: "np.ndarray", query: "np.ndarray", k: int,
+           excluded: Optional["np.ndarray"] = None) -> List[Tuple[int, float]]:
+    """厳密な Top-K（行列ベクトル積 + argpartition）。(行番号, コサイン類似度) を返す"""
+    rows = matrix.shape[0]
+    if rows == 0 or k <= 0:
+        return []
+    if matrix.dtype == np.float16:
+        # float16 の積は BLAS が使えないため、ブロックごとに float32 へ変換して計算
+        scores = np.empty(rows, dtype=np.float32)
+        for start in range(0, rows, _MATMUL_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + _MATMUL_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + block.shape[0]] = block @ query
+    else:
+        scores = matrix @ query
+    if excluded is not None and excluded.any():
+        scores[excluded] = -np.inf
+
+    k = min(k, rows)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(i), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+class CompanyVectorIndex:
+    """1社分のローカルベクトルインデックス（本体 + 差分 + 除外ドキュメント）"""
+
+    def __init__(self, company_id: str):
+        self.company_id = company_id
+        self.path = os.path.join(VECTOR_INDEX_DIR, re.sub(r'[^A-Za-z0-9_\-]', '_', company_id))
+
+        # 本体（ディスク上・メモリマップ）
+        self.embeddings = None
+        self._row_doc_ids = None
+        self._doc_ids: List[str] = []
+        self._offsets = None
+        self._chunks_file = None
+        self._chunks_mmap = None
+        self.signatures: Dict[str, str] = {}
+
+        # 差分（メモリ上）
+        self.delta_embeddings = None
+        self.delta_chunks: List[Dict[str, Any]] = []
+
+        # 本体に含まれるが検索対象外のドキュメント（無効化・削除・差分で置き換え済み）
+        self.hidden_doc_ids: Set[str] = set()
+        self._excluded = None
+
+        # チャンク数が上限を超えている（pgvector で検索する）
+        self.too_large = False
+        self.last_refresh = 0.0
+        self.stale = True
+        # 共有ストアの更新世代（他ワーカーでの更新検知用）
+        self.seen_generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return not self.too_large and (self.embeddings is not None or self.delta_embeddings is not None)
+
+    # ---- 本体インデックスの保存・読み込み ----
+
+    def _current_file(self) -> str:
+        return os.path.join(self.path, "CURRENT")
+
+    def _write(self, tmp_path: str, signatures: Dict[str, str]) -> int:
+        """チャンクを読み込みながら世代ディレクトリに書き出す。書き出した件数を返す"""
+        capacity = _count_chunks(signatures)
+        embeddings = None
+        doc_ids = list(signatures)
+        doc_positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        row_doc_ids = np.zeros(capacity, dtype=np.int32)
+        offsets = []
+        position = 0
+        rows = 0
+
+        with open(os.path.join(tmp_path, "chunks.jsonl"), "wb") as f:
+            for chunks, vectors in _iter_chunk_batches(self.company_id):
+                # 署名の取得後に追加されたドキュメントは次回の更新で差分に反映する
+                keep = [i for i, chunk in enumerate(chunks) if chunk["doc_id"] in doc_positions]
+                keep = keep[:capacity - rows]
+                if not keep:
+                    continue
+                if embeddings is None:
+                    embeddings = np.lib.format.open_memmap(
+                        os.path.join(tmp_path, "embeddings.npy"), mode="w+",
+                        dtype=np.float16, shape=(capacity, vectors.shape[1])
+                    )
+                embeddings[rows:rows + len(keep)] = vectors[keep]
+                for i in keep:
+                    chunk = chunks[i]
+                    row_doc_ids[rows] = doc_positions[chunk["doc_id"]]
+                    line = (json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8")
+                    offsets.append(position)
+                    f.write(line)
+                    position += len(line)
+                    rows += 1
+
+        if embeddings is None:
+            return 0
+        embeddings.flush()
+        del embeddings
+        offsets.append(position)
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        np.save(os.path.join(tmp_path, "row_doc_ids.npy"), row_doc_ids[:rows])
+        with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"built_at": time.time(), "rows": rows, "doc_ids": doc_ids, "signatures": signatures}, f)
+        return rows
+
+    def _new_version(self) -> str:
+        """新しい世代のディレクトリを作成して世代名を返す"""
+        if os.path.exists(os.path.join(self.path, "manifest.json")):
+            # 世代ディレクトリ導入前の配置は作り直す
+            shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        version = f"v-{time.time_ns()}-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(os.path.join(self.path, version))
+        return version
+
+    def _publish(self, version: str):
+        """CURRENT をアトミックに置き換えて世代を公開する"""
+        current_tmp = f"{self._current_file()}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(current_tmp, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(current_tmp, self._current_file())
+        self._remove_old_versions(version)
+
+    def _remove_old_versions(self, current: str):
+        """猶予を過ぎた古い世代を削除（メモリマップ中のファイルは削除後も読める）"""
+        threshold = time.time() - VECTOR_INDEX_OLD_VERSION_GRACE_SECONDS
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name == current or not name.startswith("v-"):
+                continue
+            try:
+                if os.path.getmtime(path) < threshold:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _unpublish(self):
+        try:
+            os.remove(self._current_file())
+        except FileNotFoundError:
+            pass
+
+    def _open(self) -> Optional[Dict[str, Any]]:
+        """公開中の世代をメモリマップで開く（インスタンスの状態は変更しない）"""
+        try:
+            with open(self._current_file(), encoding="utf-8") as f:
+                version_path = os.path.join(self.path, f.read().strip())
+        except FileNotFoundError:
+            return None
+        with open(os.path.join(version_path, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        rows = manifest["rows"]
+        chunks_file = open(os.path.join(version_path, "chunks.jsonl"), "rb")
+        return {
+            "embeddings": np.load(os.path.join(version_path, "embeddings.npy"), mmap_mode="r")[:rows],
+            "row_doc_ids": np.load(os.path.join(version_path, "row_doc_ids.npy")),
+            "offsets": np.load(os.path.join(version_path, "offsets.npy"), mmap_mode="r"),
+            "chunks_file": chunks_file,
+            "chunks_mmap": mmap.mmap(chunks_file.fileno(), 0, access=mmap.ACCESS_READ),
+            "doc_ids": manifest["doc_ids"],
+            "signatures": manifest["signatures"]
+        }
+
+    def _swap(self, opened: Dict[str, Any]):
+        """開いた世代に差し替える（呼び出し側で _lock を保持）"""
+        old_file = self._chunks_file
+        self.embeddings = opened["embeddings"]
+        self._row_doc_ids = opened["row_doc_ids"]
+        self._doc_ids = opened["doc_ids"]
+        self._offsets = opened["offsets"]
+        self._chunks_file = opened["chunks_file"]
+        self._chunks_mmap = opened["chunks_mmap"]
+        self.signatures = opened["signatures"]
+        self.delta_embeddings = None
+        self.delta_chunks = []
+        self.hidden_doc_ids = set()
+        self._excluded = None
+        if old_file is not None:
+            # 検索中のメモリマップはファイルを閉じても有効
+            old_file.close()
+
+    def _clear(self):
+        """本体を持たない状態にする（呼び出し側で _lock を保持。ディスク上の世代は他ワーカーが使うため消さない）"""
+        self.embeddings = None
+        self._row_doc_ids = None
+        self._doc_ids = []
+        self._offsets = None
+        self._chunks_mmap = None
+        self.delta_embeddings = None
+        self.delta_chunks = []
+        self.hidden_doc_ids = set()
+        self._excluded = None
+
+    @staticmethod
+    def _main_chunk(offsets, chunks_mmap, position: int) -> Dict[str, Any]:
+        start, end = int(offsets[position]), int(offsets[position + 1])
+        return json.loads(chunks_mmap[start:end])
+
+    # ---- 構築・更新（バックグラウンドスレッドで実行） ----
+
+    def rebuild(self, signatures: Optional[Dict[str, str]] = None):
+        """全チャンクから本体を再構築"""
+        started = time.time()
+        if signatures is None:
+            signatures = _fetch_doc_signatures(self.company_id)
+        chunk_count = _count_chunks(signatures)
+        if chunk_count > LOCAL_VECTOR_INDEX_MAX_CHUNKS:
+            self._unpublish()
+            with self._lock:
+                self._clear()
+                self.signatures = signatures
+                self.too_large = True
+                self.last_refresh = time.time()
+                self.stale = False
+            logger.info(f"🧮 ローカルベクトルインデックス対象外: company={self.company_id}, {chunk_count}チャンク")
+            return
+
+        os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+        version = self._new_version()
+        version_path = os.path.join(self.path, version)
+        try:
+            rows = self._write(version_path, signatures)
+        except Exception:
+            shutil.rmtree(version_path, ignore_errors=True)
+            raise
+
+        # 保存・読み込みはロック外で行い、検索を止めないよう参照の差し替えだけをロック内で行う
+        opened = None
+        if rows == 0:
+            # 自分だけが書き込んだ未公開の世代なので、すぐに削除してよい
+            shutil.rmtree(version_path, ignore_errors=True)
+            self._unpublish()
+        else:
+            self._publish(version)
+            opened = self._open()
+        with self._lock:
+            if opened is None:
+                self._clear()
+                self.signatures = signatures
+            else:
+                self._swap(opened)
+            self.too_large = False
+            self.last_refresh = time.time()
+            self.stale = False
+        logger.info(f"🧮 ローカルベクトルインデックス構築: company={self.company_id}, {rows}チャンク, {time.time() - started:.1f}秒")
+
+    def refresh(self):
+        """変更されたドキュメントだけを差分に反映"""
+        signatures = _fetch_doc_signatures(self.company_id)
+        if self.too_large or _count_chunks(signatures) > LOCAL_VECTOR_INDEX_MAX_CHUNKS:
+            self.rebuild(signatures)
+            return
+
+        changed = [doc_id for doc_id, sig in signatures.items() if self.signatures.get(doc_id) != sig]
+        removed = [doc_id for doc_id in self.signatures if doc_id not in signatures]
+
+        if changed or removed:
+            keep = [
+                i for i, chunk in enumerate(self.delta_chunks)
+                if chunk["doc_id"] not in changed and chunk["doc_id"] not in removed
+            ]
+            delta_chunks = [self.delta_chunks[i] for i in keep]
+            delta_vectors = [self.delta_embeddings[keep]] if keep else []
+            if changed:
+                for chunks, vectors in _iter_chunk_batches(self.company_id, changed):
+                    delta_chunks.extend(chunks)
+                    delta_vectors.append(vectors.astype(np.float16))
+
+            main_size = self.embeddings.shape[0] if self.embeddings is not None else 0
+            if len(delta_chunks) > max(VECTOR_INDEX_DELTA_MAX_CHUNKS, main_size * VECTOR_INDEX_DELTA_RATIO):
+                self.rebuild(signatures)
+                return
+
+            delta_embeddings = np.concatenate(delta_vectors) if delta_vectors else None
+            with self._lock:
+                self.delta_chunks = delta_chunks
+                self.delta_embeddings = delta_embeddings
+                main_doc_ids = set(self._doc_ids)
+                self.hidden_doc_ids = self.hidden_doc_ids | ((set(changed) | set(removed)) & main_doc_ids)
+                if self._row_doc_ids is not None:
+                    hidden_positions = [i for i, doc_id in enumerate(self._doc_ids) if doc_id in self.hidden_doc_ids]
+                    self._excluded = np.isin(self._row_doc_ids, hidden_positions)
+                for doc_id in removed:
+                    self.signatures.pop(doc_id, None)
+                self.signatures.update({doc_id: signatures[doc_id] for doc_id in changed})
+            logger.info(
+                f"🧮 ローカルベクトル差分更新: company={self.company_id}, 変更{len(changed)}件, 削除{len(removed)}件, "
+                f"差分{len(delta_chunks)}チャンク"
+            )
+
+        with self._lock:
+            self.last_refresh = time.time()
+            self.stale = False
+
+    def ensure_fresh(self):
+        """未構築なら読み込み・構築、古ければ差分更新"""
+        if self.embeddings is None and not self.signatures:
+            try:
+                opened = self._open()
+                if opened is not None:
+                    with self._lock:
+                        self._swap(opened)
+                loaded = opened is not None
+            except Exception as e:
+                logger.warning(f"ローカルベクトルインデックス読み込み失敗（再構築します）: {e}")
+                loaded = False
+            if not loaded:
+                self.rebuild()
+                return
+        if self.stale or time.time() - self.last_refresh >= VECTOR_INDEX_REFRESH_SECONDS:
+            self.refresh()
+
+    # ---- 検索 ----
+
+    def search(self, query_embedding: List[float], limit: int) -> List[Dict[str, Any]]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        # 参照だけをロック内で取り出し、スコア計算はロック外で行う（更新は参照の差し替えのみ）
+        with self._lock:
+            embeddings, excluded = self.embeddings, self._excluded
+            offsets, chunks_mmap = self._offsets, self._chunks_mmap
+            delta_embeddings, delta_chunks = self.delta_embeddings, self.delta_chunks
+
+        results = []
+        if embeddings is not None and query.shape[0] == embeddings.shape[1]:
+            for position, score in _top_k(embeddings, query, limit, excluded):
+                results.append((score, self._main_chunk(offsets, chunks_mmap, position)))
+        if delta_embeddings is not None and query.shape[0] == delta_embeddings.shape[1]:
+            for position, score in _top_k(delta_embeddings, query, limit):
+                results.append((score, delta_chunks[position]))
+
+        results.sort(key=lambda item: item[0], reverse=True)
+        return [
+            {
+                "chunk_id": chunk["id"],
+                "doc_id": chunk["doc_id"],
+                "chunk_index": chunk["chunk_index"],
+                "content": chunk["content"],
+                "document_name": chunk["document_name"],
+                "document_type": chunk["document_type"],
+                "similarity_score": score,
+                "search_method": "vector_local"
+            }
+            for score, chunk in results[:limit]
+        ]
+
+
+class VectorIndexManager:
+    """会社ごとのローカルベクトルインデックスを管理"""
+
+    def __init__(self):
+        self._indexes: Dict[str, CompanyVectorIndex] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def _get_index(self, company_id: str) -> CompanyVectorIndex:
+        if company_id not in self._indexes:
+            self._indexes[company_id] = CompanyVectorIndex(company_id)
+        return self._indexes[company_id]
+
+    def _schedule_refresh(self, index: CompanyVectorIndex):
+        task = self._refreshing.get(index.company_id)
+        if task is not None and not task.done():
+            return
+        self._refreshing[index.company_id] = asyncio.create_task(self._refresh(index))
+
+    async def _refresh(self, index: CompanyVectorIndex):
+        try:
+            await asyncio.to_thread(index.ensure_fresh)
+        except Exception as e:
+            logger.error(f"❌ ローカルベクトルインデックス更新エラー (company={index.company_id}): {e}")
+            # 連続で失敗し続けないよう次回確認まで待つ
+            index.last_refresh = time.time()
+            index.stale = False
+
+    async def search(self, query_embedding: List[float], company_id: Optional[str],
+                     limit: int = 80) -> Optional[List[Dict[str, Any]]]:
+        """
+        ローカルでベクトル検索
+        対象外・構築中の場合は None を返す（呼び出し側で pgvector にフォールバック）
+        """
+        if not company_id or not local_vector_index_available():
+            return None
+
+        index = self._get_index(company_id)
+        generation = _shared_generation(company_id)
+        if generation is not None and generation != index.seen_generation:
+            # 他のワーカーでドキュメントが更新された
+            index.seen_generation = generation
+            index.stale = True
+        if index.stale or time.time() - index.last_refresh >= VECTOR_INDEX_REFRESH_SECONDS:
+            self._schedule_refresh(index)
+        if not index.ready:
+            return None
+        return await asyncio.to_thread(index.search, query_embedding, limit)
+
+    async def warm_up(self, company_id: str):
+        """起動時のウォームアップ用（インデックスの読み込み・構築の完了を待つ）"""
+        if not company_id or not local_vector_index_available():
+            return
+        index = self._get_index(company_id)
+        self._schedule_refresh(index)
+        # タイムアウトなどで待ち側がキャンセルされても、共有の更新タスクは止めない
+        # （止めてもスレッドでの構築は続き、次の検索で二重に構築が始まるため）
+        await asyncio.shield(self._refreshing[company_id])
+
+    def mark_stale(self, company_id: Optional[str]):
+        """ドキュメントの追加・有効/無効切り替え時に呼び出す"""
+        if company_id and company_id in self._indexes:
+            self._indexes[company_id].stale = True
+
+
+# グローバルインスタンス
+_vector_index_manager: Optional[VectorIndexManager] = None
+
+
+def get_vector_index_manager() -> VectorIndexManager:
+    """ローカルベクトルインデックスマネージャーのシングルトンを取得"""
+    global _vector_index_manager
+    if _vector_index_manager is None:
+        _vector_index_manager = VectorIndexManager()
+    return _vector_index_manager
+
+
+def _shared_generation(company_id: str) -> Optional[int]:
+    try:
+        return get_generation(f"vector:{company_id}")
+    except Exception as e:
+        logger.warning(f"⚠️ ベクトルインデックス更新世代の取得エラー: {e}")
+        return None
+
+
+def mark_vector_index_stale(company_id: Optional[str]):
+    """会社のローカルベクトルインデックスに更新があったことを通知（他のワーカーにも共有ストア経由で伝わる）"""
+    if company_id and local_vector_index_available():
+        try:
+            bump_generation(f"vector:{company_id}")
+        except Exception as e:
+            logger.warning(f"⚠️ ベクトルインデックス更新世代の更新エラー: {e}")
+    if _vector_index_manager is not None:
+        _vector_index_manager.mark_stale(company_id)
+
+
+def local_vector_index_available() -> bool:
+    """ローカルベクトル検索が有効かチェック"""
+    return LOCAL_VECTOR_INDEX_ENABLED and NUMPY_AVAILABLE
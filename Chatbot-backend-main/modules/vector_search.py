@@ -13,6 +13,11 @@ from psycopg2.extras import RealDictCursor
 import numpy as np
 import google.generativeai as genai
 from .multi_api_embedding import get_multi_api_embedding_client, multi_api_embedding_available
+from .chunk_metadata import get_chunk_search_source
+from .quantized_vector_search import (
+    get_quantized_mode, quantized_distance_sql, rescore_candidate_count, prepare_quantized_search,
+    needs_exact_fallback, count_eligible_rows
+)
 
 # 環境変数の読み込み
 load_dotenv()
@@ -198,32 +203,48 @@ class VectorSearchSystem:
                         order_sql = "RANDOM()"
                         params = []
                     
+                    # 📎 非正規化列があれば document_sources を JOIN せずにチャンクだけで絞り込む
+                    # （special は返却する行についてだけ参照する）
+                    source = get_chunk_search_source(cur)
+                    
                     # ベクトル類似検索SQL
+                    where_sql = f"c.embedding IS NOT NULL AND {source.active}"
                     sql = f"""
                     SELECT
                         c.id as chunk_id,
                         c.doc_id as document_id,
                         c.chunk_index,
                         c.content as snippet,
-                        ds.name,
-                        ds.special,
-                        ds.type,
+                        {source.document_name} as name,
+                        (SELECT sds.special FROM document_sources sds WHERE sds.id = c.doc_id) as special,
+                        {source.document_type} as type,
                         {similarity_sql} as similarity_score
-                    FROM chunks c
-                    LEFT JOIN document_sources ds ON ds.id = c.doc_id
+                    FROM {source.from_sql}
                     WHERE c.embedding IS NOT NULL
-                    AND ds.active = true
+                    AND {source.active}
                     """
                     
                     # 会社IDフィルタ
                     if company_id:
                         sql += " AND c.company_id = %s"
+                        where_sql += " AND c.company_id = %s"
                         params.append(company_id)
                         logger.info(f"🔍 会社IDフィルタ適用: {company_id}")
                     
-                    # ソートと制限
-                    sql += f" ORDER BY {order_sql} LIMIT %s"
-                    params.append(limit)
+                    # 🗜️ 量子化インデックスがあれば候補を絞り込んでから元のベクトルで再スコアリング
+                    quantized_mode = get_quantized_mode(conn) if self.pgvector_available else None
+                    exact_sql = sql + f" ORDER BY {order_sql} LIMIT %s"
+                    where_params = list(params)
+                    exact_params = params + [limit]
+                    if quantized_mode:
+                        candidate_count = rescore_candidate_count(limit)
+                        prepare_quantized_search(cur, candidate_count)
+                        sql += f" ORDER BY {quantized_distance_sql(quantized_mode, vector_str)} LIMIT %s"
+                        sql = f"SELECT * FROM ({sql}) ann ORDER BY similarity_score DESC LIMIT %s"
+                        params.extend([candidate_count, limit])
+                    else:
+                        # ソートと制限
+                        sql, params = exact_sql, exact_params
                     
                     logger.info(f"実行SQL: {sql}")
                     logger.info(f"パラメータ: {params}")
@@ -233,6 +254,12 @@ class VectorSearchSystem:
                     
                     cur.execute(sql, params)
                     results = cur.fetchall()
+                    if quantized_mode and len(results) < limit:
+                        # 会社のチャンク数が limit 未満で全件返っている場合は取り直さない
+                        eligible_count = count_eligible_rows(cur, source.from_sql, where_sql, where_params, limit)
+                        if needs_exact_fallback(len(results), eligible_count):
+                            cur.execute(exact_sql, exact_params)
+                            results = cur.fetchall()
                     
                     logger.info(f"DBからの生の結果: {results}")
 
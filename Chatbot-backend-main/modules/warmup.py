@@ -0,0 +1,144 @@
+"""
+🔥 起動時のウォームアップとレディネス
+再起動直後の最初のリクエストが、tiktoken のエンコーディング読み込み・DBへの初回接続・
+Geminiクライアントの構築・RAG/ベクトル検索のシングルトン初期化の待ち時間を負担しないよう、
+起動時にまとめて初期化します。/health/ready はウォームアップ完了まで 503 を返します
+
+- WARMUP_ENABLED=false でウォームアップを行わず、起動直後から ready とする
+- WARMUP_STEP_TIMEOUT: 各ステップ（検索インデックスは会社ごと）の待ち時間の上限（秒、超えたら失敗として次へ進む）
+- WARMUP_COMPANY_IDS: BM25・ローカルベクトルインデックスを事前に読み込む会社ID（カンマ区切り）
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", "30"))
+WARMUP_COMPANY_IDS = [
+    company_id.strip() for company_id in os.getenv("WARMUP_COMPANY_IDS", "").split(",") if company_id.strip()
+]
+
+# pending → running → ready（WARMUP_ENABLED=false なら最初から ready）
+_state: Dict[str, Any] = {
+    "status": "pending" if WARMUP_ENABLED else "ready",
+    "started_at": None,
+    "finished_at": None,
+    "steps": {},
+}
+
+
+def _warm_tokenizers():
+    from .tokenizer import get_tokenizer
+    from .bm25_index import tokenize_japanese, BM25S_AVAILABLE
+    get_tokenizer().count("ウォームアップ用のテキストです")
+    if BM25S_AVAILABLE:
+        tokenize_japanese("ウォームアップ用のテキストです")
+
+
+def _warm_database():
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from .config import get_database_url
+    from .chunk_metadata import get_chunk_search_source
+    conn = psycopg2.connect(get_database_url(), cursor_factory=RealDictCursor, connect_timeout=10)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            # マイグレーション適用状況の検出結果をキャッシュ
+            get_chunk_search_source(cur)
+    finally:
+        conn.close()
+
+
+def _warm_gemini_clients():
+    from .multi_gemini_client import get_multi_gemini_client
+    from .multi_api_embedding import get_multi_api_embedding_client
+    get_multi_gemini_client()
+    get_multi_api_embedding_client()
+
+
+def _warm_rag():
+    from .realtime_rag import get_realtime_rag_processor, get_or_init_multi_gemini_client
+    from .vector_search import get_vector_search_instance
+    get_or_init_multi_gemini_client()
+    if get_realtime_rag_processor() is None:
+        raise RuntimeError("リアルタイムRAGプロセッサを初期化できません")
+    get_vector_search_instance()
+
+
+async def _warm_company_indexes(company_id: str):
+    from .bm25_index import get_bm25_index_manager
+    from .vector_index import get_vector_index_manager
+    await get_bm25_index_manager().warm_up(company_id)
+    await get_vector_index_manager().warm_up(company_id)
+
+
+async def _warm_search_indexes():
+    """会社ごとに待ち時間の上限を設ける（超えた会社の構築はバックグラウンドで続く）"""
+    failed = []
+    for company_id in WARMUP_COMPANY_IDS:
+        try:
+            await asyncio.wait_for(_warm_company_indexes(company_id), timeout=WARMUP_STEP_TIMEOUT)
+        except asyncio.TimeoutError:
+            failed.append(company_id)
+    if failed:
+        raise RuntimeError(f"timeout: {', '.join(failed)}")
+
+
+def _steps() -> List[Tuple[str, Callable[[], Awaitable[Any]], Optional[float]]]:
+    """(名前, ステップ, 待ち時間の上限)。上限が None のステップは内部で個別に上限を設ける"""
+    steps = [
+        ("tokenizers", lambda: asyncio.to_thread(_warm_tokenizers), WARMUP_STEP_TIMEOUT),
+        ("database", lambda: asyncio.to_thread(_warm_database), WARMUP_STEP_TIMEOUT),
+        ("gemini_clients", lambda: asyncio.to_thread(_warm_gemini_clients), WARMUP_STEP_TIMEOUT),
+        ("rag", lambda: asyncio.to_thread(_warm_rag), WARMUP_STEP_TIMEOUT),
+    ]
+    if WARMUP_COMPANY_IDS:
+        steps.append(("search_indexes", _warm_search_indexes, None))
+    return steps
+
+
+async def run_warmup():
+    """起動時のウォームアップ（lifespan からバックグラウンドタスクとして実行）"""
+    if not WARMUP_ENABLED:
+        return
+    _state["status"] = "running"
+    _state["started_at"] = time.time()
+    logger.info("🔥 ウォームアップ開始")
+
+    for name, step, timeout in _steps():
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), timeout=timeout)
+            _state["steps"][name] = {"ok": True, "seconds": round(time.perf_counter() - started, 3)}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = "timeout" if isinstance(e, asyncio.TimeoutError) else str(e)
+            _state["steps"][name] = {"ok": False, "seconds": round(time.perf_counter() - started, 3), "error": error}
+            logger.warning(f"⚠️ ウォームアップ {name} 失敗: {error}")
+        else:
+            logger.info(f"🔥 ウォームアップ {name}: {_state['steps'][name]['seconds']:.2f}秒")
+
+    # 失敗したステップは最初のリクエストで改めて初期化されるため、完了をもって ready とする
+    _state["status"] = "ready"
+    _state["finished_at"] = time.time()
+    logger.info(f"✅ ウォームアップ完了 ({_state['finished_at'] - _state['started_at']:.1f}秒)")
+
+
+def is_ready() -> bool:
+    return _state["status"] == "ready"
+
+
+def get_warmup_status() -> Dict[str, Any]:
+    """/health/ready 用の状態"""
+    status = {"status": _state["status"], "steps": dict(_state["steps"])}
+    if _state["started_at"] is not None:
+        end = _state["finished_at"] or time.time()
+        status["warmup_seconds"] = round(end - _state["started_at"], 3)
+    return status
@@ -0,0 +1,29 @@
+-- 🗂️ chat_history キーセットページネーション用インデックス
+-- 管理画面のチャット履歴を (timestamp, id) カーソルで取得するため、
+-- 会社・社員ごとの降順スキャンをインデックスだけで完結させる
+
+-- 1. company_id が未設定の古い履歴を users から補完
+UPDATE chat_history ch
+SET company_id = u.company_id
+FROM users u
+WHERE ch.company_id IS NULL
+  AND u.id = COALESCE(ch.employee_id, ch.user_id)
+  AND u.company_id IS NOT NULL;
+
+-- 2. 会社単位の一覧（会社管理者用）
+CREATE INDEX IF NOT EXISTS idx_chat_history_company_ts_id
+    ON chat_history (company_id, timestamp DESC, id DESC);
+
+-- 3. 社員単位の一覧（社員詳細・個人履歴用）
+CREATE INDEX IF NOT EXISTS idx_chat_history_employee_ts_id
+    ON chat_history (employee_id, timestamp DESC, id DESC);
+
+-- 4. 全社一覧（特別管理者用）
+CREATE INDEX IF NOT EXISTS idx_chat_history_ts_id
+    ON chat_history (timestamp DESC, id DESC);
+
+COMMENT ON INDEX idx_chat_history_company_ts_id IS '管理画面チャット履歴のキーセットページネーション（会社別）';
+COMMENT ON INDEX idx_chat_history_employee_ts_id IS '管理画面チャット履歴のキーセットページネーション（社員別）';
+
+-- 統計情報更新
+ANALYZE chat_history;
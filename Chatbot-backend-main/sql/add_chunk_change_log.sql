@@ -0,0 +1,72 @@
+-- 🔄 chunks 変更ログ（Elasticsearch 差分同期用）
+-- chunks の追加・更新・削除と document_sources の active 切り替えを記録し、
+-- 同期処理は会社ごとのチェックポイント以降の変更だけを反映する
+-- 反映したログは差分同期（ES_INCREMENTAL_SYNC=true）が削除する。差分同期を使わない場合も
+-- アプリが ES_CHANGE_LOG_RETENTION_HOURS（既定24時間）より古いログを定期的に削除する
+-- Elasticsearch を使わない環境では適用しないか、末尾のコメントのとおりトリガーを外す
+
+-- 1. 変更ログ
+CREATE TABLE IF NOT EXISTS chunk_change_log (
+    id BIGSERIAL PRIMARY KEY,
+    company_id TEXT,
+    doc_id TEXT,
+    chunk_id UUID,                       -- ドキュメント単位の変更では NULL
+    op TEXT NOT NULL CHECK (op IN ('upsert', 'delete', 'doc_active', 'doc_inactive')),
+    changed_at TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chunk_change_log_company_id
+    ON chunk_change_log (company_id, id);
+
+-- 2. 会社ごとの同期チェックポイント
+CREATE TABLE IF NOT EXISTS es_sync_checkpoints (
+    company_id TEXT PRIMARY KEY,
+    last_change_id BIGINT NOT NULL DEFAULT 0,
+    synced_at TIMESTAMPTZ DEFAULT now()
+);
+
+-- 3. chunks の変更を記録
+CREATE OR REPLACE FUNCTION log_chunk_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO chunk_change_log (company_id, doc_id, chunk_id, op)
+        VALUES (OLD.company_id, OLD.doc_id, OLD.id, 'delete');
+        RETURN OLD;
+    END IF;
+    INSERT INTO chunk_change_log (company_id, doc_id, chunk_id, op)
+    VALUES (NEW.company_id, NEW.doc_id, NEW.id, 'upsert');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chunks_change_log ON chunks;
+CREATE TRIGGER trg_chunks_change_log
+    AFTER INSERT OR UPDATE OF content, doc_id, chunk_index, company_id OR DELETE ON chunks
+    FOR EACH ROW
+    EXECUTE FUNCTION log_chunk_change();
+
+-- 4. ドキュメントの有効/無効切り替えを記録
+CREATE OR REPLACE FUNCTION log_document_active_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.active IS DISTINCT FROM OLD.active THEN
+        INSERT INTO chunk_change_log (company_id, doc_id, op)
+        VALUES (NEW.company_id, NEW.id, CASE WHEN NEW.active THEN 'doc_active' ELSE 'doc_inactive' END);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_document_sources_active_change_log ON document_sources;
+CREATE TRIGGER trg_document_sources_active_change_log
+    AFTER UPDATE OF active ON document_sources
+    FOR EACH ROW
+    EXECUTE FUNCTION log_document_active_change();
+
+COMMENT ON TABLE chunk_change_log IS 'chunks / document_sources.active の変更ログ（Elasticsearch差分同期で消費後に削除）';
+COMMENT ON TABLE es_sync_checkpoints IS 'Elasticsearch差分同期の会社別チェックポイント';
+
+-- トリガーを外す場合
+-- DROP TRIGGER IF EXISTS trg_chunks_change_log ON chunks;
+-- DROP TRIGGER IF EXISTS trg_document_sources_active_change_log ON document_sources;
@@ -0,0 +1,75 @@
+-- 📎 chunks にドキュメント情報を非正規化
+-- 検索のたびに document_sources を JOIN して ds.active を確認し、LENGTH(c.content) を行ごとに計算しないよう、
+-- active / document_name / document_type / content_length を chunks に保持してトリガーで同期する
+-- （modules/chunk_metadata.py が列の有無を検出し、未適用の環境では従来の JOIN で検索する）
+-- 検索用インデックスは書き込みを止めないよう CREATE INDEX CONCURRENTLY で作成するため、
+-- 本ファイルの適用後に sql/add_chunks_document_metadata_indexes.sql をトランザクション外で実行する
+
+-- 1. 非正規化列
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS active BOOLEAN;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS document_name TEXT;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS document_type TEXT;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_length INTEGER;
+
+-- 2. チャンクの INSERT / 本文・親ドキュメント変更時に値を設定
+CREATE OR REPLACE FUNCTION chunks_set_document_metadata()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.content_length := COALESCE(length(NEW.content), 0);
+    IF TG_OP = 'INSERT' OR NEW.doc_id IS DISTINCT FROM OLD.doc_id THEN
+        -- 親ドキュメントが無い場合は NULL（検索対象外）
+        SELECT ds.active, ds.name, ds.type
+        INTO NEW.active, NEW.document_name, NEW.document_type
+        FROM document_sources ds
+        WHERE ds.id = NEW.doc_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chunks_document_metadata ON chunks;
+CREATE TRIGGER trg_chunks_document_metadata
+    BEFORE INSERT OR UPDATE OF content, doc_id ON chunks
+    FOR EACH ROW
+    EXECUTE FUNCTION chunks_set_document_metadata();
+
+-- 3. ドキュメントの有効/無効切り替え・名前変更をチャンクに反映
+CREATE OR REPLACE FUNCTION document_sources_propagate_metadata()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.active IS DISTINCT FROM OLD.active
+       OR NEW.name IS DISTINCT FROM OLD.name
+       OR NEW.type IS DISTINCT FROM OLD.type THEN
+        UPDATE chunks
+        SET active = NEW.active,
+            document_name = NEW.name,
+            document_type = NEW.type
+        WHERE doc_id = NEW.id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_document_sources_propagate_metadata ON document_sources;
+CREATE TRIGGER trg_document_sources_propagate_metadata
+    AFTER UPDATE OF active, name, type ON document_sources
+    FOR EACH ROW
+    EXECUTE FUNCTION document_sources_propagate_metadata();
+
+-- 4. 既存行のバックフィル
+UPDATE chunks c
+SET active = ds.active,
+    document_name = ds.name,
+    document_type = ds.type,
+    content_length = COALESCE(length(c.content), 0)
+FROM document_sources ds
+WHERE ds.id = c.doc_id
+  AND c.content_length IS NULL;
+
+COMMENT ON COLUMN chunks.active IS 'document_sources.active のコピー（トリガーで同期）';
+COMMENT ON COLUMN chunks.document_name IS 'document_sources.name のコピー（トリガーで同期）';
+COMMENT ON COLUMN chunks.document_type IS 'document_sources.type のコピー（トリガーで同期）';
+COMMENT ON COLUMN chunks.content_length IS 'length(content)（トリガーで維持）';
+
+-- 統計情報更新
+ANALYZE chunks;
@@ -0,0 +1,15 @@
+-- 📎 非正規化列（sql/add_chunks_document_metadata.sql）を使う検索用インデックス
+-- CREATE INDEX CONCURRENTLY はトランザクション内で実行できないため、psql などで1文ずつ自動コミットで実行する
+--     psql "$DATABASE_URL" -f sql/add_chunks_document_metadata_indexes.sql
+-- 途中で失敗した場合は INVALID なインデックスが残るので、DROP INDEX CONCURRENTLY してから再実行する
+
+-- 検索対象チャンクの部分インデックス（有効なドキュメントの、本文が10文字を超えるチャンク）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chunks_searchable
+    ON chunks (company_id, doc_id)
+    WHERE active = true AND content_length > 10;
+
+-- 量子化ベクトルインデックスを有効なチャンクだけに絞る入れ替えは、量子化検索を使う環境でのみ
+-- sql/add_chunks_quantized_embedding_active.sql で行う
+
+-- 統計情報更新
+ANALYZE chunks;
@@ -0,0 +1,41 @@
+-- 🔍 chunks 正規化テキスト列 + トライグラムインデックス
+-- 高度ファジー検索で検索のたびに全行へ normalize_text() を適用しないよう、
+-- 正規化済みテキストを列として保持し gin_trgm_ops インデックスで候補を絞り込む
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- 1. 正規化済みテキスト列
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_normalized TEXT;
+
+-- 2. INSERT / content 更新時に正規化テキストを維持するトリガー
+CREATE OR REPLACE FUNCTION chunks_set_content_normalized()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.content_normalized := normalize_text(NEW.content);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chunks_content_normalized ON chunks;
+CREATE TRIGGER trg_chunks_content_normalized
+    BEFORE INSERT OR UPDATE OF content ON chunks
+    FOR EACH ROW
+    EXECUTE FUNCTION chunks_set_content_normalized();
+
+-- 3. 既存行のバックフィル
+UPDATE chunks
+SET content_normalized = normalize_text(content)
+WHERE content IS NOT NULL
+  AND content_normalized IS NULL;
+
+-- 4. トライグラムインデックス（% / <% 演算子で使用）
+CREATE INDEX IF NOT EXISTS idx_chunks_content_normalized_trgm
+    ON chunks USING gin (content_normalized gin_trgm_ops);
+
+-- 正規化列に置き換わった式インデックスは不要
+DROP INDEX IF EXISTS idx_chunks_normalized_content_trgm;
+
+COMMENT ON COLUMN chunks.content_normalized IS 'normalize_text(content) の結果（トリガーで維持、ファジー検索用）';
+
+-- 統計情報更新
+ANALYZE chunks;
@@ -0,0 +1,27 @@
+-- 🗜️ chunks.embedding の量子化インデックス（2段階ベクトル検索用）
+-- 3072次元の vector は HNSW の上限（2000次元）を超えるため直接インデックス化できない
+-- 量子化した式インデックスで候補を絞り込み、候補だけを元の embedding で再スコアリングする
+-- （modules/quantized_vector_search.py）
+-- 式インデックスのため列の追加やトリガーは不要で、embedding の更新に自動で追従する
+-- pgvector 0.7.0 以上が必要（会社IDで絞り込んだ際の反復スキャンは 0.8.0 以上）
+-- インデックスを作成しても VECTOR_QUANTIZED_SEARCH（既定 off）を設定するまでは使われない
+-- benchmark_vector_search.py で再現率を確認してから auto / binary / halfvec を設定する
+-- chunks.active（sql/add_chunks_document_metadata.sql）がある環境では、続けて
+-- sql/add_chunks_quantized_embedding_active.sql で有効なチャンクだけのインデックスに入れ替えられる
+
+-- 1. バイナリ量子化（符号ビット, 1件 384B, ハミング距離）- auto で優先
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_binary_hnsw
+    ON chunks USING hnsw ((binary_quantize(embedding)::bit(3072)) bit_hamming_ops);
+
+-- 2. 半精度（1件 6KB, コサイン距離）- 再現率を優先する場合のみ作成
+--    VECTOR_QUANTIZED_SEARCH=halfvec で使用（auto の場合はバイナリを優先）
+-- CREATE INDEX IF NOT EXISTS idx_chunks_embedding_halfvec_hnsw
+--     ON chunks USING hnsw ((embedding::halfvec(3072)) halfvec_cosine_ops);
+
+-- 統計情報更新
+ANALYZE chunks;
+
+-- 確認クエリ
+SELECT indexname, pg_size_pretty(pg_relation_size(indexname::regclass)) AS size
+FROM pg_indexes
+WHERE tablename = 'chunks' AND indexname LIKE 'idx_chunks_embedding_%';
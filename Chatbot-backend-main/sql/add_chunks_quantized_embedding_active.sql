@@ -0,0 +1,17 @@
+-- 🗜️ 量子化ベクトルインデックスを有効なチャンクだけに絞る（任意）
+-- sql/add_chunks_quantized_embedding.sql と sql/add_chunks_document_metadata.sql（chunks.active）の適用後、
+-- 量子化検索（VECTOR_QUANTIZED_SEARCH）を使う環境でのみ実行する
+-- 条件は active = true のみにする（本文の長さで絞る検索・絞らない検索のどちらの条件にも含まれるため両方で使われる）
+-- 新しいインデックスを作成してから入れ替えるため、検索は止まらない
+-- CREATE INDEX CONCURRENTLY はトランザクション内で実行できないため、psql などで1文ずつ自動コミットで実行する
+--     psql "$DATABASE_URL" -f sql/add_chunks_quantized_embedding_active.sql
+-- 途中で失敗した場合は INVALID なインデックスが残るので、DROP INDEX CONCURRENTLY してから再実行する
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chunks_embedding_binary_hnsw_active
+    ON chunks USING hnsw ((binary_quantize(embedding)::bit(3072)) bit_hamming_ops)
+    WHERE active = true;
+DROP INDEX CONCURRENTLY IF EXISTS idx_chunks_embedding_binary_hnsw;
+ALTER INDEX idx_chunks_embedding_binary_hnsw_active RENAME TO idx_chunks_embedding_binary_hnsw;
+
+-- 統計情報更新
+ANALYZE chunks;
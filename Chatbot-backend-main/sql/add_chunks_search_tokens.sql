@@ -0,0 +1,41 @@
+-- 🔎 chunks 日本語全文検索用 tsvector 列
+-- 標準のPostgreSQLには 'japanese' 設定が無いため、トークン化は Python 側
+-- （modules/bm25_index.tokenize_japanese）で行い、結果の tsvector を保存する
+-- 既存チャンクは python -m modules.postgresql_fuzzy_search --backfill で索引化する
+
+-- 1. トークン列
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS search_tokens TSVECTOR;
+
+-- 2. 本文が更新されたらトークンを破棄し、再索引化の対象にする
+CREATE OR REPLACE FUNCTION chunks_reset_search_tokens()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.content IS DISTINCT FROM OLD.content THEN
+        NEW.search_tokens := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chunks_reset_search_tokens ON chunks;
+CREATE TRIGGER trg_chunks_reset_search_tokens
+    BEFORE UPDATE OF content ON chunks
+    FOR EACH ROW
+    EXECUTE FUNCTION chunks_reset_search_tokens();
+
+-- 3. 全文検索インデックス
+CREATE INDEX IF NOT EXISTS idx_chunks_search_tokens
+    ON chunks USING gin (search_tokens);
+
+-- 4. 未索引チャンクの検索用（バックフィル・アップロード直後の索引化）
+CREATE INDEX IF NOT EXISTS idx_chunks_search_tokens_pending
+    ON chunks (doc_id)
+    WHERE search_tokens IS NULL;
+
+-- 'japanese' 設定を前提にした旧インデックスは作成できないため不要
+DROP INDEX IF EXISTS idx_chunks_content_fulltext;
+
+COMMENT ON COLUMN chunks.search_tokens IS 'Pythonでトークン化した日本語全文検索用tsvector（形態素 + 文字バイグラム + 英数字識別子）';
+
+-- 統計情報更新
+ANALYZE chunks;
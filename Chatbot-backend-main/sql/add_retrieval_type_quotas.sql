@@ -0,0 +1,13 @@
+-- 📁 類似チャンク検索のファイルタイプ別枠（会社ごと）
+-- リアルタイムRAGの Step 3 は類似度上位の候補からタイプ別の最低件数を確保する
+-- 未設定（NULL）の会社は環境変数 RAG_TYPE_QUOTAS（既定: {"pdf": 20}）を使用し、
+-- 設定したタイプだけが既定値を上書きする
+
+ALTER TABLE company_settings ADD COLUMN IF NOT EXISTS retrieval_type_quotas JSONB;
+
+COMMENT ON COLUMN company_settings.retrieval_type_quotas IS '類似チャンク検索でファイルタイプ別に確保する最低件数（例: {"pdf": 20, "excel": 10}）';
+
+-- 設定例
+-- UPDATE company_settings
+-- SET retrieval_type_quotas = '{"pdf": 30, "excel": 10}'
+-- WHERE company_id = '<company_id>';
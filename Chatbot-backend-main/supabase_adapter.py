@@ -72,7 +72,7 @@ def select_data(table: str, columns: str = "*", filters: Optional[Dict[str, Any]
     Args:
         table: テーブル名
         columns: 取得する列（デフォルト: "*"）
-        filters: フィルタ条件のディクショナリ
+        filters: フィルタ条件のディクショナリ（値がリストの場合は IN 条件）
         limit: 取得件数制限
         offset: オフセット（ページネーション用）
         order: ソート順（例: "timestamp desc"）
@@ -87,7 +87,9 @@ def select_data(table: str, columns: str = "*", filters: Optional[Dict[str, Any]
         # フィルタを適用
         if filters:
             for key, value in filters.items():
-                if value is not None:
+                if isinstance(value, (list, tuple, set)):
+                    query = query.in_(key, list(value))
+                elif value is not None:
                     query = query.eq(key, value)
         
         # ソート順を適用